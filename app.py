@@ -1,37 +1,182 @@
+import os
+import threading
 import time
+from functools import partial, wraps
+from typing import Optional
 
 from flasgger import Swagger
-from flask import Flask, jsonify, Response, g, request
-from services.serasa_service import SerasaService
-from utils.logger import get_correlation_id, logger
-from utils.metrics import track_metrics
-from utils.rate_limiter import RateLimiter
+from flask import Blueprint, Flask, current_app, jsonify, Response, g, request
+from services.jobs import JobManager, JobNotFound, UploadTooLarge, detect_format
+from services.serasa_service import REPORT_PATHS, SerasaService, batch_error
+from utils.deadline import DEADLINE_HEADER, deadline_from_header, request_deadline_var
+from utils.headers import cache_headers
+from utils.logger import get_correlation_id, log_enabled, logger
+from utils.metrics import CONTENT_TYPE, HTTP_REQUEST_DURATION, HTTP_REQUESTS, REGISTRY, stats_samples
+from utils.rate_limiter import RateLimiter, create_batch_limiter, create_rate_limiter
+from utils.streaming import NDJSON_CONTENT_TYPE, STREAMING_HEADERS, batch_chunks, wants_ndjson
+from utils.tracing import TRACEPARENT_HEADER, finish_trace, start_trace, trace_timing
 
-app = Flask(__name__)
-Swagger(app)
-serasa_service = SerasaService()
+api = Blueprint("api", __name__)
+_service_lock = threading.Lock()
 
-rate_limiter = RateLimiter(limit=10, period=60)
-metrics_data = {"last_request_duration": 0}
+
+def create_app(
+    service: Optional[SerasaService] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    batch_limiter: Optional[RateLimiter] = None,
+) -> Flask:
+    """
+    Builds the Flask application.
+    The Serasa service is created on first use in each process unless one is given, so a server that
+    preloads the app before forking workers does not share its threads, sockets or cache connections.
+    :param service: a SerasaService to serve requests with
+    :param rate_limiter: a RateLimiter applied to the consultation endpoints
+    :param batch_limiter: a RateLimiter counting the documents of batch requests
+    :return: a Flask application
+    """
+    app = Flask(__name__)
+    app.config["START_TIME"] = time.time()
+    app.extensions["serasa_service"] = service
+    app.extensions["rate_limiter"] = rate_limiter or create_rate_limiter(limit=10, period=60)
+    app.extensions["batch_limiter"] = batch_limiter or create_batch_limiter()
+    REGISTRY.register_collector("serasa", partial(service_samples, app))
+    app.register_blueprint(api)
+    Swagger(app)
+    return app
+
+
+def get_service(app: Optional[Flask] = None) -> SerasaService:
+    """
+    Returns the Serasa service of an application, creating it on first use in this process.
+    :param app: a Flask application, defaults to the current one
+    :return: the SerasaService instance
+    """
+    app = app or current_app
+    service = app.extensions.get("serasa_service")
+    if service is None:
+        with _service_lock:
+            service = app.extensions.get("serasa_service")
+            if service is None:
+                service = app.extensions["serasa_service"] = SerasaService()
+    return service
+
+
+def get_job_manager(app: Optional[Flask] = None) -> JobManager:
+    """
+    Returns the bulk job manager of an application, creating it on first use in this process.
+    :param app: a Flask application, defaults to the current one
+    :return: the JobManager instance
+    """
+    app = app or current_app
+    manager = app.extensions.get("job_manager")
+    if manager is None:
+        service = get_service(app)
+        with _service_lock:
+            manager = app.extensions.get("job_manager")
+            if manager is None:
+                manager = app.extensions["job_manager"] = JobManager(service)
+    return manager
+
+
+def service_samples(app: Flask) -> list:
+    """
+    Builds the gauge samples of the metrics endpoint from the service stats of an application.
+    :param app: a Flask application
+    :return: a list of (name, labels, value) tuples, empty until the service is created
+    """
+    service = app.extensions.get("serasa_service")
+    if service is None:
+        return []
+    samples = stats_samples("serasa", service.stats(), {report_type: "report_type" for report_type in REPORT_PATHS})
+    samples.append(("serasa_uptime_seconds", {}, time.time() - app.config["START_TIME"]))
+    return samples
+
+
+def warm_up(app: Flask):
+    """
+    Prepares a worker before it accepts traffic: creates the service, fetches the access token and
+    opens the cache connections. Documents listed in SERASA_WARM_UP_DOCUMENTS (comma separated) are
+    also fetched into the cache. Failures are logged and never prevent the worker from starting.
+    :param app: a Flask application
+    """
+    service = get_service(app)
+    documents = [doc.strip() for doc in os.getenv("SERASA_WARM_UP_DOCUMENTS", "").split(",") if doc.strip()]
+    start = time.perf_counter()
+    try:
+        service.warm_up(documents)
+    except Exception as e:
+        logger.warning({"event": "warm_up_failed", "error": str(e)})
+        return
+    logger.info({"event": "warm_up_done", "documents": len(documents), "duration": time.perf_counter() - start})
+
+
+def rate_limited(func):
+    """
+    Applies the rate limiter of the current application to a route.
+    :param func: a callable function that represents a Flask route
+    :return: a wrapped function that applies rate limiting
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return current_app.extensions["rate_limiter"].decorator(func)(*args, **kwargs)
+
+    return wrapper
 
 
-@app.before_request
+@api.before_app_request
 def start_request():
     g.correlation_id = get_correlation_id()
-    g.start_time = time.time()
-    logger.info(f"Incoming request: {request.method} {request.path}")
+    g.start_time = time.perf_counter()
+    g.deadline_token = request_deadline_var.set(deadline_from_header(request.headers.get(DEADLINE_HEADER)))
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    g.trace = start_trace(f"{request.method} {route}", g.correlation_id, request.headers.get(TRACEPARENT_HEADER))
+    if log_enabled("incoming_request"):
+        logger.info("Incoming request: %s %s", request.method, request.path)
 
 
-@app.after_request
+@api.after_app_request
 def end_request(response):
-    duration = time.time() - g.start_time
-    metrics_data["last_request_duration"] = duration
+    start_time, method, trace = g.start_time, request.method, g.pop("trace", None)
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+
+    def record() -> Optional[str]:
+        status = str(response.status_code)
+        HTTP_REQUESTS.inc(route, method, status)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start_time, route, method, status)
+        return finish_trace(trace, response.status_code)
+
+    if response.is_streamed:
+        # the body is produced after this hook, e.g. a streamed batch: the request ends when the response is closed
+        timing = trace_timing(trace)
+        response.call_on_close(record)
+    else:
+        timing = record()
+    if timing:
+        response.headers["Server-Timing"] = timing
     return response
 
 
-@app.route("/api/v1/consulta/cpf/<cpf>")
-@rate_limiter.decorator
-@track_metrics
+@api.teardown_app_request
+def clear_request_deadline(exc):
+    if "deadline_token" in g:
+        request_deadline_var.reset(g.pop("deadline_token"))
+    if "trace" in g:
+        # the response was never built, e.g. after an unhandled error
+        finish_trace(g.pop("trace"), 500)
+
+
+def set_cache_header(response: Response, response_data: dict):
+    """
+    Sets the X-Cache-Hit and X-Cache-Stale headers of a consultation response.
+    :param response: the Flask response
+    :param response_data: the dictionary returned by the Serasa service
+    """
+    response.headers.update(cache_headers(response_data))
+
+
+@api.route("/api/v1/consulta/cpf/<cpf>")
+@rate_limited
 def consult_cpf(cpf: str) -> Response:
     """
     Consults the Serasa mock service for a person's credit report by CPF.
@@ -51,7 +196,10 @@ def consult_cpf(cpf: str) -> Response:
         headers:
           X-Cache-Hit:
             type: string
-            description: Indicates if the response was served from cache
+            description: Cache tier that served the response (l1 or l2), or false on a miss
+          X-Cache-Stale:
+            type: string
+            description: Present when the cached report is past its fresh TTL and is being refreshed
       400:
         description: Invalid CPF
       404:
@@ -59,20 +207,17 @@ def consult_cpf(cpf: str) -> Response:
       503:
         description: Error in Serasa service
     """
-    response_data, status = serasa_service.consult_cpf(cpf)
+    response_data, status = get_service().consult_cpf(cpf)
 
     response = jsonify(response_data)
     response.status_code = status
 
-    if "cached" in response_data:
-        response.headers["X-Cache-Hit"] = str(response_data["cached"]).lower()
-
+    set_cache_header(response, response_data)
     return response
 
 
-@app.route("/api/v1/consulta/cnpj/<cnpj>")
-@rate_limiter.decorator
-@track_metrics
+@api.route("/api/v1/consulta/cnpj/<cnpj>")
+@rate_limited
 def consult_cnpj(cnpj: str) -> Response:
     """
     Consults the Serasa mock service for a company's credit report by CNPJ.
@@ -92,7 +237,10 @@ def consult_cnpj(cnpj: str) -> Response:
         headers:
           X-Cache-Hit:
             type: string
-            description: Indicates if the response was served from cache
+            description: Cache tier that served the response (l1 or l2), or false on a miss
+          X-Cache-Stale:
+            type: string
+            description: Present when the cached report is past its fresh TTL and is being refreshed
       400:
         description: Invalid CNPJ
       404:
@@ -101,42 +249,220 @@ def consult_cnpj(cnpj: str) -> Response:
         description: Error in Serasa service
     """
 
-    response_data, status = serasa_service.consult_cnpj(cnpj)
+    response_data, status = get_service().consult_cnpj(cnpj)
 
     response = jsonify(response_data)
     response.status_code = status
 
-    if "cached" in response_data:
-        response.headers["X-Cache-Hit"] = str(response_data["cached"]).lower()
+    set_cache_header(response, response_data)
+    return response
+
+
+@api.route("/api/v1/consulta/batch", methods=["POST"])
+@rate_limited
+def consult_batch() -> Response:
+    """
+    Consults the Serasa mock service for a mixed list of CPFs and CNPJs in a single request.
+    The results are streamed as the upstream calls finish, as one JSON document or, when the client
+    accepts application/x-ndjson, one result per line.
+    :return: a JSON or NDJSON response with one result per document
 
+    ---
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: order
+        in: query
+        type: string
+        enum: [input, completion]
+        required: false
+        description: Result order; completion sends each result as soon as it is ready
+      - name: format
+        in: query
+        type: string
+        enum: [json, ndjson]
+        required: false
+        description: Response format, when the Accept header does not tell it
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            documents:
+              type: array
+              items:
+                type: string
+              description: CPFs and CNPJs to query, formatted or digits only
+    responses:
+      200:
+        description: Per-document results, each with its own status (200, 400, 404 or 503)
+      400:
+        description: Malformed request body
+      429:
+        description: Too many requests, or too many documents for the batch quota
+    """
+    payload = request.get_json(silent=True) or {}
+    documents = payload.get("documents")
+    ordered = request.args.get("order", "input") != "completion"
+    service = get_service()
+    # each document counts against the batch quota, checked before any upstream call is made
+    if batch_error(documents, service.batch_max_size) is None:
+        allowed, headers = current_app.extensions["batch_limiter"].check(request.remote_addr, cost=len(documents))
+        if not allowed:
+            response = jsonify({"error": "Too many documents"})
+            response.status_code = 429
+            response.headers["Retry-After"] = headers["X-RateLimit-Reset"]
+            return response
+
+    items, status = service.stream_batch(documents, ordered=ordered)
+    if status != 200:
+        response = jsonify(items)
+        response.status_code = status
+        return response
+
+    ndjson = wants_ndjson(request.headers.get("Accept"), request.args.get("format"))
+    chunks = batch_chunks(items, ndjson, current_app.json.dumps)
+    content_type = NDJSON_CONTENT_TYPE if ndjson else "application/json"
+    return Response(chunks, content_type=content_type, headers=STREAMING_HEADERS)
+
+
+@api.route("/api/v1/jobs", methods=["POST"])
+@rate_limited
+def submit_job() -> Response:
+    """
+    Uploads a CSV or NDJSON file of CPFs and CNPJs to be consulted in the background.
+    The body is streamed to disk, so its size is limited only by JOBS_MAX_UPLOAD_BYTES.
+    :return: a JSON response with the job ID
+
+    ---
+    consumes:
+      - text/csv
+      - application/x-ndjson
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ndjson]
+        required: false
+        description: Input format, when the Content-Type does not tell it
+      - name: body
+        in: body
+        required: true
+        description: >
+          One document per line: a CSV whose document column is named document, documento, cpf, cnpj or
+          cpf_cnpj (otherwise the first column), or NDJSON lines holding a string or {"document": "..."}
+        schema:
+          type: string
+    responses:
+      202:
+        description: Job queued; follow the Location header for its progress
+      400:
+        description: Unknown input format
+      413:
+        description: Upload too large
+    """
+    fmt = detect_format(request.content_type, request.args.get("format"))
+    if fmt is None:
+        response = jsonify({"error": "Send a CSV (text/csv) or NDJSON (application/x-ndjson) body."})
+        response.status_code = 400
+        return response
+    try:
+        job_id = get_job_manager().submit(request.stream, fmt)
+    except UploadTooLarge as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 413
+        return response
+
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.status_code = 202
+    response.headers["Location"] = f"/api/v1/jobs/{job_id}"
     return response
 
 
-@app.route("/metrics")
+@api.route("/api/v1/jobs/<job_id>")
+def job_status(job_id: str) -> tuple[Response, int]:
+    """
+    Status and progress of a bulk job.
+    :param job_id: the job ID returned on upload
+    :return: a JSON response describing the job
+
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: >
+          Job status (queued, running, completed or failed), progress as the share of the input read,
+          and counters of lines, results, duplicates, invalid documents and results per status
+      404:
+        description: Job not found
+    """
+    try:
+        return jsonify(get_job_manager().status(job_id)), 200
+    except JobNotFound:
+        return jsonify({"error": "Job not found"}), 404
+
+
+@api.route("/api/v1/jobs/<job_id>/results")
+def job_results(job_id: str) -> Response:
+    """
+    Streams the results of a bulk job written so far, one JSON object per line in input order, in the
+    same format as the items of the batch endpoint. Duplicate documents appear once.
+    :param job_id: the job ID returned on upload
+    :return: an NDJSON response
+
+    ---
+    produces:
+      - application/x-ndjson
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: NDJSON results; X-Job-Status tells whether more are to come
+      404:
+        description: Job not found
+    """
+    manager = get_job_manager()
+    try:
+        status = manager.status(job_id)["status"]
+        chunks = manager.results(job_id)
+    except JobNotFound:
+        return jsonify({"error": "Job not found"}), 404
+    return Response(chunks, content_type=NDJSON_CONTENT_TYPE, headers={"X-Job-Status": status, **STREAMING_HEADERS})
+
+
+@api.route("/metrics")
 def metrics() -> Response:
     """
-    Metrics endpoint to provide service metrics such as uptime and last request duration.
-    :return: a JSON response with the service metrics
+    Metrics endpoint in the Prometheus text format. Counters and histograms are summed across worker
+    processes when METRICS_MULTIPROC_DIR is set.
+    :return: a text response with the service metrics
 
     ---
+    produces:
+      - text/plain
     responses:
       200:
-        description: Metrics retrieved successfully
-        schema:
-          type: object
-          properties:
-            uptime:
-              type: number
-              description: Service uptime in seconds
-            last_request_duration:
-              type: number
-              description: Duration of the last request in seconds
+        description: >
+          Request counts and latency histograms per route and status (http_requests_total,
+          http_request_duration_seconds), upstream latency per report type
+          (serasa_upstream_request_duration_seconds), cache lookups by result, token refreshes,
+          rate limit rejections, and the service state as serasa_* gauges (single-flight, cache,
+          outbound limiter, retries, circuit breakers, bulkheads, hedging and uptime)
     """
-    uptime = time.time() - app.config.get("START_TIME", time.time())
-    return jsonify({"uptime": uptime, "last_request_duration": metrics_data["last_request_duration"]})
+    get_service()
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
-@app.route("/api/v1/health")
+@api.route("/api/v1/health")
 def health() -> tuple[Response, int]:
     """
     Health check endpoint to verify if the service is running.
@@ -156,5 +482,7 @@ def health() -> tuple[Response, int]:
     return jsonify({"status": "ok"}), 200
 
 
+app = create_app()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=3000, debug=True)
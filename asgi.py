@@ -0,0 +1,231 @@
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial, wraps
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from services.async_serasa_service import AsyncSerasaService
+from services.serasa_service import REPORT_PATHS, batch_error
+from utils.deadline import DEADLINE_HEADER, deadline_from_header, request_deadline_var
+from utils.headers import cache_headers
+from utils.logger import correlation_id_var, log_enabled, logger
+from utils.metrics import CONTENT_TYPE, HTTP_REQUEST_DURATION, HTTP_REQUESTS, REGISTRY, stats_samples
+from utils.rate_limiter import RateLimiter, create_batch_limiter, create_rate_limiter
+from utils.streaming import NDJSON_CONTENT_TYPE, STREAMING_HEADERS, async_batch_chunks, wants_ndjson
+from utils.tracing import TRACEPARENT_HEADER, finish_trace, start_trace, trace_timing
+
+serasa_service = AsyncSerasaService()
+
+rate_limiter = create_rate_limiter(limit=10, period=60)
+batch_limiter = create_batch_limiter()
+metrics_data = {"start_time": time.time()}
+# the serialization of JSONResponse, for the streamed batch items
+json_dumps = partial(json.dumps, ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def service_samples() -> list:
+    """
+    Builds the gauge samples of the metrics endpoint from the service stats.
+    :return: a list of (name, labels, value) tuples
+    """
+    samples = stats_samples("serasa", serasa_service.stats(), {report_type: "report_type" for report_type in REPORT_PATHS})
+    samples.append(("serasa_uptime_seconds", {}, time.time() - metrics_data["start_time"]))
+    return samples
+
+
+async def check_limit(limiter: RateLimiter, request: Request, cost: int = 1) -> tuple[bool, dict]:
+    """
+    Applies a rate limiter to a request, in a worker thread when the limiter may block on its store.
+    :param limiter: the RateLimiter to apply
+    :param request: the Starlette request
+    :param cost: an integer with the number of requests the request counts for
+    :return: a tuple (allowed: bool, headers: dict)
+    """
+    ip = request.client.host if request.client else None
+    # a distributed limiter calls its store over a socket, which must not block the event loop
+    if limiter.blocking:
+        return await asyncio.to_thread(limiter.check, ip, cost)
+    return limiter.check(ip, cost)
+
+
+def rate_limited(endpoint):
+    """
+    Applies the shared rate limiter to an async endpoint, with the same headers as the Flask app.
+    :param endpoint: an async callable receiving a Starlette request
+    :return: the wrapped endpoint
+    """
+
+    @wraps(endpoint)
+    async def wrapper(request: Request):
+        allowed, headers = await check_limit(rate_limiter, request)
+        if not allowed:
+            return JSONResponse({"error": "Too many requests"}, status_code=429, headers=headers)
+
+        response = await endpoint(request)
+        response.headers.update(headers)
+        return response
+
+    return wrapper
+
+
+def consultation_response(response_data: dict, status: int) -> JSONResponse:
+    """
+    Builds the JSON response of a consultation, including the cache headers.
+    :param response_data: the dictionary returned by the Serasa service
+    :param status: an integer representing the HTTP status code
+    :return: a JSONResponse
+    """
+    return JSONResponse(response_data, status_code=status, headers=cache_headers(response_data))
+
+
+@rate_limited
+async def consult_cpf(request: Request) -> JSONResponse:
+    """
+    Consults the Serasa mock service for a person's credit report by CPF.
+    :param request: the Starlette request, with the CPF in the path
+    :return: a JSON response with the result of the consultation
+    """
+    return consultation_response(*await serasa_service.consult_cpf(request.path_params["cpf"]))
+
+
+@rate_limited
+async def consult_cnpj(request: Request) -> JSONResponse:
+    """
+    Consults the Serasa mock service for a company's credit report by CNPJ.
+    :param request: the Starlette request, with the CNPJ in the path
+    :return: a JSON response with the result of the consultation
+    """
+    return consultation_response(*await serasa_service.consult_cnpj(request.path_params["cnpj"]))
+
+
+@rate_limited
+async def consult_batch(request: Request) -> Response:
+    """
+    Consults the Serasa mock service for a mixed list of CPFs and CNPJs in a single request, streaming
+    the results like the Flask app (JSON, or NDJSON when accepted; `?order=completion` for completion order).
+    :param request: the Starlette request, with a {"documents": [...]} JSON body
+    :return: a JSON or NDJSON response with one result per document
+    """
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = {}
+    documents = payload.get("documents") if isinstance(payload, dict) else None
+    ordered = request.query_params.get("order", "input") != "completion"
+    # each document counts against the batch quota, checked before any upstream call is made
+    if batch_error(documents, serasa_service.batch_max_size) is None:
+        allowed, headers = await check_limit(batch_limiter, request, cost=len(documents))
+        if not allowed:
+            return JSONResponse(
+                {"error": "Too many documents"}, status_code=429, headers={"Retry-After": headers["X-RateLimit-Reset"]}
+            )
+
+    items, status = await serasa_service.stream_batch(documents, ordered=ordered)
+    if status != 200:
+        return JSONResponse(items, status_code=status)
+
+    ndjson = wants_ndjson(request.headers.get("accept"), request.query_params.get("format"))
+    chunks = async_batch_chunks(items, ndjson, json_dumps)
+    media_type = NDJSON_CONTENT_TYPE if ndjson else "application/json"
+    return StreamingResponse(chunks, media_type=media_type, headers=STREAMING_HEADERS)
+
+
+async def metrics(request: Request) -> Response:
+    """
+    Metrics endpoint in the Prometheus text format, with the same metrics as the Flask app.
+    :param request: the Starlette request
+    :return: a text response with the service metrics
+    """
+    return Response(REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def health(request: Request) -> JSONResponse:
+    """
+    Health check endpoint to verify if the service is running.
+    :param request: the Starlette request
+    :return: JSON response with service status
+    """
+    return JSONResponse({"status": "ok"})
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware doing what the Flask before/after request hooks do: it sets the correlation ID
+    from X-Correlation-ID (or a new UUID) and the deadline from X-Request-Timeout, traces the request,
+    logs it and records its count and duration per route and status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        correlation_id = headers.get(b"x-correlation-id", b"").decode() or str(uuid.uuid4())
+        token = correlation_id_var.set(correlation_id)
+        timeout = headers.get(DEADLINE_HEADER.lower().encode(), b"").decode()
+        deadline_token = request_deadline_var.set(deadline_from_header(timeout))
+        start = time.perf_counter()
+        status = {"code": "500"}
+        traceparent = headers.get(TRACEPARENT_HEADER.encode(), b"").decode()
+        trace = start_trace(f"{scope['method']} {scope['path']}", correlation_id, traceparent)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = str(message["status"])
+                timing = trace_timing(trace)
+                if timing:
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode())]
+            await send(message)
+
+        if log_enabled("incoming_request"):
+            logger.info("Incoming request: %s %s", scope["method"], scope["path"])
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            HTTP_REQUESTS.inc(path, scope["method"], status["code"])
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, path, scope["method"], status["code"])
+            if trace:
+                trace[1].set("http.route", f"{scope['method']} {path}")
+            finish_trace(trace, int(status["code"]))
+            correlation_id_var.reset(token)
+            request_deadline_var.reset(deadline_token)
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    await serasa_service.start()
+    metrics_data["start_time"] = time.time()
+    REGISTRY.register_collector("serasa", service_samples)
+    yield
+    await serasa_service.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/v1/consulta/cpf/{cpf}", consult_cpf),
+        Route("/api/v1/consulta/cnpj/{cnpj}", consult_cnpj),
+        Route("/api/v1/consulta/batch", consult_batch, methods=["POST"]),
+        Route("/metrics", metrics),
+        Route("/api/v1/health", health),
+    ],
+    lifespan=lifespan,
+)
+app.add_middleware(RequestContextMiddleware)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=3000)
@@ -0,0 +1,120 @@
+"""
+Compares the batch endpoint building the whole JSON response before sending it with the streamed
+NDJSON response, in input and in completion order: time to the first result, total time and peak
+Python memory while serving one batch of large reports.
+
+Usage:
+    python -m benchmarks.bench_batch_stream --documents 200 --report-kb 100
+"""
+
+import argparse
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+from benchmarks.load_sync_vs_async import make_cpf
+from benchmarks.upstream_stub import REPORT, start_stub_process
+
+
+def buffered(app, documents: list) -> tuple[int, int]:
+    """
+    Serves a batch the way the endpoint did before streaming: every result, then one JSON document.
+    :param app: the Flask application
+    :param documents: the batch documents
+    :return: the number of bytes sent and of results that are not 200
+    """
+    from flask import jsonify
+
+    from app import get_service
+
+    with app.app_context():
+        response_data, _ = get_service(app).consult_batch(documents)
+        errors = sum(1 for item in response_data["results"] if item["status"] != 200)
+        return len(jsonify(response_data).get_data()), errors
+
+
+def streamed(app, documents: list, order: str, first: list) -> tuple[int, int]:
+    """
+    Serves a batch through the streamed NDJSON endpoint, recording when the first result arrives.
+    :param app: the Flask application
+    :param documents: the batch documents
+    :param order: "input" or "completion"
+    :param first: a list receiving the time of the first result
+    :return: the number of bytes sent and of results that are not 200
+    """
+    with app.test_client() as client:
+        response = client.post(
+            f"/api/v1/consulta/batch?order={order}&format=ndjson", json={"documents": documents}, buffered=False
+        )
+        size = errors = 0
+        for chunk in response.response:
+            if not size:
+                first.append(time.perf_counter())
+            size += len(chunk)
+            errors += b'"status": 200' not in chunk
+        response.close()
+        return size, errors
+
+
+def run(label: str, documents: list, serve):
+    """
+    Serves one batch twice with a new app, once timed and once under tracemalloc, and prints the results.
+    The traced pass is much slower and may hit upstream timeouts, so each scenario gets its own service and
+    circuit breakers.
+    :param label: a string naming the scenario
+    :param documents: two lists of distinct documents, so neither pass is answered from the cache
+    :param serve: a callable (app, documents, first) -> (bytes sent, results that are not 200)
+    """
+    from app import create_app, get_service
+
+    app = create_app()
+    get_service(app).warm_up()
+    try:
+        first = []
+        start = time.perf_counter()
+        size, errors = serve(app, documents[0], first)
+        elapsed = time.perf_counter() - start
+        ttfb = (first[0] if first else time.perf_counter()) - start
+
+        tracemalloc.start()
+        _, traced_errors = serve(app, documents[1], [])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        get_service(app).close()
+    print(
+        f"{label:<24} first result {ttfb * 1000:8.1f} ms  total {elapsed * 1000:8.1f} ms  "
+        f"peak {peak / 2**20:7.1f} MiB  ({size / 2**20:.1f} MiB sent, {errors}/{traced_errors} errors)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--report-kb", type=int, default=100)
+    parser.add_argument("--min-latency", type=float, default=0.01)
+    parser.add_argument("--max-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = {**REPORT, "history": [{"entry": i, "detail": "x" * 90} for i in range(args.report_kb * 10)]}
+    url, process = start_stub_process(lambda: random.uniform(args.min_latency, args.max_latency), report)
+    os.environ.update(MOCK_URL=url, SERASA_AUTH_TOKEN="bench-token", SERASA_BATCH_MAX_SIZE=str(args.documents))
+
+    logging.getLogger("credit_check").setLevel(logging.ERROR)
+    batches = iter([make_cpf(500_000 + i * args.documents + n) for n in range(args.documents)] for i in range(6))
+    try:
+        run("buffered json", [next(batches), next(batches)], lambda app, docs, first: buffered(app, docs))
+        for order in ("input", "completion"):
+            run(
+                f"ndjson {order} order",
+                [next(batches), next(batches)],
+                lambda app, docs, first: streamed(app, docs, order, first),
+            )
+    finally:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    main()
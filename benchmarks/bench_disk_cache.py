@@ -0,0 +1,74 @@
+"""
+Compares the disk report store with the SQLite cache: write and read throughput for many reports, and
+the time to reopen the store after a restart, when the in-process cache is empty.
+
+Usage:
+    python -m benchmarks.bench_disk_cache --reports 20000 --report-kb 20
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.upstream_stub import REPORT
+from services.cache import SQLiteCache
+from services.disk_cache import DiskCache
+
+
+def run(label: str, open_cache, reports: int, report: dict, reads: int):
+    """
+    Fills a cache, reopens it as after a restart and reads random reports back, printing the rates.
+    :param label: a string naming the backend
+    :param open_cache: a callable returning a new cache instance over the same storage
+    :param reports: an integer with the number of reports written
+    :param report: the report payload
+    :param reads: an integer with the number of random reads
+    """
+    cache = open_cache()
+    start = time.perf_counter()
+    for n in range(reports):
+        cache.set(f"pf:{n:011d}", {**report, "n": n})
+    write_elapsed = time.perf_counter() - start
+    cache.close()
+
+    start = time.perf_counter()
+    cache = open_cache()
+    reopen_elapsed = time.perf_counter() - start
+
+    keys = [f"pf:{random.randrange(reports):011d}" for _ in range(reads)]
+    start = time.perf_counter()
+    hits = sum(1 for key in keys if cache.get(key) is not None)
+    read_elapsed = time.perf_counter() - start
+    cache.close()
+    print(
+        f"{label:<8} writes {reports / write_elapsed:9.0f}/s  reopen {reopen_elapsed * 1000:7.1f} ms  "
+        f"reads {reads / read_elapsed:9.0f}/s  ({hits}/{reads} hits)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reports", type=int, default=20000)
+    parser.add_argument("--report-kb", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=20000)
+    args = parser.parse_args()
+
+    report = {
+        **REPORT,
+        "history": [{"entry": i, "detail": f"{random.random():.17f}" * 4} for i in range(args.report_kb * 10)],
+    }
+    directory = tempfile.mkdtemp(prefix="bench-disk-cache-")
+    try:
+        sqlite_path = os.path.join(directory, "cache.sqlite3")
+        run("sqlite", lambda: SQLiteCache(3600, sqlite_path), args.reports, report, args.reads)
+        disk_path = os.path.join(directory, "reports")
+        run("disk", lambda: DiskCache(3600, disk_path, compact_interval=0), args.reports, report, args.reads)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Tail latency of report calls with and without hedging, against an upstream stub whose latency is
+heavy-tailed: most calls take `--latency` seconds, and a `--tail-ratio` share of them stall for
+`--tail` seconds, like a slow replica or a GC pause on the provider side.
+
+Every request uses a distinct CPF so it misses the cache and waits on the upstream.
+
+Usage:
+    python -m benchmarks.bench_hedging --requests 1000 --concurrency 8 --latency 0.01 --tail 0.5 --tail-ratio 0.03
+"""
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.load_sync_vs_async import make_cpf
+from benchmarks.upstream_stub import start_stub_process
+
+
+def run(label: str, hedge: bool, url: str, total: int, concurrency: int, offset: int):
+    """
+    Consults `total` distinct CPFs through a SerasaService and prints latency percentiles.
+    :param label: a string naming the run
+    :param hedge: a boolean enabling hedging of PF report calls
+    :param url: the base URL of the upstream stub
+    :param total: an integer with the number of consultations
+    :param concurrency: an integer with the number of concurrent callers
+    :param offset: an integer added to the CPF seeds so runs do not share documents
+    """
+    os.environ["SERASA_PF_HEDGE"] = "true" if hedge else "false"
+    os.environ["MOCK_URL"] = url
+
+    from services.serasa_service import SerasaService
+
+    logging.getLogger("credit_check").setLevel(logging.WARNING)
+    service = SerasaService()
+    service.warm_up()
+
+    def call(seed: int) -> float:
+        start = time.perf_counter()
+        _, status = service.consult_cpf(make_cpf(100_000 + offset + seed))
+        assert status == 200, status
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(call, range(total)))
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+    hedging = service.stats()["hedging"]["pf"]
+    extra = hedging["hedged"] / hedging["calls"] * 100
+    print(
+        f"{label:<12} p50 {pct(50):7.1f} ms  p95 {pct(95):7.1f} ms  p99 {pct(99):7.1f} ms  "
+        f"max {latencies[-1] * 1000:7.1f} ms  mean {statistics.mean(latencies) * 1000:6.1f} ms  "
+        f"hedged {hedging['hedged']} ({extra:.1f}% extra calls), hedge wins {hedging['hedge_wins']}"
+    )
+    service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--tail", type=float, default=0.5)
+    parser.add_argument("--tail-ratio", type=float, default=0.03)
+    args = parser.parse_args()
+
+    os.environ.setdefault("SERASA_AUTH_TOKEN", "bench")
+    os.environ.setdefault("SERASA_HEDGE_MAX_RATIO", "0.1")
+
+    def latency() -> float:
+        return args.tail if random.random() < args.tail_ratio else args.latency * random.uniform(0.8, 1.2)
+
+    url, stub = start_stub_process(latency)
+    try:
+        print(
+            f"{args.requests} requests, concurrency {args.concurrency}, "
+            f"latency {args.latency * 1000:.0f} ms with {args.tail_ratio:.0%} at {args.tail * 1000:.0f} ms"
+        )
+        run("no hedging", False, url, args.requests, args.concurrency, 0)
+        run("hedging", True, url, args.requests, args.concurrency, args.requests)
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Logging overhead per request, as seen by the request thread, for the synchronous StreamHandler and
+the queue-based AsyncLogHandler.
+
+Each simulated request emits the 8 records of a CPF cache miss, then waits `--gap` seconds as it
+would on the upstream; only the time spent in the logging calls is measured. Two sinks are used:
+/dev/null, where the cost is formatting alone, and a pipe drained by a slow reader (`--reader-rate`
+bytes per second), like a stdout collector that falls behind.
+
+Usage:
+    python -m benchmarks.bench_logging --requests 5000 --gap 0.001 --reader-rate 500000
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from utils.logger import AsyncLogHandler, JsonFormatter
+
+RECORDS = [
+    {"event": "validate_cpf", "input": "****8909", "valid": True},
+    {"event": "validate_document", "type": "CPF", "input": "****8909", "valid": True},
+    {"event": "auth_request", "url": "http://mock-serasa/security/iam/v1/client-identities/login"},
+    {"event": "request_start", "document_id": "12345678909", "url": "http://mock-serasa/credit-services/report"},
+    {"event": "request_end", "document_id": "12345678909", "status_code": 200},
+    {"event": "consult_success", "document_id": "pf:12345678909"},
+    {"event": "cache_store", "document_id": "pf:12345678909", "ttl": 300},
+    "Incoming request: GET /api/v1/consulta/cpf/12345678909",
+]
+
+
+def slow_pipe(rate: int):
+    """
+    Opens a pipe whose read end is drained by a forked child at about `rate` bytes per second.
+    :param rate: an integer with the reader throughput in bytes per second
+    :return: a tuple (writable stream, child pid)
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(write_fd)
+        chunk = 4096
+        while os.read(read_fd, chunk):
+            time.sleep(chunk / rate)
+        os._exit(0)
+    os.close(read_fd)
+    return os.fdopen(write_fd, "w"), pid
+
+
+def run(label: str, handler: logging.Handler, total: int, gap: float):
+    """
+    Logs `total` simulated requests and prints the time spent logging in the request thread.
+    :param label: a string naming the run
+    :param handler: the handler under test
+    :param total: an integer with the number of simulated requests
+    :param gap: seconds each request waits after logging, like an upstream call
+    """
+    handler.setFormatter(JsonFormatter())
+    bench_logger = logging.getLogger(f"bench.{label}")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    bench_logger.addHandler(handler)
+
+    timings = []
+    for _ in range(total):
+        start = time.perf_counter()
+        for record in RECORDS:
+            bench_logger.info(record)
+        timings.append(time.perf_counter() - start)
+        time.sleep(gap)
+    timings.sort()
+
+    dropped = getattr(handler, "dropped", 0)
+    print(
+        f"{label:<20} mean {sum(timings) / total * 1e6:8.1f} us  p99 {timings[int(total * 0.99)] * 1e6:8.1f} us  "
+        f"max {timings[-1] * 1e6:9.1f} us  dropped {dropped} of {total * len(RECORDS)} records"
+    )
+    bench_logger.removeHandler(handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--gap", type=float, default=0.001)
+    parser.add_argument("--reader-rate", type=int, default=500_000)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull:
+        run("sync, /dev/null", logging.StreamHandler(devnull), args.requests, args.gap)
+        handler = AsyncLogHandler(devnull)
+        run("async, /dev/null", handler, args.requests, args.gap)
+        handler.close()
+
+    for label, build in [("sync, slow reader", logging.StreamHandler), ("async, slow reader", AsyncLogHandler)]:
+        stream, reader = slow_pipe(args.reader_rate)
+        handler = build(stream)
+        run(label, handler, args.requests, args.gap)
+        if isinstance(handler, AsyncLogHandler):
+            handler.close()
+        stream.close()
+        os.waitpid(reader, 0)
+
+
+if __name__ == "__main__":
+    main()
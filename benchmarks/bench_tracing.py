@@ -0,0 +1,57 @@
+"""
+Cost of the tracing instrumentation per request: the five spans of a CPF cache miss (validation, cache,
+auth, upstream and the root span), with tracing disabled, enabled without export and enabled with every
+trace queued for export.
+
+Usage:
+    python -m benchmarks.bench_tracing --requests 100000
+"""
+
+import argparse
+import time
+
+from utils.tracing import BatchSpanProcessor, Tracer, inject, span
+
+
+class NullExporter:
+    """
+    Exporter discarding the spans, so only the request-side cost is measured.
+    """
+
+    def export(self, spans):
+        pass
+
+
+def run(label: str, tracer: Tracer, total: int):
+    """
+    Times `total` simulated requests and prints the mean cost per request.
+    :param label: a string naming the run
+    :param tracer: the tracer under test
+    :param total: an integer with the number of simulated requests
+    """
+    start = time.perf_counter()
+    for i in range(total):
+        handle = tracer.start("GET /api/v1/consulta/cpf/<cpf>", f"req-{i}")
+        for name in ("validation", "cache", "auth"):
+            with span(name):
+                pass
+        with span("upstream", report_type="pf") as upstream:
+            inject({})
+            upstream.set("http.status_code", 200)
+        tracer.finish(handle, 200)
+    print(f"{label:<22} {(time.perf_counter() - start) / total * 1e6:6.2f} us per request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=100_000)
+    args = parser.parse_args()
+
+    run("disabled", Tracer(enabled=False), args.requests)
+    run("enabled, not exported", Tracer(enabled=True, sample_rate=0.0), args.requests)
+    processor = BatchSpanProcessor(NullExporter(), max_queue=1_000_000, interval=0.1)
+    run("enabled, exported", Tracer(enabled=True, processor=processor), args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Compares upstream throughput with and without the pooled keep-alive transport.
+
+Usage:
+    python -m benchmarks.bench_transport --requests 2000 --threads 8
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.upstream_stub import UpstreamStub
+from services.http_transport import TransportConfig, build_session
+
+
+def run(label: str, get, url: str, total: int, threads: int):
+    """
+    Issues `total` report requests using `threads` workers and prints requests/sec.
+    :param label: a string naming the scenario
+    :param get: a callable with the signature of requests.get
+    :param url: a string representing the report URL
+    :param total: an integer with the number of requests
+    :param threads: an integer with the number of concurrent workers
+    """
+    headers = {"Authorization": "Bearer bench-token", "X-Document-Id": "12345678909"}
+
+    def call(_):
+        resp = get(url, headers=headers, timeout=(3.05, 10))
+        resp.content  # noqa: B018 - drain the body so the connection returns to the pool
+        return resp.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(call, range(total)))
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for status in statuses if status != 200)
+    print(f"{label:<12} {total / elapsed:>10.1f} req/s  ({elapsed:.2f}s, {errors} errors)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    stub = UpstreamStub().start()
+    url = f"{stub.url}/credit-services/person-information-report/v1/creditreport"
+    try:
+        run("no pooling", requests.get, url, args.requests, args.threads)
+        session = build_session(TransportConfig(pool_maxsize=args.threads, max_connections=args.threads))
+        run("pooled", session.get, url, args.requests, args.threads)
+        session.close()
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
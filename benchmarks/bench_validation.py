@@ -0,0 +1,96 @@
+"""
+Bulk validation of a document list with the vectorized `validate_bulk` against a loop over the scalar
+`validate_cpf`/`validate_cnpj`, as when pre-screening a file before consultation.
+
+The input mixes formatted and unformatted CPFs and CNPJs, about half of them valid. The scalar loop runs
+with the per-document `validate_document` log sampled out, its cheapest configuration; with the log on,
+each record adds its formatting and write on top.
+
+Usage:
+    python -m benchmarks.bench_validation --documents 1000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from services.bulk_validation import validate_bulk
+from services.validation import CPF, document_type, validate_cnpj, validate_cpf
+import utils.logger
+from utils.logger import LogSampler
+
+
+def make_documents(total: int, seed: int = 1) -> list:
+    """
+    Builds a mixed list of CPFs and CNPJs: random digits with valid check digits for half of them,
+    and punctuation for a third.
+    :param total: an integer with the number of documents
+    :param seed: an integer seeding the generator
+    :return: a list of strings
+    """
+    rng = np.random.default_rng(seed)
+    documents = []
+    for size in (9, 12):
+        base = rng.integers(0, 10, (total // 2, size))
+        digits = np.concatenate([base, np.zeros((total // 2, 2), dtype=base.dtype)], axis=1)
+        for position in (size, size + 1):
+            if size == 9:
+                weight = np.arange(position + 1, 1, -1)
+                digits[:, position] = (digits[:, :position] @ weight) * 10 % 11 % 10
+            else:
+                weight = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])[-position:]
+                remainder = (digits[:, :position] @ weight) % 11
+                digits[:, position] = np.where(remainder < 2, 0, 11 - remainder)
+        digits[::2, -1] = (digits[::2, -1] + 1) % 10
+        documents += ["".join(map(str, row)) for row in digits.tolist()]
+    for i in range(0, len(documents), 3):
+        value = documents[i]
+        documents[i] = (
+            f"{value[:3]}.{value[3:6]}.{value[6:9]}-{value[9:]}" if len(value) == 11 else f"{value[:2]}.{value[2:]}"
+        )
+    return documents
+
+
+def scalar(documents: list) -> list:
+    """
+    Validates each document with the scalar validators.
+    :param documents: a list of strings
+    :return: a list of booleans
+    """
+    return [
+        bool(doc_type) and (validate_cpf(value) if doc_type == CPF else validate_cnpj(value))
+        for value, doc_type in ((value, document_type(value)) for value in documents)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents)
+    utils.logger.sampler = LogSampler({"validate_document": 0.0, "bulk_validation": 0.0})
+
+    start = time.perf_counter()
+    expected = scalar(documents)
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = validate_bulk(documents)
+    bulk_time = time.perf_counter() - start
+
+    array = np.array(documents)
+    start = time.perf_counter()
+    validate_bulk(array)
+    array_time = time.perf_counter() - start
+
+    assert result.valid.tolist() == expected
+    print(f"documents {len(documents)}, valid {result.summary()['valid']}")
+    print(f"scalar loop           {scalar_time:7.3f} s  {scalar_time / len(documents) * 1e9:7.1f} ns per document")
+    print(f"validate_bulk (list)  {bulk_time:7.3f} s  {bulk_time / len(documents) * 1e9:7.1f} ns per document")
+    print(f"validate_bulk (array) {array_time:7.3f} s  {array_time / len(documents) * 1e9:7.1f} ns per document")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Microbenchmarks of the scalar validators against the original regex and generator implementation,
+kept here as the reference. `--check` exits with an error when a validator is less than `--min-speedup`
+times faster than its reference, so a regression of the fast path fails the run whatever the machine speed.
+
+The per-document `validate_document` log is sampled out, so only validation is measured.
+
+Usage:
+    python -m benchmarks.bench_validators --number 50000 --check --min-speedup 1.5
+"""
+
+import argparse
+import re
+import sys
+import timeit
+
+import utils.logger
+from services.validation import check_cnpj, check_cpf, check_document
+from utils.logger import LogSampler
+
+
+def reference_cpf(cpf: str) -> bool:
+    """
+    The original CPF validator: regex normalization and two generator sums.
+    """
+    cpf = re.sub(r"\D", "", cpf)
+    if len(cpf) != 11 or cpf == cpf[0] * 11:
+        return False
+    check1 = sum(int(cpf[i]) * (10 - i) for i in range(9)) * 10 % 11 % 10
+    check2 = sum(int(cpf[i]) * (11 - i) for i in range(10)) * 10 % 11 % 10
+    return check1 == int(cpf[9]) and check2 == int(cpf[10])
+
+
+def reference_cnpj(cnpj: str) -> bool:
+    """
+    The original CNPJ validator: regex normalization and two generator sums.
+    """
+    cnpj = re.sub(r"\D", "", cnpj)
+    if len(cnpj) != 14 or cnpj == cnpj[0] * 14:
+        return False
+    weights_first = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
+    weights_second = [6] + weights_first
+    check1 = 11 - sum(int(cnpj[i]) * weights_first[i] for i in range(12)) % 11
+    check2 = 11 - sum(int(cnpj[i]) * weights_second[i] for i in range(13)) % 11
+    return (0 if check1 >= 10 else check1) == int(cnpj[12]) and (0 if check2 >= 10 else check2) == int(cnpj[13])
+
+
+def reference_document(value: str) -> bool:
+    """
+    The original batch path: infer the type from the digit count, then validate.
+    """
+    digits = re.sub(r"\D", "", value)
+    if len(digits) == 11:
+        return reference_cpf(value)
+    return len(digits) == 14 and reference_cnpj(value)
+
+
+# (name, fast path, reference, input)
+CASES = [
+    ("cpf formatted", check_cpf, reference_cpf, "123.456.789-09"),
+    ("cpf digits", check_cpf, reference_cpf, "12345678909"),
+    ("cpf invalid", check_cpf, reference_cpf, "123.456.789-00"),
+    ("cpf too short", check_cpf, reference_cpf, "123.456"),
+    ("cnpj formatted", check_cnpj, reference_cnpj, "11.222.333/0001-81"),
+    ("cnpj digits", check_cnpj, reference_cnpj, "11222333000181"),
+    ("document cnpj", check_document, reference_document, "11.222.333/0001-81"),
+]
+
+
+def measure(func, value: str, number: int, repeat: int = 5) -> float:
+    """
+    Times a validator call.
+    :param func: the validator
+    :param value: the input document
+    :param number: an integer with the number of calls per repetition
+    :param repeat: an integer with the number of repetitions, of which the fastest is kept
+    :return: the time per call in nanoseconds
+    """
+    return min(timeit.repeat(lambda: func(value), number=number, repeat=repeat)) / number * 1e9
+
+
+def run(number: int) -> list:
+    """
+    Measures every case.
+    :param number: an integer with the number of calls per repetition
+    :return: a list of (name, fast path ns, reference ns) tuples
+    """
+    utils.logger.sampler = LogSampler({"validate_document": 0.0})
+    return [
+        (name, measure(fast, value, number), measure(reference, value, number)) for name, fast, reference, value in CASES
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=50_000)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--min-speedup", type=float, default=1.5)
+    args = parser.parse_args()
+
+    failed = False
+    for name, fast, reference in run(args.number):
+        speedup = reference / fast
+        failed |= speedup < args.min_speedup
+        print(f"{name:<16} {fast:8.0f} ns  reference {reference:8.0f} ns  speedup {speedup:5.2f}x")
+    if args.check and failed:
+        sys.exit(f"a validator is less than {args.min_speedup}x faster than its reference")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Load test comparing the Flask (threaded WSGI) and ASGI serving paths against a slow upstream stub.
+
+The upstream stub and each server run in their own process; every request uses a distinct CPF so it
+misses the cache and waits on the upstream.
+
+Usage:
+    python -m benchmarks.load_sync_vs_async --requests 2000 --concurrency 200 --latency 0.05 --threads 16
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.upstream_stub import start_stub_process
+
+
+def make_cpf(seed: int) -> str:
+    """
+    Builds a valid CPF from a 9-digit seed.
+    :param seed: an integer used as the CPF base number
+    :return: a string with the 11 CPF digits
+    """
+    digits = [int(c) for c in f"{seed:09d}"]
+    for size in (9, 10):
+        total = sum(d * (size + 1 - i) for i, d in enumerate(digits[:size]))
+        digits.append(total * 10 % 11 % 10)
+    return "".join(map(str, digits))
+
+
+def serve_wsgi(threads: int, conn):
+    """
+    Serves the Flask app with a fixed-size thread pool, like a threaded production WSGI server.
+    :param threads: an integer with the number of worker threads
+    :param conn: a pipe end used to report the listening port
+    """
+    from werkzeug.serving import BaseWSGIServer
+
+    import app as flask_app
+
+    flask_app.app.extensions["rate_limiter"].limit = 10**9
+    logging.getLogger("credit_check").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    class PooledWSGIServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.__process, request, client_address)
+
+        def __process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer("127.0.0.1", 0, flask_app.app)
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+def serve_asgi(conn):
+    """
+    Serves the ASGI app with uvicorn.
+    :param conn: a pipe end used to report the listening port
+    """
+    import uvicorn
+
+    import asgi
+
+    asgi.rate_limiter.limit = 10**9
+    logging.getLogger("credit_check").setLevel(logging.WARNING)
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host="127.0.0.1", port=0, log_level="warning", backlog=4096))
+
+    def report_port():
+        while not server.started:
+            time.sleep(0.01)
+        conn.send(server.servers[0].sockets[0].getsockname()[1])
+
+    threading.Thread(target=report_port, daemon=True).start()
+    server.run()
+
+
+def start_server(target, *args) -> tuple[str, multiprocessing.Process]:
+    """
+    Runs a server function in a forked child process.
+    :param target: a function serving forever and sending its port through the pipe passed last
+    :return: the server base URL and the child process
+    """
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe()
+    process = context.Process(target=target, args=(*args, child), daemon=True)
+    process.start()
+    return f"http://127.0.0.1:{parent.recv()}", process
+
+
+async def load(base_url: str, total: int, concurrency: int, offset: int) -> tuple[list, float, int]:
+    """
+    Sends `total` CPF lookups with at most `concurrency` requests in flight.
+    :param base_url: a string representing the server URL
+    :param total: an integer with the number of requests
+    :param concurrency: an integer with the number of concurrent requests
+    :param offset: an integer used to generate CPFs not seen by previous runs
+    :return: the latencies in seconds, the elapsed time and the number of errors
+    """
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def one(i: int):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    resp = await client.get(f"/api/v1/consulta/cpf/{make_cpf(offset + i)}")
+                    errors += resp.status_code != 200
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return latencies, elapsed, errors
+
+
+def report(label: str, latencies: list, elapsed: float, errors: int):
+    """
+    Prints throughput and latency percentiles for one mode.
+    """
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{label:<6} {len(latencies) / elapsed:>9.1f} req/s  p50 {quantiles[49] * 1000:>8.1f} ms  "
+        f"p99 {quantiles[98] * 1000:>8.1f} ms  errors {errors}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="upstream latency in seconds")
+    parser.add_argument("--threads", type=int, default=16, help="WSGI worker threads")
+    parser.add_argument("--connections", type=int, default=32, help="upstream connection pool size")
+    args = parser.parse_args()
+
+    stub_url, stub = start_stub_process(lambda: args.latency)
+    os.environ["MOCK_URL"] = stub_url
+    os.environ["SERASA_CACHE_MAXSIZE"] = "10"
+    os.environ["SERASA_MAX_CONNECTIONS"] = os.environ["SERASA_POOL_MAXSIZE"] = str(args.connections)
+
+    processes = [stub]
+    try:
+        for label, target, target_args, offset in [
+            ("wsgi", serve_wsgi, (args.threads,), 100_000_000),
+            ("asgi", serve_asgi, (), 200_000_000),
+        ]:
+            url, process = start_server(target, *target_args)
+            processes.append(process)
+            report(label, *asyncio.run(load(url, args.requests, args.concurrency, offset)))
+            process.terminate()
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import json
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+REPORT = {"reports": [{"reportName": "RELATORIO_BASICO_PF_PME", "score": 750, "negativeData": {"pefin": []}}]}
+
+
+class UpstreamStub:
+    """
+    Local stand-in for the Serasa upstream used by the benchmarks.
+    It answers the login endpoint and both report endpoints over HTTP/1.1 keep-alive.
+
+    Attributes:
+        latency (Callable[[], float]): Function returning the delay, in seconds, applied to each report request.
+        report (dict): Report returned for every document.
+        url (str): Base URL the stub is listening on, available after `start`.
+    """
+
+    def __init__(self, latency: Optional[Callable[[], float]] = None, report: Optional[dict] = None):
+        self.latency = latency or (lambda: 0.0)
+        self.report = report or REPORT
+        self.url = None
+        self._server = None
+
+    def start(self) -> "UpstreamStub":
+        """
+        Starts the stub on an ephemeral port in a background thread.
+        :return: the started stub
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._reply(200, {"accessToken": "bench-token", "expiresIn": 3600})
+
+            def do_GET(self):
+                delay = stub.latency()
+                if delay:
+                    time.sleep(delay)
+                if self.headers.get("X-Document-Id", "").startswith("404"):
+                    self._reply(404, {"error": "Document not found"})
+                    return
+                self._reply(200, stub.report)
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 1024
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Stops the stub server.
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def start_stub_process(
+    latency: Optional[Callable[[], float]] = None, report: Optional[dict] = None
+) -> tuple[str, multiprocessing.Process]:
+    """
+    Runs an UpstreamStub in a forked child process, so its threads do not compete for the
+    benchmark process GIL.
+    :param latency: a function returning the delay, in seconds, applied to each report request
+    :param report: the report returned for every document
+    :return: the stub base URL and the child process (terminate it when done)
+    """
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe()
+
+    def serve():
+        stub = UpstreamStub(latency, report).start()
+        child.send(stub.url)
+        threading.Event().wait()
+
+    process = context.Process(target=serve, daemon=True)
+    process.start()
+    return parent.recv(), process
@@ -0,0 +1,83 @@
+"""
+Gunicorn settings for the production WSGI entry point (`gunicorn -c gunicorn.conf.py wsgi:app`).
+
+The app is preloaded in the master so workers share the imported code, and each worker creates its own
+Serasa service after the fork. Worker and thread counts are tuned through environment variables.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3000)}"
+preload_app = True
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+# a draining worker must be able to finish an upstream call that has just started
+_upstream_budget = float(os.getenv("SERASA_CONNECT_TIMEOUT", 3.05)) + float(os.getenv("SERASA_READ_TIMEOUT", 10))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", int(_upstream_budget) + 5))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", graceful_timeout + 15))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")
+errorlog = "-"
+
+# workers share their metrics through this directory, so /metrics reports the whole server; it must be
+# set before the app is preloaded
+os.environ.setdefault("METRICS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"credit-check-metrics-{os.getpid()}"))
+
+
+def on_starting(server):
+    """
+    Removes metric snapshots left by a previous run.
+    """
+    from utils.metrics import clear_multiprocess_dir
+
+    clear_multiprocess_dir(os.environ["METRICS_MULTIPROC_DIR"])
+
+
+def post_worker_init(worker):
+    """
+    Warms the worker up before it starts accepting connections, unless SERASA_WARM_UP is disabled, and
+    resumes the bulk jobs left unfinished by a previous run; each job is claimed by a single worker.
+    """
+    from app import get_job_manager, warm_up
+
+    if os.getenv("SERASA_WARM_UP", "true").lower() in ("1", "true", "yes"):
+        warm_up(worker.wsgi)
+    get_job_manager(worker.wsgi).resume()
+
+
+def worker_exit(server, worker):
+    """
+    Checkpoints the bulk jobs in progress, drains background calls, closes the upstream and cache
+    connections of a stopping worker, and writes its last metrics snapshot, queued log records and spans.
+    """
+    manager = worker.wsgi.extensions.get("job_manager")
+    if manager is not None:
+        manager.close()
+    service = worker.wsgi.extensions.get("serasa_service")
+    if service is not None:
+        service.close()
+
+    from utils.logger import handler
+    from utils.metrics import REGISTRY
+    from utils.tracing import tracer
+
+    REGISTRY.flush()
+    if tracer.processor is not None:
+        tracer.processor.flush()
+    handler.flush()
+
+
+def child_exit(server, worker):
+    """
+    Folds the metrics of an exited worker into the archive kept by the master.
+    """
+    from utils.metrics import REGISTRY
+
+    REGISTRY.mark_process_dead(worker.pid)
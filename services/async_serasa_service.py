@@ -0,0 +1,388 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from services.cache import CacheBackend, CachePolicy, MemoryCache, ReportCache, create_cache
+from services.http_transport import TransportConfig
+from services.serasa_service import REPORT_PATHS, batch_error, result_item
+from services.token_manager import AsyncTokenManager
+from services.validation import Document, check_document, parse_cnpj, parse_cpf
+from utils.logger import log_enabled, logger
+from utils.metrics import UPSTREAM_REQUEST_DURATION
+from utils.singleflight import AsyncSingleFlight
+from utils.tracing import inject, span
+
+
+class AsyncSerasaService:
+    """
+    asyncio variant of SerasaService, used by the ASGI app.
+    It shares validation, cache backends, cache policies and response formats with SerasaService,
+    and talks to the upstream through a pooled httpx.AsyncClient, so one event loop can keep many
+    upstream calls in flight instead of one thread per request.
+
+    Attributes:
+        mock_url (str): The base URL of the Serasa mock service.
+        auth_header (dict): The authorization header for API requests.
+        cache (CacheBackend): Cache of consultation results keyed by the namespaced document key.
+        reports (ReportCache): Stores reports in `cache` following the per report type policies.
+        transport (TransportConfig): Pool sizes and timeouts used for upstream calls.
+        client (httpx.AsyncClient): Pooled HTTP client, created by `start`.
+        token_manager (AsyncTokenManager): Owns the access token, created by `start`.
+        singleflight (AsyncSingleFlight): Coalesces concurrent upstream fetches for the same document.
+        batch_max_size (int): Maximum number of documents accepted in a single batch.
+        batch_workers (int): Maximum number of concurrent upstream calls per batch.
+
+    Methods:
+        start():
+            Opens the HTTP client; must run inside the event loop.
+        close():
+            Waits for background refreshes and closes the HTTP client.
+        consult_cpf(cpf: str) -> [dict, int]:
+            Consults the Serasa mock service for a person's credit report by CPF.
+        consult_cnpj(cnpj: str) -> [dict, int]:
+            Consults the Serasa mock service for a company's credit report by CNPJ.
+        consult_batch(documents: list) -> [dict, int]:
+            Consults a mixed list of CPFs and CNPJs concurrently.
+        stream_batch(documents: list, ordered: bool = True) -> [AsyncIterator, int]:
+            Like consult_batch, yielding each result as it is ready.
+        stats() -> dict:
+            Returns runtime counters exposed by the metrics endpoint.
+    """
+
+    def __init__(self, cache: Optional[CacheBackend] = None):
+        self.mock_url = os.getenv("MOCK_URL")
+        self.auth_header = {"Authorization": f"Basic {os.getenv('SERASA_AUTH_TOKEN')}"}
+        self.cache = cache or create_cache(ttl=float(os.getenv("SERASA_CACHE_TTL", 300)))
+        self.reports = ReportCache(
+            self.cache, {report_type: CachePolicy.from_env(report_type) for report_type in REPORT_PATHS}
+        )
+        self.transport = TransportConfig.from_env()
+        self.batch_max_size = int(os.getenv("SERASA_BATCH_MAX_SIZE", 5000))
+        self.batch_workers = int(os.getenv("SERASA_BATCH_WORKERS", 8))
+        self.singleflight = AsyncSingleFlight()
+        self.client = None
+        self.token_manager = None
+        self._upstream_slots = None
+        self._revalidating = {}
+
+    async def start(self):
+        """
+        Opens the pooled HTTP client. Must be awaited inside the event loop that serves requests.
+        """
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.transport.max_connections,
+                max_keepalive_connections=self.transport.pool_maxsize if self.transport.keep_alive else 0,
+            ),
+            timeout=httpx.Timeout(self.transport.read_timeout, connect=self.transport.connect_timeout),
+        )
+        # httpx hands freed connections to waiters in no particular order, so under a burst some requests
+        # starve until the pool timeout; queueing on a semaphore first keeps waiters first-come, first-served
+        self._upstream_slots = asyncio.Semaphore(self.transport.max_connections)
+        self.token_manager = AsyncTokenManager(
+            self.client, f"{self.mock_url}/security/iam/v1/client-identities/login", self.auth_header
+        )
+
+    async def close(self):
+        """
+        Waits for background refreshes and closes the HTTP client.
+        """
+        if self._revalidating:
+            await asyncio.gather(*self._revalidating.values(), return_exceptions=True)
+        if self.token_manager:
+            await self.token_manager.close()
+        if self.client:
+            await self.client.aclose()
+        self.cache.close()
+
+    async def __cache_call(self, fn, *args):
+        """
+        Runs a cache operation, off the event loop unless the cache is purely in-process.
+        """
+        if isinstance(self.cache, MemoryCache):
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def __get(self, url: str, headers: dict, report_type: str) -> httpx.Response:
+        """
+        Makes one GET request, recording its latency in the upstream histogram and tracing it as an
+        "upstream" span whose context is sent upstream.
+        """
+        with span("upstream", report_type=report_type) as upstream_span:
+            inject(headers)
+            async with self._upstream_slots:
+                start = time.perf_counter()
+                status = "error"
+                try:
+                    resp = await self.client.get(url, headers=headers)
+                    status = str(resp.status_code)
+                    upstream_span.set("http.status_code", resp.status_code)
+                    return resp
+                finally:
+                    UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - start, report_type, status)
+
+    async def __request_with_retry(self, url: str, document_id: str, report_type: str = "report") -> httpx.Response:
+        """
+        Makes a GET request to the specified URL, retrying once with a new token on 401.
+        :param url: a string representing the URL to request
+        :param document_id: a string representing the document digits
+        :param report_type: a string with the report type, labelling the latency histogram
+        :return: an httpx.Response object
+        """
+        if log_enabled("request_start"):
+            logger.info({"event": "request_start", "document_id": document_id, "url": url})
+
+        with span("auth"):
+            token = await self.token_manager.get_token()
+        headers = {"Authorization": f"Bearer {token}", "X-Document-Id": document_id}
+        resp = await self.__get(url, headers, report_type)
+
+        if resp.status_code == 401:
+            logger.warning({"event": "token_expired", "message": "Retrying request with new token"})
+
+            with span("auth", refresh=True):
+                token = await self.token_manager.get_token(force=True, stale_token=token)
+            headers["Authorization"] = f"Bearer {token}"
+            resp = await self.__get(url, headers, report_type)
+
+        if log_enabled("request_end"):
+            logger.info({"event": "request_end", "document_id": document_id, "status_code": resp.status_code})
+
+        return resp
+
+    async def __cached_response(self, document: Document) -> Optional[tuple[dict, int]]:
+        """
+        Builds the consultation response for a document already in the cache, scheduling a background
+        refresh when the report is stale.
+        :param document: a validated Document
+        :return: a (response, status) tuple, or None on a cache miss
+        """
+        hit = await self.__cache_call(self.reports.lookup, document)
+        if hit is None:
+            return None
+
+        response_data, status, stale = hit
+        if stale and document.key not in self._revalidating:
+            self.reports.counters["revalidations"] += 1
+            task = asyncio.get_running_loop().create_task(self.__revalidate(document))
+            self._revalidating[document.key] = task
+        return response_data, status
+
+    async def __revalidate(self, document: Document):
+        try:
+            await self.singleflight.do(document.key, self.__request_report, document, True)
+        except Exception as e:
+            logger.warning({"event": "revalidation_failed", "document_id": document.key, "error": str(e)})
+        finally:
+            self._revalidating.pop(document.key, None)
+
+    async def __consult(self, document: Document) -> tuple[dict, int]:
+        """
+        Answers a validated document from the cache or fetches it from the upstream.
+        :param document: a validated Document
+        :return: a (response, status) tuple
+        """
+        with span("cache"):
+            cached = await self.__cached_response(document)
+        if cached:
+            return cached
+        return await self.__fetch(document)
+
+    async def __fetch(self, document: Document) -> tuple[dict, int]:
+        """
+        Fetches a validated document already missed in the cache from the upstream, coalescing
+        concurrent fetches for the same document.
+        :param document: a validated Document
+        :return: a (response, status) tuple
+        """
+        response_data, status = await self.singleflight.do(document.key, self.__request_report, document)
+        return dict(response_data), status
+
+    async def __request_report(self, document: Document, revalidate: bool = False) -> tuple[dict, int]:
+        """
+        Requests a report from the upstream and caches the answer.
+        :param document: a validated Document
+        :param revalidate: a boolean indicating a background refresh of a stale entry
+        :return: a (response, status) tuple
+        """
+        if not revalidate:
+            # a previous leader may have filled the cache between our miss and taking the lead; the miss
+            # was already counted, so the cache is peeked at without counting another lookup
+            cached = await self.__cache_call(self.reports.peek, document)
+            if cached:
+                return cached
+
+        try:
+            resp = await self.__request_with_retry(
+                f"{self.mock_url}{REPORT_PATHS[document.report_type]}", document.digits, document.report_type
+            )
+        except httpx.HTTPError as e:
+            logger.error({"event": "service_error", "document_id": document.key, "error": str(e)})
+            return {"error": "Error in Serasa service. Please try again later."}, 503
+
+        if resp.status_code == 404:
+            logger.error({"event": "document_not_found", "document_id": document.key})
+            await self.__cache_call(self.reports.store, document, None)
+            return {"error": "Document not found"}, 404
+        if resp.status_code != 200:
+            logger.error({"event": "service_error", "status_code": resp.status_code})
+            return {"error": "Error in Serasa service. Please try again later."}, 503
+
+        data = resp.json()
+        await self.__cache_call(self.reports.store, document, data)
+
+        if log_enabled("consult_success"):
+            logger.info({"event": "consult_success", "document_id": document.key})
+        return {"success": True, "data": data, "cached": False}, 200
+
+    async def consult_cpf(self, cpf: str) -> [dict, int]:
+        """
+        Consults the Serasa mock service for a person's credit report by CPF.
+        :param cpf: a string representing the CPF number, which may contain non-digit characters
+        :return: a dictionary with the result of the consultation
+        """
+        with span("validation"):
+            document = parse_cpf(cpf)
+        if document is None:
+            logger.error({"event": "invalid_cpf"})
+            return {"error": "Invalid CPF."}, 400
+
+        return await self.__consult(document)
+
+    async def consult_cnpj(self, cnpj: str) -> [dict, int]:
+        """
+        Consults the Serasa mock service for a company's credit report by CNPJ.
+        :param cnpj: a string representing the CNPJ number, which may contain non-digit characters
+        :return: a dictionary with the result of the consultation
+        """
+        with span("validation"):
+            document = parse_cnpj(cnpj)
+        if document is None:
+            logger.error({"event": "invalid_cnpj"})
+            return {"error": "Invalid CNPJ."}, 400
+
+        return await self.__consult(document)
+
+    async def consult_batch(self, documents: list) -> [dict, int]:
+        """
+        Consults a mixed list of CPFs and CNPJs, with at most `batch_workers` upstream calls in flight.
+        Validation, per-item statuses and the response format match SerasaService.consult_batch.
+        :param documents: a list of strings with CPF (11 digits) or CNPJ (14 digits) numbers
+        :return: a dictionary with one result per document, in the input order
+        """
+        items, status = await self.stream_batch(documents)
+        if status != 200:
+            return items, status
+        items = [item async for item in items]
+        return {"results": items, "total": len(items)}, 200
+
+    async def stream_batch(self, documents: list, ordered: bool = True) -> [AsyncIterator, int]:
+        """
+        Consults a mixed list of CPFs and CNPJs like `consult_batch`, returning the results as they are
+        ready. The upstream calls are scheduled as tasks before returning, so they run in the request
+        context and progress while earlier results are being sent.
+        :param documents: a list of strings with CPF (11 digits) or CNPJ (14 digits) numbers
+        :param ordered: a boolean, True to return the results in input order, False in completion order
+        :return: an async iterator of result items and 200, or an error dictionary and 400
+        """
+        error = batch_error(documents, self.batch_max_size)
+        if error:
+            return {"error": error}, 400
+
+        if log_enabled("batch_start"):
+            logger.info({"event": "batch_start", "size": len(documents)})
+
+        semaphore = asyncio.Semaphore(self.batch_workers)
+
+        async def fetch(document: Document) -> tuple[str, tuple[dict, int]]:
+            async with semaphore:
+                try:
+                    return document.key, await self.__fetch(document)
+                except Exception as e:
+                    logger.error({"event": "batch_item_error", "document_id": document.key, "error": str(e)})
+                    return document.key, ({"error": "Error in Serasa service. Please try again later."}, 503)
+
+        parsed = {}
+        results = {}
+        pending = {}
+        for raw in documents:
+            if raw in parsed:
+                continue
+
+            validation = check_document(raw)
+            doc_type, document = validation.type, validation.document()
+            parsed[raw] = (doc_type, document.key if document else raw)
+
+            if document is None:
+                error = f"Invalid {doc_type}." if doc_type else "Invalid document."
+                results[raw] = ({"error": error}, 400)
+                continue
+            if document.key in results or document.key in pending:
+                continue
+
+            cached = await self.__cached_response(document)
+            if cached:
+                results[document.key] = cached
+            else:
+                pending[document.key] = asyncio.ensure_future(fetch(document))
+
+        return self.__batch_items(documents, parsed, results, pending, ordered), 200
+
+    @staticmethod
+    async def __batch_items(documents: list, parsed: dict, results: dict, pending: dict, ordered: bool) -> AsyncIterator:
+        """
+        Yields the result items of a batch, like SerasaService, cancelling the remaining upstream calls
+        if the reader stops early.
+        :param documents: the batch documents
+        :param parsed: the type and result key of each distinct document
+        :param results: the results known up front, by key
+        :param pending: the tasks of the upstream calls, by key
+        :param ordered: a boolean, True to yield in input order, False in completion order
+        :return: an async generator of result item dictionaries
+        """
+        upstream_calls = len(pending)
+        try:
+            if ordered:
+                remaining = Counter(parsed[raw][1] for raw in documents)
+                for raw in documents:
+                    doc_type, key = parsed[raw]
+                    if key in pending:
+                        results[key] = (await pending.pop(key))[1]
+                    yield result_item(raw, doc_type, *results[key])
+                    remaining[key] -= 1
+                    if not remaining[key]:
+                        del results[key]
+            else:
+                waiting = {}
+                for raw in documents:
+                    doc_type, key = parsed[raw]
+                    if key in pending:
+                        waiting.setdefault(key, []).append(raw)
+                    else:
+                        yield result_item(raw, doc_type, *results[key])
+                for task in asyncio.as_completed(list(pending.values())):
+                    key, result = await task
+                    del pending[key]
+                    for raw in waiting.pop(key):
+                        yield result_item(raw, parsed[raw][0], *result)
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+        if log_enabled("batch_end"):
+            logger.info({"event": "batch_end", "size": len(documents), "upstream_calls": upstream_calls})
+
+    def stats(self) -> dict:
+        """
+        Returns runtime counters of the service.
+        :return: a dictionary with the service counters
+        """
+        return {
+            "singleflight": self.singleflight.stats(),
+            "token": self.token_manager.stats() if self.token_manager else {},
+            "cache": {**self.cache.stats(), **self.reports.counters},
+        }
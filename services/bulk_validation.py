@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Optional
+
+import numpy as np
+
+from services.validation import CNPJ, CPF, Document, only_digits
+from utils.logger import log_enabled, logger
+
+CPF_WEIGHTS = (np.arange(10, 1, -1), np.arange(11, 1, -1))
+CNPJ_WEIGHTS = (np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]), np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]))
+DEFAULT_CHUNK_SIZE = 65536
+
+
+@dataclass(frozen=True)
+class BulkValidation:
+    """
+    Result of validating a list of documents at once, one row per input document.
+
+    Attributes:
+        valid (np.ndarray): Boolean validity mask.
+        digits (np.ndarray): Normalized digits of each document, or "" when it has neither 11 nor 14 digits.
+        types (np.ndarray): "CPF" or "CNPJ" inferred from the number of digits, or "".
+
+    Methods:
+        summary() -> dict:
+            Counts of documents by type and validity.
+        documents() -> list:
+            The valid documents as Document instances, in input order.
+    """
+
+    valid: np.ndarray
+    digits: np.ndarray
+    types: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.valid)
+
+    def summary(self) -> dict:
+        """
+        Counts of documents by type and validity.
+        :return: a dictionary with total, valid, invalid, cpf and cnpj counts
+        """
+        total = len(self.valid)
+        valid = int(np.count_nonzero(self.valid))
+        return {
+            "total": total,
+            "valid": valid,
+            "invalid": total - valid,
+            "cpf": int(np.count_nonzero(self.valid & (self.types == CPF))),
+            "cnpj": int(np.count_nonzero(self.valid & (self.types == CNPJ))),
+        }
+
+    def documents(self) -> list:
+        """
+        The valid documents as Document instances, in input order.
+        :return: a list of Document
+        """
+        types, digits = self.types[self.valid].tolist(), self.digits[self.valid].tolist()
+        return [Document(doc_type, value) for doc_type, value in zip(types, digits)]
+
+
+def digit_matrix(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Packs the digits of each string to the left of a 14-column matrix of character codes, dropping every
+    other character; rows with fewer digits are padded with 0, rows with more are truncated. Decimal digits
+    of other scripts are normalized to ASCII, as in `only_digits`.
+    :param values: a NumPy array of str or bytes
+    :return: a tuple with a (len(values), 14) uint32 array of character codes, 0 for padding, and the
+        number of digits of each string before truncation
+    """
+    if values.dtype.kind == "S":
+        codes = values.view(np.uint8).reshape(len(values), -1).astype(np.uint32)
+    else:
+        codes = values.view(np.uint32).reshape(len(values), -1)
+        non_ascii = (codes > 127).any(axis=1)
+        if non_ascii.any():
+            # other scripts' decimal digits count as digits, like in only_digits: those rows are normalized
+            # by it, which never makes them longer
+            values = values.copy()
+            values[non_ascii] = [only_digits(value) for value in values[non_ascii].tolist()]
+            codes = values.view(np.uint32).reshape(len(values), -1)
+    # unsigned subtraction wraps around, so only "0" to "9" are below 10
+    is_digit = (codes - 48) < 10
+    position = np.cumsum(is_digit, axis=1, dtype=np.int16 if codes.shape[1] < 2**15 else np.intp)
+    # every character is written in one pass: digits to their packed column, the rest to a discarded 15th column
+    target = np.where(is_digit & (position <= 14), position - 1, 14).astype(np.intp)
+    packed = np.zeros((len(values), 15), dtype=np.uint32)
+    np.put_along_axis(packed, target, codes, axis=1)
+    return np.ascontiguousarray(packed[:, :14]), position[:, -1]
+
+
+def check_digits(digits: np.ndarray, weights: tuple, cpf: bool) -> np.ndarray:
+    """
+    Computes whether the last two digits of each row are the check digits of the others.
+    :param digits: an (n, 11) or (n, 14) integer array of digits
+    :param weights: the weight vectors of the first and second check digits
+    :param cpf: a boolean selecting the CPF rule (otherwise CNPJ)
+    :return: a boolean array with one value per row
+    """
+    size = digits.shape[1]
+    valid = ~(digits == digits[:, :1]).all(axis=1)
+    for position, weight in zip((size - 2, size - 1), weights):
+        remainder = (digits[:, :position] @ weight) % 11
+        check = remainder * 10 % 11 % 10 if cpf else np.where(remainder < 2, 0, 11 - remainder)
+        valid &= check == digits[:, position]
+    return valid
+
+
+def validate_chunk(values: np.ndarray, doc_type: Optional[str]) -> BulkValidation:
+    """
+    Validates one chunk of documents. See validate_bulk.
+    """
+    if values.dtype.kind not in "US":
+        values = values.astype(str)
+    packed, count = digit_matrix(values)
+    digits = packed.astype(np.int32) - 48
+
+    is_cpf = count == 11 if doc_type in (None, CPF) else np.zeros(len(values), dtype=bool)
+    is_cnpj = count == 14 if doc_type in (None, CNPJ) else np.zeros(len(values), dtype=bool)
+    valid = np.zeros(len(values), dtype=bool)
+    if is_cpf.any():
+        valid[is_cpf] = check_digits(digits[is_cpf, :11], CPF_WEIGHTS, cpf=True)
+    if is_cnpj.any():
+        valid[is_cnpj] = check_digits(digits[is_cnpj], CNPJ_WEIGHTS, cpf=False)
+
+    packed[~(is_cpf | is_cnpj)] = 0
+    types = np.where(is_cpf, CPF, np.where(is_cnpj, CNPJ, ""))
+    return BulkValidation(valid, packed.view("U14").ravel(), types)
+
+
+def chunked(documents: Iterable, chunk_size: int):
+    """
+    Splits documents into NumPy string arrays of at most `chunk_size` items.
+    :param documents: an iterable or NumPy array of strings
+    :param chunk_size: an integer with the maximum chunk length
+    :return: a generator of NumPy arrays
+    """
+    if isinstance(documents, np.ndarray):
+        for start in range(0, len(documents), chunk_size):
+            end = start + chunk_size
+            yield np.ascontiguousarray(documents[start:end])
+        return
+    iterator = iter(documents)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield np.array(chunk, dtype=str)
+
+
+def validate_bulk(
+    documents: Iterable, doc_type: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> BulkValidation:
+    """
+    Validates many CPFs and CNPJs at once, for pre-screening files before consultation.
+    Inputs are normalized and their check digits computed with array operations, a chunk at a time to
+    bound memory. Only a summary is logged, never the individual documents.
+    :param documents: an iterable or NumPy array of strings, formatted or not
+    :param doc_type: "CPF" or "CNPJ" to accept only that type, or None to infer it from the number of digits
+    :param chunk_size: an integer with the number of documents processed per chunk
+    :return: a BulkValidation with one row per document
+    """
+    if doc_type not in (None, CPF, CNPJ):
+        raise ValueError(f"Unknown document type: {doc_type}")
+
+    results = [validate_chunk(chunk, doc_type) for chunk in chunked(documents, chunk_size) if len(chunk)]
+    if len(results) == 1:
+        result = results[0]
+    elif results:
+        result = BulkValidation(
+            np.concatenate([item.valid for item in results]),
+            np.concatenate([item.digits for item in results]),
+            np.concatenate([item.types for item in results]),
+        )
+    else:
+        result = BulkValidation(np.zeros(0, dtype=bool), np.zeros(0, dtype="U14"), np.zeros(0, dtype="U4"))
+
+    if log_enabled("bulk_validation"):
+        logger.info({"event": "bulk_validation", **result.summary()})
+    return result
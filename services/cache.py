@@ -0,0 +1,598 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from utils.logger import log_enabled, logger
+from utils.metrics import CACHE_LOOKUPS
+from utils.resp import RespClient, RespError
+
+
+def serialize(value: Any) -> bytes:
+    """
+    Encodes a report payload as compact, zlib-compressed JSON.
+    :param value: a JSON-serializable value
+    :return: the encoded bytes
+    """
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode(), 6)
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estimates the memory footprint of a report payload by the size of its compact JSON encoding.
+    :param value: a JSON-serializable value
+    :return: the estimated size in bytes
+    """
+    return len(json.dumps(value, separators=(",", ":")))
+
+
+def deserialize(data: bytes) -> Any:
+    """
+    Decodes a payload produced by `serialize`.
+    :param data: the encoded bytes
+    :return: the decoded value
+    """
+    return json.loads(zlib.decompress(data))
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """
+    Caching rules for one report type.
+
+    Attributes:
+        fresh_ttl (float): Seconds a report is served as fresh (soft TTL).
+        stale_ttl (float): Extra seconds a report may be served stale while it is revalidated in the background.
+        negative_ttl (float): Seconds a "document not found" answer is cached; 0 disables negative caching.
+        fallback_ttl (float): Extra seconds, after the stale window, a report is kept only to be served
+            when the upstream is unavailable.
+    """
+
+    fresh_ttl: float
+    stale_ttl: float = 0
+    negative_ttl: float = 0
+    fallback_ttl: float = 0
+
+    @classmethod
+    def from_env(cls, report_type: str) -> "CachePolicy":
+        """
+        Builds the policy of a report type from SERASA_<TYPE>_* variables, falling back to SERASA_CACHE_*.
+        :param report_type: a string representing the report type ("pf" or "pj")
+        :return: a CachePolicy instance
+        """
+        prefix = f"SERASA_{report_type.upper()}_"
+
+        def setting(name: str, default: float) -> float:
+            return float(os.getenv(prefix + name, os.getenv(f"SERASA_CACHE_{name}", default)))
+
+        return cls(
+            fresh_ttl=float(os.getenv(prefix + "CACHE_TTL", os.getenv("SERASA_CACHE_TTL", 300))),
+            stale_ttl=setting("STALE_TTL", 60),
+            negative_ttl=setting("NEGATIVE_TTL", 30),
+            fallback_ttl=setting("FALLBACK_TTL", 600),
+        )
+
+
+class CacheBackend:
+    """
+    Interface implemented by every cache backend used by SerasaService.
+    Entries carry their own absolute expiration time, so a value copied from one backend to another
+    keeps the same expiry.
+
+    Attributes:
+        name (str): Short backend name reported in stats.
+        tier (str): Cache tier served by the backend: "l1" for in-process, "l2" for shared backends.
+        ttl (float): Default time-to-live in seconds for new entries.
+        hits (int): Number of lookups that found a live entry.
+        misses (int): Number of lookups that found nothing.
+        evictions (int): Number of live entries removed to make room for new ones.
+
+    Methods:
+        get_entry(key: str) -> Optional[tuple[Any, float]]:
+            Returns the value and its expiration time, or None on a miss.
+        lookup(key: str) -> Optional[tuple[Any, float, str]]:
+            Like `get_entry`, also returning the tier that served the value.
+        peek(key: str) -> Optional[tuple[Any, float, str]]:
+            Like `lookup`, without counting a hit or a miss.
+        set(key: str, value: Any, ttl: Optional[float] = None):
+            Stores a value with the given (or default) time-to-live.
+        delete(key: str):
+            Removes a value.
+        clear():
+            Removes every value.
+        stats() -> dict:
+            Returns hit/miss/eviction counters.
+    """
+
+    name = "base"
+    tier = "l2"
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: Any, expires_at: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def get_entry(self, key: str) -> Optional[tuple[Any, float]]:
+        """
+        Looks up a value and its absolute expiration time.
+        :param key: a string representing the cache key
+        :return: a (value, expires_at) tuple, or None on a miss
+        """
+        entry = self._get(key)
+        if entry is None or entry[1] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def lookup(self, key: str) -> Optional[tuple[Any, float, str]]:
+        """
+        Looks up a value, its absolute expiration time and the tier that served it.
+        :param key: a string representing the cache key
+        :return: a (value, expires_at, tier) tuple, or None on a miss
+        """
+        entry = self.get_entry(key)
+        return (entry[0], entry[1], self.tier) if entry else None
+
+    def peek(self, key: str) -> Optional[tuple[Any, float, str]]:
+        """
+        Looks up a value like `lookup`, without counting a hit or a miss.
+        :param key: a string representing the cache key
+        :return: a (value, expires_at, tier) tuple, or None on a miss
+        """
+        entry = self._get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0], entry[1], self.tier
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Looks up a value.
+        :param key: a string representing the cache key
+        :param default: the value returned on a miss
+        :return: the cached value or `default`
+        """
+        entry = self.get_entry(key)
+        return entry[0] if entry else default
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None):
+        """
+        Stores a value.
+        :param key: a string representing the cache key
+        :param value: a JSON-serializable value
+        :param ttl: a float with the time-to-live in seconds, defaults to the backend TTL
+        :param expires_at: an absolute epoch expiration time, takes precedence over `ttl`
+        """
+        if expires_at is None:
+            expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._set(key, value, expires_at)
+
+    def stats(self) -> dict:
+        """
+        Returns the backend counters.
+        :return: a dictionary with hits, misses and evictions
+        """
+        return {"backend": self.name, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def close(self):
+        """
+        Releases resources held by the backend.
+        """
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def __getitem__(self, key: str) -> Any:
+        entry = self._get(key)
+        if entry is None or entry[1] <= time.time():
+            raise KeyError(key)
+        return entry[0]
+
+    def __setitem__(self, key: str, value: Any):
+        self.set(key, value)
+
+
+class MemoryCache(CacheBackend):
+    """
+    Per-process LRU cache with per-entry expiration, bounded both in entries and in bytes.
+    Values are stored as-is; their size is estimated once, when they are stored.
+    """
+
+    name = "memory"
+    tier = "l1"
+
+    def __init__(self, ttl: float, maxsize: int = 100, max_bytes: Optional[int] = None):
+        super().__init__(ttl)
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __remove(self, key: str) -> tuple:
+        entry = self._entries.pop(key)
+        self.bytes -= entry[2]
+        return entry
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                self.__remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def _set(self, key: str, value: Any, expires_at: float):
+        size = estimate_size(value) if self.max_bytes else 0
+        with self._lock:
+            if key in self._entries:
+                self.__remove(key)
+            if self.max_bytes and size > self.max_bytes:
+                # too large to keep, but the previous value of the key is outdated all the same
+                return
+            self._entries[key] = (value, expires_at, size)
+            self.bytes += size
+
+            now = time.time()
+            while len(self._entries) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes):
+                _, (_, evicted_expires_at, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                if evicted_expires_at > now:
+                    self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self.__remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._entries), "bytes": self.bytes}
+
+
+class SQLiteCache(CacheBackend):
+    """
+    On-host cache shared by every worker process through a SQLite database in WAL mode.
+    Each thread keeps its own connection; expired rows are purged opportunistically on writes.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, ttl: float, path: str, purge_every: int = 1000):
+        super().__init__(ttl)
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        with self.__connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+
+    def __connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        row = self.__connection().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        return (deserialize(row[0]), row[1]) if row else None
+
+    def _set(self, key: str, value: Any, expires_at: float):
+        conn = self.__connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, serialize(value), expires_at)
+        )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str):
+        self.__connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self.__connection().execute("DELETE FROM cache")
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisCache(CacheBackend):
+    """
+    Network cache shared across hosts through a Redis-compatible server.
+    Expiration is delegated to the server; store errors degrade to cache misses instead of failing requests.
+    """
+
+    name = "redis"
+
+    def __init__(self, ttl: float, url: str, prefix: str = "serasa:"):
+        super().__init__(ttl)
+        self.client = RespClient.from_url(url)
+        self.prefix = prefix
+        self.errors = 0
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        try:
+            value, pttl = self.client.pipeline([("GET", self.prefix + key), ("PTTL", self.prefix + key)])
+            # the pipeline returns error replies in place rather than raising them
+            for reply in (value, pttl):
+                if isinstance(reply, RespError):
+                    raise reply
+        except (OSError, RespError) as e:
+            self.__failed(e)
+            return None
+        if value is None:
+            return None
+        return deserialize(value), time.time() + max(pttl, 0) / 1000
+
+    def _set(self, key: str, value: Any, expires_at: float):
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        try:
+            self.client.execute("SET", self.prefix + key, serialize(value), "PX", ttl_ms)
+        except (OSError, RespError) as e:
+            self.__failed(e)
+
+    def delete(self, key: str):
+        try:
+            self.client.execute("DEL", self.prefix + key)
+        except (OSError, RespError) as e:
+            self.__failed(e)
+
+    def clear(self):
+        try:
+            self.client.execute("FLUSHDB")
+        except (OSError, RespError) as e:
+            self.__failed(e)
+
+    def __failed(self, error: Exception):
+        """
+        Counts and logs a failed store call, which the caller then treats as a miss or a no-op.
+        :param error: the connection error or error reply
+        """
+        self.errors += 1
+        logger.warning({"event": "cache_backend_error", "backend": self.name, "error": str(error)})
+
+    def stats(self) -> dict:
+        return {**super().stats(), "errors": self.errors}
+
+    def close(self):
+        self.client.close()
+
+
+class TieredCache(CacheBackend):
+    """
+    Two-tier cache: a small in-process L1 in front of a shared L2.
+    Lookups check L1 first; an L2 hit is promoted into L1 with the same absolute expiration time,
+    so an L1 copy never outlives the L2 entry it came from. Writes go to both tiers.
+    """
+
+    name = "tiered"
+
+    def __init__(self, l1: CacheBackend, l2: CacheBackend):
+        super().__init__(l2.ttl)
+        self.l1 = l1
+        self.l2 = l2
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        entry = self.lookup(key)
+        return (entry[0], entry[1]) if entry else None
+
+    def _set(self, key: str, value: Any, expires_at: float):
+        self.l2.set(key, value, expires_at=expires_at)
+        self.l1.set(key, value, expires_at=expires_at)
+
+    def get_entry(self, key: str) -> Optional[tuple[Any, float]]:
+        return self._get(key)
+
+    def lookup(self, key: str) -> Optional[tuple[Any, float, str]]:
+        entry = self.l1.lookup(key)
+        if entry:
+            return entry
+
+        entry = self.l2.get_entry(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        self.l1.set(key, value, expires_at=expires_at)
+        return value, expires_at, self.l2.tier
+
+    def peek(self, key: str) -> Optional[tuple[Any, float, str]]:
+        return self.l1.peek(key) or self.l2.peek(key)
+
+    def delete(self, key: str):
+        self.l1.delete(key)
+        self.l2.delete(key)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "l1": self.l1.stats(), "l2": self.l2.stats()}
+
+    def close(self):
+        self.l1.close()
+        self.l2.close()
+
+
+class ReportCache:
+    """
+    Report-level view of a cache backend shared by the sync and async Serasa services.
+    It stores reports with a fresh (soft) TTL plus a stale window, and "not found" answers with a
+    negative TTL, following the policy of each report type, and turns entries into API responses.
+
+    Attributes:
+        backend (CacheBackend): The underlying cache backend.
+        policies (dict): CachePolicy per report type ("pf" and "pj").
+        counters (dict): Stale, revalidation, negative hit and fallback counters.
+
+    Methods:
+        lookup(document, fallback: bool) -> Optional[tuple[dict, int, bool]]:
+            Returns the cached response, its status and whether it is stale.
+        peek(document) -> Optional[tuple[dict, int]]:
+            Returns the cached response while it is fresh, without counting the lookup.
+        store(document, data: Optional[dict]):
+            Caches a report, or a "not found" marker when `data` is None.
+    """
+
+    def __init__(self, backend: CacheBackend, policies: dict):
+        self.backend = backend
+        self.policies = policies
+        self.counters = {"stale_served": 0, "revalidations": 0, "negative_hits": 0, "fallback_served": 0}
+
+    def lookup(self, document, fallback: bool = False) -> Optional[tuple[dict, int, bool]]:
+        """
+        Builds the consultation response for a document already in the cache.
+        Reports past their stale window are only kept for fallback lookups, made when the upstream
+        cannot be called.
+        :param document: a validated Document
+        :param fallback: whether reports past their stale window may be served
+        :return: a (response, status, stale) tuple, or None on a cache miss
+        """
+        entry = self.backend.lookup(document.key)
+        if entry is None:
+            CACHE_LOOKUPS.inc(document.report_type, "miss")
+            return None
+
+        value, _, tier = entry
+        if value.get("not_found"):
+            self.counters["negative_hits"] += 1
+            CACHE_LOOKUPS.inc(document.report_type, "negative")
+            if log_enabled("negative_cache_hit"):
+                logger.info({"event": "negative_cache_hit", "document_id": document.key, "tier": tier})
+            return {"error": "Document not found", "cached": True, "cache_tier": tier}, 404, False
+
+        now = time.time()
+        response = {"success": True, "data": value["data"], "cached": True, "cache_tier": tier}
+        if value["fresh_until"] > now:
+            CACHE_LOOKUPS.inc(document.report_type, "hit")
+            if log_enabled("cache_hit"):
+                logger.info({"event": "cache_hit", "document_id": document.key, "tier": tier})
+            return response, 200, False
+
+        if value.get("stale_until", now) < now:
+            if not fallback:
+                CACHE_LOOKUPS.inc(document.report_type, "miss")
+                return None
+            self.counters["fallback_served"] += 1
+            CACHE_LOOKUPS.inc(document.report_type, "fallback")
+            if log_enabled("fallback_cache_hit"):
+                logger.info({"event": "fallback_cache_hit", "document_id": document.key, "tier": tier})
+            response["stale"] = True
+            return response, 200, True
+
+        self.counters["stale_served"] += 1
+        CACHE_LOOKUPS.inc(document.report_type, "stale")
+        if log_enabled("stale_cache_hit"):
+            logger.info({"event": "stale_cache_hit", "document_id": document.key, "tier": tier})
+        response["stale"] = True
+        return response, 200, True
+
+    def peek(self, document) -> Optional[tuple[dict, int]]:
+        """
+        Returns the response for a fresh report or a "not found" answer in the cache, leaving the lookup
+        metrics and counters untouched, e.g. to re-check the cache after a lookup already counted a miss.
+        :param document: a validated Document
+        :return: a (response, status) tuple, or None when there is no fresh entry
+        """
+        entry = self.backend.peek(document.key)
+        if entry is None:
+            return None
+
+        value, _, tier = entry
+        if value.get("not_found"):
+            return {"error": "Document not found", "cached": True, "cache_tier": tier}, 404
+        if value["fresh_until"] <= time.time():
+            return None
+        return {"success": True, "data": value["data"], "cached": True, "cache_tier": tier}, 200
+
+    def store(self, document, data: Optional[dict]):
+        """
+        Caches a report, or a "not found" marker when `data` is None, following the report type policy.
+        :param document: a validated Document
+        :param data: the report payload, or None for a document unknown to the upstream
+        """
+        policy = self.policies[document.report_type]
+        if data is None:
+            if policy.negative_ttl > 0:
+                self.backend.set(document.key, {"not_found": True}, ttl=policy.negative_ttl)
+            return
+
+        fresh_until = time.time() + policy.fresh_ttl
+        value = {"data": data, "fresh_until": fresh_until, "stale_until": fresh_until + policy.stale_ttl}
+        self.backend.set(document.key, value, ttl=policy.fresh_ttl + policy.stale_ttl + policy.fallback_ttl)
+
+
+def create_cache(ttl: float) -> CacheBackend:
+    """
+    Builds the cache selected by the SERASA_CACHE_BACKEND environment variable.
+    The in-process backend is used as L1; when a shared backend (sqlite, disk or redis) is selected it
+    becomes the L2 behind it, unless SERASA_CACHE_L1_MAX_BYTES is 0.
+    :param ttl: a float with the default time-to-live in seconds
+    :return: a CacheBackend instance
+    """
+    backend = os.getenv("SERASA_CACHE_BACKEND", "memory").lower()
+    l1_max_bytes = int(os.getenv("SERASA_CACHE_L1_MAX_BYTES", 8 * 1024 * 1024))
+    l1 = MemoryCache(ttl, maxsize=int(os.getenv("SERASA_CACHE_MAXSIZE", 100)), max_bytes=l1_max_bytes or None)
+    if backend == "memory":
+        return l1
+
+    if backend == "sqlite":
+        l2 = SQLiteCache(ttl, os.getenv("SERASA_CACHE_SQLITE_PATH", "/tmp/serasa-cache.sqlite3"))
+    elif backend == "disk":
+        # imported here because the disk backend builds on this module
+        from services.disk_cache import DiskCache
+
+        l2 = DiskCache(
+            ttl,
+            os.getenv("SERASA_CACHE_DISK_PATH", "/tmp/serasa-reports"),
+            segment_bytes=int(os.getenv("SERASA_CACHE_DISK_SEGMENT_BYTES", 64 * 1024 * 1024)),
+            max_bytes=int(os.getenv("SERASA_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)),
+            index_slots=int(os.getenv("SERASA_CACHE_DISK_INDEX_SLOTS", 1 << 18)),
+            compact_interval=float(os.getenv("SERASA_CACHE_DISK_COMPACT_INTERVAL", 60)),
+            compact_ratio=float(os.getenv("SERASA_CACHE_DISK_COMPACT_RATIO", 0.5)),
+        )
+    elif backend == "redis":
+        l2 = RedisCache(ttl, os.getenv("SERASA_REDIS_URL", "redis://localhost:6379/0"))
+    else:
+        raise ValueError(f"Unknown cache backend: {backend}")
+
+    return TieredCache(l1, l2) if l1_max_bytes > 0 else l2
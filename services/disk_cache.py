@@ -0,0 +1,484 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from services.cache import CacheBackend, deserialize, serialize
+from utils.logger import log_enabled, logger
+
+INDEX_FILE = "index"
+LOCK_FILE = "lock"
+SEGMENT_SUFFIX = ".seg"
+INDEX_MAGIC = b"SRXIDX01"
+# magic, slot count, state, active segment, valid length of the active segment
+INDEX_HEADER = struct.Struct("<8sIIIQ")
+INDEX_HEADER_SIZE = 64
+# key fingerprint (0 for an empty slot), segment, offset, record length, expiration time (0 once deleted)
+SLOT = struct.Struct("<QIIId4x")
+# crc32 of the rest of the record, expiration time, key length, value length; followed by the key and value
+RECORD = struct.Struct("<IdHI")
+READY = 0
+REBUILDING = 1
+# longest probe sequence of a key; writes that find no slot within it are dropped until the index is rebuilt
+MAX_PROBES = 64
+# share of dead slots (expired or deleted) above which compaction rebuilds the index
+DEAD_SLOTS_RATIO = 0.25
+
+
+def fingerprint(key: str) -> int:
+    """
+    Hashes a cache key to the non-zero 64-bit fingerprint stored in the index. Unlike hash(), it is
+    the same in every process.
+    :param key: a string representing the cache key
+    :return: an integer fingerprint
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") | 1
+
+
+def pack_record(key: str, value: bytes, expires_at: float) -> bytes:
+    """
+    Encodes one log record.
+    :param key: a string representing the cache key
+    :param value: the serialized value
+    :param expires_at: an absolute epoch expiration time, 0 for a deletion
+    :return: the record bytes
+    """
+    body = key.encode() + value
+    header = RECORD.pack(0, expires_at, len(body) - len(value), len(value))
+    return struct.pack("<I", zlib.crc32(body, zlib.crc32(header[4:]))) + header[4:] + body
+
+
+def unpack_record(data: bytes) -> Optional[tuple[str, float, bytes]]:
+    """
+    Decodes one log record, checking its length and checksum.
+    :param data: bytes starting at the record
+    :return: a (key, expires_at, value) tuple, or None when the record is truncated or corrupt
+    """
+    if len(data) < RECORD.size:
+        return None
+    crc, expires_at, key_length, value_length = RECORD.unpack_from(data)
+    end = RECORD.size + key_length + value_length
+    if len(data) < end or zlib.crc32(data[4:end]) != crc:
+        return None
+    start, key_end = RECORD.size, RECORD.size + key_length
+    return data[start:key_end].decode(), expires_at, data[key_end:end]
+
+
+class DiskCache(CacheBackend):
+    """
+    On-host cache that survives restarts, shared by every worker process through a directory.
+    Reports are appended, compressed, to a log split into segment files, and located through a
+    memory-mapped open-addressing hash index from the key fingerprint to the record and its expiry,
+    so a lookup costs a few slot reads and one pread, whatever the size of the store.
+
+    Writers are serialized by a lock file; readers take no lock and instead check the key, length and
+    checksum of the record they read, so a torn or stale index slot is just a miss. The index header
+    keeps the valid length of the active segment: a partial record left by a writer that crashed is
+    overwritten by the next write, and an index left mid-rebuild, or missing, is rebuilt from the log.
+
+    A background thread compacts the store: sealed segments that are mostly dead (expired, overwritten
+    or deleted records) have their live records copied to the active segment and are removed, the
+    oldest segments are evicted while the store is over `max_bytes`, and the index is rebuilt when too
+    many of its slots are dead.
+
+    Attributes:
+        path (str): Directory holding the segments, the index and the lock file.
+        segment_bytes (int): Size after which the active segment is sealed and a new one started.
+        max_bytes (int): Size of all segments above which the oldest ones are evicted.
+        slots (int): Number of index slots; at most this many keys are stored.
+        compact_ratio (float): Share of live bytes below which a sealed segment is rewritten.
+        compactions (int): Number of compaction passes run.
+        dropped (int): Number of writes skipped because the value or the index was full.
+        errors (int): Number of I/O errors, each degraded to a cache miss.
+
+    Methods:
+        compact() -> dict:
+            Runs one compaction pass and returns what it did.
+    """
+
+    name = "disk"
+
+    def __init__(
+        self,
+        ttl: float,
+        path: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        index_slots: int = 1 << 18,
+        compact_interval: float = 60.0,
+        compact_ratio: float = 0.5,
+    ):
+        super().__init__(ttl)
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.slots = index_slots
+        self.compact_ratio = compact_ratio
+        self.compactions = 0
+        self.dropped = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._readers_lock = threading.Lock()
+        self._readers = {}
+        self._writer = None
+        self._stopping = threading.Event()
+
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, LOCK_FILE), "a+b")
+        with self.__locked():
+            self._index = self.__open_index()
+
+        self._compactor = None
+        if compact_interval > 0:
+            self._compactor = threading.Thread(
+                target=self.__compact_loop, args=(compact_interval,), daemon=True, name="disk-cache-compactor"
+            )
+            self._compactor.start()
+
+    @contextmanager
+    def __locked(self):
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def __segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def __segment_ids(self) -> list:
+        names = os.listdir(self.path)
+        return sorted(int(name.removesuffix(SEGMENT_SUFFIX)) for name in names if name.endswith(SEGMENT_SUFFIX))
+
+    def __open_index(self) -> mmap.mmap:
+        """
+        Maps the index file, rebuilding it from the log when it is new, resized, or was left mid-rebuild.
+        Must be called with the lock held.
+        """
+        size = INDEX_HEADER_SIZE + self.slots * SLOT.size
+        fd = os.open(os.path.join(self.path, INDEX_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            current = os.fstat(fd).st_size
+            if current != size:
+                os.ftruncate(fd, size)
+            index = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, slots, state, _, _ = INDEX_HEADER.unpack_from(index)
+        if current != size or magic != INDEX_MAGIC or slots != self.slots or state != READY:
+            self._index = index
+            self.__rebuild()
+        return index
+
+    def __header(self) -> tuple[int, int]:
+        _, _, _, active, length = INDEX_HEADER.unpack_from(self._index)
+        return active, length
+
+    def __write_header(self, state: int, active: int, length: int):
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self.slots, state, active, length)
+
+    def __slot(self, position: int) -> tuple:
+        return SLOT.unpack_from(self._index, INDEX_HEADER_SIZE + position * SLOT.size)
+
+    def __write_slot(self, position: int, fp: int, segment: int, offset: int, length: int, expires_at: float):
+        SLOT.pack_into(self._index, INDEX_HEADER_SIZE + position * SLOT.size, fp, segment, offset, length, expires_at)
+
+    def __find(self, fp: int) -> Optional[int]:
+        """
+        Returns the slot position holding a fingerprint, or None.
+        """
+        start = fp % self.slots
+        for probe in range(min(MAX_PROBES, self.slots)):
+            position = (start + probe) % self.slots
+            slot_fp = self.__slot(position)[0]
+            if slot_fp == fp:
+                return position
+            if slot_fp == 0:
+                return None
+        return None
+
+    def __put(self, fp: int, segment: int, offset: int, length: int, expires_at: float) -> bool:
+        """
+        Points the slot of a fingerprint to a record, reusing the first dead slot of its probe sequence
+        for a new key. Must be called with the lock held.
+        :return: False when the probe sequence has no room left
+        """
+        now = time.time()
+        start = fp % self.slots
+        target = None
+        for probe in range(min(MAX_PROBES, self.slots)):
+            position = (start + probe) % self.slots
+            slot_fp, _, _, _, slot_expires_at = self.__slot(position)
+            if slot_fp == fp:
+                target = position
+                break
+            if slot_fp == 0:
+                target = position if target is None else target
+                break
+            if target is None and slot_expires_at <= now:
+                target = position
+        if target is None:
+            return False
+        self.__write_slot(target, fp, segment, offset, length, expires_at)
+        return True
+
+    def __reader(self, segment: int) -> int:
+        fd = self._readers.get(segment)
+        if fd is None:
+            with self._readers_lock:
+                fd = self._readers.get(segment)
+                if fd is None:
+                    fd = self._readers[segment] = os.open(self.__segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def __append(self, record: bytes) -> tuple[int, int]:
+        """
+        Appends a record to the active segment, sealing it first if the record does not fit.
+        Must be called with the lock held.
+        :return: the segment and offset of the record
+        """
+        active, length = self.__header()
+        if length and length + len(record) > self.segment_bytes:
+            active, length = active + 1, 0
+        if self._writer is None or self._writer[0] != active:
+            if self._writer is not None:
+                os.close(self._writer[1])
+            self._writer = (active, os.open(self.__segment_path(active), os.O_WRONLY | os.O_CREAT, 0o644))
+        # records always go at the valid length from the header, overwriting what a crashed writer left
+        os.pwrite(self._writer[1], record, length)
+        self.__write_header(READY, active, length + len(record))
+        return active, length
+
+    def __scan(self, segment: int) -> Iterator[tuple[int, str, float, int]]:
+        """
+        Reads the records of a segment in order, stopping at the first truncated or corrupt one.
+        :return: a generator of (offset, key, expires_at, length) tuples
+        """
+        with open(self.__segment_path(segment), "rb") as file:
+            offset = 0
+            while True:
+                header = file.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                crc, expires_at, key_length, value_length = RECORD.unpack(header)
+                body = file.read(key_length + value_length)
+                if len(body) < key_length + value_length or zlib.crc32(body, zlib.crc32(header[4:])) != crc:
+                    return
+                yield offset, body[:key_length].decode(), expires_at, RECORD.size + len(body)
+                offset += RECORD.size + len(body)
+
+    def __rebuild(self):
+        """
+        Rebuilds the index by replaying the whole log, and truncates the active segment after its last
+        valid record. Must be called with the lock held.
+        """
+        # segment numbers only grow, even when the log is gone, so stale descriptors never match a new segment
+        previous = self.__header()[0] if self._index[:8] == INDEX_MAGIC else 1
+        active = max(self.__segment_ids() + [previous])
+        self.__write_header(REBUILDING, active, 0)
+        self._index[INDEX_HEADER_SIZE:] = bytes(len(self._index) - INDEX_HEADER_SIZE)
+        length = 0
+        for segment in self.__segment_ids():
+            length = 0
+            for offset, key, expires_at, size in self.__scan(segment):
+                self.__put(fingerprint(key), segment, offset, size, expires_at)
+                length = offset + size
+        if os.path.exists(self.__segment_path(active)):
+            os.truncate(self.__segment_path(active), length)
+        self.__write_header(READY, active, length)
+        logger.info({"event": "disk_cache_rebuilt", "path": self.path, "segments": len(self.__segment_ids())})
+
+    def __rebuild_index(self):
+        """
+        Rebuilds the index from its own live slots, freeing the dead ones. Must be called with the lock held.
+        """
+        now = time.time()
+        active, length = self.__header()
+        live = [slot for slot in SLOT.iter_unpack(self._index[INDEX_HEADER_SIZE:]) if slot[0] and slot[4] > now]
+        self.__write_header(REBUILDING, active, length)
+        self._index[INDEX_HEADER_SIZE:] = bytes(len(self._index) - INDEX_HEADER_SIZE)
+        for slot in live:
+            self.__put(*slot)
+        self.__write_header(READY, active, length)
+
+    def _get(self, key: str) -> Optional[tuple[Any, float]]:
+        fp = fingerprint(key)
+        try:
+            position = self.__find(fp)
+            if position is None:
+                return None
+            _, segment, offset, length, expires_at = self.__slot(position)
+            if expires_at <= time.time():
+                return None
+            record = unpack_record(os.pread(self.__reader(segment), length, offset))
+        except FileNotFoundError:
+            # the segment was compacted away by another process since the slot was read
+            return None
+        except (OSError, ValueError) as e:
+            self.__error(e)
+            return None
+        if record is None or record[0] != key:
+            return None
+        return deserialize(record[2]), record[1]
+
+    def _set(self, key: str, value: Any, expires_at: float):
+        record = pack_record(key, serialize(value), expires_at)
+        if len(record) > self.segment_bytes:
+            self.dropped += 1
+            return
+        try:
+            with self.__locked():
+                segment, offset = self.__append(record)
+                if not self.__put(fingerprint(key), segment, offset, len(record), expires_at):
+                    self.dropped += 1
+        except OSError as e:
+            self.__error(e)
+
+    def delete(self, key: str):
+        try:
+            with self.__locked():
+                position = self.__find(fingerprint(key))
+                if position is not None:
+                    # the deletion is logged too, so a rebuild does not bring the key back
+                    self.__append(pack_record(key, b"", 0))
+                    fp, segment, offset, length, _ = self.__slot(position)
+                    self.__write_slot(position, fp, segment, offset, length, 0)
+        except OSError as e:
+            self.__error(e)
+
+    def clear(self):
+        with self.__locked():
+            active, _ = self.__header()
+            for segment in self.__segment_ids():
+                os.unlink(self.__segment_path(segment))
+            self._index[INDEX_HEADER_SIZE:] = bytes(len(self._index) - INDEX_HEADER_SIZE)
+            # segment numbers are never reused, so other processes never append to a removed file
+            self.__write_header(READY, active + 1, 0)
+
+    def compact(self) -> dict:
+        """
+        Runs one compaction pass. Sealed segments are handled one at a time, each under the write lock,
+        oldest first: evicted while the store is over `max_bytes`, otherwise rewritten when less than
+        `compact_ratio` of their bytes are live records.
+        :return: a dictionary with the number of segments rewritten and evicted, the records evicted and
+            the bytes reclaimed
+        """
+        result = {"rewritten": 0, "evicted_segments": 0, "evicted": 0, "reclaimed_bytes": 0}
+        sizes = {segment: os.path.getsize(self.__segment_path(segment)) for segment in self.__segment_ids()}
+        total = sum(sizes.values())
+        for segment, size in sizes.items():
+            if self._stopping.is_set():
+                break
+            with self.__locked():
+                if segment >= self.__header()[0]:
+                    break
+                if not os.path.exists(self.__segment_path(segment)):
+                    # compacted by another process since it was listed
+                    total -= size
+                    continue
+                now = time.time()
+                live, tombstones = [], []
+                for offset, key, expires_at, length in self.__scan(segment):
+                    position = self.__find(fingerprint(key))
+                    if position is None:
+                        continue
+                    # the slot expiry, not the record's, tells whether the key was deleted since
+                    _, slot_segment, slot_offset, _, slot_expires_at = self.__slot(position)
+                    if (slot_segment, slot_offset) == (segment, offset) and slot_expires_at > now:
+                        live.append((position, offset, length))
+                    elif not expires_at and slot_expires_at <= now and 0 < slot_segment < segment:
+                        # a deletion of a record still in an older segment, kept so a rebuild does not revive it
+                        if os.path.exists(self.__segment_path(slot_segment)):
+                            tombstones.append((offset, length))
+
+                live_bytes = sum(length for _, _, length in live) + sum(length for _, length in tombstones)
+                if total > self.max_bytes:
+                    for position, _, _ in live:
+                        fp, _, _, length, _ = self.__slot(position)
+                        self.__write_slot(position, fp, 0, 0, length, 0)
+                    result["evicted_segments"] += 1
+                    result["evicted"] += len(live)
+                    self.evictions += len(live)
+                    live_bytes = 0
+                elif live_bytes < size * self.compact_ratio:
+                    fd = self.__reader(segment)
+                    for position, offset, length in live:
+                        new_segment, new_offset = self.__append(os.pread(fd, length, offset))
+                        fp, _, _, _, expires_at = self.__slot(position)
+                        self.__write_slot(position, fp, new_segment, new_offset, length, expires_at)
+                    for offset, length in tombstones:
+                        self.__append(os.pread(fd, length, offset))
+                    result["rewritten"] += 1
+                else:
+                    continue
+                os.unlink(self.__segment_path(segment))
+                total -= size - live_bytes
+                result["reclaimed_bytes"] += size - live_bytes
+
+        with self.__locked():
+            now = time.time()
+            used = dead = 0
+            for slot_fp, _, _, _, expires_at in SLOT.iter_unpack(self._index[INDEX_HEADER_SIZE:]):
+                if slot_fp:
+                    used += 1
+                    dead += expires_at <= now
+            if dead > self.slots * DEAD_SLOTS_RATIO:
+                self.__rebuild_index()
+            result["index_used"], result["index_dead"] = used, dead
+            self.__close_removed_readers()
+
+        self.compactions += 1
+        if log_enabled("disk_cache_compaction") and (result["rewritten"] or result["evicted_segments"]):
+            logger.info({"event": "disk_cache_compaction", **result})
+        return result
+
+    def __close_removed_readers(self):
+        existing = set(self.__segment_ids())
+        with self._readers_lock:
+            for segment in [segment for segment in self._readers if segment not in existing]:
+                os.close(self._readers.pop(segment))
+
+    def __compact_loop(self, interval: float):
+        while not self._stopping.wait(interval):
+            try:
+                self.compact()
+            except Exception as e:
+                self.__error(e)
+
+    def __error(self, e: Exception):
+        self.errors += 1
+        logger.warning({"event": "cache_backend_error", "backend": self.name, "error": str(e)})
+
+    def stats(self) -> dict:
+        segments = self.__segment_ids()
+        size = sum(os.path.getsize(self.__segment_path(segment)) for segment in segments)
+        return {
+            **super().stats(),
+            "segments": len(segments),
+            "bytes": size,
+            "compactions": self.compactions,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def close(self):
+        self._stopping.set()
+        if self._compactor is not None:
+            self._compactor.join(timeout=5)
+        with self._lock, self._readers_lock:
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers.clear()
+            if self._writer is not None:
+                os.close(self._writer[1])
+                self._writer = None
+            self._index.close()
+            self._lock_file.close()
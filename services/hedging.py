@@ -0,0 +1,199 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from services.retry import RetryBudget
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    """
+    Hedging rules for one report type.
+
+    Attributes:
+        enabled (bool): Whether slow calls are hedged.
+        percentile (float): Percentile of recent latencies after which a second call is sent.
+        max_ratio (float): Hedged calls allowed as a share of calls, capping the extra upstream load.
+        min_delay (float): Lower bound, in seconds, of the wait before hedging.
+        min_samples (int): Latencies needed before hedging starts, so the percentile is meaningful.
+    """
+
+    enabled: bool = False
+    percentile: float = 95.0
+    max_ratio: float = 0.1
+    min_delay: float = 0.01
+    min_samples: int = 20
+
+    @classmethod
+    def from_env(cls, report_type: str) -> "HedgePolicy":
+        """
+        Builds the policy of a report type from SERASA_<TYPE>_HEDGE, falling back to SERASA_HEDGE_*.
+        :param report_type: a string representing the report type ("pf" or "pj")
+        :return: a HedgePolicy instance
+        """
+        enabled = os.getenv(f"SERASA_{report_type.upper()}_HEDGE", os.getenv("SERASA_HEDGE_ENABLED", "false"))
+        return cls(
+            enabled=enabled.lower() in ("1", "true", "yes"),
+            percentile=float(os.getenv("SERASA_HEDGE_PERCENTILE", cls.percentile)),
+            max_ratio=float(os.getenv("SERASA_HEDGE_MAX_RATIO", cls.max_ratio)),
+            min_delay=float(os.getenv("SERASA_HEDGE_MIN_DELAY", cls.min_delay)),
+            min_samples=int(os.getenv("SERASA_HEDGE_MIN_SAMPLES", cls.min_samples)),
+        )
+
+
+class LatencyWindow:
+    """
+    Latencies of the most recent calls, with a cached percentile recomputed every `refresh` samples.
+
+    Attributes:
+        samples (deque): The most recent latencies, in seconds.
+        refresh (int): Samples recorded between two percentile computations.
+    """
+
+    def __init__(self, size: int = 512, refresh: int = 32):
+        self.samples = deque(maxlen=size)
+        self.refresh = refresh
+        self._cached = {}
+        self._since_refresh = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        """
+        Records the latency of a call.
+        :param latency: a float with the call duration in seconds
+        """
+        with self._lock:
+            self.samples.append(latency)
+            self._since_refresh += 1
+            if self._since_refresh >= self.refresh:
+                self._cached.clear()
+                self._since_refresh = 0
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Returns a percentile of the recorded latencies.
+        :param p: the percentile, between 0 and 100
+        :return: the latency in seconds, or None without samples
+        """
+        with self._lock:
+            if not self.samples:
+                return None
+            if p not in self._cached:
+                ordered = sorted(self.samples)
+                self._cached[p] = ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+            return self._cached[p]
+
+
+class Hedger:
+    """
+    Sends a second, identical call when the first one is slower than a percentile of recent latencies,
+    and returns whichever answers first.
+    The loser is cancelled if it has not started yet; a call already on the wire cannot be interrupted,
+    so it runs to completion (bounded by its timeouts) and its result is discarded. Hedged calls draw
+    from a budget refilled by `max_ratio` per call, so hedging adds at most that share of extra load.
+
+    Attributes:
+        policy (HedgePolicy): The hedging rules.
+        window (LatencyWindow): Latencies of recent calls.
+        budget (RetryBudget): Tokens spent by hedged calls.
+        counters (dict): Calls, hedged calls, hedge wins and hedges denied by the budget.
+
+    Methods:
+        call(func, *args) -> Any:
+            Runs a call, hedging it when it is slow.
+        delay() -> Optional[float]:
+            Returns the wait before hedging, or None while hedging is off.
+    """
+
+    def __init__(self, policy: HedgePolicy, executor: Executor):
+        self.policy = policy
+        self.window = LatencyWindow()
+        self.budget = RetryBudget(policy.max_ratio, 0.0)
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0}
+        self._executor = executor
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """
+        Returns the wait before hedging a call.
+        :return: the delay in seconds, or None when hedging is disabled or there are too few samples
+        """
+        if not self.policy.enabled or len(self.window.samples) < self.policy.min_samples:
+            return None
+        return max(self.policy.min_delay, self.window.percentile(self.policy.percentile))
+
+    def call(self, func: Callable, *args) -> Any:
+        """
+        Runs a call, sending a hedge when it has not answered after `delay()` seconds.
+        :param func: the callable to run
+        :param args: the arguments of the callable
+        :return: the result of the first call to succeed
+        :raises Exception: the error of the first call when every call fails
+        """
+        self.__count("calls")
+        self.budget.deposit()
+        delay = self.delay()
+        start = time.perf_counter()
+
+        if delay is None:
+            result = func(*args)
+            self.window.record(time.perf_counter() - start)
+            return result
+
+        # calls run in a copy of the caller's context, so they see its trace and correlation ID
+        primary = self._executor.submit(contextvars.copy_context().run, func, *args)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.withdraw():
+            if not done:
+                self.__count("budget_denied")
+            result = primary.result()
+            self.window.record(time.perf_counter() - start)
+            return result
+
+        self.__count("hedged")
+        hedge = self._executor.submit(contextvars.copy_context().run, func, *args)
+        winner = self.__first_success([primary, hedge])
+        for future in (primary, hedge):
+            if future is not winner:
+                future.cancel()
+        if winner is hedge:
+            self.__count("hedge_wins")
+
+        result = winner.result()
+        self.window.record(time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def __first_success(futures: list) -> Future:
+        """
+        Waits for the first future to succeed.
+        :param futures: the futures of the competing calls, primary first
+        :return: the first successful future, or the primary one when all of them fail
+        """
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not future.cancelled() and future.exception() is None:
+                    return future
+        return futures[0]
+
+    def __count(self, name: str):
+        # calls run concurrently, and `+=` on a dictionary item is not atomic
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the hedging counters and current delay.
+        :return: a dictionary with the counters
+        """
+        delay = self.delay()
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "enabled": self.policy.enabled, "delay": round(delay, 4) if delay is not None else None}
@@ -0,0 +1,118 @@
+import os
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+
+@dataclass(frozen=True)
+class TransportConfig:
+    """
+    Configuration for the pooled HTTP transport used to talk to the Serasa service.
+
+    Attributes:
+        pool_connections (int): Number of per-host connection pools kept by the session.
+        pool_maxsize (int): Maximum number of connections kept alive in each host pool.
+        max_connections (int): Hard cap on concurrent connections; callers wait, up to the connect timeout,
+            when it is reached.
+        connect_timeout (float): Seconds to wait for the TCP/TLS connection to be established.
+        read_timeout (float): Seconds to wait for the upstream to send a response.
+        keep_alive (bool): Whether connections are reused between requests.
+    """
+
+    pool_connections: int = 4
+    pool_maxsize: int = 20
+    max_connections: int = 20
+    connect_timeout: float = 3.05
+    read_timeout: float = 10.0
+    keep_alive: bool = True
+
+    @classmethod
+    def from_env(cls) -> "TransportConfig":
+        """
+        Builds the transport configuration from environment variables.
+        :return: a TransportConfig instance
+        """
+        pool_maxsize = int(os.getenv("SERASA_POOL_MAXSIZE", cls.pool_maxsize))
+        return cls(
+            pool_connections=int(os.getenv("SERASA_POOL_CONNECTIONS", cls.pool_connections)),
+            pool_maxsize=pool_maxsize,
+            max_connections=int(os.getenv("SERASA_MAX_CONNECTIONS", pool_maxsize)),
+            connect_timeout=float(os.getenv("SERASA_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(os.getenv("SERASA_READ_TIMEOUT", cls.read_timeout)),
+            keep_alive=os.getenv("SERASA_KEEP_ALIVE", "true").lower() in ("1", "true", "yes"),
+        )
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """
+        Timeout tuple in the format expected by requests.
+        :return: a (connect, read) tuple of seconds
+        """
+        return self.connect_timeout, self.read_timeout
+
+
+class BoundedWaitMixin:
+    """
+    Connection pool mixin bounding the wait for a free connection, when the pool is full and blocking,
+    by the connect timeout of the call, which the service already shortens to the request deadline.
+    """
+
+    def urlopen(self, method, url, *args, **kwargs):
+        if kwargs.get("pool_timeout") is None:
+            wait = self._get_timeout(kwargs.get("timeout", self.timeout)).connect_timeout
+            if isinstance(wait, (int, float)):
+                kwargs["pool_timeout"] = wait
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class BoundedWaitHTTPConnectionPool(BoundedWaitMixin, HTTPConnectionPool):
+    pass
+
+
+class BoundedWaitHTTPSConnectionPool(BoundedWaitMixin, HTTPSConnectionPool):
+    pass
+
+
+class BoundedWaitAdapter(HTTPAdapter):
+    """
+    HTTP adapter whose pools wait for a free connection no longer than the connect timeout, failing
+    the call with requests.ConnectTimeout when none is released in time.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": BoundedWaitHTTPConnectionPool,
+            "https": BoundedWaitHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs) -> requests.Response:
+        try:
+            return super().send(request, *args, **kwargs)
+        except EmptyPoolError as e:
+            raise requests.ConnectTimeout(e, request=request)
+
+
+def build_session(config: TransportConfig) -> requests.Session:
+    """
+    Creates a requests session backed by a bounded keep-alive connection pool.
+    The pool blocks when `max_connections` connections are in use, so the number of
+    concurrent connections to the upstream never exceeds the configured cap; a call waits
+    for a free connection at most its connect timeout.
+    :param config: a TransportConfig instance
+    :return: a configured requests.Session
+    """
+    session = requests.Session()
+    adapter = BoundedWaitAdapter(
+        pool_connections=config.pool_connections,
+        pool_maxsize=min(config.pool_maxsize, config.max_connections),
+        pool_block=True,
+        max_retries=0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive" if config.keep_alive else "close"
+    return session
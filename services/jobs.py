@@ -0,0 +1,587 @@
+import csv
+import fcntl
+import json
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Optional
+
+from services.serasa_service import SerasaService, result_item
+from services.validation import Document, check_document
+from utils.logger import log_enabled, logger
+
+CSV = "csv"
+NDJSON = "ndjson"
+FORMATS = {
+    "text/csv": CSV,
+    "application/csv": CSV,
+    "application/x-ndjson": NDJSON,
+    "application/ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+}
+# CSV header cells naming the document column
+DOCUMENT_COLUMNS = ("document", "documento", "cpf", "cnpj", "cpf_cnpj")
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+CHUNK_SIZE = 64 * 1024
+MAX_LINE_BYTES = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    format TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    input_bytes INTEGER NOT NULL,
+    input_offset INTEGER NOT NULL DEFAULT 0,
+    output_bytes INTEGER NOT NULL DEFAULT 0,
+    counters TEXT NOT NULL DEFAULT '{}',
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+
+class JobNotFound(Exception):
+    """
+    Raised when a job ID does not name an existing job.
+    """
+
+
+class UploadTooLarge(Exception):
+    """
+    Raised when an upload exceeds the configured maximum size.
+    """
+
+
+@dataclass(frozen=True)
+class JobPolicy:
+    """
+    Settings of the bulk consultation jobs.
+
+    Attributes:
+        directory (str): Where the input, output and state of each job are kept.
+        workers (int): Jobs processed at the same time by a process.
+        concurrency (int): Documents of a job consulted at the same time.
+        rate (float): Upstream calls per second allowed to a job; cache hits are not paced.
+        checkpoint_every (int): Input lines between two checkpoints.
+        checkpoint_interval (float): Maximum seconds between two checkpoints.
+        max_upload_bytes (int): Maximum size of an uploaded input.
+        rescan_interval (float): Seconds between two scans for jobs left unfinished by another process.
+        retention (float): Seconds a completed or failed job is kept after its last update; 0 keeps it forever.
+    """
+
+    directory: str = os.path.join(tempfile.gettempdir(), "credit-check-jobs")
+    workers: int = 1
+    concurrency: int = 4
+    rate: float = 10.0
+    checkpoint_every: int = 100
+    checkpoint_interval: float = 1.0
+    max_upload_bytes: int = 1024**3
+    rescan_interval: float = 30.0
+    retention: float = 7 * 24 * 3600
+
+    @classmethod
+    def from_env(cls) -> "JobPolicy":
+        """
+        Reads the policy from JOBS_DIR, JOBS_WORKERS, JOBS_CONCURRENCY, JOBS_RATE, JOBS_CHECKPOINT_EVERY,
+        JOBS_CHECKPOINT_INTERVAL, JOBS_MAX_UPLOAD_BYTES, JOBS_RESCAN_INTERVAL and JOBS_RETENTION_SECONDS.
+        :return: a JobPolicy instance
+        """
+        return cls(
+            directory=os.getenv("JOBS_DIR", cls.directory),
+            workers=int(os.getenv("JOBS_WORKERS", cls.workers)),
+            concurrency=int(os.getenv("JOBS_CONCURRENCY", cls.concurrency)),
+            rate=float(os.getenv("JOBS_RATE", cls.rate)),
+            checkpoint_every=int(os.getenv("JOBS_CHECKPOINT_EVERY", cls.checkpoint_every)),
+            checkpoint_interval=float(os.getenv("JOBS_CHECKPOINT_INTERVAL", cls.checkpoint_interval)),
+            max_upload_bytes=int(os.getenv("JOBS_MAX_UPLOAD_BYTES", cls.max_upload_bytes)),
+            rescan_interval=float(os.getenv("JOBS_RESCAN_INTERVAL", cls.rescan_interval)),
+            retention=float(os.getenv("JOBS_RETENTION_SECONDS", cls.retention)),
+        )
+
+
+class Pacer:
+    """
+    Spaces calls at a fixed rate: each call waits for the next free slot.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the next slot, and reserves it.
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> Optional[str]:
+    """
+    Picks the input format from an explicit request or the content type of the upload.
+    :param content_type: the Content-Type header, e.g. "text/csv; charset=utf-8"
+    :param requested: "csv" or "ndjson" when given explicitly
+    :return: "csv", "ndjson" or None when it is unknown
+    """
+    if requested:
+        return requested.lower() if requested.lower() in (CSV, NDJSON) else None
+    return FORMATS.get((content_type or "").split(";")[0].strip().lower())
+
+
+def parse_line(line: str, fmt: str, column: int = 0) -> Optional[str]:
+    """
+    Extracts the document of one input line.
+    :param line: a decoded line, without its line break
+    :param fmt: "csv" or "ndjson"
+    :param column: the CSV column holding the document
+    :return: the document string, or None when the line is malformed
+    """
+    if fmt == NDJSON:
+        try:
+            value = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(value, dict):
+            value = value.get("document")
+        return value if isinstance(value, str) else None
+    cells = next(csv.reader([line]), [])
+    return cells[column].strip() if len(cells) > column else None
+
+
+class Job:
+    """
+    On-disk state of one job: the uploaded input, the NDJSON output and a SQLite database holding the
+    job row (status, progress, counters) and the keys of the documents already answered.
+    The output size, input offset, counters and seen keys are committed in one transaction, so a job
+    restarted after a crash truncates its output back to the last checkpoint and carries on from there.
+
+    Attributes:
+        job_id (str): 32 hex digits identifying the job.
+        path (str): The directory of the job.
+    """
+
+    def __init__(self, directory: str, job_id: str):
+        if not JOB_ID.match(job_id):
+            raise JobNotFound(job_id)
+        self.job_id = job_id
+        self.path = os.path.join(directory, job_id)
+
+    @property
+    def input_path(self) -> str:
+        return os.path.join(self.path, "input")
+
+    @property
+    def output_path(self) -> str:
+        return os.path.join(self.path, "output.ndjson")
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Opens the job database.
+        :return: a sqlite3 connection
+        :raises JobNotFound: when the job does not exist
+        """
+        db_path = os.path.join(self.path, "state.sqlite")
+        if not os.path.exists(db_path):
+            raise JobNotFound(self.job_id)
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def state(self) -> dict:
+        """
+        Reads the status and progress of the job.
+        :return: a dictionary describing the job
+        :raises JobNotFound: when the job does not exist
+        """
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT format, status, created_at, updated_at, input_bytes, input_offset, output_bytes, counters, error "
+                "FROM job"
+            ).fetchone()
+        finally:
+            conn.close()
+        fmt, status, created_at, updated_at, input_bytes, input_offset, output_bytes, counters, error = row
+        return {
+            "job_id": self.job_id,
+            "status": status,
+            "format": fmt,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "progress": round(input_offset / input_bytes, 4) if input_bytes else 1.0,
+            "input_bytes": input_bytes,
+            "input_offset": input_offset,
+            "output_bytes": output_bytes,
+            "counters": json.loads(counters),
+            **({"error": error} if error else {}),
+        }
+
+    def claim(self) -> Optional[BinaryIO]:
+        """
+        Takes the exclusive processing lock of the job, held until the returned file is closed or the
+        process exits, so a job is never processed twice across workers or restarts.
+        :return: the open lock file, or None when another thread or process holds the lock
+        """
+        lock = open(os.path.join(self.path, "lock"), "wb")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def results(self) -> Iterator[bytes]:
+        """
+        Streams the output up to the last checkpoint, so only complete result lines are returned.
+        :return: a generator of byte chunks
+        :raises JobNotFound: when the job does not exist
+        """
+        size = self.state()["output_bytes"]
+
+        def chunks():
+            with open(self.output_path, "rb") as f:
+                remaining = size
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return chunks()
+
+
+class JobManager:
+    """
+    Runs bulk consultation jobs on top of a SerasaService.
+    An uploaded input is spooled to disk and queued; worker threads stream it line by line, validate and
+    dedupe each document, answer cache hits directly and pace upstream calls at `policy.rate`, writing
+    results in input order to an NDJSON output. Memory use does not depend on the size of the input:
+    lines are read one at a time, at most `policy.concurrency` documents are in flight and the keys
+    already answered live in the job database.
+
+    Attributes:
+        service (SerasaService): The service answering each document.
+        policy (JobPolicy): Directory, concurrency, rate and checkpoint settings.
+
+    Methods:
+        submit(stream, fmt) -> str:
+            Spools an upload and queues its job.
+        status(job_id) -> dict:
+            Status, progress and counters of a job.
+        results(job_id) -> Iterator[bytes]:
+            The results written so far, as NDJSON.
+        resume():
+            Queues the unfinished jobs found on disk and deletes the finished ones past their retention.
+        close():
+            Stops the workers, checkpointing the jobs in progress.
+    """
+
+    def __init__(self, service: SerasaService, policy: Optional[JobPolicy] = None):
+        self.service = service
+        self.policy = policy or JobPolicy.from_env()
+        os.makedirs(self.policy.directory, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.policy.concurrency, thread_name_prefix="job-item")
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._workers = [
+            threading.Thread(target=self.__work, name=f"job-worker-{i}", daemon=True) for i in range(self.policy.workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def close(self):
+        """
+        Stops the workers. Jobs in progress are checkpointed and set back to queued, to be resumed later.
+        """
+        self._stopping.set()
+        for worker in self._workers:
+            worker.join()
+        self.executor.shutdown(wait=True)
+
+    def submit(self, stream: BinaryIO, fmt: str) -> str:
+        """
+        Spools an upload to disk and queues its job.
+        :param stream: a binary stream with the CSV or NDJSON input
+        :param fmt: "csv" or "ndjson"
+        :return: the job ID
+        :raises UploadTooLarge: when the input exceeds `policy.max_upload_bytes`
+        """
+        job = Job(self.policy.directory, uuid.uuid4().hex)
+        os.makedirs(job.path)
+        size = 0
+        try:
+            with open(job.input_path, "wb") as f:
+                while chunk := stream.read(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.policy.max_upload_bytes:
+                        raise UploadTooLarge(f"Upload exceeds {self.policy.max_upload_bytes} bytes.")
+                    f.write(chunk)
+        except Exception:
+            shutil.rmtree(job.path, ignore_errors=True)
+            raise
+        open(job.output_path, "wb").close()
+
+        # the database appears complete or not at all to readers listing the jobs
+        db_path = os.path.join(job.path, "state.sqlite")
+        conn = sqlite3.connect(db_path + ".tmp")
+        try:
+            conn.executescript(SCHEMA)
+            now = time.time()
+            conn.execute(
+                "INSERT INTO job (id, format, status, created_at, updated_at, input_bytes) VALUES (1, ?, ?, ?, ?, ?)",
+                (fmt, QUEUED, now, now, size),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.rename(db_path + ".tmp", db_path)
+
+        logger.info({"event": "job_submitted", "job_id": job.job_id, "format": fmt, "input_bytes": size})
+        self._queue.put(job.job_id)
+        return job.job_id
+
+    def status(self, job_id: str) -> dict:
+        """
+        Returns the status, progress and counters of a job, as of its last checkpoint.
+        :param job_id: the job ID
+        :return: a dictionary describing the job
+        :raises JobNotFound: when the job does not exist
+        """
+        return Job(self.policy.directory, job_id).state()
+
+    def results(self, job_id: str) -> Iterator[bytes]:
+        """
+        Streams the results written up to the last checkpoint.
+        :param job_id: the job ID
+        :return: a generator of NDJSON byte chunks
+        :raises JobNotFound: when the job does not exist
+        """
+        return Job(self.policy.directory, job_id).results()
+
+    def resume(self):
+        """
+        Queues every queued or running job found on disk; jobs held by another process are skipped when
+        a worker tries to claim them. Completed and failed jobs not updated for `policy.retention`
+        seconds are deleted, as are the directories of uploads interrupted by a crash.
+        """
+        expired = time.time() - self.policy.retention if self.policy.retention > 0 else None
+        for job_id in sorted(os.listdir(self.policy.directory)):
+            path = os.path.join(self.policy.directory, job_id)
+            try:
+                state = self.status(job_id)
+            except JobNotFound:
+                # a directory without a database is an upload that never finished
+                if expired is not None and JOB_ID.match(job_id) and os.path.getmtime(path) < expired:
+                    self.__remove(job_id, path)
+                continue
+            except (sqlite3.Error, TypeError, OSError):
+                continue
+            if state["status"] in (QUEUED, RUNNING):
+                self._queue.put(job_id)
+            elif expired is not None and state["updated_at"] < expired:
+                self.__remove(job_id, path)
+
+    @staticmethod
+    def __remove(job_id: str, path: str):
+        # results being downloaded stay readable, as their file is already open
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info({"event": "job_removed", "job_id": job_id})
+
+    def __work(self):
+        next_scan = time.monotonic() + self.policy.rescan_interval
+        while not self._stopping.is_set():
+            try:
+                job_id = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                if time.monotonic() >= next_scan:
+                    next_scan = time.monotonic() + self.policy.rescan_interval
+                    self.resume()
+                continue
+            job = Job(self.policy.directory, job_id)
+            lock = job.claim()
+            if lock is None:
+                continue
+            try:
+                self.__run(job)
+            except Exception as e:
+                logger.error({"event": "job_failed", "job_id": job_id, "error": str(e)})
+                self.__set_status(job, FAILED, str(e))
+            finally:
+                lock.close()
+
+    def __set_status(self, job: Job, status: str, error: Optional[str] = None):
+        conn = job.connect()
+        try:
+            conn.execute("UPDATE job SET status = ?, error = ?, updated_at = ?", (status, error, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def __consult(self, document: Document, pacer: Pacer) -> tuple[dict, int]:
+        """
+        Answers one document, pacing only the calls that miss the cache.
+        """
+        return self.service.consult_document(document, before_fetch=pacer.wait)
+
+    def __item(self, conn: sqlite3.Connection, text: str, fmt: str, column: int, in_flight: set, pacer: Pacer) -> tuple:
+        """
+        Turns one input line into an entry of the output window.
+        :return: a tuple (key, document, type, result) where result is a (response, status) tuple, a Future
+            of one, or None for a duplicate, which is not written; the key is None for invalid documents
+        """
+        raw = parse_line(text, fmt, column)
+        if raw is None:
+            return None, text, None, ({"error": "Malformed line."}, 400)
+
+        validation = check_document(raw)
+        document = validation.document()
+        if document is None:
+            error = f"Invalid {validation.type}." if validation.type else "Invalid document."
+            return None, raw, validation.type, ({"error": error}, 400)
+
+        if document.key in in_flight or conn.execute("SELECT 1 FROM seen WHERE key = ?", (document.key,)).fetchone():
+            return None, raw, validation.type, None
+        in_flight.add(document.key)
+        return document.key, raw, validation.type, self.executor.submit(self.__consult, document, pacer)
+
+    @staticmethod
+    def __csv_column(source: BinaryIO) -> tuple[int, int]:
+        """
+        Finds the document column from the CSV header, if the first line is one.
+        :param source: the input file, positioned at its start
+        :return: a tuple (column index, offset of the first data line)
+        """
+        first = source.readline()
+        cells = next(csv.reader([first.decode("utf-8", errors="replace").lstrip("\ufeff")]), [])
+        names = [cell.strip().lower() for cell in cells]
+        for name in DOCUMENT_COLUMNS:
+            if name in names:
+                return names.index(name), len(first)
+        return 0, 0
+
+    def __run(self, job: Job):
+        """
+        Processes a claimed job from its last checkpoint to the end of its input, or until the manager stops.
+        """
+        state = job.state()
+        if state["status"] not in (QUEUED, RUNNING):
+            return
+        counters = state["counters"] or {"lines": 0, "written": 0, "duplicates": 0, "invalid": 0, "statuses": {}}
+        offset = state["input_offset"]
+        conn = job.connect()
+        try:
+            conn.execute("UPDATE job SET status = ?, updated_at = ?", (RUNNING, time.time()))
+            conn.commit()
+            if log_enabled("job_start"):
+                logger.info({"event": "job_start", "job_id": job.job_id, "input_offset": offset})
+
+            pacer = Pacer(self.policy.rate)
+            # entries (line end offset, key, raw document, type, result), written in input order
+            window = deque()
+            in_flight = set()
+
+            with open(job.input_path, "rb") as source, open(job.output_path, "r+b") as output:
+                # anything past the last checkpoint was written by an interrupted run
+                output.truncate(state["output_bytes"])
+                output.seek(state["output_bytes"])
+                column = 0
+                if state["format"] == CSV:
+                    source.seek(0)
+                    column, header_end = self.__csv_column(source)
+                    offset = max(offset, header_end)
+                source.seek(offset)
+
+                def write(entry: tuple):
+                    nonlocal offset
+                    line_end, key, raw, doc_type, result = entry
+                    offset = line_end
+                    counters["lines"] += 1
+                    if raw is None:
+                        return
+                    if result is None:
+                        counters["duplicates"] += 1
+                        return
+                    if key is None:
+                        counters["invalid"] += 1
+                    if isinstance(result, Future):
+                        try:
+                            result = result.result()
+                        except Exception as e:
+                            logger.error({"event": "job_item_error", "job_id": job.job_id, "error": str(e)})
+                            result = ({"error": "Error in Serasa service. Please try again later."}, 503)
+                    if key is not None:
+                        in_flight.discard(key)
+                        conn.execute("INSERT OR IGNORE INTO seen (key) VALUES (?)", (key,))
+                    response_data, status = result
+                    output.write(json.dumps(result_item(raw, doc_type, response_data, status)).encode() + b"\n")
+                    counters["written"] += 1
+                    counters["statuses"][str(status)] = counters["statuses"].get(str(status), 0) + 1
+
+                def checkpoint():
+                    output.flush()
+                    os.fsync(output.fileno())
+                    conn.execute(
+                        "UPDATE job SET input_offset = ?, output_bytes = ?, counters = ?, updated_at = ?",
+                        (offset, output.tell(), json.dumps(counters), time.time()),
+                    )
+                    conn.commit()
+
+                last_checkpoint = time.monotonic()
+                since_checkpoint = 0
+                # longer lines are cut, so a file without line breaks cannot grow the memory use
+                while not self._stopping.is_set() and (line := source.readline(MAX_LINE_BYTES)):
+                    text = line.decode("utf-8", errors="replace").strip()
+                    entry = self.__item(conn, text, state["format"], column, in_flight, pacer) if text else None
+                    window.append((source.tell(), *(entry or (None, None, None, None))))
+
+                    # the head is written once answered, or waited for when the window is full
+                    while window and (
+                        len(window) > self.policy.concurrency or not isinstance(window[0][4], Future) or window[0][4].done()
+                    ):
+                        write(window.popleft())
+                        since_checkpoint += 1
+
+                    if (
+                        since_checkpoint >= self.policy.checkpoint_every
+                        or time.monotonic() - last_checkpoint >= self.policy.checkpoint_interval
+                    ):
+                        checkpoint()
+                        since_checkpoint, last_checkpoint = 0, time.monotonic()
+
+                while window:
+                    write(window.popleft())
+                checkpoint()
+
+            finished = offset >= state["input_bytes"]
+            conn.execute("UPDATE job SET status = ?, updated_at = ?", (COMPLETED if finished else QUEUED, time.time()))
+            conn.commit()
+            if log_enabled("job_end"):
+                logger.info({"event": "job_end", "job_id": job.job_id, "finished": finished, **counters})
+        finally:
+            conn.close()
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from utils.logger import logger
+
+
+class CircuitOpen(Exception):
+    """
+    Raised when a call is rejected because the circuit breaker is open.
+    """
+
+
+class BulkheadFull(Exception):
+    """
+    Raised when a call is rejected because its bulkhead has no free slot.
+    """
+
+
+@dataclass(frozen=True)
+class BreakerPolicy:
+    """
+    Thresholds of a circuit breaker.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the circuit.
+        recovery_timeout (float): Seconds the circuit stays open before letting probe calls through.
+        half_open_max_calls (int): Probe calls allowed while half-open; all of them must succeed to close.
+    """
+
+    failure_threshold: int = 5
+    recovery_timeout: float = 30.0
+    half_open_max_calls: int = 1
+
+    @classmethod
+    def from_env(cls) -> "BreakerPolicy":
+        """
+        Builds the breaker thresholds from environment variables.
+        :return: a BreakerPolicy instance
+        """
+        return cls(
+            failure_threshold=int(os.getenv("SERASA_BREAKER_FAILURE_THRESHOLD", cls.failure_threshold)),
+            recovery_timeout=float(os.getenv("SERASA_BREAKER_RECOVERY_TIMEOUT", cls.recovery_timeout)),
+            half_open_max_calls=int(os.getenv("SERASA_BREAKER_HALF_OPEN_CALLS", cls.half_open_max_calls)),
+        )
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker guarding calls to a dependency.
+    While closed, calls go through and consecutive failures are counted; reaching the threshold opens
+    the circuit and calls fail fast with CircuitOpen. After the recovery timeout the circuit turns
+    half-open and lets a few probe calls through: if they all succeed it closes, and any failure
+    opens it again.
+
+    Attributes:
+        name (str): Name reported in logs and stats.
+        policy (BreakerPolicy): The breaker thresholds.
+        state (str): "closed", "open" or "half_open".
+        failures (int): Consecutive failures while closed.
+        opened (int): Number of times the circuit opened.
+        rejected (int): Calls rejected without reaching the dependency.
+
+    Methods:
+        call(func, *args, is_failure=None, ignore=()) -> Any:
+            Runs a call through the breaker.
+        stats() -> dict:
+            Returns the breaker state exposed by the metrics endpoint.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, policy: BreakerPolicy):
+        self.name = name
+        self.policy = policy
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def __transition(self, state: str):
+        """
+        Changes the state and logs it. Must be called with the lock held.
+        """
+        logger.warning({"event": "circuit_state_change", "circuit": self.name, "from": self.state, "to": state})
+        self.state = state
+        if state == self.OPEN:
+            self.opened += 1
+            self._opened_at = time.monotonic()
+        if state == self.HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        if state == self.CLOSED:
+            self.failures = 0
+
+    def __before_call(self) -> bool:
+        """
+        Admits or rejects a call.
+        :return: True when the call is a half-open probe
+        :raises CircuitOpen: when the circuit rejects the call
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.policy.recovery_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(f"Circuit {self.name} is open")
+                self.__transition(self.HALF_OPEN)
+
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.policy.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpen(f"Circuit {self.name} is half-open and waiting for probe calls")
+                self._probes += 1
+                return True
+            return False
+
+    def __after_call(self, probe: bool, failed: Optional[bool]):
+        """
+        Records the outcome of an admitted call.
+        :param probe: whether the call was a half-open probe
+        :param failed: whether the call failed, or None when it was abandoned without an outcome
+        """
+        with self._lock:
+            if probe and self.state == self.HALF_OPEN:
+                if failed:
+                    self.__transition(self.OPEN)
+                elif failed is None:
+                    self._probes -= 1
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.policy.half_open_max_calls:
+                        self.__transition(self.CLOSED)
+                return
+
+            if self.state != self.CLOSED or failed is None:
+                return
+            if not failed:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= self.policy.failure_threshold:
+                self.__transition(self.OPEN)
+
+    def call(self, func: Callable, *args, is_failure: Optional[Callable[[Any], bool]] = None, ignore: tuple = ()) -> Any:
+        """
+        Runs a call through the breaker.
+        Exceptions count as failures, except those listed in `ignore`, which neither fail nor succeed.
+        :param func: the callable to run
+        :param args: the arguments of the callable
+        :param is_failure: a predicate telling whether a returned value is a failure
+        :param ignore: exception types that do not say anything about the dependency health
+        :return: the value returned by the callable
+        :raises CircuitOpen: when the circuit rejects the call
+        """
+        probe = self.__before_call()
+        try:
+            result = func(*args)
+        except ignore:
+            self.__after_call(probe, None)
+            raise
+        except Exception:
+            self.__after_call(probe, True)
+            raise
+        self.__after_call(probe, bool(is_failure and is_failure(result)))
+        return result
+
+    def stats(self) -> dict:
+        """
+        Returns the breaker state.
+        :return: a dictionary with the state and counters
+        """
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class Bulkhead:
+    """
+    Caps the concurrent calls of one kind, so a degraded dependency cannot take every worker thread.
+    Callers wait up to `max_wait` seconds for a slot and are rejected with BulkheadFull afterwards.
+
+    Attributes:
+        name (str): Name reported in logs and stats.
+        max_concurrent (int): Maximum concurrent calls.
+        max_wait (float): Seconds a caller may wait for a slot.
+        active (int): Calls currently running.
+        rejected (int): Callers rejected for lack of a slot.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float = 0.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.active = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Bulkhead":
+        if self.max_wait > 0:
+            acquired = self._slots.acquire(timeout=self.max_wait)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise BulkheadFull(f"Bulkhead {self.name} is full")
+        with self._lock:
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """
+        Returns the bulkhead usage.
+        :return: a dictionary with the capacity, active calls and rejections
+        """
+        return {"max_concurrent": self.max_concurrent, "active": self.active, "rejected": self.rejected}
@@ -0,0 +1,142 @@
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+import requests
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Rules for retrying upstream calls.
+
+    Attributes:
+        max_attempts (int): Total attempts per call, including the first one.
+        retry_statuses (frozenset): Status codes worth retrying.
+        retry_exceptions (tuple): Exception types worth retrying.
+        base_delay (float): Backoff in seconds before the first retry; it doubles on every retry.
+        max_delay (float): Upper bound of the backoff in seconds.
+        budget_ratio (float): Retries allowed as a fraction of first attempts, so retries add at most this
+            share of extra load when the upstream is failing.
+        budget_min_per_sec (float): Retries per second always allowed, so low traffic can still retry.
+    """
+
+    max_attempts: int = 3
+    retry_statuses: frozenset = frozenset({502, 503, 504})
+    retry_exceptions: tuple = (requests.ConnectionError, requests.Timeout)
+    base_delay: float = 0.1
+    max_delay: float = 2.0
+    budget_ratio: float = 0.1
+    budget_min_per_sec: float = 1.0
+
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {self.max_attempts}")
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """
+        Builds the retry policy from environment variables.
+        :return: a RetryPolicy instance
+        """
+        statuses = os.getenv("SERASA_RETRY_STATUSES")
+        return cls(
+            max_attempts=int(os.getenv("SERASA_RETRY_MAX_ATTEMPTS", cls.max_attempts)),
+            retry_statuses=frozenset(int(s) for s in statuses.split(",") if s.strip()) if statuses else cls.retry_statuses,
+            base_delay=float(os.getenv("SERASA_RETRY_BASE_DELAY", cls.base_delay)),
+            max_delay=float(os.getenv("SERASA_RETRY_MAX_DELAY", cls.max_delay)),
+            budget_ratio=float(os.getenv("SERASA_RETRY_BUDGET_RATIO", cls.budget_ratio)),
+            budget_min_per_sec=float(os.getenv("SERASA_RETRY_BUDGET_MIN_PER_SEC", cls.budget_min_per_sec)),
+        )
+
+    def backoff(self, retry: int) -> float:
+        """
+        Computes the delay before a retry with exponential backoff and full jitter.
+        :param retry: the retry number, starting at 1
+        :return: the delay in seconds
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a share of the traffic.
+    Every first attempt deposits `ratio` tokens and a constant `min_per_sec` trickles in; every retry
+    withdraws one token. The balance is capped, so a quiet period cannot save up for a retry storm.
+
+    Attributes:
+        ratio (float): Tokens deposited per first attempt.
+        min_per_sec (float): Tokens deposited per second regardless of traffic.
+        cap (float): Maximum balance.
+        balance (float): Tokens available.
+    """
+
+    def __init__(self, ratio: float, min_per_sec: float, cap: float = 10.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.cap = cap
+        self.balance = 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __refill(self, now: float):
+        self.balance = min(self.cap, self.balance + (now - self._updated_at) * self.min_per_sec)
+        self._updated_at = now
+
+    def deposit(self):
+        """
+        Records a first attempt.
+        """
+        with self._lock:
+            self.__refill(time.monotonic())
+            self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Takes a token for a retry.
+        :return: True when the retry is allowed
+        """
+        with self._lock:
+            self.__refill(time.monotonic())
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class RetryStats:
+    """
+    Retry counters per upstream endpoint.
+
+    Methods:
+        incr(endpoint: str, counter: str):
+            Increments a counter of an endpoint.
+        snapshot() -> dict:
+            Returns the counters of every endpoint.
+    """
+
+    COUNTERS = ("attempts", "retries", "budget_exhausted", "deadline_exceeded", "gave_up")
+
+    def __init__(self):
+        self._counters = defaultdict(lambda: dict.fromkeys(self.COUNTERS, 0))
+        self._lock = threading.Lock()
+
+    def incr(self, endpoint: str, counter: str):
+        """
+        Increments a counter of an endpoint.
+        :param endpoint: a string naming the endpoint (e.g. the report type)
+        :param counter: one of COUNTERS
+        """
+        with self._lock:
+            self._counters[endpoint][counter] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns the counters of every endpoint.
+        :return: a dictionary of counters keyed by endpoint
+        """
+        with self._lock:
+            return {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
@@ -1,12 +1,58 @@
+import contextvars
 import os
+import threading
 import time
-from typing import Optional
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator, Optional
 
 import requests
-from cachetools import TTLCache
 
-from services.validation import validate_cpf, validate_cnpj
-from utils.logger import logger
+from services.cache import CachePolicy, ReportCache, create_cache
+from services.hedging import HedgePolicy, Hedger
+from services.http_transport import TransportConfig, build_session
+from services.retry import RetryBudget, RetryPolicy, RetryStats
+from services.resilience import BreakerPolicy, Bulkhead, BulkheadFull, CircuitBreaker, CircuitOpen
+from services.token_manager import TokenManager
+from services.upstream_limiter import UpstreamLimiter, UpstreamLimits, UpstreamOverloaded, parse_retry_after
+from services.validation import Document, check_document, parse_cnpj, parse_cpf
+from utils.deadline import deadline_from_header, request_deadline_var
+from utils.logger import log_enabled, logger
+from utils.metrics import UPSTREAM_REQUEST_DURATION
+from utils.singleflight import SingleFlight
+from utils.tracing import inject, span
+
+PF_REPORT_PATH = "/credit-services/person-information-report/v1/creditreport?reportName=RELATORIO_BASICO_PF_PME"
+PJ_REPORT_PATH = "/credit-services/business-information-report/v1/reports?reportName=RELATORIO_BASICO_PJ_PME"
+REPORT_PATHS = {"pf": PF_REPORT_PATH, "pj": PJ_REPORT_PATH}
+
+
+def result_item(raw: str, doc_type: Optional[str], response_data: dict, status: int) -> dict:
+    """
+    Builds the result of one document of a batch or bulk job.
+    :param raw: the document as sent by the caller
+    :param doc_type: "CPF", "CNPJ" or None when the type could not be inferred
+    :param response_data: the consultation response
+    :param status: the consultation status
+    :return: a dictionary with the document, its type, status and response fields
+    """
+    return {"document": raw, "type": doc_type.lower() if doc_type else None, "status": status, **response_data}
+
+
+def batch_error(documents: list, max_size: int) -> Optional[str]:
+    """
+    Checks the documents field of a batch request.
+    :param documents: the value of the documents field
+    :param max_size: an integer with the maximum number of documents
+    :return: the error message, or None when the batch is valid
+    """
+    if not isinstance(documents, list) or not all(isinstance(doc, str) for doc in documents):
+        return "Field 'documents' must be a list of strings."
+    if not documents:
+        return "Field 'documents' must not be empty."
+    if len(documents) > max_size:
+        return f"Batch size exceeds the limit of {max_size} documents."
+    return None
 
 
 class SerasaService:
@@ -17,8 +63,22 @@ class SerasaService:
     Attributes:
         mock_url (str): The base URL of the Serasa mock service.
         auth_header (dict): The authorization header for API requests.
-        token_cache (dict): Cache for the access token and its expiration time.
-        cache (TTLCache): Cache for storing consultation results with a time-to-live.
+        token_manager (TokenManager): Owns the access token and refreshes it in the background.
+        cache (CacheBackend): Cache of consultation results keyed by the namespaced document key (e.g. "pf:<digits>").
+        transport (TransportConfig): Pool sizes and timeouts used for upstream calls.
+        session (requests.Session): Persistent keep-alive session shared by all upstream calls.
+        batch_max_size (int): Maximum number of documents accepted in a single batch.
+        executor (ThreadPoolExecutor): Bounded worker pool used to fan out batch cache misses.
+        singleflight (SingleFlight): Coalesces concurrent upstream fetches for the same document.
+        cache_policies (dict): Fresh, stale and negative TTLs per report type ("pf" and "pj").
+        reports (ReportCache): Stores reports in `cache` following `cache_policies`.
+        upstream_limiter (UpstreamLimiter): Paces report calls to the provider quota and adapts their concurrency.
+        breakers (dict): CircuitBreaker per report type, opened by consecutive upstream failures.
+        bulkheads (dict): Bulkhead per report type, so a degraded report endpoint cannot starve the other.
+        retry_policy (RetryPolicy): Which failures are retried, how many times and with which backoff.
+        retry_budget (RetryBudget): Caps retries to a share of the upstream traffic.
+        retry_stats (RetryStats): Attempt, retry and give-up counters per report type.
+        hedgers (dict): Hedger per report type, re-sending report calls slower than their recent latency percentile.
     Methods:
         __get_token() -> Optional[str]:
             Authenticates with the mock Serasa service to retrieve an access token.
@@ -26,130 +86,528 @@ class SerasaService:
             Consults the Serasa mock service for a person's credit report by CPF.
         consult_cnpj(cnpj: str) -> [dict, int]:
             Consults the Serasa mock service for a company's credit report by CNPJ.
+        consult_batch(documents: list) -> [dict, int]:
+            Consults a mixed list of CPFs and CNPJs, fanning cache misses out concurrently.
+        stream_batch(documents: list, ordered: bool = True) -> [Iterator, int]:
+            Like consult_batch, yielding each result as it is ready.
+        warm_up(documents: list):
+            Fetches the access token, opens the cache connections and optionally preloads reports.
+        stats() -> dict:
+            Returns runtime counters exposed by the metrics endpoint.
     """
 
     def __init__(self):
         self.mock_url = os.getenv("MOCK_URL")
         self.auth_header = {"Authorization": f"Basic {os.getenv('SERASA_AUTH_TOKEN')}"}
-        self.token_cache = {"token": None, "expires_at": 0}
-        self.cache = TTLCache(maxsize=100, ttl=int(os.getenv("SERASA_CACHE_TTL", 300)))
+        self.cache = create_cache(ttl=float(os.getenv("SERASA_CACHE_TTL", 300)))
+        self.transport = TransportConfig.from_env()
+        self.session = build_session(self.transport)
+        self.token_manager = TokenManager(
+            self.session,
+            f"{self.mock_url}/security/iam/v1/client-identities/login",
+            self.auth_header,
+            self.transport.timeout,
+        )
+        self.batch_max_size = int(os.getenv("SERASA_BATCH_MAX_SIZE", 5000))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("SERASA_BATCH_WORKERS", 8)), thread_name_prefix="serasa-batch"
+        )
+        self.singleflight = SingleFlight()
+        self.cache_policies = {report_type: CachePolicy.from_env(report_type) for report_type in REPORT_PATHS}
+        self.reports = ReportCache(self.cache, self.cache_policies)
+        self.upstream_limiter = UpstreamLimiter(UpstreamLimits.from_env(self.transport.max_connections))
+        self.retry_policy = RetryPolicy.from_env()
+        self.retry_budget = RetryBudget(self.retry_policy.budget_ratio, self.retry_policy.budget_min_per_sec)
+        self.retry_stats = RetryStats()
+        breaker_policy = BreakerPolicy.from_env()
+        self.breakers = {report_type: CircuitBreaker(report_type, breaker_policy) for report_type in REPORT_PATHS}
+        self.bulkheads = {
+            report_type: Bulkhead(
+                report_type,
+                int(os.getenv(f"SERASA_{report_type.upper()}_BULKHEAD", os.getenv("SERASA_BULKHEAD_SIZE", 10))),
+                float(os.getenv("SERASA_BULKHEAD_MAX_WAIT", 1.0)),
+            )
+            for report_type in REPORT_PATHS
+        }
+        self.hedge_executor = ThreadPoolExecutor(
+            max_workers=self.transport.max_connections * 2, thread_name_prefix="serasa-hedge"
+        )
+        self.hedgers = {
+            report_type: Hedger(HedgePolicy.from_env(report_type), self.hedge_executor) for report_type in REPORT_PATHS
+        }
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
 
-    def __get_token(self, force=False) -> Optional[str]:
+    def close(self):
+        """
+        Waits for in-flight batch calls and releases the pooled connections held by the service.
         """
-        Authenticates with the mock Serasa service to retrieve an access token.
+        self.executor.shutdown(wait=True)
+        self.hedge_executor.shutdown(wait=True)
+        self.token_manager.close()
+        self.cache.close()
+        self.session.close()
+
+    def warm_up(self, documents: Optional[list] = None):
+        """
+        Fetches the access token, which also opens the first upstream connection, touches the cache so
+        its connections are open, and optionally fetches some documents into the cache.
+        :param documents: a list of CPFs and CNPJs to preload
+        """
+        self.__get_token()
+        self.cache.get("warm-up")
+        if documents:
+            self.consult_batch(documents)
+
+    def __get_token(self, force=False, stale_token: Optional[str] = None) -> Optional[str]:
+        """
+        Retrieves an access token from the token manager, authenticating only when needed.
         :param force: a boolean indicating whether to force re-authentication
+        :param stale_token: the token rejected by the upstream, if any
         :return: a string representing the access token
         """
-        if not force and self.token_cache["token"] and self.token_cache["expires_at"] > time.time():
-            return self.token_cache["token"]
+        return self.token_manager.get_token(force=force, stale_token=stale_token)
 
-        resp = requests.post(
-            f"{self.mock_url}/security/iam/v1/client-identities/login",
-            headers=self.auth_header,
-        )
-        if resp.status_code != 200:
-            raise Exception("Error authenticating with Serasa mock service")
+    def __call_upstream(self, url: str, headers: dict, deadline: float, endpoint: str = "report") -> requests.Response:
+        """
+        Makes one GET request through the outbound limiter, reporting its outcome back to it and to the
+        upstream latency histogram. The call is traced as an "upstream" span whose context is sent upstream.
+        The transport timeouts are shortened so the call never outlives the request deadline.
+        :param url: a string representing the URL to request
+        :param headers: a dictionary with the request headers, left unchanged
+        :param deadline: the absolute deadline of the request, as a time.monotonic value
+        :param endpoint: a string with the report type, labelling the latency histogram
+        :return: a requests.Response object
+        :raises UpstreamOverloaded: when the call is shed by the limiter
+        :raises requests.Timeout: when the deadline has already passed
+        """
+        # each call gets its own copy, as a hedge and its primary run at the same time with their own spans
+        headers = dict(headers)
+        with span("upstream", report_type=endpoint) as upstream_span:
+            inject(headers)
+            self.upstream_limiter.acquire()
+            start = time.perf_counter()
+            status_code = None
+            retry_after = None
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise requests.Timeout("Request deadline exceeded")
+                timeout = (min(self.transport.connect_timeout, remaining), min(self.transport.read_timeout, remaining))
+                resp = self.session.get(url, headers=headers, timeout=timeout)
+                status_code = resp.status_code
+                upstream_span.set("http.status_code", status_code)
+                if status_code == 429:
+                    retry_after = parse_retry_after(resp)
+                return resp
+            finally:
+                latency = time.perf_counter() - start
+                self.upstream_limiter.release(status_code, latency, retry_after)
+                UPSTREAM_REQUEST_DURATION.observe(latency, endpoint, str(status_code or "error"))
 
-        data = resp.json()
-        token = data.get("accessToken")
-        expires_in = data.get("expiresIn", 60)
-        if isinstance(expires_in, str):
-            expires_in = int(expires_in)
+    def __attempt(self, url: str, headers: dict, deadline: float, endpoint: str = "report") -> requests.Response:
+        """
+        Makes one attempt, re-issuing the call once with a new token on 401 and once more after the wait
+        requested by a 429. The first call is hedged when hedging is enabled for the report type.
+        :param url: a string representing the URL to request
+        :param headers: a dictionary with the request headers, updated with the new token on 401
+        :param deadline: the absolute deadline of the request, as a time.monotonic value
+        :param endpoint: a string with the report type, selecting the hedger
+        :return: a requests.Response object
+        """
+        hedger = self.hedgers.get(endpoint)
+        if hedger is None:
+            resp = self.__call_upstream(url, headers, deadline, endpoint)
+        else:
+            resp = hedger.call(self.__call_upstream, url, headers, deadline, endpoint)
 
-        self.token_cache["token"] = token
-        self.token_cache["expires_at"] = time.time() + expires_in - 5
+        if resp.status_code == 401:
+            logger.warning({"event": "token_expired", "message": "Retrying request with new token"})
 
-        logger.info({"event": "auth_success", "token_set": True, "expires_at": self.token_cache["expires_at"]})
+            with span("auth", refresh=True):
+                token = self.__get_token(force=True, stale_token=headers["Authorization"].removeprefix("Bearer "))
+            headers["Authorization"] = f"Bearer {token}"
+            resp = self.__call_upstream(url, headers, deadline, endpoint)
 
-        return token
+        if resp.status_code == 429:
+            # the limiter holds new calls for the Retry-After period; the retry is shed if that is too long
+            logger.warning({"event": "upstream_throttled", "retry_after": parse_retry_after(resp)})
+            resp = self.__call_upstream(url, headers, deadline, endpoint)
 
-    def __request_with_retry(self, url: str, document_id: str) -> requests.Response:
+        return resp
+
+    def __request_with_retry(self, url: str, document_id: str, endpoint: str = "report") -> requests.Response:
         """
-        Makes a GET request to the specified URL with retries on failure.
+        Makes a GET request to the specified URL, retrying transient failures according to the retry policy.
+        A retry is skipped when the attempts are used up, when the backoff would cross the request deadline
+        or when the retry budget is exhausted; the last response is returned, or the last error raised.
         :param url: a string representing the URL to request
         :param document_id: a string representing the document ID (CPF or CNPJ)
+        :param endpoint: a string naming the endpoint in the retry counters
         :return: a requests.Response object
+        :raises UpstreamOverloaded: when the call is shed by the outbound limiter
+        :raises requests.RequestException: when the last attempt failed without a response
         """
-        logger.info({"event": "request_start", "document_id": document_id, "url": url})
+        if log_enabled("request_start"):
+            logger.info({"event": "request_start", "document_id": document_id, "url": url})
 
-        token = self.__get_token()
+        policy = self.retry_policy
+        deadline = request_deadline_var.get() or deadline_from_header(None)
+        with span("auth"):
+            token = self.__get_token()
         headers = {"Authorization": f"Bearer {token}", "X-Document-Id": document_id}
-        resp = requests.get(url, headers=headers)
+        self.retry_budget.deposit()
 
-        if resp.status_code == 401:
-            logger.warning({"event": "token_expired", "message": "Retrying request with new token"})
+        for attempt in range(1, policy.max_attempts + 1):
+            self.retry_stats.incr(endpoint, "attempts")
+            try:
+                resp, error = self.__attempt(url, headers, deadline, endpoint), None
+                if resp.status_code not in policy.retry_statuses:
+                    break
+            except policy.retry_exceptions as e:
+                resp, error = None, e
 
-            token = self.__get_token(force=True)
-            headers["Authorization"] = f"Bearer {token}"
-            resp = requests.get(url, headers=headers)
+            delay = policy.backoff(attempt)
+            if attempt == policy.max_attempts:
+                self.retry_stats.incr(endpoint, "gave_up")
+                break
+            if deadline - time.monotonic() <= delay:
+                self.retry_stats.incr(endpoint, "deadline_exceeded")
+                break
+            if not self.retry_budget.withdraw():
+                self.retry_stats.incr(endpoint, "budget_exhausted")
+                break
+
+            self.retry_stats.incr(endpoint, "retries")
+            logger.warning(
+                {
+                    "event": "upstream_retry",
+                    "document_id": document_id,
+                    "attempt": attempt,
+                    "delay": round(delay, 3),
+                    "reason": str(error) if error else resp.status_code,
+                }
+            )
+            time.sleep(delay)
 
-        logger.info({"event": "request_end", "document_id": document_id, "status_code": resp.status_code})
+        if error is not None:
+            raise error
+
+        if log_enabled("request_end"):
+            logger.info({"event": "request_end", "document_id": document_id, "status_code": resp.status_code})
 
         return resp
 
-    def consult_cpf(self, cpf: str) -> [dict, int]:
+    def __cached_response(self, document: Document) -> Optional[tuple[dict, int]]:
         """
-        Consults the Serasa mock service for a person's credit report by CPF.
-        :param cpf: a string representing the CPF number, which may contain non-digit characters
-        :return: a dictionary with the result of the consultation
+        Builds the consultation response for a document already in the cache.
+        Reports past their fresh TTL are still served, flagged as stale, while a single background
+        refresh runs; cached "not found" answers are served as 404.
+        :param document: a validated Document
+        :return: a (response, status) tuple, or None on a cache miss
         """
-        logger.info({"event": "validate_cpf", "cpf": cpf})
+        hit = self.reports.lookup(document)
+        if hit is None:
+            return None
 
-        if not validate_cpf(cpf):
-            logger.error({"event": "invalid_cpf", "cpf": cpf})
-            return {"error": "Invalid CPF."}, 400
+        response_data, status, stale = hit
+        if stale:
+            self.__revalidate(document)
+        return response_data, status
 
-        if cpf in self.cache:
-            logger.info({"event": "cache_hit", "document_id": cpf})
-            return {"success": True, "data": self.cache[cpf], "cached": True}, 200
+    def __revalidate(self, document: Document):
+        """
+        Schedules a background refresh of a stale report, at most one per document at a time.
+        :param document: a validated Document
+        """
+        with self._revalidating_lock:
+            if document.key in self._revalidating:
+                return
+            self._revalidating.add(document.key)
+        self.reports.counters["revalidations"] += 1
 
-        logger.info({"event": "auth_request", "message": "Requesting new token"})
-        resp = self.__request_with_retry(
-            f"{self.mock_url}/credit-services/person-information-report/v1/creditreport?reportName=RELATORIO_BASICO_PF_PME",
-            cpf,
-        )
+        def refresh():
+            try:
+                self.singleflight.do(document.key, self.__request_report, document, True)
+            except Exception as e:
+                logger.warning({"event": "revalidation_failed", "document_id": document.key, "error": str(e)})
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(document.key)
+
+        try:
+            self.executor.submit(refresh)
+        except RuntimeError:
+            # executor already shut down
+            with self._revalidating_lock:
+                self._revalidating.discard(document.key)
+
+    def __consult(self, document: Document, before_fetch: Optional[Callable[[], None]] = None) -> tuple[dict, int]:
+        """
+        Answers a validated document from the cache or fetches it from the upstream.
+        :param document: a validated Document
+        :param before_fetch: an optional function called after a cache miss, before fetching
+        :return: a (response, status) tuple
+        """
+        with span("cache"):
+            cached = self.__cached_response(document)
+        if cached:
+            return cached
+        if before_fetch is not None:
+            before_fetch()
+        return self.__fetch(document)
+
+    def __fetch(self, document: Document) -> tuple[dict, int]:
+        """
+        Fetches a validated document already missed in the cache from the upstream.
+        Concurrent fetches for the same document are coalesced; followers receive a copy of the
+        leader's response, including error responses and exceptions.
+        :param document: a validated Document
+        :return: a (response, status) tuple
+        """
+        response_data, status = self.singleflight.do(document.key, self.__request_report, document)
+        return dict(response_data), status
+
+    def __guarded_request(self, document: Document) -> requests.Response:
+        """
+        Requests a report inside the bulkhead and circuit breaker of its report type.
+        Transport errors and 5xx responses count as breaker failures; calls shed before reaching the
+        upstream do not.
+        :param document: a validated Document
+        :return: a requests.Response object
+        :raises CircuitOpen: when the circuit of the report type is open
+        :raises BulkheadFull: when the report type already has its maximum of calls in flight
+        """
+        url = f"{self.mock_url}{REPORT_PATHS[document.report_type]}"
+        with self.bulkheads[document.report_type]:
+            return self.breakers[document.report_type].call(
+                self.__request_with_retry,
+                url,
+                document.digits,
+                document.report_type,
+                is_failure=lambda resp: resp.status_code >= 500,
+                ignore=(UpstreamOverloaded,),
+            )
+
+    def __fallback_response(self, document: Document, error: Exception) -> tuple[dict, int]:
+        """
+        Answers a document that could not be requested from the upstream, with the cached report when
+        there is one, even past its stale window.
+        :param document: a validated Document
+        :param error: the exception that prevented the upstream call
+        :return: a (response, status) tuple
+        """
+        reason = type(error).__name__
+        logger.warning({"event": "upstream_unavailable", "document_id": document.key, "reason": reason, "error": str(error)})
+        hit = self.reports.lookup(document, fallback=True)
+        if hit:
+            response_data, status, _ = hit
+            return response_data, status
+        if isinstance(error, UpstreamOverloaded):
+            return {"error": "Serasa service is busy. Please try again later."}, 503
+        return {"error": "Serasa service is unavailable. Please try again later."}, 503
+
+    def __request_report(self, document: Document, revalidate: bool = False) -> tuple[dict, int]:
+        """
+        Requests a report from the upstream and caches the answer.
+        :param document: a validated Document
+        :param revalidate: a boolean indicating a background refresh of a stale entry
+        :return: a (response, status) tuple
+        """
+        if not revalidate:
+            # a previous leader may have filled the cache between our miss and taking the lead; the miss
+            # was already counted, so the cache is peeked at without counting another lookup
+            cached = self.reports.peek(document)
+            if cached:
+                return cached
+
+        try:
+            resp = self.__guarded_request(document)
+        except (CircuitOpen, BulkheadFull, UpstreamOverloaded, requests.RequestException) as e:
+            return self.__fallback_response(document, e)
 
         if resp.status_code == 404:
-            logger.error({"event": "document_not_found", "document_id": cpf})
+            logger.error({"event": "document_not_found", "document_id": document.key})
+            self.reports.store(document, None)
             return {"error": "Document not found"}, 404
         if resp.status_code != 200:
             logger.error({"event": "service_error", "status_code": resp.status_code})
             return {"error": "Error in Serasa service. Please try again later."}, 503
 
         data = resp.json()
-        self.cache[cpf] = data
+        self.reports.store(document, data)
 
-        logger.info({"event": "consult_success", "document_id": cpf})
+        if log_enabled("consult_success"):
+            logger.info({"event": "consult_success", "document_id": document.key})
         return {"success": True, "data": data, "cached": False}, 200
 
+    def consult_document(self, document: Document, before_fetch: Optional[Callable[[], None]] = None) -> tuple[dict, int]:
+        """
+        Consults a validated document, from the cache or the upstream.
+        :param document: a validated Document
+        :param before_fetch: an optional function called only when the upstream is about to be called,
+            e.g. to pace bulk jobs on upstream calls alone
+        :return: a (response, status) tuple
+        """
+        return self.__consult(document, before_fetch)
+
+    def consult_cpf(self, cpf: str) -> [dict, int]:
+        """
+        Consults the Serasa mock service for a person's credit report by CPF.
+        :param cpf: a string representing the CPF number, which may contain non-digit characters
+        :return: a dictionary with the result of the consultation
+        """
+        with span("validation"):
+            document = parse_cpf(cpf)
+        if document is None:
+            logger.error({"event": "invalid_cpf"})
+            return {"error": "Invalid CPF."}, 400
+
+        return self.__consult(document)
+
     def consult_cnpj(self, cnpj: str) -> [dict, int]:
         """
         Consults the Serasa mock service for a company's credit report by CNPJ.
         :param cnpj: a string representing the CNPJ number, which may contain non-digit characters
         :return: a dictionary with the result of the consultation
         """
-        logger.info({"event": "validate_cnpj", "cnpj": cnpj})
-        if not validate_cnpj(cnpj):
-            logger.error({"event": "invalid_cnpj", "cnpj": cnpj})
+        with span("validation"):
+            document = parse_cnpj(cnpj)
+        if document is None:
+            logger.error({"event": "invalid_cnpj"})
             return {"error": "Invalid CNPJ."}, 400
 
-        if cnpj in self.cache:
-            logger.info({"event": "cache_hit", "document_id": cnpj})
-            return {"success": True, "data": self.cache[cnpj], "cached": True}, 200
+        return self.__consult(document)
 
-        resp = self.__request_with_retry(
-            f"{self.mock_url}/credit-services/business-information-report/v1/reports?reportName=RELATORIO_BASICO_PJ_PME",
-            cnpj,
-        )
+    def consult_batch(self, documents: list) -> [dict, int]:
+        """
+        Consults a mixed list of CPFs and CNPJs.
+        Every document is validated up front and cache hits are answered immediately; the remaining
+        documents are sent to the upstream concurrently through the bounded batch executor. Items go
+        through the same path as `consult_cpf`/`consult_cnpj`, so statuses match the single-document endpoints.
+        :param documents: a list of strings with CPF (11 digits) or CNPJ (14 digits) numbers
+        :return: a dictionary with one result per document, in the input order
+        """
+        items, status = self.stream_batch(documents)
+        if status != 200:
+            return items, status
+        items = list(items)
+        return {"results": items, "total": len(items)}, 200
 
-        if resp.status_code == 404:
-            logger.error({"event": "document_not_found", "document_id": cnpj})
-            return {"error": "Document not found"}, 404
-        if resp.status_code != 200:
-            logger.error({"event": "service_error", "status_code": resp.status_code})
+    def stream_batch(self, documents: list, ordered: bool = True) -> [Iterator, int]:
+        """
+        Consults a mixed list of CPFs and CNPJs like `consult_batch`, returning the results as they are
+        ready instead of all at once. The upstream calls are submitted before returning, in the caller's
+        context, so the request deadline and trace apply to them even when the results are read later.
+        :param documents: a list of strings with CPF (11 digits) or CNPJ (14 digits) numbers
+        :param ordered: a boolean, True to return the results in input order, False in completion order
+        :return: an iterator of result items and 200, or an error dictionary and 400
+        """
+        error = batch_error(documents, self.batch_max_size)
+        if error:
+            return {"error": error}, 400
+
+        if log_enabled("batch_start"):
+            logger.info({"event": "batch_start", "size": len(documents)})
+
+        parsed = {}
+        results = {}
+        pending = {}
+        for raw in documents:
+            if raw in parsed:
+                continue
+
+            validation = check_document(raw)
+            doc_type, document = validation.type, validation.document()
+            parsed[raw] = (doc_type, document.key if document else raw)
+
+            if document is None:
+                error = f"Invalid {doc_type}." if doc_type else "Invalid document."
+                results[raw] = ({"error": error}, 400)
+                continue
+            if document.key in results or document.key in pending:
+                continue
+
+            cached = self.__cached_response(document)
+            if cached:
+                results[document.key] = cached
+            else:
+                # each item runs in a copy of the request context, keeping its deadline and trace
+                pending[document.key] = self.executor.submit(contextvars.copy_context().run, self.__fetch, document)
+
+        return self.__batch_items(documents, parsed, results, pending, ordered), 200
+
+    def __batch_items(self, documents: list, parsed: dict, results: dict, pending: dict, ordered: bool) -> Iterator:
+        """
+        Yields the result items of a batch, waiting for the upstream calls as needed. Each result is
+        released once its last item is yielded, and calls not started yet are cancelled if the reader
+        stops early (e.g. a client disconnecting from a streamed response).
+        :param documents: the batch documents
+        :param parsed: the type and result key of each distinct document
+        :param results: the results known up front, by key
+        :param pending: the futures of the upstream calls, by key
+        :param ordered: a boolean, True to yield in input order, False in completion order
+        :return: a generator of result item dictionaries
+        """
+        upstream_calls = len(pending)
+        try:
+            if ordered:
+                remaining = Counter(parsed[raw][1] for raw in documents)
+                for raw in documents:
+                    doc_type, key = parsed[raw]
+                    if key in pending:
+                        results[key] = self.__batch_result(key, pending.pop(key))
+                    yield result_item(raw, doc_type, *results[key])
+                    remaining[key] -= 1
+                    if not remaining[key]:
+                        del results[key]
+            else:
+                waiting = {}
+                for raw in documents:
+                    doc_type, key = parsed[raw]
+                    if key in pending:
+                        waiting.setdefault(key, []).append(raw)
+                    else:
+                        yield result_item(raw, doc_type, *results[key])
+                keys = {future: key for key, future in pending.items()}
+                for future in as_completed(keys):
+                    key = keys.pop(future)
+                    result = self.__batch_result(key, pending.pop(key))
+                    for raw in waiting.pop(key):
+                        yield result_item(raw, parsed[raw][0], *result)
+        finally:
+            for future in pending.values():
+                future.cancel()
+
+        if log_enabled("batch_end"):
+            logger.info({"event": "batch_end", "size": len(documents), "upstream_calls": upstream_calls})
+
+    @staticmethod
+    def __batch_result(key: str, future: Future) -> tuple[dict, int]:
+        """
+        Waits for the upstream call of one batch document.
+        :param key: the document key
+        :param future: the future of the call
+        :return: the consultation response and status, or a 503 response if the call failed
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error({"event": "batch_item_error", "document_id": key, "error": str(e)})
             return {"error": "Error in Serasa service. Please try again later."}, 503
 
-        data = resp.json()
-        self.cache[cnpj] = data
-        logger.info({"event": "consult_success", "document_id": cnpj})
-        return {"success": True, "data": data, "cached": False}, 200
+    def stats(self) -> dict:
+        """
+        Returns runtime counters of the service.
+        :return: a dictionary with the service counters
+        """
+        return {
+            "singleflight": self.singleflight.stats(),
+            "token": self.token_manager.stats(),
+            "cache": {**self.cache.stats(), **self.reports.counters},
+            "upstream": self.upstream_limiter.stats(),
+            "retries": {"budget": round(self.retry_budget.balance, 2), "endpoints": self.retry_stats.snapshot()},
+            "circuit_breakers": {name: breaker.stats() for name, breaker in self.breakers.items()},
+            "bulkheads": {name: bulkhead.stats() for name, bulkhead in self.bulkheads.items()},
+            "hedging": {name: hedger.stats() for name, hedger in self.hedgers.items()},
+        }
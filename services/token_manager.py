@@ -0,0 +1,319 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from utils.logger import logger
+from utils.metrics import TOKEN_REFRESHES
+
+
+def refresh_mode(background: bool) -> str:
+    """
+    Labels a login in the token refresh counter.
+    :param background: a boolean indicating whether the login is a proactive refresh
+    :return: "background" or "on_demand"
+    """
+    return "background" if background else "on_demand"
+
+
+def parse_login_response(data: dict) -> tuple[str, float]:
+    """
+    Extracts the access token and its local expiration time from a login response.
+    The expiration is brought forward by 5 seconds to absorb clock skew and request latency.
+    :param data: the decoded JSON body of the login endpoint
+    :return: a (token, expires_at) tuple
+    """
+    expires_in = data.get("expiresIn", 60)
+    if isinstance(expires_in, str):
+        expires_in = int(expires_in)
+    return data.get("accessToken"), time.time() + expires_in - 5
+
+
+class TokenManager:
+    """
+    Thread-safe owner of the Serasa access token.
+    Only one login can be in flight at a time: callers that find the token expired queue on a lock
+    and reuse the token obtained by whoever got there first. After the first login a background
+    thread renews the token `refresh_margin` seconds before it expires, so requests do not wait on auth.
+
+    Attributes:
+        login_url (str): The URL of the login endpoint.
+        token (str): The current access token, or None before the first login.
+        expires_at (float): Epoch time after which the current token must not be used.
+        refresh_margin (float): Seconds before `expires_at` at which the background refresh runs.
+
+    Methods:
+        get_token(force: bool = False, stale_token: Optional[str] = None) -> str:
+            Returns a valid token, logging in if needed.
+        stats() -> dict:
+            Returns login/refresh counts and auth latency.
+        close():
+            Stops the background refresh thread.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        login_url: str,
+        auth_header: dict,
+        timeout: tuple[float, float],
+        refresh_margin: Optional[float] = None,
+    ):
+        self.session = session
+        self.login_url = login_url
+        self.auth_header = auth_header
+        self.timeout = timeout
+        self.refresh_margin = (
+            float(os.getenv("SERASA_TOKEN_REFRESH_MARGIN", 15)) if refresh_margin is None else refresh_margin
+        )
+        self.token = None
+        self.expires_at = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+
+        self.login_count = 0
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.last_auth_latency = 0.0
+        self.total_auth_latency = 0.0
+
+    def __is_valid(self) -> bool:
+        return self.token is not None and self.expires_at > time.time()
+
+    def get_token(self, force: bool = False, stale_token: Optional[str] = None) -> str:
+        """
+        Returns a valid access token, authenticating when there is none or it has expired.
+        :param force: a boolean indicating whether to force re-authentication
+        :param stale_token: the token rejected by the upstream; a forced login is skipped if another
+            thread already replaced it
+        :return: a string representing the access token
+        """
+        if not force and self.__is_valid():
+            return self.token
+
+        with self._lock:
+            if self.__is_valid() and (not force or (stale_token is not None and self.token != stale_token)):
+                return self.token
+            return self.__login()
+
+    def __login(self, background: bool = False) -> str:
+        """
+        Authenticates with the Serasa service. Must be called with the lock held.
+        :param background: a boolean indicating whether the login is a proactive refresh
+        :return: a string representing the access token
+        """
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(self.login_url, headers=self.auth_header, timeout=self.timeout)
+        except requests.RequestException:
+            self.failure_count += 1
+            TOKEN_REFRESHES.inc(refresh_mode(background), "failure")
+            raise
+        finally:
+            self.last_auth_latency = time.perf_counter() - start
+            self.total_auth_latency += self.last_auth_latency
+
+        if resp.status_code != 200:
+            self.failure_count += 1
+            TOKEN_REFRESHES.inc(refresh_mode(background), "failure")
+            raise Exception("Error authenticating with Serasa mock service")
+
+        self.token, self.expires_at = parse_login_response(resp.json())
+        self.login_count += 1
+        TOKEN_REFRESHES.inc(refresh_mode(background), "success")
+        if background:
+            self.refresh_count += 1
+
+        logger.info(
+            {
+                "event": "auth_success",
+                "token_set": True,
+                "expires_at": self.expires_at,
+                "background": background,
+                "latency": self.last_auth_latency,
+            }
+        )
+
+        self.__ensure_refresher()
+        return self.token
+
+    def __ensure_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self.__refresh_loop, name="serasa-token-refresh", daemon=True)
+            self._refresher.start()
+
+    def __next_refresh_delay(self) -> float:
+        lifetime = self.expires_at - time.time()
+        return max(0.0, lifetime - min(self.refresh_margin, lifetime / 2))
+
+    def __refresh_loop(self):
+        """
+        Renews the token ahead of its expiration until `close` is called.
+        Failed refreshes are retried with exponential backoff while the current token is still valid.
+        """
+        backoff = 1.0
+        delay = self.__next_refresh_delay()
+        while not self._stop.wait(delay):
+            try:
+                with self._lock:
+                    # a foreground login may have renewed it while we slept
+                    if self.__next_refresh_delay() > 0:
+                        delay = self.__next_refresh_delay()
+                        continue
+                    self.__login(background=True)
+                backoff = 1.0
+                delay = self.__next_refresh_delay()
+            except Exception as e:
+                logger.warning({"event": "token_refresh_failed", "error": str(e)})
+                delay = min(backoff, max(1.0, self.expires_at - time.time()))
+                backoff = min(backoff * 2, 30.0)
+
+    def stats(self) -> dict:
+        """
+        Returns the authentication counters.
+        :return: a dictionary with login, refresh and failure counts and auth latency in seconds
+        """
+        return {
+            "logins": self.login_count,
+            "refreshes": self.refresh_count,
+            "failures": self.failure_count,
+            "last_latency": self.last_auth_latency,
+            "avg_latency": self.total_auth_latency / max(1, self.login_count + self.failure_count),
+            "expires_in": max(0.0, self.expires_at - time.time()),
+        }
+
+    def close(self):
+        """
+        Stops the background refresh thread.
+        """
+        self._stop.set()
+
+
+class AsyncTokenManager:
+    """
+    asyncio counterpart of TokenManager for the async Serasa service.
+    Logins are serialized by an asyncio.Lock and a background task renews the token
+    `refresh_margin` seconds before it expires.
+
+    Attributes:
+        login_url (str): The URL of the login endpoint.
+        token (str): The current access token, or None before the first login.
+        expires_at (float): Epoch time after which the current token must not be used.
+        refresh_margin (float): Seconds before `expires_at` at which the background refresh runs.
+    """
+
+    def __init__(self, client, login_url: str, auth_header: dict, refresh_margin: Optional[float] = None):
+        self.client = client
+        self.login_url = login_url
+        self.auth_header = auth_header
+        self.refresh_margin = (
+            float(os.getenv("SERASA_TOKEN_REFRESH_MARGIN", 15)) if refresh_margin is None else refresh_margin
+        )
+        self.token = None
+        self.expires_at = 0
+
+        self._lock = None
+        self._refresher = None
+
+        self.login_count = 0
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.last_auth_latency = 0.0
+        self.total_auth_latency = 0.0
+
+    def __is_valid(self) -> bool:
+        return self.token is not None and self.expires_at > time.time()
+
+    async def get_token(self, force: bool = False, stale_token: Optional[str] = None) -> str:
+        """
+        Returns a valid access token, authenticating when there is none or it has expired.
+        :param force: a boolean indicating whether to force re-authentication
+        :param stale_token: the token rejected by the upstream, if any
+        :return: a string representing the access token
+        """
+        if not force and self.__is_valid():
+            return self.token
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.__is_valid() and (not force or (stale_token is not None and self.token != stale_token)):
+                return self.token
+            return await self.__login()
+
+    async def __login(self, background: bool = False) -> str:
+        start = time.perf_counter()
+        try:
+            resp = await self.client.post(self.login_url, headers=self.auth_header)
+        except Exception:
+            self.failure_count += 1
+            TOKEN_REFRESHES.inc(refresh_mode(background), "failure")
+            raise
+        finally:
+            self.last_auth_latency = time.perf_counter() - start
+            self.total_auth_latency += self.last_auth_latency
+
+        if resp.status_code != 200:
+            self.failure_count += 1
+            TOKEN_REFRESHES.inc(refresh_mode(background), "failure")
+            raise Exception("Error authenticating with Serasa mock service")
+
+        self.token, self.expires_at = parse_login_response(resp.json())
+        self.login_count += 1
+        TOKEN_REFRESHES.inc(refresh_mode(background), "success")
+        if background:
+            self.refresh_count += 1
+
+        logger.info({"event": "auth_success", "token_set": True, "expires_at": self.expires_at, "background": background})
+
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(self.__refresh_loop())
+        return self.token
+
+    def __next_refresh_delay(self) -> float:
+        lifetime = self.expires_at - time.time()
+        return max(0.0, lifetime - min(self.refresh_margin, lifetime / 2))
+
+    async def __refresh_loop(self):
+        backoff = 1.0
+        while True:
+            await asyncio.sleep(self.__next_refresh_delay())
+            try:
+                async with self._lock:
+                    if self.__next_refresh_delay() > 0:
+                        continue
+                    await self.__login(background=True)
+                backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning({"event": "token_refresh_failed", "error": str(e)})
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def stats(self) -> dict:
+        """
+        Returns the authentication counters.
+        :return: a dictionary with login, refresh and failure counts and auth latency in seconds
+        """
+        return {
+            "logins": self.login_count,
+            "refreshes": self.refresh_count,
+            "failures": self.failure_count,
+            "last_latency": self.last_auth_latency,
+            "avg_latency": self.total_auth_latency / max(1, self.login_count + self.failure_count),
+            "expires_in": max(0.0, self.expires_at - time.time()),
+        }
+
+    async def close(self):
+        """
+        Cancels the background refresh task.
+        """
+        if self._refresher is not None:
+            self._refresher.cancel()
@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+class UpstreamOverloaded(Exception):
+    """
+    Raised when a call to the upstream is shed because the queue is full or the wait would be too long.
+    """
+
+
+@dataclass(frozen=True)
+class UpstreamLimits:
+    """
+    Configuration of the outbound limiter.
+
+    Attributes:
+        rate (float): Calls per second allowed by the provider quota; 0 disables pacing.
+        burst (int): Calls that may be sent back to back before pacing applies.
+        initial_concurrency (int): Concurrent calls allowed at start.
+        min_concurrency (int): Lower bound of the adaptive concurrency limit.
+        max_concurrency (int): Upper bound of the adaptive concurrency limit.
+        queue_size (int): Maximum number of callers waiting for a slot; further callers are shed.
+        queue_timeout (float): Seconds a caller may wait for a slot before being shed.
+        latency_threshold (float): Seconds above which a successful call counts as a latency spike.
+        backoff (float): Factor applied to the concurrency limit on 429, 5xx, errors or latency spikes.
+        cooldown (float): Minimum seconds between two decreases, so one burst of failures halves the limit once.
+    """
+
+    rate: float = 0.0
+    burst: int = 1
+    initial_concurrency: int = 10
+    min_concurrency: int = 1
+    max_concurrency: int = 20
+    queue_size: int = 100
+    queue_timeout: float = 5.0
+    latency_threshold: float = 2.0
+    backoff: float = 0.5
+    cooldown: float = 1.0
+
+    @classmethod
+    def from_env(cls, max_concurrency: int) -> "UpstreamLimits":
+        """
+        Builds the limiter configuration from environment variables.
+        :param max_concurrency: an integer with the upper bound of concurrent calls, usually the connection cap
+        :return: an UpstreamLimits instance
+        """
+        rate = float(os.getenv("SERASA_UPSTREAM_RATE", cls.rate))
+        return cls(
+            rate=rate,
+            burst=int(os.getenv("SERASA_UPSTREAM_BURST", max(1, int(rate)))),
+            initial_concurrency=min(max_concurrency, int(os.getenv("SERASA_UPSTREAM_CONCURRENCY", cls.initial_concurrency))),
+            min_concurrency=int(os.getenv("SERASA_UPSTREAM_MIN_CONCURRENCY", cls.min_concurrency)),
+            max_concurrency=max_concurrency,
+            queue_size=int(os.getenv("SERASA_UPSTREAM_QUEUE_SIZE", cls.queue_size)),
+            queue_timeout=float(os.getenv("SERASA_UPSTREAM_QUEUE_TIMEOUT", cls.queue_timeout)),
+            latency_threshold=float(os.getenv("SERASA_UPSTREAM_LATENCY_THRESHOLD", cls.latency_threshold)),
+        )
+
+
+class UpstreamLimiter:
+    """
+    Outbound limiter for calls to the Serasa provider.
+    It paces calls to the provider quota with a token bucket and bounds concurrent calls with an AIMD
+    limit: every healthy call raises the limit by 1/limit (about one slot per round of calls), while a
+    429, 5xx, transport error or latency spike multiplies it by `backoff`. A 429 also pauses new calls
+    for the Retry-After period. Callers over the limit wait in a bounded queue, and are shed with
+    UpstreamOverloaded when it is full or their wait exceeds `queue_timeout`.
+
+    Attributes:
+        limits (UpstreamLimits): The limiter configuration.
+        limit (float): The current concurrency limit.
+        in_flight (int): Calls currently running.
+        queued (int): Callers waiting for a slot.
+        shed (int): Callers rejected without calling the upstream.
+        throttled (int): Calls answered with 429 by the upstream.
+        decreases (int): Times the concurrency limit was cut.
+
+    Methods:
+        acquire():
+            Waits for a slot, raising UpstreamOverloaded when the call is shed.
+        release(status_code: Optional[int], latency: float, retry_after: Optional[float]):
+            Frees the slot and adapts the limit to the outcome of the call.
+        stats() -> dict:
+            Returns the limiter state exposed by the metrics endpoint.
+    """
+
+    def __init__(self, limits: UpstreamLimits):
+        self.limits = limits
+        self.limit = float(limits.initial_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = 0
+        self.throttled = 0
+        self.decreases = 0
+        self._tokens = float(limits.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._cond = threading.Condition()
+
+    def __admission_delay(self, now: float) -> Optional[float]:
+        """
+        Computes how long a caller must wait before it can be admitted. Must be called with the lock held.
+        :param now: the current monotonic time
+        :return: 0 when a call can start now, the seconds until it may start, or None to wait for a release
+        """
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.limits.rate > 0:
+            self._tokens = min(self.limits.burst, self._tokens + (now - self._refilled_at) * self.limits.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.limits.rate
+        return 0
+
+    def acquire(self):
+        """
+        Waits for a slot to call the upstream.
+        :raises UpstreamOverloaded: when the queue is full or no slot frees up within `queue_timeout`
+        """
+        with self._cond:
+            now = time.monotonic()
+            delay = self.__admission_delay(now)
+            if delay != 0 and self.queued >= self.limits.queue_size:
+                self.shed += 1
+                raise UpstreamOverloaded("Upstream queue is full")
+
+            deadline = now + self.limits.queue_timeout
+            self.queued += 1
+            try:
+                while delay != 0:
+                    remaining = deadline - now
+                    if remaining <= 0 or (delay is not None and delay > remaining):
+                        self.shed += 1
+                        raise UpstreamOverloaded("Timed out waiting for an upstream slot")
+                    self._cond.wait(remaining if delay is None else delay)
+                    now = time.monotonic()
+                    delay = self.__admission_delay(now)
+            finally:
+                self.queued -= 1
+
+            self.in_flight += 1
+            if self.limits.rate > 0:
+                self._tokens -= 1
+
+    def release(self, status_code: Optional[int], latency: float, retry_after: Optional[float] = None):
+        """
+        Frees a slot and adapts the concurrency limit to the outcome of the call.
+        :param status_code: the upstream status code, or None when the call failed without a response
+        :param latency: a float with the call duration in seconds
+        :param retry_after: seconds the upstream asked us to wait, from a 429 response
+        """
+        with self._cond:
+            now = time.monotonic()
+            self.in_flight -= 1
+
+            if status_code == 429:
+                self.throttled += 1
+                self._paused_until = max(self._paused_until, now + (retry_after or self.limits.cooldown))
+
+            if status_code is None or status_code == 429 or status_code >= 500 or latency > self.limits.latency_threshold:
+                if now - self._decreased_at >= self.limits.cooldown:
+                    self.limit = max(self.limits.min_concurrency, self.limit * self.limits.backoff)
+                    self._decreased_at = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.limits.max_concurrency, self.limit + 1 / self.limit)
+
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Returns the limiter state.
+        :return: a dictionary with the current window, queue depth and counters
+        """
+        with self._cond:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "shed": self.shed,
+                "throttled": self.throttled,
+                "decreases": self.decreases,
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 3),
+            }
+
+
+def parse_retry_after(resp) -> Optional[float]:
+    """
+    Reads the wait requested by a 429 response, from the Retry-After header or a `retryAfter` body field.
+    :param resp: a response object with `headers` and `json()`
+    :return: the number of seconds to wait, or None when the response does not say
+    """
+    value = resp.headers.get("Retry-After")
+    if value is None:
+        try:
+            body = resp.json()
+        except ValueError:
+            return None
+        value = body.get("retryAfter") if isinstance(body, dict) else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
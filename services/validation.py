@@ -1,9 +1,84 @@
 import re
+from dataclasses import dataclass
+from typing import NamedTuple, Optional
 
-from utils.logger import logger
+from utils.logger import log_enabled, logger
+
+CPF = "CPF"
+CNPJ = "CNPJ"
+
+# Report namespace used in cache keys, so a CPF and a CNPJ with the same digits never collide
+REPORT_TYPES = {CPF: "pf", CNPJ: "pj"}
+
+
+@dataclass(frozen=True)
+class Document:
+    """
+    Canonical representation of a validated CPF or CNPJ.
+    Produced once at the validation boundary so the cache, the upstream request and the logs all
+    refer to the same normalized value regardless of how the caller formatted the input.
+
+    Attributes:
+        type (str): The document type, either "CPF" or "CNPJ".
+        digits (str): The document number with every non-digit character removed.
+    """
+
+    type: str
+    digits: str
+
+    @property
+    def report_type(self) -> str:
+        """
+        Report namespace of the document: "pf" for CPF and "pj" for CNPJ.
+        """
+        return REPORT_TYPES[self.type]
+
+    @property
+    def key(self) -> str:
+        """
+        Cache key namespaced by report type, e.g. "pf:12345678909".
+        """
+        return f"{self.report_type}:{self.digits}"
+
+
+# Separators stripped by the fast path; any other non-digit character falls back to the regular expression
+SEPARATORS = b".-/ "
+NON_DIGITS = re.compile(r"\D")
+
+# (first, second) check digit weights of each position, so one pass computes both sums
+CPF_WEIGHTS = tuple(zip(range(10, 1, -1), range(11, 2, -1)))
+CNPJ_WEIGHTS = tuple(zip((5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2), (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3)))
+
+
+class Validation(NamedTuple):
+    """
+    Outcome of validating a CPF or CNPJ, carrying the normalized digits so callers never normalize twice.
+
+    Attributes:
+        type (Optional[str]): The document type, "CPF" or "CNPJ", or None when it could not be inferred.
+        digits (str): The input with every non-digit character removed, or "" when the input is too short
+            to hold a document and was not normalized.
+        valid (bool): Whether the document is valid.
+
+    Methods:
+        document() -> Optional[Document]:
+            The canonical Document when valid, otherwise None.
+    """
+
+    type: Optional[str]
+    digits: str
+    valid: bool
+
+    def document(self) -> Optional[Document]:
+        """
+        The canonical Document when valid, otherwise None.
+        """
+        return Document(self.type, self.digits) if self.valid else None
 
 
 def log_validation(doc_type: str, value: str, valid: bool):
+    if not log_enabled("validate_document"):
+        return
     masked = "****" + value[-4:] if len(value) > 4 else value
     logger.info({"event": "validate_document", "type": doc_type, "input": masked, "valid": valid})
 
@@ -14,33 +89,97 @@ def only_digits(value: str) -> str:
     :param value: a string that may contain digits and non-digit characters
     :return: a string containing only digits
     """
-    return re.sub(r"\D", "", value)
+    if value.isascii():
+        if value.isdigit():
+            return value
+        digits = value.encode().translate(None, SEPARATORS)
+        if digits.isdigit():
+            return digits.decode()
+    digits = NON_DIGITS.sub("", value)
+    # other scripts' decimal digits are matched by \d; they are normalized to ASCII
+    return digits if digits.isascii() else "".join(str(int(char)) for char in digits)
+
+
+def check_sums(digits: bytes, weights: tuple) -> tuple[int, int]:
+    """
+    Computes the weighted sums of the first and second check digits in one pass.
+    :param digits: the ASCII digits of the document
+    :param weights: the (first, second) weights of each position before the first check digit
+    :return: a tuple (first sum, second sum)
+    """
+    first = second = 0
+    for code, (weight_first, weight_second) in zip(digits, weights):
+        value = code - 48
+        first += value * weight_first
+        second += value * weight_second
+    # the first check digit itself weighs 2 in the second sum
+    return first, second + (digits[len(weights)] - 48) * 2
 
 
-def validate_cpf(cpf: str) -> bool:
+def check_cpf(cpf: str) -> Validation:
     """
-    Validate Brazilian CPF number.
+    Validate Brazilian CPF number, keeping its normalized digits.
     :param cpf: a string representing the CPF number, which may contain non-digit characters
-    :return: a boolean indicating whether the CPF is valid
+    :return: a Validation of type "CPF"
     """
-    cpf = only_digits(cpf)
+    if len(cpf) < 11:
+        return Validation(CPF, "", False)
+    digits = only_digits(cpf)
+    if len(digits) != 11:
+        return Validation(CPF, digits, False)
 
-    if len(cpf) != 11 or cpf == cpf[0] * 11:
-        return False
+    raw = digits.encode()
+    first, second = check_sums(raw, CPF_WEIGHTS)
+    is_valid = raw.count(raw[:1]) != 11 and first * 10 % 11 % 10 == raw[9] - 48 and second * 10 % 11 % 10 == raw[10] - 48
+    log_validation(CPF, digits, is_valid)
+    return Validation(CPF, digits, is_valid)
 
-    # First check digit
-    sum1 = sum(int(cpf[i]) * (10 - i) for i in range(9))
-    check1 = (sum1 * 10 % 11) % 10
 
-    # Second check digit
-    sum2 = sum(int(cpf[i]) * (11 - i) for i in range(10))
-    check2 = (sum2 * 10 % 11) % 10
-
-    is_valid = check1 == int(cpf[9]) and check2 == int(cpf[10])
+def check_cnpj(cnpj: str) -> Validation:
+    """
+    Validate Brazilian CNPJ number, keeping its normalized digits.
+    :param cnpj: a string representing the CNPJ number, which may contain non-digit characters
+    :return: a Validation of type "CNPJ"
+    """
+    if len(cnpj) < 14:
+        return Validation(CNPJ, "", False)
+    digits = only_digits(cnpj)
+    if len(digits) != 14:
+        return Validation(CNPJ, digits, False)
+
+    raw = digits.encode()
+    first, second = check_sums(raw, CNPJ_WEIGHTS)
+    first, second = first % 11, second % 11
+    is_valid = (
+        raw.count(raw[:1]) != 14
+        and (0 if first < 2 else 11 - first) == raw[12] - 48
+        and (0 if second < 2 else 11 - second) == raw[13] - 48
+    )
+    log_validation(CNPJ, digits, is_valid)
+    return Validation(CNPJ, digits, is_valid)
+
+
+def check_document(value: str) -> Validation:
+    """
+    Validate a CPF or CNPJ, inferring the type from the number of digits.
+    :param value: a string representing a CPF or CNPJ, which may contain non-digit characters
+    :return: a Validation, of type None when the input has neither 11 nor 14 digits
+    """
+    digits = only_digits(value)
+    if len(digits) == 11:
+        return check_cpf(digits)
+    if len(digits) == 14:
+        return check_cnpj(digits)
+    return Validation(None, digits, False)
 
-    log_validation("CPF", cpf, is_valid)
 
-    return is_valid
+def validate_cpf(cpf: str) -> bool:
+    """
+    Validate Brazilian CPF number.
+    :param cpf: a string representing the CPF number, which may contain non-digit characters
+    :return: a boolean indicating whether the CPF is valid
+    """
+    return check_cpf(cpf).valid
 
 
 def validate_cnpj(cnpj: str) -> bool:
@@ -49,25 +188,31 @@ def validate_cnpj(cnpj: str) -> bool:
     :param cnpj: a string representing the CNPJ number, which may contain non-digit characters
     :return: a boolean indicating whether the CNPJ is valid
     """
-    cnpj = only_digits(cnpj)
+    return check_cnpj(cnpj).valid
 
-    if len(cnpj) != 14 or cnpj == cnpj[0] * 14:
-        return False
 
-    weights_first = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
-    weights_second = [6] + weights_first
+def parse_cpf(cpf: str) -> Optional[Document]:
+    """
+    Validate a CPF and return its canonical form.
+    :param cpf: a string representing the CPF number, which may contain non-digit characters
+    :return: a Document if the CPF is valid, otherwise None
+    """
+    return check_cpf(cpf).document()
 
-    # First check digit
-    sum1 = sum(int(cnpj[i]) * weights_first[i] for i in range(12))
-    check1 = 11 - (sum1 % 11)
-    check1 = 0 if check1 >= 10 else check1
 
-    # Second check digit
-    sum2 = sum(int(cnpj[i]) * weights_second[i] for i in range(13))
-    check2 = 11 - (sum2 % 11)
-    check2 = 0 if check2 >= 10 else check2
+def parse_cnpj(cnpj: str) -> Optional[Document]:
+    """
+    Validate a CNPJ and return its canonical form.
+    :param cnpj: a string representing the CNPJ number, which may contain non-digit characters
+    :return: a Document if the CNPJ is valid, otherwise None
+    """
+    return check_cnpj(cnpj).document()
 
-    is_valid = check1 == int(cnpj[12]) and check2 == int(cnpj[13])
-    log_validation("CNPJ", cnpj, is_valid)
 
-    return is_valid
+def document_type(value: str) -> Optional[str]:
+    """
+    Infer the document type from the number of digits in the input.
+    :param value: a string representing a CPF or CNPJ, which may contain non-digit characters
+    :return: "CPF" for 11 digits, "CNPJ" for 14 digits, otherwise None
+    """
+    return {11: CPF, 14: CNPJ}.get(len(only_digits(value)))
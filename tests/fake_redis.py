@@ -0,0 +1,149 @@
+import socketserver
+import threading
+import time
+
+from utils.resp import RespError, read_reply
+
+
+class FakeRedisServer:
+    """
+    In-process Redis-protocol server used by the tests and benchmarks.
+    It implements the subset of commands used by the service (strings, counters and expirations)
+    on top of a dictionary guarded by a lock.
+
+    Attributes:
+        url (str): The redis:// URL the server is listening on, available after `start`.
+        commands (int): Number of commands processed, useful to assert round trips.
+        errors (dict): Error replies forced by the tests, by command name, e.g. {"PTTL": "ERR failure"}.
+    """
+
+    def __init__(self):
+        self.url = None
+        self.commands = 0
+        self.errors = {}
+        self._data = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self) -> "FakeRedisServer":
+        """
+        Starts the server on an ephemeral port in a background thread.
+        :return: the started server
+        """
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def handle(self):
+                while True:
+                    try:
+                        args = read_reply(self.rfile)
+                    except (ConnectionError, ValueError, OSError):
+                        return
+                    self.wfile.write(encode_reply(fake.dispatch(args)))
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"redis://127.0.0.1:{self._server.server_address[1]}/0"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes its listening socket.
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __live(self, key: bytes):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    def dispatch(self, args: list):
+        """
+        Executes one command against the in-memory store.
+        :param args: the command name followed by its arguments, as bytes
+        :return: the reply value
+        """
+        name, args = args[0].decode().upper(), args[1:]
+        with self._lock:
+            self.commands += 1
+            now = time.time()
+            if name in self.errors:
+                return RespError(self.errors[name])
+            if name == "PING":
+                return "PONG"
+            if name in ("SELECT", "FLUSHDB"):
+                if name == "FLUSHDB":
+                    self._data.clear()
+                return "OK"
+            if name == "GET":
+                entry = self.__live(args[0])
+                return entry[0] if entry else None
+            if name == "SET":
+                key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+                expires_at = None
+                if "EX" in options:
+                    expires_at = now + int(options[options.index("EX") + 1])
+                if "PX" in options:
+                    expires_at = now + int(options[options.index("PX") + 1]) / 1000
+                exists = self.__live(key) is not None
+                if ("NX" in options and exists) or ("XX" in options and not exists):
+                    return None
+                self._data[key] = (value, expires_at)
+                return "OK"
+            if name == "DEL":
+                return sum(1 for key in args if self.__live(key) is not None and self._data.pop(key))
+            if name == "EXISTS":
+                return sum(1 for key in args if self.__live(key) is not None)
+            if name in ("PTTL", "TTL"):
+                entry = self.__live(args[0])
+                if entry is None:
+                    return -2
+                if entry[1] is None:
+                    return -1
+                remaining = entry[1] - now
+                return int(remaining * 1000) if name == "PTTL" else int(remaining)
+            if name in ("PEXPIRE", "EXPIRE"):
+                entry = self.__live(args[0])
+                if entry is None:
+                    return 0
+                seconds = int(args[1]) / 1000 if name == "PEXPIRE" else int(args[1])
+                self._data[args[0]] = (entry[0], now + seconds)
+                return 1
+            if name in ("INCR", "INCRBY", "DECRBY"):
+                entry = self.__live(args[0])
+                amount = int(args[1]) if len(args) > 1 else 1
+                amount = -amount if name == "DECRBY" else amount
+                value = int(entry[0]) + amount if entry else amount
+                self._data[args[0]] = (str(value).encode(), entry[1] if entry else None)
+                return value
+            if name == "DBSIZE":
+                return sum(1 for key in list(self._data) if self.__live(key) is not None)
+            return RespError(f"ERR unknown command '{name}'")
+
+
+def encode_reply(value) -> bytes:
+    """
+    Encodes a reply value in RESP2.
+    :param value: None, str (simple string), bytes (bulk string), int, list or RespError
+    :return: the encoded reply
+    """
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RespError):
+        return b"-%s\r\n" % str(value).encode()
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
@@ -0,0 +1,338 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+from services.async_serasa_service import AsyncSerasaService
+from tests.fake_redis import FakeRedisServer
+from utils.metrics import REGISTRY
+from utils.rate_limiter import DistributedRateLimiter, RateLimiter
+from utils.resp import RespClient
+from utils.tracing import Tracer
+
+
+@pytest.fixture
+def client():
+    """
+    Fixture to create a test client for the ASGI application.
+    :return: a test client instance
+    """
+    asgi.rate_limiter.clear()
+    asgi.batch_limiter.clear()
+    return TestClient(asgi.app)
+
+
+@pytest.fixture
+def mock_serasa_service(monkeypatch):
+    """
+    Fixture to mock the async Serasa service for testing purposes.
+    :param monkeypatch: a pytest fixture for monkeypatching
+    :return: a mock async Serasa service
+    """
+
+    class MockAsyncSerasaService:
+        """
+        Mock implementation of the async Serasa service for testing.
+        """
+
+        batch_max_size = 5000
+
+        @staticmethod
+        async def consult_cpf(cpf):
+            """
+            Mock implementation of the consult_cpf coroutine.
+            :param cpf: a string representing the CPF to be consulted
+            :return: a tuple containing a mock response and status code
+            """
+            if cpf == "00000000000":
+                return {"error": "Invalid CPF."}, 400
+            if cpf == "40440440400":
+                return {"error": "Document not found"}, 404
+            if cpf == "52998224725":
+                return {"success": True, "data": {"cpf": cpf}, "cached": True, "cache_tier": "l1"}, 200
+            return {"success": True, "data": {"cpf": cpf}, "cached": False}, 200
+
+        @staticmethod
+        async def consult_cnpj(cnpj):
+            """
+            Mock implementation of the consult_cnpj coroutine.
+            :param cnpj: a string representing the CNPJ to be consulted
+            :return: a tuple containing a mock response and status code
+            """
+            if cnpj == "00000000000000":
+                return {"error": "Invalid CNPJ."}, 400
+            return {"success": True, "data": {"cnpj": cnpj}, "cached": False}, 200
+
+        @staticmethod
+        async def stream_batch(documents, ordered=True):
+            """
+            Mock implementation of the stream_batch coroutine.
+            :param documents: a list of documents to be consulted
+            :param ordered: a boolean, False to return the results in reverse order
+            :return: a tuple containing an async iterator of mock results and status code
+            """
+            if not isinstance(documents, list):
+                return {"error": "Field 'documents' must be a list of strings."}, 400
+
+            async def results():
+                for doc in documents if ordered else reversed(documents):
+                    yield {"document": doc, "status": 200, "success": True}
+
+            return results(), 200
+
+        @staticmethod
+        def stats():
+            """
+            Mock implementation of the stats method.
+            :return: a dictionary with mock counters
+            """
+            return {"singleflight": {"leader": 0, "coalesced": 0, "in_flight": 0}}
+
+    monkeypatch.setattr("asgi.serasa_service", MockAsyncSerasaService())
+
+
+def test_health_endpoint(client):
+    """
+    Test the health check endpoint.
+    :param client: a test client instance
+    :return: assertions to verify the health endpoint response
+    """
+    resp = client.get("/api/v1/health")
+    assert resp.status_code == 200
+    assert resp.json() == {"status": "ok"}
+
+
+def test_metrics_endpoint(client, mock_serasa_service):
+    """
+    Test the metrics endpoint.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :return: assertions to verify the metrics endpoint response
+    """
+    REGISTRY.register_collector("serasa", asgi.service_samples)
+    client.get("/api/v1/health")
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{route="/api/v1/health",method="GET",status="200"}' in resp.text
+    assert "serasa_singleflight_leader 0" in resp.text
+    assert "serasa_uptime_seconds " in resp.text
+
+
+def test_consult_cpf_success(client, mock_serasa_service):
+    """
+    Test the CPF consultation endpoint, including the rate limit and cache headers.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :return: assertions to verify the CPF consultation response
+    """
+    resp = client.get("/api/v1/consulta/cpf/12345678909", headers={"X-Correlation-ID": "abc"})
+    assert resp.status_code == 200
+    assert resp.json()["data"]["cpf"] == "12345678909"
+    assert resp.headers["X-Cache-Hit"] == "false"
+    assert resp.headers["X-RateLimit-Limit"] == "10"
+    assert resp.headers["X-RateLimit-Remaining"] == "9"
+
+
+@pytest.mark.parametrize(
+    "path, status",
+    [
+        ("/api/v1/consulta/cpf/00000000000", 400),
+        ("/api/v1/consulta/cpf/40440440400", 404),
+        ("/api/v1/consulta/cnpj/00000000000000", 400),
+        ("/api/v1/consulta/cnpj/12345678000195", 200),
+    ],
+)
+def test_consult_statuses(client, mock_serasa_service, path, status):
+    """
+    Test that statuses from the service are passed through.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :param path: the requested path
+    :param status: the expected status code
+    :return: assertion on the status code
+    """
+    assert client.get(path).status_code == status
+
+
+def test_consult_cpf_cache_tier_header(client, mock_serasa_service):
+    """
+    Test that X-Cache-Hit reports the cache tier, as in the Flask app.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :return: assertion on the cache header
+    """
+    assert client.get("/api/v1/consulta/cpf/52998224725").headers["X-Cache-Hit"] == "l1"
+
+
+def test_server_timing_header(client, mock_serasa_service):
+    """
+    Test that the middleware returns the Server-Timing header when tracing is enabled, and not otherwise.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :return: assertions on the response headers
+    """
+    assert "Server-Timing" not in client.get("/api/v1/consulta/cpf/12345678909").headers
+    with patch("utils.tracing.tracer", Tracer(enabled=True)):
+        resp = client.get("/api/v1/consulta/cpf/12345678909")
+    assert resp.status_code == 200
+    assert resp.headers["Server-Timing"].startswith("total;dur=")
+
+
+def test_consult_batch(client, mock_serasa_service):
+    """
+    Test the batch endpoint with valid and malformed bodies, as JSON and NDJSON.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :return: assertions to verify the batch responses
+    """
+    resp = client.post("/api/v1/consulta/batch", json={"documents": ["12345678909"]})
+    assert resp.status_code == 200
+    assert resp.json()["total"] == 1
+    assert client.post("/api/v1/consulta/batch", content=b"not json").status_code == 400
+
+    resp = client.post("/api/v1/consulta/batch?format=ndjson", json={"documents": ["12345678909", "52998224725"]})
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["document"] for line in resp.text.splitlines()] == ["12345678909", "52998224725"]
+
+
+def test_rate_limit(client, mock_serasa_service):
+    """
+    Test that the shared rate limiter rejects requests over the limit.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :return: assertions on the rejected request
+    """
+    for _ in range(asgi.rate_limiter.limit):
+        client.get("/api/v1/consulta/cpf/12345678909")
+    resp = client.get("/api/v1/consulta/cpf/12345678909")
+    assert resp.status_code == 429
+    assert resp.headers["X-RateLimit-Remaining"] == "0"
+
+
+def test_consult_batch_document_quota(client, mock_serasa_service, monkeypatch):
+    """
+    Test that each document of a batch counts against the batch quota, like in the Flask app.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :param monkeypatch: a pytest fixture for monkeypatching
+    :return: assertions to verify the rejected batch
+    """
+    monkeypatch.setattr(asgi, "batch_limiter", RateLimiter(limit=3, period=60))
+    documents = ["12345678909", "12345678000195"]
+    assert client.post("/api/v1/consulta/batch", json={"documents": documents}).status_code == 200
+
+    resp = client.post("/api/v1/consulta/batch", json={"documents": documents})
+    assert resp.status_code == 429
+    assert resp.json() == {"error": "Too many documents"}
+    assert int(resp.headers["Retry-After"]) > 0
+
+
+def test_distributed_rate_limit_runs_off_the_event_loop(client, mock_serasa_service, monkeypatch):
+    """
+    Test that a distributed rate limiter, which calls its store over a socket, is checked in a worker thread
+    rather than on the event loop.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock async Serasa service
+    :param monkeypatch: a pytest fixture for monkeypatching
+    :return: assertions on the limited requests and where they were checked
+    """
+
+    def on_event_loop() -> bool:
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    server = FakeRedisServer().start()
+    try:
+        limiter = DistributedRateLimiter(RespClient.from_url(server.url), limit=3, period=60, batch=1)
+        checks = []
+        check = limiter.check
+        monkeypatch.setattr(limiter, "check", lambda ip, cost=1: checks.append(on_event_loop()) or check(ip, cost))
+        monkeypatch.setattr(asgi, "rate_limiter", limiter)
+
+        statuses = [client.get("/api/v1/consulta/cpf/12345678909").status_code for _ in range(4)]
+        assert statuses == [200, 200, 200, 429]
+        assert checks == [False] * 4
+    finally:
+        server.stop()
+
+
+def test_upstream_transport_error_is_a_503(monkeypatch):
+    """
+    Test that a transport error reaching the upstream is answered like the Flask app, with a 503
+    instead of an unhandled exception.
+    :param monkeypatch: a pytest fixture for monkeypatching
+    :return: assertions on the consultation and batch responses
+    """
+    monkeypatch.setenv("MOCK_URL", "http://mock-serasa")
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/login"):
+            return httpx.Response(200, json={"accessToken": "t1", "expiresIn": 3600})
+        raise httpx.ConnectError("Connection refused", request=request)
+
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        httpx, "AsyncClient", lambda **kwargs: async_client(transport=httpx.MockTransport(handler), **kwargs)
+    )
+    monkeypatch.setattr(asgi, "serasa_service", AsyncSerasaService())
+    asgi.rate_limiter.clear()
+    with TestClient(asgi.app) as client:
+        resp = client.get("/api/v1/consulta/cpf/12345678909")
+        batch = client.post("/api/v1/consulta/batch", json={"documents": ["12345678000195"]})
+
+    assert resp.status_code == 503
+    assert resp.json() == {"error": "Error in Serasa service. Please try again later."}
+    assert [item["status"] for item in batch.json()["results"]] == [503]
+
+
+def test_async_service_against_mock_transport(monkeypatch):
+    """
+    Test the async service end to end against an httpx mock transport.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the consultations, streamed batch, cache and coalescing
+    """
+    monkeypatch.setenv("MOCK_URL", "http://mock-serasa")
+    calls = {"login": 0, "report": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/login"):
+            calls["login"] += 1
+            return httpx.Response(200, json={"accessToken": "t1", "expiresIn": 3600})
+        calls["report"] += 1
+        await asyncio.sleep(0.05)
+        if request.headers["X-Document-Id"] == "11222333000181":
+            return httpx.Response(404, json={})
+        return httpx.Response(200, json={"report": request.headers["X-Document-Id"]})
+
+    async def scenario():
+        service = AsyncSerasaService()
+        await service.start()
+        await service.client.aclose()
+        service.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        service.token_manager.client = service.client
+
+        results = await asyncio.gather(*[service.consult_cpf("123.456.789-09") for _ in range(5)])
+        cached, _ = await service.consult_cpf("12345678909")
+        batch, _ = await service.consult_batch(["12345678909", "11.222.333/0001-81", "123"])
+        items, _ = await service.stream_batch(["12345678000195", "123", "12345678909"], ordered=False)
+        streamed = [item["document"] async for item in items]
+        stats = service.stats()
+        await service.close()
+        return results, cached, batch, streamed, stats
+
+    results, cached, batch, streamed, stats = asyncio.run(scenario())
+
+    assert [status for _, status in results] == [200] * 5
+    assert cached["cache_tier"] == "l1"
+    assert [item["status"] for item in batch["results"]] == [200, 404, 400]
+    assert streamed == ["123", "12345678909", "12345678000195"]
+    assert calls == {"login": 1, "report": 3}
+    assert stats["singleflight"]["coalesced"] == 4
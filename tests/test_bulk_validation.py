@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from services.bulk_validation import validate_bulk
+from services.validation import CNPJ, CPF, Document, document_type, only_digits, validate_cnpj, validate_cpf
+
+DOCUMENTS = [
+    "123.456.789-09",
+    "11.222.333/0001-81",
+    "111.111.111-11",
+    "11111111111111",
+    "12345678900",
+    "11222333000180",
+    "abc",
+    "",
+    "1234567890912345",
+    "52998224725",
+]
+
+
+def scalar_valid(value: str) -> bool:
+    """
+    Validates a document with the scalar validators.
+    :param value: a string with a CPF or CNPJ
+    :return: a boolean indicating whether the document is valid
+    """
+    doc_type = document_type(value)
+    return bool(doc_type and (validate_cpf(value) if doc_type == CPF else validate_cnpj(value)))
+
+
+@pytest.mark.parametrize("chunk_size", [3, 1000])
+def test_bulk_matches_scalar_validators(chunk_size):
+    """
+    Test that the bulk validator agrees with the scalar validators on formatted, malformed and random input,
+    whatever the chunk size.
+    :param chunk_size: the number of documents per chunk
+    :return: assertions on the validity mask
+    """
+    rng = np.random.default_rng(7)
+    randoms = ["".join(map(str, rng.integers(0, 10, size))) for size in rng.choice([11, 14], 500)]
+    documents = DOCUMENTS + randoms
+    result = validate_bulk(iter(documents), chunk_size=chunk_size)
+    assert result.valid.tolist() == [scalar_valid(value) for value in documents]
+
+
+def test_bulk_matches_scalar_validators_on_unicode_digits():
+    """
+    Test that the bulk validator normalizes the decimal digits of other scripts like the scalar validators,
+    while other non-ASCII characters are still dropped.
+    :return: assertions on the validity mask and normalized digits
+    """
+    documents = [
+        "１２３.４５６.７８９-０９",
+        "١١٫٢٢٢٫٣٣٣/٠٠٠١-٨١",
+        "529.982.247-2５",
+        "123·456·789·09",
+        "١٢٣٤٥٦٧٨٩٠٠",
+        "52998224725",
+    ]
+    result = validate_bulk(np.array(documents))
+    assert result.valid.tolist() == [scalar_valid(value) for value in documents] == [True] * 4 + [False, True]
+    assert result.digits.tolist() == [only_digits(value) for value in documents]
+
+
+def test_bulk_result_fields():
+    """
+    Test the normalized digits, inferred types, summary and valid documents of a bulk validation.
+    :return: assertions on the result
+    """
+    result = validate_bulk(np.array(DOCUMENTS))
+    assert result.digits[:3].tolist() == ["12345678909", "11222333000181", "11111111111"]
+    assert result.digits[6:9].tolist() == ["", "", ""]
+    assert result.types[:3].tolist() == [CPF, CNPJ, CPF]
+    assert result.summary() == {"total": 10, "valid": 3, "invalid": 7, "cpf": 2, "cnpj": 1}
+    assert result.documents() == [
+        Document(CPF, "12345678909"),
+        Document(CNPJ, "11222333000181"),
+        Document(CPF, "52998224725"),
+    ]
+
+
+def test_bulk_restricted_to_one_type_and_bytes_input():
+    """
+    Test that a document type rejects documents of the other type, and that bytes arrays are accepted.
+    :return: assertions on the validity mask
+    """
+    result = validate_bulk(np.array([b"123.456.789-09", b"11.222.333/0001-81"]), doc_type=CNPJ)
+    assert result.valid.tolist() == [False, True]
+    with pytest.raises(ValueError):
+        validate_bulk([], doc_type="RG")
+    assert len(validate_bulk([])) == 0
+
+
+def test_bulk_logs_only_a_summary():
+    """
+    Test that a bulk validation logs one summary record instead of one record per document.
+    :return: assertions on the logger calls
+    """
+    with patch("services.bulk_validation.logger") as mock_logger, patch("services.validation.logger") as item_logger:
+        validate_bulk(DOCUMENTS)
+    mock_logger.info.assert_called_once_with(
+        {"event": "bulk_validation", "total": 10, "valid": 3, "invalid": 7, "cpf": 2, "cnpj": 1}
+    )
+    item_logger.info.assert_not_called()
@@ -0,0 +1,293 @@
+import time
+
+import pytest
+
+from services.cache import (
+    MemoryCache,
+    RedisCache,
+    SQLiteCache,
+    TieredCache,
+    create_cache,
+    deserialize,
+    estimate_size,
+    serialize,
+)
+from services.disk_cache import DiskCache
+from tests.fake_redis import FakeRedisServer
+
+REPORT = {"reports": [{"reportName": "RELATORIO_BASICO_PF_PME", "score": 750, "name": "José"}]}
+
+
+@pytest.fixture(scope="module")
+def redis_server():
+    """
+    Fixture that runs an in-process Redis-protocol server for the module.
+    :return: a started FakeRedisServer
+    """
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(params=["memory", "sqlite", "disk", "redis"])
+def backend(request, tmp_path, redis_server):
+    """
+    Fixture that yields each cache backend in turn.
+    :param request: the pytest request object carrying the backend name
+    :param tmp_path: a temporary directory for the SQLite database and disk store
+    :param redis_server: the in-process Redis-protocol server
+    :return: a CacheBackend instance
+    """
+    if request.param == "memory":
+        cache = MemoryCache(ttl=60, maxsize=10)
+    elif request.param == "sqlite":
+        cache = SQLiteCache(ttl=60, path=str(tmp_path / "cache.sqlite3"))
+    elif request.param == "disk":
+        cache = DiskCache(ttl=60, path=str(tmp_path / "reports"), index_slots=1024, compact_interval=0)
+    else:
+        cache = RedisCache(ttl=60, url=redis_server.url)
+        cache.clear()
+    yield cache
+    cache.close()
+
+
+def test_serialization_round_trip():
+    """
+    Test that report payloads survive compact serialization.
+    :return: assertions on the decoded payload and its size
+    """
+    data = serialize(REPORT)
+    assert deserialize(data) == REPORT
+    assert isinstance(data, bytes)
+
+
+def test_set_and_get(backend):
+    """
+    Test that stored values are returned with their expiration time.
+    :param backend: a CacheBackend instance
+    :return: assertions on the cached entry and counters
+    """
+    assert backend.get("pf:12345678909") is None
+    backend["pf:12345678909"] = REPORT
+    value, expires_at = backend.get_entry("pf:12345678909")
+    assert value == REPORT
+    assert time.time() + 55 < expires_at <= time.time() + 60.1
+    assert "pf:12345678909" in backend
+    assert backend.stats()["hits"] == 1
+    assert backend.stats()["misses"] == 1
+
+
+def test_entries_expire(backend):
+    """
+    Test that entries are not returned after their time-to-live.
+    :param backend: a CacheBackend instance
+    :return: assertions on the expired entry
+    """
+    backend.set("pf:12345678909", REPORT, ttl=0.05)
+    assert backend.get("pf:12345678909") == REPORT
+    time.sleep(0.1)
+    assert backend.get("pf:12345678909") is None
+    with pytest.raises(KeyError):
+        backend["pf:12345678909"]
+
+
+def test_delete_and_clear(backend):
+    """
+    Test removing one and all entries.
+    :param backend: a CacheBackend instance
+    :return: assertions on the removed entries
+    """
+    backend["pf:1"] = {"a": 1}
+    backend["pj:2"] = {"b": 2}
+    backend.delete("pf:1")
+    assert backend.get("pf:1") is None
+    assert backend.get("pj:2") == {"b": 2}
+    backend.clear()
+    assert backend.get("pj:2") is None
+
+
+def test_memory_cache_counts_evictions():
+    """
+    Test that the in-process backend evicts the least recently used entry when full.
+    :return: assertions on the eviction counter
+    """
+    cache = MemoryCache(ttl=60, maxsize=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache.get("a")
+    cache["c"] = 3
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    """
+    Test that two SQLite backends on the same file (e.g. two workers) see each other's entries.
+    :param tmp_path: a temporary directory for the SQLite database
+    :return: assertion on the shared entry
+    """
+    path = str(tmp_path / "shared.sqlite3")
+    SQLiteCache(ttl=60, path=path)["pf:12345678909"] = REPORT
+    assert SQLiteCache(ttl=60, path=path).get("pf:12345678909") == REPORT
+
+
+def test_redis_cache_degrades_to_miss_when_unavailable():
+    """
+    Test that an unreachable Redis server turns lookups into misses instead of errors.
+    :return: assertions on the miss and error counter
+    """
+    server = FakeRedisServer().start()
+    url = server.url
+    server.stop()
+    cache = RedisCache(ttl=60, url=url)
+    cache["pf:12345678909"] = REPORT
+    assert cache.get("pf:12345678909") is None
+    assert cache.stats()["errors"] == 2
+
+
+def test_redis_cache_degrades_on_error_replies(redis_server):
+    """
+    Test that error replies from the Redis server, including one for the PTTL of a lookup, are counted
+    and turn lookups into misses and writes, deletions and clears into no-ops.
+    :param redis_server: the in-process Redis-protocol server
+    :return: assertions on the misses and error counter
+    """
+    cache = RedisCache(ttl=60, url=redis_server.url)
+    cache["pf:12345678909"] = REPORT
+    redis_server.errors.update({"PTTL": "ERR failure", "SET": "OOM command not allowed", "DEL": "ERR failure"})
+    try:
+        assert cache.get("pf:12345678909") is None
+        cache["pf:52998224725"] = REPORT
+        cache.delete("pf:12345678909")
+        redis_server.errors["FLUSHDB"] = "ERR failure"
+        cache.clear()
+    finally:
+        redis_server.errors.clear()
+    assert cache.stats()["errors"] == 4
+    assert cache.get("pf:12345678909") == REPORT
+    assert cache.get("pf:52998224725") is None
+    cache.close()
+
+
+@pytest.mark.parametrize("name, expected", [("sqlite", SQLiteCache), ("disk", DiskCache), ("redis", RedisCache)])
+def test_create_cache_from_env(monkeypatch, tmp_path, name, expected):
+    """
+    Test that a shared backend selected by SERASA_CACHE_BACKEND sits behind an in-process L1.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :param tmp_path: a temporary directory for the SQLite database and disk store
+    :param name: the backend name
+    :param expected: the expected L2 backend class
+    :return: assertions on the created tiers
+    """
+    monkeypatch.setenv("SERASA_CACHE_BACKEND", name)
+    monkeypatch.setenv("SERASA_CACHE_SQLITE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setenv("SERASA_CACHE_DISK_PATH", str(tmp_path / "reports"))
+    monkeypatch.setenv("SERASA_CACHE_DISK_COMPACT_INTERVAL", "0")
+    cache = create_cache(ttl=60)
+    assert isinstance(cache, TieredCache)
+    assert isinstance(cache.l1, MemoryCache)
+    assert isinstance(cache.l2, expected)
+
+    monkeypatch.setenv("SERASA_CACHE_L1_MAX_BYTES", "0")
+    assert isinstance(create_cache(ttl=60), expected)
+
+
+def test_create_cache_defaults_to_memory(monkeypatch):
+    """
+    Test that the in-process backend is used alone by default.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the created backend
+    """
+    monkeypatch.delenv("SERASA_CACHE_BACKEND", raising=False)
+    cache = create_cache(ttl=60)
+    assert isinstance(cache, MemoryCache)
+    assert cache.max_bytes == 8 * 1024 * 1024
+
+
+def test_create_cache_rejects_unknown_backend(monkeypatch):
+    """
+    Test that an unknown backend name is rejected.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertion on the raised error
+    """
+    monkeypatch.setenv("SERASA_CACHE_BACKEND", "memcached")
+    with pytest.raises(ValueError):
+        create_cache(ttl=60)
+
+
+def test_memory_cache_is_bounded_in_bytes():
+    """
+    Test that the in-process backend evicts entries to stay under its byte budget, and never stores a
+    value larger than the budget.
+    :return: assertions on the byte accounting and evictions
+    """
+    size = estimate_size(REPORT)
+    cache = MemoryCache(ttl=60, maxsize=100, max_bytes=size * 2)
+    for i in range(3):
+        cache[f"pf:{i}"] = REPORT
+    assert cache.keys() == ["pf:1", "pf:2"]
+    assert cache.bytes == size * 2
+    assert cache.stats()["evictions"] == 1
+
+    cache["pf:big"] = {"blob": "x" * size * 3}
+    assert cache.get("pf:big") is None
+
+    # an oversized update drops the previous value of the key instead of keeping it
+    cache["pf:1"] = {"blob": "x" * size * 3}
+    assert cache.get("pf:1") is None
+    assert cache.keys() == ["pf:2"] and cache.bytes == size
+
+
+def test_tiered_cache_promotes_l2_hits(tmp_path):
+    """
+    Test that an L2 hit is promoted to L1 with the same expiration and reported per tier.
+    :param tmp_path: a temporary directory for the SQLite database
+    :return: assertions on the serving tier, promotion and counters
+    """
+    l1 = MemoryCache(ttl=60)
+    l2 = SQLiteCache(ttl=60, path=str(tmp_path / "l2.sqlite3"))
+    cache = TieredCache(l1, l2)
+
+    l2.set("pf:12345678909", REPORT, ttl=30)
+    value, expires_at, tier = cache.lookup("pf:12345678909")
+    assert (value, tier) == (REPORT, "l2")
+
+    value, l1_expires_at, tier = cache.lookup("pf:12345678909")
+    assert tier == "l1"
+    assert l1_expires_at == expires_at
+
+    assert cache.lookup("pf:00000000000") is None
+    stats = cache.stats()
+    assert (stats["l1"]["hits"], stats["l1"]["misses"]) == (1, 2)
+    assert (stats["l2"]["hits"], stats["l2"]["misses"]) == (1, 1)
+
+
+def test_peek_does_not_count_lookups(tmp_path):
+    """
+    Test that peeking at a tiered cache finds values in either tier without counting hits or misses.
+    :param tmp_path: a temporary directory for the SQLite database
+    :return: assertions on the peeked values and counters
+    """
+    cache = TieredCache(MemoryCache(ttl=60), SQLiteCache(ttl=60, path=str(tmp_path / "l2.sqlite3")))
+    cache.l2.set("pf:12345678909", REPORT, ttl=30)
+
+    assert cache.peek("pf:12345678909")[0::2] == (REPORT, "l2")
+    assert cache.peek("pf:00000000000") is None
+    stats = cache.stats()
+    assert (stats["l1"]["hits"], stats["l1"]["misses"]) == (0, 0)
+    assert (stats["l2"]["hits"], stats["l2"]["misses"]) == (0, 0)
+
+
+def test_tiered_cache_writes_both_tiers(tmp_path):
+    """
+    Test that writes reach both tiers so other processes can read them from L2.
+    :param tmp_path: a temporary directory for the SQLite database
+    :return: assertions on both tiers
+    """
+    cache = TieredCache(MemoryCache(ttl=60), SQLiteCache(ttl=60, path=str(tmp_path / "l2.sqlite3")))
+    cache["pj:12345678000195"] = REPORT
+    assert cache.l1.get("pj:12345678000195") == REPORT
+    assert cache.l2.get("pj:12345678000195") == REPORT
+    cache.delete("pj:12345678000195")
+    assert cache.get("pj:12345678000195") is None
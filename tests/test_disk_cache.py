@@ -0,0 +1,192 @@
+import os
+import time
+
+import pytest
+
+from services.disk_cache import INDEX_FILE, INDEX_HEADER, INDEX_MAGIC, REBUILDING, DiskCache
+
+REPORT = {"reports": [{"reportName": "RELATORIO_BASICO_PF_PME", "score": 750, "name": "José"}]}
+
+
+@pytest.fixture
+def open_cache(tmp_path):
+    """
+    Fixture opening disk caches over a temporary directory, closed at teardown.
+    :param tmp_path: a pytest fixture providing a temporary directory
+    :return: a function (**options) -> DiskCache
+    """
+    caches = []
+
+    def build(**options):
+        options = {"index_slots": 1024, "compact_interval": 0, **options}
+        cache = DiskCache(60, str(tmp_path / "reports"), **options)
+        caches.append(cache)
+        return cache
+
+    yield build
+    for cache in caches:
+        cache.close()
+
+
+def segments(cache: DiskCache) -> list:
+    """
+    Lists the segment files of a disk cache.
+    :param cache: a DiskCache
+    :return: a sorted list of segment paths
+    """
+    return sorted(os.path.join(cache.path, name) for name in os.listdir(cache.path) if name.endswith(".seg"))
+
+
+def test_entries_survive_a_restart_and_are_shared(open_cache):
+    """
+    Test that entries written by one instance are read by another on the same directory, both while
+    it runs (another worker) and after it is closed (a restart), with the same expiration time.
+    :param open_cache: the disk cache fixture
+    :return: assertions on the shared entries
+    """
+    first = open_cache()
+    second = open_cache()
+    first["pf:12345678909"] = REPORT
+    first.set("pj:11222333000181", {"not_found": True}, ttl=30)
+    assert second.get("pf:12345678909") == REPORT
+
+    expires_at = first.get_entry("pj:11222333000181")[1]
+    first.close()
+    restarted = open_cache()
+    assert restarted.get("pf:12345678909") == REPORT
+    assert restarted.get_entry("pj:11222333000181") == ({"not_found": True}, expires_at)
+    assert restarted.get("pf:52998224725") is None
+
+
+def test_recovers_from_a_torn_write_and_a_lost_index(open_cache):
+    """
+    Test that a partial record left by a crashed writer is discarded by the next write, and that an
+    index left mid-rebuild is rebuilt from the log without bringing deleted entries back.
+    :param open_cache: the disk cache fixture
+    :return: assertions on the recovered entries
+    """
+    cache = open_cache()
+    cache["pf:1"] = {"n": 1}
+    cache["pf:2"] = {"n": 2}
+    cache.delete("pf:2")
+    [segment] = segments(cache)
+    with open(segment, "ab") as file:
+        file.write(b"\x01\x02\x03 torn record")
+
+    cache["pf:3"] = {"n": 3}
+    cache.close()
+    with open(os.path.join(cache.path, INDEX_FILE), "r+b") as file:
+        magic, slots, _, active, length = INDEX_HEADER.unpack(file.read(INDEX_HEADER.size))
+        file.seek(0)
+        file.write(INDEX_HEADER.pack(magic, slots, REBUILDING, active, length))
+
+    recovered = open_cache()
+    assert [recovered.get(f"pf:{n}") for n in (1, 2, 3)] == [{"n": 1}, None, {"n": 3}]
+    recovered["pf:4"] = {"n": 4}
+    assert recovered.get("pf:4") == {"n": 4}
+
+
+def test_corrupt_records_are_misses(open_cache):
+    """
+    Test that a record whose bytes were damaged on disk is treated as a miss.
+    :param open_cache: the disk cache fixture
+    :return: assertions on the damaged entry
+    """
+    cache = open_cache()
+    cache["pf:12345678909"] = REPORT
+    [segment] = segments(cache)
+    with open(segment, "r+b") as file:
+        file.seek(-1, os.SEEK_END)
+        file.write(b"\x00")
+    assert cache.get("pf:12345678909") is None
+    assert cache.stats()["errors"] == 0
+
+
+def test_compaction_reclaims_dead_records_and_bounds_the_store(open_cache):
+    """
+    Test that compaction rewrites mostly dead segments, keeping live entries readable, and evicts the
+    oldest segments once the store is over its size limit.
+    :param open_cache: the disk cache fixture
+    :return: assertions on the segments, entries and counters
+    """
+    cache = open_cache(segment_bytes=2048)
+    for round in range(10):
+        for n in range(10):
+            cache.set(f"pf:{n}", {"n": n, "round": round, "padding": "x" * 40}, ttl=60 if n < 2 else 0.05)
+    time.sleep(0.1)
+    before = cache.stats()["bytes"]
+
+    result = cache.compact()
+    assert result["rewritten"] >= 1 and result["evicted_segments"] == 0
+    assert cache.stats()["bytes"] < before
+    assert [cache.get(f"pf:{n}")["round"] for n in range(2)] == [9, 9]
+    assert cache.get("pf:5") is None
+
+    cache.max_bytes = 2048
+    for n in range(40):
+        cache[f"pj:{n}"] = {"n": n, "padding": "y" * 40}
+    result = cache.compact()
+    assert result["evicted"] > 0 and cache.stats()["evictions"] == result["evicted"]
+    assert cache.stats()["bytes"] <= 2 * 2048
+    assert cache.get("pj:39") == {"n": 39, "padding": "y" * 40}
+    assert cache.get("pj:0") is None
+
+
+def test_full_index_drops_writes_until_rebuilt(open_cache):
+    """
+    Test that writes are dropped when the index has no free slot, and that compaction frees the slots
+    of expired entries.
+    :param open_cache: the disk cache fixture
+    :return: assertions on the dropped counter and the rebuilt index
+    """
+    cache = open_cache(index_slots=8)
+    for n in range(8):
+        cache.set(f"pf:{n}", n, ttl=0.05)
+    cache["pf:live"] = "kept"
+    assert cache.stats()["dropped"] == 1
+
+    time.sleep(0.1)
+    assert cache.compact()["index_dead"] == 8
+    cache["pf:live"] = "kept"
+    assert cache.get("pf:live") == "kept"
+    with open(os.path.join(cache.path, INDEX_FILE), "rb") as file:
+        assert file.read(8) == INDEX_MAGIC
+
+
+def test_compaction_does_not_revive_deleted_entries(open_cache):
+    """
+    Test that a deleted entry stays deleted after compaction and an index rebuild, both when its record
+    is compacted away and when only the segment holding its deletion is.
+    :param open_cache: the disk cache fixture
+    :return: assertions on the deleted entries after a restart without the index
+    """
+    cache = open_cache(segment_bytes=2048, compact_ratio=1.0)
+    cache["pf:victim"] = REPORT
+    cache.delete("pf:victim")
+    for n in range(40):
+        cache[f"pf:{n}"] = {"n": n, "padding": "x" * 40}
+    assert cache.compact()["rewritten"] >= 1
+    cache.close()
+    os.unlink(os.path.join(cache.path, INDEX_FILE))
+    assert open_cache().get("pf:victim") is None
+
+    cache = open_cache(segment_bytes=2048, compact_ratio=0.5)
+    cache.clear()
+    n = 0
+    while len(segments(cache)) < 2:
+        cache[f"pj:{n}"] = {"n": n, "padding": "y" * 40}
+        n += 1
+    # the record stays in a mostly live segment, the deletion goes to one that is compacted away
+    cache.delete("pj:0")
+    while len(segments(cache)) < 3:
+        cache.set(f"pf:{n}", {"n": n, "padding": "z" * 40}, ttl=0.05)
+        n += 1
+    time.sleep(0.1)
+    first = segments(cache)[0]
+    cache.compact()
+    assert segments(cache)[0] == first
+    cache.close()
+    os.unlink(os.path.join(cache.path, INDEX_FILE))
+    restarted = open_cache()
+    assert restarted.get("pj:0") is None
+    assert restarted.get("pj:1") == {"n": 1, "padding": "y" * 40}
@@ -1,30 +1,50 @@
+import json
+
 import pytest
-from app import app
+from app import create_app, get_service, warm_up
+from utils.rate_limiter import RateLimiter
 
 
 @pytest.fixture
-def client():
+def flask_app():
     """
-    Fixture to create a test client for the Flask application.
-    :return: a test client instance
+    Fixture to create a fresh Flask application for each test.
+    :return: a Flask application
     """
+    app = create_app()
     app.config["TESTING"] = True
     app.config["START_TIME"] = 0
-    with app.test_client() as client:
+    yield app
+    service = app.extensions.get("serasa_service")
+    if hasattr(service, "close"):
+        service.close()
+
+
+@pytest.fixture
+def client(flask_app):
+    """
+    Fixture to create a test client for the Flask application.
+    :param flask_app: the Flask application under test
+    :return: a test client instance
+    """
+    with flask_app.test_client() as client:
         yield client
 
 
 @pytest.fixture
-def mock_serasa_service(monkeypatch):
+def mock_serasa_service(flask_app):
     """
     Fixture to mock the Serasa service for testing purposes.
-    :param monkeypatch:  a pytest fixture for monkeypatching
+    :param flask_app: the Flask application under test
     :return: a mock Serasa service
     """
     class MockSerasaService:
         """
         Mock implementation of the Serasa service for testing.
         """
+
+        batch_max_size = 5000
+
         @staticmethod
         def consult_cpf(cpf):
             """
@@ -36,6 +56,8 @@ def mock_serasa_service(monkeypatch):
                 return {"error": "Invalid CPF."}, 400
             if cpf == "40440440400":
                 return {"error": "Document not found"}, 404
+            if cpf == "52998224725":
+                return {"success": True, "data": {"cpf": cpf}, "cached": True, "cache_tier": "l2", "stale": True}, 200
             return {"success": True, "data": {"cpf": cpf}, "cached": False}, 200
 
         @staticmethod
@@ -51,7 +73,20 @@ def mock_serasa_service(monkeypatch):
                 return {"error": "Document not found"}, 404
             return {"success": True, "data": {"cnpj": cnpj}, "cached": False}, 200
 
-    monkeypatch.setattr("app.serasa_service", MockSerasaService())
+        @staticmethod
+        def stream_batch(documents, ordered=True):
+            """
+            Mock implementation of the stream_batch method.
+            :param documents: a list of documents to be consulted
+            :param ordered: a boolean, False to return the results in reverse order
+            :return: a tuple containing an iterator of mock results and status code
+            """
+            if not isinstance(documents, list):
+                return {"error": "Field 'documents' must be a list of strings."}, 400
+            results = documents if ordered else reversed(documents)
+            return ({"document": doc, "status": 200, "success": True} for doc in results), 200
+
+    flask_app.extensions["serasa_service"] = MockSerasaService()
 
 
 def test_health_endpoint(client):
@@ -71,10 +106,15 @@ def test_metrics_endpoint(client):
     :param client: a test client instance
     :return: assertions to verify the metrics endpoint response
     """
+    client.get("/api/v1/health")
     resp = client.get("/metrics")
     assert resp.status_code == 200
-    assert "uptime" in resp.json
-    assert "last_request_duration" in resp.json
+    assert resp.content_type.startswith("text/plain; version=0.0.4")
+    assert 'http_requests_total{route="/api/v1/health",method="GET",status="200"}' in resp.text
+    assert 'http_request_duration_seconds_bucket{route="/api/v1/health",method="GET",status="200",le="+Inf"}' in resp.text
+    assert "serasa_singleflight_leader 0" in resp.text
+    assert 'serasa_circuit_breakers_state{report_type="pf",state="closed"} 1' in resp.text
+    assert "serasa_uptime_seconds " in resp.text
 
 
 def test_consult_cpf_success(client, mock_serasa_service):
@@ -89,6 +129,7 @@ def test_consult_cpf_success(client, mock_serasa_service):
     assert resp.json["success"] is True
     assert resp.json["data"]["cpf"] == "12345678909"
     assert resp.headers.get("X-Cache-Hit") == "false"
+    assert resp.headers.get("X-Cache-Stale") is None
 
 
 def test_consult_cpf_invalid(client, mock_serasa_service):
@@ -149,3 +190,154 @@ def test_consult_cnpj_not_found(client, mock_serasa_service):
     """
     resp = client.get("/api/v1/consulta/cnpj/40440440400000")
     assert resp.status_code == 404
+
+
+def test_consult_batch_success(client, mock_serasa_service):
+    """
+    Test the batch consultation endpoint for a successful case.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock Serasa service
+    :return: assertions to verify the batch consultation response
+    """
+    resp = client.post("/api/v1/consulta/batch", json={"documents": ["12345678909", "12345678000195"]})
+    assert resp.status_code == 200
+    assert resp.json["total"] == 2
+    assert resp.headers.get("X-RateLimit-Limit") is not None
+
+
+def test_consult_batch_ndjson(client, mock_serasa_service):
+    """
+    Test that the batch endpoint streams one result per line when NDJSON is accepted, in completion order
+    when requested.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock Serasa service
+    :return: assertions to verify the streamed lines
+    """
+    documents = ["12345678909", "12345678000195"]
+    resp = client.post(
+        "/api/v1/consulta/batch?order=completion", json={"documents": documents}, headers={"Accept": "application/x-ndjson"}
+    )
+    assert resp.status_code == 200
+    assert resp.content_type == "application/x-ndjson"
+    assert [json.loads(line)["document"] for line in resp.data.splitlines()] == documents[::-1]
+    assert resp.headers.get("X-RateLimit-Limit") is not None
+
+
+def test_consult_batch_invalid_body(client, mock_serasa_service):
+    """
+    Test the batch consultation endpoint with a malformed body.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock Serasa service
+    :return: assertions to verify the batch consultation response
+    """
+    resp = client.post("/api/v1/consulta/batch", data="not json")
+    assert resp.status_code == 400
+
+
+def test_consult_batch_document_quota(flask_app, client, mock_serasa_service):
+    """
+    Test that each document of a batch counts against the batch quota, and that invalid batches do not.
+    :param flask_app: the Flask application under test
+    :param client: a test client instance
+    :param mock_serasa_service: a mock Serasa service
+    :return: assertions to verify the rejected batch
+    """
+    flask_app.extensions["batch_limiter"] = RateLimiter(limit=3, period=60)
+    documents = ["12345678909", "12345678000195"]
+    assert client.post("/api/v1/consulta/batch", json={"documents": "12345678909"}).status_code == 400
+    assert client.post("/api/v1/consulta/batch", json={"documents": documents}).status_code == 200
+
+    resp = client.post("/api/v1/consulta/batch", json={"documents": documents})
+    assert resp.status_code == 429
+    assert resp.json == {"error": "Too many documents"}
+    assert int(resp.headers["Retry-After"]) > 0
+    assert client.post("/api/v1/consulta/batch", json={"documents": documents[:1]}).status_code == 200
+
+
+def test_consult_cpf_cache_tier_header(client, mock_serasa_service):
+    """
+    Test that X-Cache-Hit reports the cache tier that served the response.
+    :param client: a test client instance
+    :param mock_serasa_service: a mock Serasa service
+    :return: assertions to verify the cache header
+    """
+    resp = client.get("/api/v1/consulta/cpf/52998224725")
+    assert resp.status_code == 200
+    assert resp.headers.get("X-Cache-Hit") == "l2"
+    assert resp.headers.get("X-Cache-Stale") == "true"
+
+
+def test_create_app_isolates_state():
+    """
+    Test that each application built by the factory has its own rate limiter and creates its service lazily.
+    :return: assertions to verify the factory
+    """
+    first, second = create_app(), create_app()
+    assert first.extensions["rate_limiter"] is not second.extensions["rate_limiter"]
+    assert first.extensions["serasa_service"] is None
+
+    service = get_service(first)
+    try:
+        assert get_service(first) is service
+        assert second.extensions["serasa_service"] is None
+    finally:
+        service.close()
+
+
+def test_warm_up_fetches_token_and_documents(monkeypatch):
+    """
+    Test that warm_up hands the configured documents to the service.
+    :param monkeypatch: a pytest fixture for monkeypatching
+    :return: assertions to verify the warm up
+    """
+    calls = []
+
+    class WarmService:
+        """
+        Service stub recording warm up calls.
+        """
+
+        @staticmethod
+        def warm_up(documents):
+            """
+            Records the documents to preload.
+            :param documents: a list of documents
+            """
+            calls.append(documents)
+
+    monkeypatch.setenv("SERASA_WARM_UP_DOCUMENTS", "529.982.247-25, 11.222.333/0001-81")
+    warm_up(create_app(service=WarmService()))
+    assert calls == [["529.982.247-25", "11.222.333/0001-81"]]
+
+
+def test_warm_up_failure_does_not_raise():
+    """
+    Test that a failing warm up is logged and does not stop the worker from starting.
+    :return: assertions to verify the warm up
+    """
+
+    class BrokenService:
+        """
+        Service stub whose warm up fails.
+        """
+
+        @staticmethod
+        def warm_up(documents):
+            """
+            Fails like an unreachable upstream.
+            :param documents: a list of documents
+            """
+            raise ConnectionError("upstream unreachable")
+
+    warm_up(create_app(service=BrokenService()))
+
+
+def test_wsgi_entry_point_reuses_module_app():
+    """
+    Test that the WSGI entry point serves the application created by the app module instead of a second one.
+    :return: an assertion on the application instance
+    """
+    import app as app_module
+    import wsgi
+
+    assert wsgi.app is app_module.app
@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.hedging import HedgePolicy, Hedger, LatencyWindow
+
+
+@pytest.fixture
+def executor():
+    """
+    Fixture providing the worker pool hedged calls run on.
+    :return: a ThreadPoolExecutor instance
+    """
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def make_hedger(executor, **policy) -> Hedger:
+    """
+    Builds an enabled hedger whose latency window already holds 20 fast samples.
+    """
+    hedger = Hedger(HedgePolicy(enabled=True, min_delay=0.02, **policy), executor)
+    for _ in range(20):
+        hedger.window.record(0.001)
+    hedger.budget.balance = 5
+    return hedger
+
+
+def test_window_percentile():
+    """
+    Test that the percentile is read from the most recent samples.
+    :return: assertions on the computed percentiles
+    """
+    window = LatencyWindow(size=100, refresh=1)
+    assert window.percentile(95) is None
+    for latency in range(1, 101):
+        window.record(latency / 1000)
+    assert window.percentile(50) == 0.051
+    assert window.percentile(95) == 0.096
+    window.record(1.0)
+    assert window.percentile(100) == 1.0
+
+
+def test_policy_from_env_per_report_type(monkeypatch):
+    """
+    Test that the per report type switch overrides the global one.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the policies
+    """
+    monkeypatch.setenv("SERASA_HEDGE_ENABLED", "true")
+    monkeypatch.setenv("SERASA_PJ_HEDGE", "false")
+    monkeypatch.setenv("SERASA_HEDGE_PERCENTILE", "99")
+    assert HedgePolicy.from_env("pf").enabled
+    assert not HedgePolicy.from_env("pj").enabled
+    assert HedgePolicy.from_env("pf").percentile == 99
+
+
+def test_disabled_hedger_calls_inline(executor):
+    """
+    Test that a disabled hedger runs the call in the caller thread and only records its latency.
+    :param executor: the worker pool fixture
+    :return: assertions on the call and counters
+    """
+    hedger = Hedger(HedgePolicy(enabled=False), executor)
+    assert hedger.call(threading.current_thread) is threading.current_thread()
+    assert hedger.counters["hedged"] == 0
+    assert len(hedger.window.samples) == 1
+
+
+def test_slow_call_is_hedged_and_hedge_wins(executor):
+    """
+    Test that a call slower than the hedge delay is re-sent and the faster answer is returned.
+    :param executor: the worker pool fixture
+    :return: assertions on the result and counters
+    """
+    hedger = make_hedger(executor)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return "slow"
+        return "fast"
+
+    start = time.perf_counter()
+    assert hedger.call(call) == "fast"
+    assert time.perf_counter() - start < 0.2
+    assert hedger.counters["hedged"] == 1
+    assert hedger.counters["hedge_wins"] == 1
+
+
+def test_fast_call_is_not_hedged(executor):
+    """
+    Test that a call answering before the hedge delay is not re-sent.
+    :param executor: the worker pool fixture
+    :return: assertions on the counters
+    """
+    hedger = make_hedger(executor)
+    assert hedger.call(lambda: "ok") == "ok"
+    assert hedger.counters == {"calls": 1, "hedged": 0, "hedge_wins": 0, "budget_denied": 0}
+
+
+def test_hedges_are_capped_by_the_budget(executor):
+    """
+    Test that slow calls are not hedged once the budget is spent.
+    :param executor: the worker pool fixture
+    :return: assertions on the counters
+    """
+    hedger = make_hedger(executor)
+    hedger.budget.balance = 0
+
+    def slow():
+        time.sleep(0.05)
+        return "slow"
+
+    assert hedger.call(slow) == "slow"
+    assert hedger.counters["hedged"] == 0
+    assert hedger.counters["budget_denied"] == 1
+
+
+def test_failed_call_loses_to_a_successful_hedge(executor):
+    """
+    Test that a failure of one call does not hide the answer of the other.
+    :param executor: the worker pool fixture
+    :return: assertions on the result
+    """
+    hedger = make_hedger(executor)
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.1)
+            raise ConnectionError("reset")
+        time.sleep(0.2)
+        return "ok"
+
+    assert hedger.call(call) == "ok"
+
+
+def test_error_is_raised_when_every_call_fails(executor):
+    """
+    Test that the error of the first call is raised when the hedge fails too.
+    :param executor: the worker pool fixture
+    :return: assertions on the raised error
+    """
+    hedger = make_hedger(executor)
+    errors = iter([ConnectionError("primary"), ConnectionError("hedge")])
+
+    def call():
+        error = next(errors)
+        time.sleep(0.05)
+        raise error
+
+    with pytest.raises(ConnectionError, match="primary"):
+        hedger.call(call)
@@ -0,0 +1,243 @@
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from services.jobs import COMPLETED, QUEUED, Job, JobManager, JobNotFound, JobPolicy, detect_format, parse_line
+from services.validation import Document
+
+
+class FakeService:
+    """
+    Service answering every document with a report, counting the upstream calls per document key.
+    `stop_after` stops the given manager once that many documents have been consulted.
+    """
+
+    def __init__(self, cached: tuple = ()):
+        self.cached = set(cached)
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.stop_after = None
+        self.manager = None
+
+    def consult_document(self, document: Document, before_fetch=None):
+        if document.digits in self.cached:
+            return {"success": True, "data": {"digits": document.digits}, "cached": True}, 200
+        if before_fetch is not None:
+            before_fetch()
+        with self.lock:
+            self.calls[document.key] = self.calls.get(document.key, 0) + 1
+            if self.stop_after is not None and sum(self.calls.values()) >= self.stop_after:
+                self.manager._stopping.set()
+        if document.digits == "52998224725":
+            return {"error": "Document not found"}, 404
+        return {"success": True, "data": {"digits": document.digits}, "cached": False}, 200
+
+
+def wait_for(manager: JobManager, job_id: str, status: str = COMPLETED, timeout: float = 5) -> dict:
+    """
+    Polls a job until it reaches a status.
+    :param manager: the job manager
+    :param job_id: the job ID
+    :param status: the awaited status
+    :param timeout: seconds to wait at most
+    :return: the job state
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = manager.status(job_id)
+        if state["status"] == status:
+            return state
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {state['status']}")
+
+
+def results(manager: JobManager, job_id: str) -> list:
+    """
+    Reads the results of a job.
+    :param manager: the job manager
+    :param job_id: the job ID
+    :return: a list of result dictionaries
+    """
+    return [json.loads(line) for line in b"".join(manager.results(job_id)).splitlines()]
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    """
+    Fixture building job managers over a temporary directory, closed at teardown.
+    :param tmp_path: a pytest fixture providing a temporary directory
+    :return: a function (service, **policy options) -> JobManager
+    """
+    managers = []
+
+    def build(service, **options):
+        policy = JobPolicy(directory=str(tmp_path), rate=0, checkpoint_every=2, **options)
+        manager = JobManager(service, policy)
+        service.manager = manager
+        managers.append(manager)
+        return manager
+
+    yield build
+    for manager in managers:
+        manager.close()
+
+
+def test_csv_job_writes_results_in_input_order(make_manager):
+    """
+    Test that a CSV job answers each line in order, skipping blank lines and duplicates, reporting invalid
+    documents, answering cache hits without consulting and counting every outcome.
+    :param make_manager: the job manager fixture
+    :return: assertions on the results and counters
+    """
+    service = FakeService(cached=("11222333000181",))
+    manager = make_manager(service)
+    body = "name,cpf\nA,123.456.789-09\nB,11.222.333/0001-81\n\nC,12345678909\nD,123\nE,52998224725\n"
+    job_id = manager.submit(io.BytesIO(body.encode()), "csv")
+
+    state = wait_for(manager, job_id)
+    assert [(item["document"], item["status"]) for item in results(manager, job_id)] == [
+        ("123.456.789-09", 200),
+        ("11.222.333/0001-81", 200),
+        ("123", 400),
+        ("52998224725", 404),
+    ]
+    assert state["progress"] == 1.0
+    assert state["counters"] == {
+        "lines": 6,
+        "written": 4,
+        "duplicates": 1,
+        "invalid": 1,
+        "statuses": {"200": 2, "400": 1, "404": 1},
+    }
+    assert service.calls == {"pf:12345678909": 1, "pf:52998224725": 1}
+
+
+def test_ndjson_lines():
+    """
+    Test the NDJSON line formats and the format detection.
+    :return: assertions on the parsed documents
+    """
+    assert parse_line('"123.456.789-09"', "ndjson") == "123.456.789-09"
+    assert parse_line('{"document": "12345678909", "ref": 1}', "ndjson") == "12345678909"
+    assert parse_line("{not json", "ndjson") is None
+    assert parse_line("1,2", "csv", column=3) is None
+    assert detect_format("application/x-ndjson; charset=utf-8") == "ndjson"
+    assert detect_format("application/json", "csv") == "csv"
+    assert detect_format("application/json") is None
+
+
+def test_interrupted_job_resumes_from_its_checkpoint(make_manager):
+    """
+    Test that a job stopped midway is checkpointed, that output written past the checkpoint by a crash is
+    discarded, and that a new manager finishes the job without consulting any document twice.
+    :param make_manager: the job manager fixture
+    :return: assertions on the results and upstream calls
+    """
+    documents = [f'{{"document": "{cpf}"}}' for cpf in ("12345678909", "52998224725", "11144477735", "39053344705")]
+    documents += ['"12345678909"', "{broken", '"98765432100"']
+    service = FakeService()
+    service.stop_after = 2
+    first = make_manager(service, concurrency=1)
+    job_id = first.submit(io.BytesIO("\n".join(documents).encode()), "ndjson")
+    assert first._stopping.wait(5)
+    first.close()
+    state = first.status(job_id)
+    assert state["status"] == QUEUED
+    assert 0 < state["progress"] < 1
+
+    job = Job(first.policy.directory, job_id)
+    with open(job.output_path, "ab") as output:
+        output.write(b'{"partial": ')
+
+    service.stop_after = None
+    second = make_manager(service)
+    second.resume()
+    wait_for(second, job_id)
+
+    lines = results(second, job_id)
+    assert [item["document"] for item in lines] == [
+        "12345678909",
+        "52998224725",
+        "11144477735",
+        "39053344705",
+        "{broken",
+        "98765432100",
+    ]
+    assert set(service.calls.values()) == {1}
+
+
+def test_a_job_is_claimed_once(make_manager):
+    """
+    Test that the processing lock of a job can only be held once.
+    :param make_manager: the job manager fixture
+    :return: assertions on the claims
+    """
+    manager = make_manager(FakeService())
+    job_id = manager.submit(io.BytesIO(b""), "csv")
+    wait_for(manager, job_id)
+    job = Job(manager.policy.directory, job_id)
+    lock = job.claim()
+    assert lock is not None
+    assert job.claim() is None
+    lock.close()
+    with pytest.raises(JobNotFound):
+        manager.status("../etc")
+
+
+def test_finished_jobs_are_deleted_after_their_retention(make_manager):
+    """
+    Test that a rescan deletes finished jobs and interrupted uploads older than the retention, and keeps
+    recent jobs and unrelated entries.
+    :param make_manager: the job manager fixture
+    :return: assertions on the remaining jobs
+    """
+    manager = make_manager(FakeService(), retention=60)
+    old, recent = [manager.submit(io.BytesIO(b"12345678909\n"), "csv") for _ in range(2)]
+    for job_id in (old, recent):
+        wait_for(manager, job_id)
+    conn = Job(manager.policy.directory, old).connect()
+    with conn:
+        conn.execute("UPDATE job SET updated_at = ?", (time.time() - 120,))
+    conn.close()
+    interrupted = os.path.join(manager.policy.directory, "0" * 32)
+    os.makedirs(interrupted)
+    os.utime(interrupted, (time.time() - 120, time.time() - 120))
+    os.makedirs(os.path.join(manager.policy.directory, "notes"))
+
+    manager.resume()
+    with pytest.raises(JobNotFound):
+        manager.status(old)
+    assert manager.status(recent)["status"] == COMPLETED
+    assert sorted(os.listdir(manager.policy.directory)) == sorted(["notes", recent])
+
+
+def test_job_endpoints(make_manager):
+    """
+    Test uploading a job, following its progress and downloading its results through the Flask app.
+    :param make_manager: the job manager fixture
+    :return: assertions on the responses
+    """
+    app = create_app(service=FakeService())
+    app.extensions["job_manager"] = make_manager(app.extensions["serasa_service"], max_upload_bytes=100)
+
+    with app.test_client() as client:
+        resp = client.post("/api/v1/jobs", data=b"12345678909\n11222333000181\n", content_type="text/csv")
+        assert resp.status_code == 202
+        job_id = resp.get_json()["job_id"]
+        assert resp.headers["Location"] == f"/api/v1/jobs/{job_id}"
+
+        wait_for(app.extensions["job_manager"], job_id)
+        assert client.get(f"/api/v1/jobs/{job_id}").get_json()["counters"]["written"] == 2
+        resp = client.get(f"/api/v1/jobs/{job_id}/results")
+        assert resp.headers["X-Job-Status"] == COMPLETED
+        assert [json.loads(line)["type"] for line in resp.data.splitlines()] == ["cpf", "cnpj"]
+
+        assert client.post("/api/v1/jobs", data=b"x", content_type="application/json").status_code == 400
+        assert client.post("/api/v1/jobs?format=ndjson", data=b"x" * 101).status_code == 413
+        assert client.get("/api/v1/jobs/0123456789abcdef0123456789abcdef").status_code == 404
+        assert client.get("/api/v1/jobs/nope/results").status_code == 404
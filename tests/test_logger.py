@@ -0,0 +1,176 @@
+import io
+import json
+import logging
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from services.validation import validate_cpf
+from utils.logger import AsyncLogHandler, JsonFormatter, LogSampler, RepeatFilter, correlation_id_var, log_enabled
+
+
+class BlockingStream(io.StringIO):
+    """
+    Stream whose writes wait until `released` is set, like a stdout nobody is reading.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+        self.writing = threading.Event()
+
+    def write(self, data):
+        self.writing.set()
+        self.released.wait(5)
+        return super().write(data)
+
+
+@pytest.fixture
+def make_logger():
+    """
+    Fixture building a logger that writes through an AsyncLogHandler, closed at teardown.
+    :return: a function (stream, **handler options) -> (logger, handler)
+    """
+    handlers = []
+
+    def build(stream, **options):
+        handler = AsyncLogHandler(stream, **options)
+        handler.setFormatter(JsonFormatter())
+        test_logger = logging.getLogger(f"test_async_{len(handlers)}_{id(stream)}")
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        handlers.append(handler)
+        return test_logger, handler
+
+    yield build
+    for handler in handlers:
+        if isinstance(handler.stream, BlockingStream):
+            handler.stream.released.set()
+        handler.close()
+
+
+def test_records_are_written_with_the_caller_correlation_id(make_logger):
+    """
+    Test that records are formatted on the writer thread with the correlation ID of the logging thread.
+    :param make_logger: the logger fixture
+    :return: assertions on the written lines
+    """
+    stream = io.StringIO()
+    test_logger, handler = make_logger(stream)
+
+    token = correlation_id_var.set("abc")
+    try:
+        test_logger.warning({"event": "first"})
+    finally:
+        correlation_id_var.reset(token)
+    test_logger.warning("second")
+    handler.flush()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line["message"], line["correlation_id"]) for line in lines] == [
+        ("{'event': 'first'}", "abc"),
+        ("second", None),
+    ]
+
+
+def test_writer_thread_writes_in_batches(make_logger):
+    """
+    Test that a full batch wakes the writer without an explicit flush.
+    :param make_logger: the logger fixture
+    :return: assertions on the written lines
+    """
+    stream = io.StringIO()
+    test_logger, handler = make_logger(stream, batch_size=3, flush_interval=60)
+    for i in range(3):
+        test_logger.warning(str(i))
+
+    for _ in range(100):
+        if stream.getvalue().count("\n") == 3:
+            break
+        threading.Event().wait(0.01)
+    assert stream.getvalue().count("\n") == 3
+
+
+def test_full_queue_drops_the_oldest_records(make_logger):
+    """
+    Test that logging never blocks on a stuck stream: past the queue size the oldest records are dropped
+    and counted.
+    :param make_logger: the logger fixture
+    :return: assertions on the counters and written lines
+    """
+    stream = BlockingStream()
+    test_logger, handler = make_logger(stream, max_queue=5, batch_size=1, flush_interval=0.01)
+    test_logger.warning("stuck")
+    assert stream.writing.wait(1)
+
+    for i in range(8):
+        test_logger.warning(str(i))
+    assert handler.stats() == {"queued": 5, "dropped": 3}
+
+    stream.released.set()
+    handler.flush()
+    messages = [json.loads(line)["message"] for line in stream.getvalue().splitlines()]
+    assert messages == ["stuck", "3", "4", "5", "6", "7"]
+
+
+def test_sampler_from_env(monkeypatch):
+    """
+    Test that sampling rates are read per event type, with a default for the others.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the sampler
+    """
+    monkeypatch.setenv("LOG_SAMPLE_RATES", "cache_hit=0.01, validate_document=0")
+    monkeypatch.setenv("LOG_SAMPLE_DEFAULT", "0.5")
+    sampler = LogSampler.from_env()
+    assert sampler.rates == {"cache_hit": 0.01, "validate_document": 0.0}
+    assert sampler.default_rate == 0.5
+
+
+def test_sampling_keeps_a_share_of_events_and_every_error():
+    """
+    Test that informational events are kept with their rate, while warnings and errors always are.
+    :return: assertions on the sampling decisions
+    """
+    sampler = LogSampler({"cache_hit": 0.1, "validate_document": 0.0})
+    with patch("utils.logger.sampler", sampler):
+        kept = sum(log_enabled("cache_hit") for _ in range(10000))
+        assert 800 < kept < 1200
+        assert not log_enabled("validate_document")
+        assert log_enabled("validate_document", logging.ERROR)
+        assert log_enabled("consult_success")
+
+
+def test_suppressed_event_payload_is_not_built():
+    """
+    Test that a sampled-out event skips the logger call, and so building its payload.
+    :return: assertions on the logger calls
+    """
+    with patch("utils.logger.sampler", LogSampler({"validate_document": 0.0})):
+        with patch("services.validation.logger") as mock_logger:
+            assert validate_cpf("12345678909")
+    mock_logger.info.assert_not_called()
+
+
+def test_repeated_errors_are_capped_per_window():
+    """
+    Test that identical errors are let through `limit` times per window, ignoring per-request fields,
+    and that the next record after the window reports how many were suppressed.
+    :return: assertions on the filter decisions
+    """
+    repeat = RepeatFilter(limit=2, window=10)
+
+    def record(payload, level=logging.ERROR):
+        return logging.LogRecord("test", level, __file__, 1, payload, None, None)
+
+    with patch("utils.logger.time.monotonic", return_value=100.0):
+        decisions = [repeat.filter(record({"event": "service_error", "document_id": str(i)})) for i in range(5)]
+        assert decisions == [True, True, False, False, False]
+        assert repeat.filter(record({"event": "service_error", "status_code": 502}))
+        assert repeat.filter(record({"event": "cache_hit"}, logging.INFO))
+
+    late = record({"event": "service_error", "document_id": "9"})
+    with patch("utils.logger.time.monotonic", return_value=111.0):
+        assert repeat.filter(late)
+    assert late.msg["suppressed"] == 3
+    assert repeat.suppressed == 3
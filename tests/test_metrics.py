@@ -0,0 +1,136 @@
+import os
+import threading
+
+from utils.metrics import Registry, stats_samples
+
+
+def make_registry():
+    """
+    Builds a registry with one counter and one histogram.
+    :return: a tuple (registry, counter, histogram)
+    """
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests.", ("route", "status"))
+    histogram = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    return registry, counter, histogram
+
+
+def test_render_text_format():
+    """
+    Test that counters and histograms are rendered in the Prometheus text format, with cumulative buckets.
+    :return: assertions on the rendered lines
+    """
+    registry, counter, histogram = make_registry()
+    counter.inc("/a", "200")
+    counter.inc("/a", "200", amount=2)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, '/"b"')
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="/a",status="200"} 3' in lines
+    assert 'latency_seconds_bucket{route="/\\"b\\"",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/\\"b\\"",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{route="/\\"b\\"",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/\\"b\\""} 3.65' in lines
+    assert 'latency_seconds_count{route="/\\"b\\""} 4' in lines
+
+
+def test_threads_record_without_losing_counts():
+    """
+    Test that values recorded concurrently by many threads, including finished ones, are all counted.
+    :return: assertions on the collected totals
+    """
+    registry, counter, histogram = make_registry()
+
+    def work():
+        for _ in range(1000):
+            counter.inc("/a", "200")
+            histogram.observe(0.2, "/a")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.collect() == {("/a", "200"): 8000}
+    assert histogram.collect()[("/a",)][:3] == [0, 8000, 0]
+
+
+def test_finished_threads_fold_into_base_shard():
+    """
+    Test that the shards of finished threads are folded into the base shard, keeping their counts without
+    keeping one shard per thread, while the shard of a live thread is kept.
+    :return: assertions on the shards and collected totals
+    """
+    registry, counter, histogram = make_registry()
+    counter.inc("/a", "200")
+
+    for _ in range(50):
+        thread = threading.Thread(target=lambda: (counter.inc("/a", "200"), histogram.observe(0.2, "/a")))
+        thread.start()
+        thread.join()
+
+    assert len(counter._shards) == 1
+    assert histogram._shards == []
+    assert counter.collect() == {("/a", "200"): 51}
+    assert histogram.collect()[("/a",)][:3] == [0, 50, 0]
+
+
+def test_collectors_render_gauges():
+    """
+    Test that collector samples are rendered as gauges, and that a failing collector is skipped.
+    :return: assertions on the rendered lines
+    """
+    registry = Registry()
+    registry.register_collector("service", lambda: [("serasa_in_flight", {"report_type": "pf"}, 2)])
+    registry.register_collector("broken", lambda: 1 / 0)
+    lines = registry.render().splitlines()
+    assert "# TYPE serasa_in_flight gauge" in lines
+    assert 'serasa_in_flight{report_type="pf"} 2' in lines
+
+
+def test_stats_samples_flattens_service_stats():
+    """
+    Test that nested stats become gauge samples, with report types as labels and strings as label values.
+    :return: assertions on the samples
+    """
+    stats = {"cache": {"hits": 3, "backend": "memory"}, "circuit_breakers": {"pf": {"state": "open", "opened": 1}}}
+    assert stats_samples("serasa", stats, {"pf": "report_type"}) == [
+        ("serasa_cache_hits", {}, 3.0),
+        ("serasa_cache_backend", {"backend": "memory"}, 1.0),
+        ("serasa_circuit_breakers_state", {"report_type": "pf", "state": "open"}, 1.0),
+        ("serasa_circuit_breakers_opened", {"report_type": "pf"}, 1.0),
+    ]
+
+
+def test_multiprocess_aggregation(tmp_path):
+    """
+    Test that counters of forked workers are summed into the scrape, that each worker starts from zero,
+    and that the counts of an exited worker survive in the archive while its gauges are dropped.
+    :param tmp_path: a pytest fixture providing a temporary directory
+    :return: assertions on the rendered lines
+    """
+    registry, counter, _ = make_registry()
+    registry.enable_multiprocess(str(tmp_path), flush_interval=3600)
+    registry.register_collector("service", lambda: [("worker_up", {}, 1)])
+    counter.inc("/a", "200", amount=5)
+
+    pid = os.fork()
+    if pid == 0:
+        counter.inc("/a", "200", amount=2)
+        registry.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    lines = registry.render().splitlines()
+    assert 'requests_total{route="/a",status="200"} 7' in lines
+    assert f'worker_up{{pid="{pid}"}} 1' in lines
+    assert f'worker_up{{pid="{os.getpid()}"}} 1' in lines
+
+    registry.mark_process_dead(pid)
+    assert not (tmp_path / f"{pid}.json").exists()
+    lines = registry.render().splitlines()
+    assert 'requests_total{route="/a",status="200"} 7' in lines
+    assert f'worker_up{{pid="{pid}"}} 1' not in lines
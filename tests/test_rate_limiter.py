@@ -0,0 +1,232 @@
+from unittest.mock import patch
+
+import pytest
+
+from tests.fake_redis import FakeRedisServer
+from utils.rate_limiter import DistributedRateLimiter, RateLimiter, create_rate_limiter
+from utils.resp import RespClient
+
+
+def test_allows_burst_up_to_limit():
+    """
+    Test that a client can send `limit` requests in a burst and the next one is rejected.
+    :return: assertions to verify the burst behavior
+    """
+    limiter = RateLimiter(limit=3, period=60)
+    with patch("utils.rate_limiter.time.monotonic", return_value=1000.0):
+        results = [limiter.is_allowed("1.1.1.1")[0] for _ in range(4)]
+    assert results == [True, True, True, False]
+
+
+def test_rejected_reset_is_time_until_next_request():
+    """
+    Test that a rejected request reports when the next one will be allowed, and that it is.
+    :return: assertions to verify the reset value
+    """
+    limiter = RateLimiter(limit=3, period=60)
+    with patch("utils.rate_limiter.time.monotonic", return_value=1000.0):
+        for _ in range(3):
+            limiter.is_allowed("1.1.1.1")
+        assert limiter.is_allowed("1.1.1.1") == (False, 20)
+    with patch("utils.rate_limiter.time.monotonic", return_value=1020.0):
+        assert limiter.is_allowed("1.1.1.1")[0] is True
+
+
+def test_check_headers():
+    """
+    Test the X-RateLimit-* headers returned by check.
+    :return: assertions to verify the headers
+    """
+    limiter = RateLimiter(limit=10, period=60)
+    with patch("utils.rate_limiter.time.monotonic", return_value=1000.0):
+        allowed, headers = limiter.check("1.1.1.1")
+    assert allowed is True
+    assert headers == {"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "9", "X-RateLimit-Reset": "6"}
+
+
+def test_cost_counts_several_requests():
+    """
+    Test that a request with a cost uses that many requests of the limit, and is rejected whole when
+    fewer are left.
+    :return: assertions to verify the weighted requests
+    """
+    limiter = RateLimiter(limit=10, period=60)
+    assert limiter.check("1.1.1.1", cost=6) == (
+        True,
+        {"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "4", "X-RateLimit-Reset": "36"},
+    )
+    assert limiter.check("1.1.1.1", cost=6)[0] is False
+    assert limiter.check("1.1.1.1", cost=4)[0] is True
+    assert limiter.is_allowed("1.1.1.1")[0] is False
+
+
+def test_limits_are_per_ip():
+    """
+    Test that exhausting one IP does not affect another.
+    :return: assertions to verify the isolation
+    """
+    limiter = RateLimiter(limit=1, period=60)
+    assert limiter.is_allowed("1.1.1.1")[0] is True
+    assert limiter.is_allowed("1.1.1.1")[0] is False
+    assert limiter.is_allowed("2.2.2.2")[0] is True
+
+
+def test_idle_keys_are_evicted():
+    """
+    Test that IPs whose window has fully drained are dropped as new requests arrive.
+    :return: assertions to verify the eviction
+    """
+    limiter = RateLimiter(limit=10, period=60)
+    with patch("utils.rate_limiter.time.monotonic", return_value=1000.0):
+        for i in range(100):
+            limiter.is_allowed(f"10.0.0.{i}")
+    assert len(limiter.keys) == 100
+
+    with patch("utils.rate_limiter.time.monotonic", return_value=2000.0):
+        for i in range(60):
+            limiter.is_allowed(f"10.0.1.{i}")
+    assert len(limiter.keys) == 60
+
+
+def test_max_keys_caps_memory():
+    """
+    Test that the number of tracked IPs never exceeds max_keys, even when none is idle.
+    :return: assertions to verify the cap
+    """
+    limiter = RateLimiter(limit=10, period=60, max_keys=50)
+    for i in range(1000):
+        limiter.is_allowed(f"10.0.{i // 256}.{i % 256}")
+    assert len(limiter.keys) == 50
+    assert "10.0.3.231" in limiter.keys
+
+
+@pytest.fixture(scope="module")
+def redis_server():
+    """
+    Fixture to run an in-process Redis-protocol server shared by the module.
+    :return: a started FakeRedisServer
+    """
+    server = FakeRedisServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def store(redis_server):
+    """
+    Fixture giving each test an empty store and a pinned wall clock, so a test never straddles a window boundary.
+    :param redis_server: the module FakeRedisServer
+    :return: the FakeRedisServer
+    """
+    RespClient.from_url(redis_server.url).execute("FLUSHDB")
+    redis_server.errors.clear()
+    with patch("utils.rate_limiter.time.time", return_value=6000.0):
+        yield redis_server
+
+
+def distributed(server, **kwargs) -> DistributedRateLimiter:
+    """
+    Builds a distributed limiter connected to the fake server.
+    """
+    return DistributedRateLimiter(RespClient.from_url(server.url), **kwargs)
+
+
+def test_distributed_limit_is_shared_across_instances(store):
+    """
+    Test that two limiters sharing a store, like two workers, enforce a single limit.
+    :param store: a started FakeRedisServer
+    :return: assertions to verify the shared limit
+    """
+    workers = [distributed(store, limit=10, period=60, batch=1) for _ in range(2)]
+    results = [workers[i % 2].is_allowed("1.1.1.1")[0] for i in range(14)]
+    assert results.count(True) == 10
+    assert results[-1] is False
+
+
+def test_distributed_batches_store_calls(store):
+    """
+    Test that reserving requests in batches avoids a store round trip per request.
+    :param store: a started FakeRedisServer
+    :return: assertions to verify the pre-allocation
+    """
+    limiter = distributed(store, limit=100, period=60, batch=10)
+    for _ in range(100):
+        assert limiter.is_allowed("1.1.1.1")[0] is True
+    assert limiter.store_calls == 10
+
+    # the store reported the window as exhausted, so it is answered locally
+    assert limiter.is_allowed("1.1.1.1")[0] is False
+    assert limiter.store_calls == 10
+
+
+def test_distributed_remaining_header(store):
+    """
+    Test the X-RateLimit-Remaining header of the distributed limiter.
+    :param store: a started FakeRedisServer
+    :return: assertions to verify the header
+    """
+    limiter = distributed(store, limit=10, period=60, batch=2)
+    _, headers = limiter.check("1.1.1.1")
+    assert headers["X-RateLimit-Remaining"] == "9"
+
+
+@pytest.mark.parametrize("fail_open", [True, False])
+def test_distributed_store_unavailable(fail_open):
+    """
+    Test that an unreachable store allows or rejects requests depending on fail_open, and is not retried
+    on every request.
+    :param fail_open: whether requests are allowed while the store is unavailable
+    :return: assertions to verify the failure mode
+    """
+    client = RespClient(host="127.0.0.1", port=1, timeout=0.1)
+    limiter = DistributedRateLimiter(client, limit=10, period=60, fail_open=fail_open, retry_after=30)
+    assert limiter.is_allowed("1.1.1.1")[0] is fail_open
+    assert limiter.is_allowed("1.1.1.1")[0] is fail_open
+    assert limiter.store_errors == 1
+
+
+@pytest.mark.parametrize("fail_open", [True, False])
+def test_distributed_store_error_reply(store, fail_open):
+    """
+    Test that an error reply from the store is handled like an unreachable store.
+    :param store: a started FakeRedisServer
+    :param fail_open: whether requests are allowed while the store is failing
+    :return: assertions to verify the failure mode
+    """
+    store.errors["INCRBY"] = "ERR value is not an integer or out of range"
+    limiter = distributed(store, limit=10, period=60, fail_open=fail_open, retry_after=30)
+    assert limiter.is_allowed("1.1.1.1")[0] is fail_open
+    assert limiter.is_allowed("1.1.1.1")[0] is fail_open
+    assert limiter.store_errors == 1
+
+
+def test_distributed_cost_reserves_what_it_needs(store):
+    """
+    Test that the distributed limiter reserves enough requests in one store call for a request whose
+    cost is over the reservation batch.
+    :param store: a started FakeRedisServer
+    :return: assertions to verify the weighted requests and store calls
+    """
+    limiter = distributed(store, limit=10, period=60, batch=2)
+    assert limiter.check("1.1.1.1", cost=6)[0] is True
+    assert limiter.store_calls == 1
+    assert limiter.check("1.1.1.1", cost=6)[0] is False
+    assert limiter.check("1.1.1.1", cost=4)[0] is True
+    assert limiter.is_allowed("1.1.1.1")[0] is False
+
+
+def test_create_rate_limiter_from_env(monkeypatch, store):
+    """
+    Test that RATE_LIMIT_BACKEND selects the limiter implementation.
+    :param monkeypatch: a pytest fixture for monkeypatching
+    :param store: a started FakeRedisServer
+    :return: assertions to verify the selection
+    """
+    assert type(create_rate_limiter()) is RateLimiter
+
+    monkeypatch.setenv("RATE_LIMIT_BACKEND", "redis")
+    monkeypatch.setenv("RATE_LIMIT_REDIS_URL", store.url)
+    monkeypatch.setenv("RATE_LIMIT_FAIL_OPEN", "false")
+    limiter = create_rate_limiter(limit=20, period=30)
+    assert isinstance(limiter, DistributedRateLimiter)
+    assert (limiter.limit, limiter.period, limiter.batch, limiter.fail_open) == (20, 30, 2, False)
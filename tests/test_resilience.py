@@ -0,0 +1,125 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from services.resilience import BreakerPolicy, Bulkhead, BulkheadFull, CircuitBreaker, CircuitOpen
+
+
+def failing():
+    """
+    Simulates a failed upstream call.
+    """
+    raise ConnectionError("upstream down")
+
+
+def open_breaker(breaker: CircuitBreaker):
+    """
+    Drives a breaker to the open state with consecutive failures.
+    """
+    for _ in range(breaker.policy.failure_threshold):
+        with pytest.raises(ConnectionError):
+            breaker.call(failing)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    """
+    Test that the circuit opens at the failure threshold and then rejects calls without running them.
+    :return: assertions on the breaker state
+    """
+    breaker = CircuitBreaker("pf", BreakerPolicy(failure_threshold=3))
+    open_breaker(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpen):
+        breaker.call(calls.append, 1)
+    assert calls == []
+    assert breaker.stats() == {"state": "open", "failures": 3, "opened": 1, "rejected": 1}
+
+
+def test_success_resets_failure_count():
+    """
+    Test that only consecutive failures count towards the threshold.
+    :return: assertions on the breaker state
+    """
+    breaker = CircuitBreaker("pf", BreakerPolicy(failure_threshold=2))
+    with pytest.raises(ConnectionError):
+        breaker.call(failing)
+    breaker.call(lambda: "ok")
+    with pytest.raises(ConnectionError):
+        breaker.call(failing)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failure_predicate_and_ignored_exceptions():
+    """
+    Test that returned values can count as failures and ignored exceptions do not.
+    :return: assertions on the failure count
+    """
+    breaker = CircuitBreaker("pf", BreakerPolicy(failure_threshold=5))
+    breaker.call(lambda: 503, is_failure=lambda status: status >= 500)
+    assert breaker.failures == 1
+
+    with pytest.raises(KeyError):
+        breaker.call(lambda: {}["missing"], ignore=(KeyError,))
+    assert breaker.failures == 1
+
+
+def test_half_open_probe_closes_or_reopens():
+    """
+    Test that after the recovery timeout a successful probe closes the circuit and a failed one reopens it.
+    :return: assertions on the breaker state
+    """
+    breaker = CircuitBreaker("pf", BreakerPolicy(failure_threshold=1, recovery_timeout=30))
+    with patch("services.resilience.time.monotonic", return_value=100.0):
+        open_breaker(breaker)
+
+    with patch("services.resilience.time.monotonic", return_value=131.0):
+        with pytest.raises(ConnectionError):
+            breaker.call(failing)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.opened == 2
+
+    with patch("services.resilience.time.monotonic", return_value=162.0):
+        assert breaker.call(lambda: "ok") == "ok"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_limits_probe_calls():
+    """
+    Test that only `half_open_max_calls` probes run at once while half-open.
+    :return: assertions on the rejected probe
+    """
+    breaker = CircuitBreaker("pf", BreakerPolicy(failure_threshold=1, recovery_timeout=0, half_open_max_calls=1))
+    open_breaker(breaker)
+    probe_started, release_probe = threading.Event(), threading.Event()
+
+    def slow_probe():
+        probe_started.set()
+        release_probe.wait(1)
+
+    thread = threading.Thread(target=breaker.call, args=(slow_probe,))
+    thread.start()
+    probe_started.wait(1)
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: "ok")
+    release_probe.set()
+    thread.join()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_bulkhead_rejects_when_full():
+    """
+    Test that a bulkhead rejects calls beyond its capacity and frees slots on exit.
+    :return: assertions on the bulkhead usage
+    """
+    bulkhead = Bulkhead("pf", max_concurrent=1, max_wait=0.01)
+    with bulkhead:
+        assert bulkhead.stats()["active"] == 1
+        with pytest.raises(BulkheadFull):
+            with bulkhead:
+                pass
+    with bulkhead:
+        pass
+    assert bulkhead.stats() == {"max_concurrent": 1, "active": 0, "rejected": 1}
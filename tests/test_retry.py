@@ -0,0 +1,109 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+from services.retry import RetryBudget, RetryPolicy, RetryStats
+from utils.deadline import deadline_from_header, remaining_time, request_deadline_var
+
+
+def test_backoff_is_jittered_and_capped():
+    """
+    Test that the backoff stays within the exponential bound and never exceeds max_delay.
+    :return: assertions on the computed delays
+    """
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.3)
+    for retry, bound in [(1, 0.1), (2, 0.2), (3, 0.3), (10, 0.3)]:
+        delays = [policy.backoff(retry) for _ in range(200)]
+        assert all(0 <= delay <= bound for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_policy_from_env(monkeypatch):
+    """
+    Test that the retry policy is read from the environment.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the policy
+    """
+    monkeypatch.setenv("SERASA_RETRY_MAX_ATTEMPTS", "5")
+    monkeypatch.setenv("SERASA_RETRY_STATUSES", "500, 503")
+    monkeypatch.setenv("SERASA_RETRY_BUDGET_RATIO", "0.2")
+    policy = RetryPolicy.from_env()
+    assert (policy.max_attempts, policy.retry_statuses, policy.budget_ratio) == (5, frozenset({500, 503}), 0.2)
+
+
+def test_policy_needs_an_attempt(monkeypatch):
+    """
+    Test that a policy without any attempt is rejected when it is built.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the raised errors
+    """
+    monkeypatch.setenv("SERASA_RETRY_MAX_ATTEMPTS", "0")
+    with pytest.raises(ValueError):
+        RetryPolicy.from_env()
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=-1)
+    assert RetryPolicy(max_attempts=1).max_attempts == 1
+
+
+def test_budget_allows_a_share_of_traffic():
+    """
+    Test that the budget grants about `ratio` retries per first attempt.
+    :return: assertions on the granted retries
+    """
+    budget = RetryBudget(ratio=0.25, min_per_sec=0)
+    for _ in range(20):
+        budget.deposit()
+    granted = sum(budget.withdraw() for _ in range(20))
+    assert granted == 5
+
+
+def test_budget_trickle_and_cap():
+    """
+    Test that the budget refills over time up to its cap.
+    :return: assertions on the balance
+    """
+    with patch("services.retry.time.monotonic", return_value=100.0):
+        budget = RetryBudget(ratio=0, min_per_sec=1, cap=3)
+    with patch("services.retry.time.monotonic", return_value=160.0):
+        assert sum(budget.withdraw() for _ in range(5)) == 3
+
+
+def test_retry_stats_per_endpoint():
+    """
+    Test that counters are kept per endpoint.
+    :return: assertions on the snapshot
+    """
+    stats = RetryStats()
+    stats.incr("pf", "retries")
+    stats.incr("pf", "retries")
+    stats.incr("pj", "gave_up")
+    snapshot = stats.snapshot()
+    assert snapshot["pf"]["retries"] == 2
+    assert snapshot["pj"] == {"attempts": 0, "retries": 0, "budget_exhausted": 0, "deadline_exceeded": 0, "gave_up": 1}
+
+
+@pytest.mark.parametrize("header, expected", [("2.5", 2.5), (None, 15), ("abc", 15), ("-1", 15), ("1000", 60)])
+def test_deadline_from_header(monkeypatch, header, expected):
+    """
+    Test that the deadline comes from the header, falls back to the default and is bounded.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :param header: the X-Request-Timeout value
+    :param expected: the expected timeout in seconds
+    :return: assertion on the deadline
+    """
+    monkeypatch.delenv("SERASA_REQUEST_TIMEOUT", raising=False)
+    assert deadline_from_header(header) - time.monotonic() == pytest.approx(expected, abs=0.1)
+
+
+def test_remaining_time():
+    """
+    Test that the remaining time follows the deadline of the current context.
+    :return: assertions on the remaining time
+    """
+    assert remaining_time() is None
+    token = request_deadline_var.set(time.monotonic() + 5)
+    try:
+        assert remaining_time() == pytest.approx(5, abs=0.1)
+    finally:
+        request_deadline_var.reset(token)
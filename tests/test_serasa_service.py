@@ -1,8 +1,15 @@
 import pytest
+import threading
 import time
 from unittest.mock import patch, MagicMock
 
+import requests
+
+from services.http_transport import TransportConfig, build_session
 from services.serasa_service import SerasaService
+from services.validation import check_document
+from utils.deadline import request_deadline_var
+from utils.metrics import CACHE_LOOKUPS
 
 
 @pytest.fixture
@@ -14,7 +21,9 @@ def service(monkeypatch):
     """
     monkeypatch.setenv("MOCK_URL", "http://mock-serasa")
     monkeypatch.setenv("SERASA_AUTH_TOKEN", "fake-token")
-    return SerasaService()
+    service = SerasaService()
+    yield service
+    service.close()
 
 
 def make_response(status_code=200, json_data=None):
@@ -30,29 +39,38 @@ def make_response(status_code=200, json_data=None):
     return resp
 
 
+def fresh_entry(data):
+    """
+    Helper function to build a cache entry as stored by the service for a fresh report.
+    :param data: a dictionary representing the report payload
+    :return: a dictionary representing the cache entry
+    """
+    return {"data": data, "fresh_until": time.time() + 60}
+
+
 # -------------------
 # __get_token
 # -------------------
-@patch("services.serasa_service.requests.post")
+@patch("requests.Session.post")
 def test_get_token_success(mock_post, service):
     """
     Test successful token retrieval.
-    :param mock_post: a mock for requests.post
+    :param mock_post: a mock for the pooled session post
     :param service: a SerasaService instance
     :return: assertions on token retrieval
     """
     mock_post.return_value = make_response(200, {"accessToken": "abc123", "expiresIn": 60})
     token = service._SerasaService__get_token(force=True)
     assert token == "abc123"
-    assert service.token_cache["token"] == "abc123"
-    assert service.token_cache["expires_at"] > time.time()
+    assert service.token_manager.token == "abc123"
+    assert service.token_manager.expires_at > time.time()
 
 
-@patch("services.serasa_service.requests.post")
+@patch("requests.Session.post")
 def test_get_token_failure(mock_post, service):
     """
     Test token retrieval failure.
-    :param mock_post: a mock for requests.post
+    :param mock_post: a mock for the pooled session post
     :param service: a SerasaService instance
     :return: assertion on exception raised
     """
@@ -64,11 +82,9 @@ def test_get_token_failure(mock_post, service):
 # -------------------
 # consult_cpf
 # -------------------
-@patch("services.serasa_service.validate_cpf", return_value=False)
-def test_consult_cpf_invalid(mock_validate, service):
+def test_consult_cpf_invalid(service):
     """
     Test CPF validation failure.
-    :param mock_validate: a mock for validate_cpf
     :param service: a SerasaService instance
     :return: assertions on error response
     """
@@ -77,27 +93,24 @@ def test_consult_cpf_invalid(mock_validate, service):
     assert "error" in data
 
 
-@patch("services.serasa_service.validate_cpf", return_value=True)
-def test_consult_cpf_cache_hit(mock_validate, service):
+def test_consult_cpf_cache_hit(service):
     """
     Test CPF cache hit.
-    :param mock_validate: a mock for validate_cpf
     :param service: a SerasaService instance
     :return: a assertions on cached response
     """
-    service.cache["12345678909"] = {"foo": "bar"}
-    data, status = service.consult_cpf("12345678909")
+    service.cache["pf:12345678909"] = fresh_entry({"foo": "bar"})
+    data, status = service.consult_cpf("123.456.789-09")
     assert status == 200
     assert data["cached"] is True
+    assert data["cache_tier"] == "l1"
 
 
-@patch("services.serasa_service.validate_cpf", return_value=True)
 @patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
-def test_consult_cpf_not_found(mock_request, mock_validate, service):
+def test_consult_cpf_not_found(mock_request, service):
     """
     Test CPF not found in Serasa service.
     :param mock_request: a mock for the request_with_retry method
-    :param mock_validate: a mock for validate_cpf
     :param service: a SerasaService instance
     :return: a assertions on 404 response
     """
@@ -107,13 +120,11 @@ def test_consult_cpf_not_found(mock_request, mock_validate, service):
     assert "error" in data
 
 
-@patch("services.serasa_service.validate_cpf", return_value=True)
 @patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
-def test_consult_cpf_service_error(mock_request, mock_validate, service):
+def test_consult_cpf_service_error(mock_request, service):
     """
     Test CPF service error handling.
     :param mock_request: a mock for the request_with_retry method
-    :param mock_validate: a mock for validate_cpf
     :param service: a SerasaService instance
     :return: a assertions on 503 response
     """
@@ -122,13 +133,11 @@ def test_consult_cpf_service_error(mock_request, mock_validate, service):
     assert status == 503
 
 
-@patch("services.serasa_service.validate_cpf", return_value=True)
 @patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
-def test_consult_cpf_success(mock_request, mock_validate, service):
+def test_consult_cpf_success(mock_request, service):
     """
     Test successful CPF consultation.
     :param mock_request: a mock for the request_with_retry method
-    :param mock_validate: a mock for validate_cpf
     :param service: a SerasaService instance
     :return: a assertions on successful response and caching
     """
@@ -136,17 +145,16 @@ def test_consult_cpf_success(mock_request, mock_validate, service):
     data, status = service.consult_cpf("12345678909")
     assert status == 200
     assert data["cached"] is False
-    assert service.cache["12345678909"] == {"report": "ok"}
+    assert service.cache["pf:12345678909"]["data"] == {"report": "ok"}
+    assert mock_request.call_args.args[1] == "12345678909"
 
 
 # -------------------
 # consult_cnpj
 # -------------------
-@patch("services.serasa_service.validate_cnpj", return_value=False)
-def test_consult_cnpj_invalid(mock_validate, service):
+def test_consult_cnpj_invalid(service):
     """
     Test CNPJ validation failure.
-    :param mock_validate: a mock for validate_cnpj
     :param service: a SerasaService instance
     :return: an assertions on error response
     """
@@ -154,27 +162,23 @@ def test_consult_cnpj_invalid(mock_validate, service):
     assert status == 400
 
 
-@patch("services.serasa_service.validate_cnpj", return_value=True)
-def test_consult_cnpj_cache_hit(mock_validate, service):
+def test_consult_cnpj_cache_hit(service):
     """
     Test CNPJ cache hit.
-    :param mock_validate: a mock for validate_cnpj
     :param service: a SerasaService instance
     :return: an assertions on cached response
     """
-    service.cache["12345678000195"] = {"foo": "bar"}
-    data, status = service.consult_cnpj("12345678000195")
+    service.cache["pj:12345678000195"] = fresh_entry({"foo": "bar"})
+    data, status = service.consult_cnpj("12.345.678/0001-95")
     assert status == 200
     assert data["cached"] is True
 
 
-@patch("services.serasa_service.validate_cnpj", return_value=True)
 @patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
-def test_consult_cnpj_not_found(mock_request, mock_validate, service):
+def test_consult_cnpj_not_found(mock_request, service):
     """
     Test CNPJ not found in Serasa service.
     :param mock_request: a mock for the request_with_retry method
-    :param mock_validate: a mock for validate_cnpj
     :param service: a SerasaService instance
     :return: an assertions on 404 response
     """
@@ -183,13 +187,11 @@ def test_consult_cnpj_not_found(mock_request, mock_validate, service):
     assert status == 404
 
 
-@patch("services.serasa_service.validate_cnpj", return_value=True)
 @patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
-def test_consult_cnpj_service_error(mock_request, mock_validate, service):
+def test_consult_cnpj_service_error(mock_request, service):
     """
     Test CNPJ service error handling.
     :param mock_request: a mock for the request_with_retry method
-    :param mock_validate: a mock for validate_cnpj
     :param service: a SerasaService instance
     :return: an assertions on 503 response
     """
@@ -198,13 +200,11 @@ def test_consult_cnpj_service_error(mock_request, mock_validate, service):
     assert status == 503
 
 
-@patch("services.serasa_service.validate_cnpj", return_value=True)
 @patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
-def test_consult_cnpj_success(mock_request, mock_validate, service):
+def test_consult_cnpj_success(mock_request, service):
     """
     Test successful CNPJ consultation.
     :param mock_request: a mock for the request_with_retry method
-    :param mock_validate: a mock for validate_cnpj
     :param service: a SerasaService instance
     :return: an assertions on successful response and caching
     """
@@ -212,19 +212,19 @@ def test_consult_cnpj_success(mock_request, mock_validate, service):
     data, status = service.consult_cnpj("12345678000195")
     assert status == 200
     assert data["cached"] is False
-    assert service.cache["12345678000195"] == {"company": "ok"}
+    assert service.cache["pj:12345678000195"]["data"] == {"company": "ok"}
 
 
 # -------------------
 # __request_with_retry
 # -------------------
-@patch("services.serasa_service.requests.get")
+@patch("requests.Session.get")
 @patch("services.serasa_service.SerasaService._SerasaService__get_token", return_value="t1")
 def test_request_with_retry_success(mock_get_token, mock_get, service):
     """
     Test successful request without token expiration.
     :param mock_get_token: a mock for the __get_token method
-    :param mock_get: a mock for requests.get
+    :param mock_get: a mock for the pooled session get
     :param service: a SerasaService instance
     :return: an assertions on successful response
     """
@@ -234,13 +234,13 @@ def test_request_with_retry_success(mock_get_token, mock_get, service):
     mock_get_token.assert_called_once()
 
 
-@patch("services.serasa_service.requests.get")
+@patch("requests.Session.get")
 @patch("services.serasa_service.SerasaService._SerasaService__get_token", side_effect=["t1", "t2"])
 def test_request_with_retry_token_expired(mock_get_token, mock_get, service):
     """
     Test request with token expiration and retry.
     :param mock_get_token: a mock for the __get_token method
-    :param mock_get: a mock for requests.get
+    :param mock_get: a mock for the pooled session get
     :param service: a SerasaService instance
     :return: an assertions on successful response after retry
     """
@@ -249,3 +249,648 @@ def test_request_with_retry_token_expired(mock_get_token, mock_get, service):
     resp = service._SerasaService__request_with_retry("http://mock-serasa/x", "123")
     assert resp.status_code == 200
     assert mock_get_token.call_count == 2
+    assert mock_get_token.call_args.kwargs == {"force": True, "stale_token": "t1"}
+
+
+@patch("requests.Session.get")
+@patch("services.serasa_service.SerasaService._SerasaService__get_token", return_value="t1")
+def test_request_with_retry_throttled(mock_get_token, mock_get, service):
+    """
+    Test that a 429 is retried after the wait requested by the upstream.
+    :param mock_get_token: a mock for the __get_token method
+    :param mock_get: a mock for the pooled session get
+    :param service: a SerasaService instance
+    :return: assertions on the retried response and the limiter counters
+    """
+    throttled = make_response(429)
+    throttled.headers = {"Retry-After": "0.05"}
+    mock_get.side_effect = [throttled, make_response(200, {"ok": True})]
+
+    start = time.monotonic()
+    resp = service._SerasaService__request_with_retry("http://mock-serasa/x", "123")
+    assert resp.status_code == 200
+    assert time.monotonic() - start >= 0.05
+    assert service.upstream_limiter.stats()["throttled"] == 1
+    assert service.upstream_limiter.limit < 10
+
+
+@patch("requests.Session.get")
+@patch("services.serasa_service.SerasaService._SerasaService__get_token", return_value="t1")
+def test_consult_cpf_shed_when_upstream_pauses_too_long(mock_get_token, mock_get, monkeypatch):
+    """
+    Test that a retry the limiter cannot admit within the queue timeout is shed as a 503.
+    :param mock_get_token: a mock for the __get_token method
+    :param mock_get: a mock for the pooled session get
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the response and the shed counter
+    """
+    monkeypatch.setenv("SERASA_UPSTREAM_QUEUE_TIMEOUT", "0.1")
+    service = SerasaService()
+    throttled = make_response(429, {"retryAfter": 900})
+    throttled.headers = {}
+    mock_get.return_value = throttled
+
+    data, status = service.consult_cpf("52998224725")
+    assert status == 503
+    assert "busy" in data["error"]
+    assert mock_get.call_count == 1
+    assert service.stats()["upstream"]["shed"] == 1
+    service.close()
+
+
+# -------------------
+# pooled transport
+# -------------------
+def test_transport_config_from_env(monkeypatch):
+    """
+    Test that pool sizes and timeouts are read from the environment.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the transport configuration
+    """
+    monkeypatch.setenv("SERASA_POOL_MAXSIZE", "8")
+    monkeypatch.setenv("SERASA_MAX_CONNECTIONS", "4")
+    monkeypatch.setenv("SERASA_CONNECT_TIMEOUT", "1.5")
+    monkeypatch.setenv("SERASA_READ_TIMEOUT", "7")
+    service = SerasaService()
+    assert service.transport.pool_maxsize == 8
+    assert service.transport.max_connections == 4
+    assert service.transport.timeout == (1.5, 7.0)
+    adapter = service.session.get_adapter("http://mock-serasa")
+    assert adapter._pool_maxsize == 4
+    assert adapter._pool_block is True
+
+
+def test_full_pool_wait_is_bounded_by_the_connect_timeout():
+    """
+    Test that a call waiting for a connection of a full pool gives up after its connect timeout
+    instead of blocking until one is released.
+    :return: assertions on the raised error and the time waited
+    """
+    session = build_session(TransportConfig(pool_maxsize=1, max_connections=1))
+    # a CA bundle from the environment would select another pool than the one held below
+    session.trust_env = False
+    request = session.prepare_request(requests.Request("GET", "http://mock-serasa/x"))
+    pool = session.get_adapter(request.url).get_connection_with_tls_context(request, verify=True)
+    held = pool._get_conn()
+    try:
+        start = time.perf_counter()
+        with pytest.raises(requests.ConnectTimeout):
+            session.get("http://mock-serasa/x", timeout=(0.1, 5))
+        assert time.perf_counter() - start < 1
+    finally:
+        pool._put_conn(held)
+        session.close()
+
+
+@patch("requests.Session.get")
+@patch("services.serasa_service.SerasaService._SerasaService__get_token", return_value="t1")
+def test_request_with_retry_uses_timeouts(mock_get_token, mock_get, service):
+    """
+    Test that upstream calls go through the pooled session with the configured timeouts.
+    :param mock_get_token: a mock for the __get_token method
+    :param mock_get: a mock for the pooled session get
+    :param service: a SerasaService instance
+    :return: an assertion on the timeout passed to the session
+    """
+    mock_get.return_value = make_response(200, {"ok": True})
+    service._SerasaService__request_with_retry("http://mock-serasa/x", "123")
+    assert mock_get.call_args.kwargs["timeout"] == service.transport.timeout
+
+
+# -------------------
+# consult_batch
+# -------------------
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_consult_batch_mixed(mock_request, service):
+    """
+    Test a batch mixing cache hits, upstream calls, invalid and unknown documents.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on per-document results
+    """
+    service.cache["pf:12345678909"] = fresh_entry({"cached": "pf"})
+
+    def fake_request(url, document_id, endpoint):
+        if document_id == "11222333000181":
+            return make_response(404)
+        return make_response(200, {"report": document_id})
+
+    mock_request.side_effect = fake_request
+    documents = ["123.456.789-09", "12345678000195", "111.111.111-11", "123", "11.222.333/0001-81"]
+    data, status = service.consult_batch(documents)
+
+    assert status == 200
+    assert data["total"] == 5
+    results = data["results"]
+    assert [item["document"] for item in results] == documents
+    assert [item["status"] for item in results] == [200, 200, 400, 400, 404]
+    assert results[0]["cached"] is True
+    assert results[1]["type"] == "cnpj" and results[1]["data"] == {"report": "12345678000195"}
+    assert results[2]["error"] == "Invalid CPF."
+    assert mock_request.call_count == 2
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_consult_batch_service_error(mock_request, service):
+    """
+    Test that upstream failures inside a batch are reported per document.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the 503 item and the deduplicated call
+    """
+    mock_request.return_value = make_response(500)
+    data, status = service.consult_batch(["12345678909", "123.456.789-09"])
+    assert status == 200
+    assert [item["status"] for item in data["results"]] == [503, 503]
+    assert mock_request.call_count == 1
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_stream_batch_in_completion_order(mock_request, service):
+    """
+    Test that a streamed batch yields invalid documents and cache hits first and each upstream result as
+    soon as it is ready, repeating duplicates, with one upstream call per distinct document.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the order of the results
+    """
+    service.cache["pf:52998224725"] = fresh_entry({"cached": "pf"})
+    release = threading.Event()
+
+    def fake_request(url, document_id, endpoint):
+        if document_id == "12345678909":
+            release.wait(5)
+        else:
+            release.set()
+        return make_response(200, {"report": document_id})
+
+    mock_request.side_effect = fake_request
+    documents = ["123.456.789-09", "12345678000195", "123", "52998224725", "12345678909"]
+    items, status = service.stream_batch(documents, ordered=False)
+
+    assert status == 200
+    assert [item["document"] for item in items] == [
+        "123",
+        "52998224725",
+        "12345678000195",
+        "123.456.789-09",
+        "12345678909",
+    ]
+    assert mock_request.call_count == 2
+
+
+def count_misses() -> float:
+    """
+    Helper function to sum the cache misses recorded so far, for every report type.
+    :return: a float with the number of misses
+    """
+    return sum(value for (report_type, result), value in CACHE_LOOKUPS.collect().items() if result == "miss")
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_upstream_fetch_counts_one_cache_miss(mock_request, service):
+    """
+    Test that a document fetched from the upstream, alone or in a batch, counts a single cache miss.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the miss counts
+    """
+    mock_request.return_value = make_response(200, {"report": "ok"})
+
+    before = count_misses()
+    service.consult_cpf("12345678909")
+    assert count_misses() - before == 1
+
+    before = count_misses()
+    items, status = service.stream_batch(["52998224725", "12345678909"])
+    assert [item["status"] for item in items] == [200, 200]
+    assert count_misses() - before == 1
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_upstream_fetch_counts_one_miss_per_tier(mock_request, monkeypatch, tmp_path):
+    """
+    Test that the per-tier counters of a tiered cache record one miss in each tier for a document
+    fetched from the upstream, and one L1 hit when it is consulted again.
+    :param mock_request: a mock for the request_with_retry method
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :param tmp_path: a temporary directory for the SQLite database
+    :return: assertions on the per-tier counters
+    """
+    monkeypatch.setenv("MOCK_URL", "http://mock-serasa")
+    monkeypatch.setenv("SERASA_AUTH_TOKEN", "fake-token")
+    monkeypatch.setenv("SERASA_CACHE_BACKEND", "sqlite")
+    monkeypatch.setenv("SERASA_CACHE_SQLITE_PATH", str(tmp_path / "l2.sqlite3"))
+    service = SerasaService()
+    mock_request.return_value = make_response(200, {"report": "ok"})
+    try:
+        service.consult_cpf("12345678909")
+        service.consult_cpf("12345678909")
+        stats = service.cache.stats()
+    finally:
+        service.close()
+
+    assert (stats["l1"]["hits"], stats["l1"]["misses"]) == (1, 1)
+    assert (stats["l2"]["hits"], stats["l2"]["misses"]) == (0, 1)
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_consult_document_calls_before_fetch_on_misses_only(mock_request, service):
+    """
+    Test that the before-fetch callback of a consultation runs only when the upstream is called, after a
+    single cache lookup.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the callback calls and miss counts
+    """
+    mock_request.return_value = make_response(200, {"report": "ok"})
+    document = check_document("12345678909").document()
+    before_fetch = MagicMock()
+
+    before = count_misses()
+    data, status = service.consult_document(document, before_fetch=before_fetch)
+    assert (status, data["cached"]) == (200, False)
+    assert count_misses() - before == 1
+
+    data, status = service.consult_document(document, before_fetch=before_fetch)
+    assert (status, data["cached"]) == (200, True)
+    assert before_fetch.call_count == 1
+    assert mock_request.call_count == 1
+
+
+@pytest.mark.parametrize("documents", [None, [], [123], "12345678909"])
+def test_consult_batch_invalid_payload(documents, service):
+    """
+    Test that malformed batch payloads are rejected.
+    :param documents: an invalid value for the documents field
+    :param service: a SerasaService instance
+    :return: an assertion on the 400 response
+    """
+    data, status = service.consult_batch(documents)
+    assert status == 400
+
+
+def test_consult_batch_too_large(service):
+    """
+    Test that batches above the configured size are rejected.
+    :param service: a SerasaService instance
+    :return: an assertion on the 400 response
+    """
+    service.batch_max_size = 2
+    data, status = service.consult_batch(["12345678909"] * 3)
+    assert status == 400
+    assert "limit" in data["error"]
+
+
+# -------------------
+# single-flight coalescing
+# -------------------
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_concurrent_cache_misses_share_one_upstream_call(mock_request, service):
+    """
+    Test that concurrent lookups of the same CPF, formatted or not, trigger a single upstream call.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the upstream call count and counters
+    """
+    import threading
+
+    release = threading.Event()
+
+    def slow_request(url, document_id, endpoint):
+        release.wait(timeout=5)
+        return make_response(200, {"report": "ok"})
+
+    mock_request.side_effect = slow_request
+    results = []
+    documents = ["12345678909", "123.456.789-09"] * 4
+    threads = [threading.Thread(target=lambda d=d: results.append(service.consult_cpf(d))) for d in documents]
+    for thread in threads:
+        thread.start()
+    threading.Timer(0.2, release.set).start()
+    for thread in threads:
+        thread.join()
+
+    assert mock_request.call_count == 1
+    assert [status for _, status in results] == [200] * len(documents)
+    stats = service.stats()["singleflight"]
+    assert stats["leader"] == 1
+    assert stats["coalesced"] == len(documents) - 1
+
+
+def test_formatted_and_raw_inputs_share_cache_entry(service):
+    """
+    Test that formatted and digits-only inputs resolve to the same cache entry.
+    :param service: a SerasaService instance
+    :return: assertions on the shared cache entry
+    """
+    with patch("services.serasa_service.SerasaService._SerasaService__request_with_retry") as mock_request:
+        mock_request.return_value = make_response(200, {"report": "ok"})
+        service.consult_cpf("123.456.789-09")
+        data, status = service.consult_cpf("12345678909")
+
+    assert mock_request.call_count == 1
+    assert data["cached"] is True
+    assert list(service.cache.keys()) == ["pf:12345678909"]
+
+
+# -------------------
+# stale-while-revalidate and negative caching
+# -------------------
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_stale_report_is_served_while_revalidating(mock_request, service):
+    """
+    Test that a report past its fresh TTL is served immediately and refreshed once in the background.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the stale response and the refreshed entry
+    """
+    import threading
+
+    release = threading.Event()
+
+    def slow_request(url, document_id, endpoint):
+        release.wait(timeout=5)
+        return make_response(200, {"report": "new"})
+
+    mock_request.side_effect = slow_request
+    service.cache.set("pf:12345678909", {"data": {"report": "old"}, "fresh_until": time.time() - 1}, ttl=60)
+
+    first, status = service.consult_cpf("12345678909")
+    second, _ = service.consult_cpf("123.456.789-09")
+    assert status == 200
+    assert first["stale"] is True and first["data"] == {"report": "old"}
+    assert second["stale"] is True
+
+    release.set()
+    deadline = time.time() + 5
+    while service.cache["pf:12345678909"]["data"] != {"report": "new"} and time.time() < deadline:
+        time.sleep(0.01)
+
+    data, _ = service.consult_cpf("12345678909")
+    assert data["data"] == {"report": "new"}
+    assert "stale" not in data
+    assert mock_request.call_count == 1
+    assert service.stats()["cache"]["stale_served"] == 2
+    assert service.stats()["cache"]["revalidations"] == 1
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_not_found_is_negatively_cached(mock_request, service):
+    """
+    Test that a 404 from the upstream is cached for the negative TTL.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the cached 404
+    """
+    mock_request.return_value = make_response(404)
+    assert service.consult_cpf("12345678909")[1] == 404
+    data, status = service.consult_cpf("12345678909")
+    assert status == 404
+    assert data["cached"] is True
+    assert mock_request.call_count == 1
+    assert service.stats()["cache"]["negative_hits"] == 1
+
+
+def test_cache_policy_per_report_type(monkeypatch):
+    """
+    Test that TTLs can be configured per report type.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the per-type policies
+    """
+    monkeypatch.setenv("SERASA_CACHE_TTL", "300")
+    monkeypatch.setenv("SERASA_PJ_CACHE_TTL", "900")
+    monkeypatch.setenv("SERASA_PF_NEGATIVE_TTL", "0")
+    service = SerasaService()
+    assert service.cache_policies["pf"].fresh_ttl == 300
+    assert service.cache_policies["pf"].negative_ttl == 0
+    assert service.cache_policies["pj"].fresh_ttl == 900
+    assert service.cache_policies["pj"].negative_ttl == 30
+    service.close()
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_negative_caching_can_be_disabled(mock_request, monkeypatch):
+    """
+    Test that a zero negative TTL keeps 404s out of the cache.
+    :param mock_request: a mock for the request_with_retry method
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertion on the upstream call count
+    """
+    monkeypatch.setenv("SERASA_PF_NEGATIVE_TTL", "0")
+    service = SerasaService()
+    mock_request.return_value = make_response(404)
+    service.consult_cpf("12345678909")
+    service.consult_cpf("12345678909")
+    assert mock_request.call_count == 2
+    service.close()
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_circuit_opens_and_serves_cached_report(mock_request, monkeypatch):
+    """
+    Test that consecutive 5xx responses open the PF circuit, after which calls skip the upstream and a
+    report past its stale window is still served from the cache.
+    :param mock_request: a mock for the request_with_retry method
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the responses, upstream calls and breaker state
+    """
+    monkeypatch.setenv("SERASA_BREAKER_FAILURE_THRESHOLD", "2")
+    service = SerasaService()
+    mock_request.return_value = make_response(500)
+    for cpf in ("12345678909", "98765432100"):
+        assert service.consult_cpf(cpf)[1] == 503
+    assert service.stats()["circuit_breakers"]["pf"]["state"] == "open"
+
+    data, status = service.consult_cpf("52998224725")
+    assert status == 503
+    assert "unavailable" in data["error"]
+    assert mock_request.call_count == 2
+
+    expired = {"data": {"score": 700}, "fresh_until": time.time() - 120, "stale_until": time.time() - 60}
+    service.cache["pf:52998224725"] = expired
+    data, status = service.consult_cpf("52998224725")
+    assert status == 200
+    assert data["data"] == {"score": 700}
+    assert data["stale"] is True
+    assert mock_request.call_count == 2
+
+    # the PJ circuit is independent
+    mock_request.return_value = make_response(200, {"company": "ok"})
+    assert service.consult_cnpj("12345678000195")[1] == 200
+    service.close()
+
+
+def test_bulkheads_isolate_report_types(monkeypatch):
+    """
+    Test that a PF bulkhead without free slots rejects PF calls while PJ calls go through.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the responses and bulkhead counters
+    """
+    monkeypatch.setenv("SERASA_PF_BULKHEAD", "1")
+    monkeypatch.setenv("SERASA_BULKHEAD_MAX_WAIT", "0")
+    service = SerasaService()
+    with patch("services.serasa_service.SerasaService._SerasaService__request_with_retry") as mock_request:
+        mock_request.return_value = make_response(200, {"ok": True})
+        with service.bulkheads["pf"]:
+            data, status = service.consult_cpf("12345678909")
+            assert status == 503
+            assert service.consult_cnpj("12345678000195")[1] == 200
+    assert service.stats()["bulkheads"]["pf"]["rejected"] == 1
+    assert service.stats()["circuit_breakers"]["pf"]["failures"] == 0
+    service.close()
+
+
+@patch("services.serasa_service.SerasaService._SerasaService__request_with_retry")
+def test_report_past_stale_window_is_refetched(mock_request, service):
+    """
+    Test that a report kept only for fallback is not served while the upstream is reachable.
+    :param mock_request: a mock for the request_with_retry method
+    :param service: a SerasaService instance
+    :return: assertions on the response and the stored entry
+    """
+    expired = {"data": {"score": 1}, "fresh_until": time.time() - 120, "stale_until": time.time() - 60}
+    service.cache["pf:52998224725"] = expired
+    mock_request.return_value = make_response(200, {"score": 2})
+    data, status = service.consult_cpf("52998224725")
+    assert status == 200
+    assert data["data"] == {"score": 2}
+    assert data["cached"] is False
+    assert service.cache["pf:52998224725"]["stale_until"] > time.time()
+
+
+# -------------------
+# retry policy
+# -------------------
+@pytest.fixture
+def retrying_service(monkeypatch):
+    """
+    Fixture to create a SerasaService with fast retries and a valid token.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: a SerasaService instance
+    """
+    monkeypatch.setenv("SERASA_RETRY_BASE_DELAY", "0.001")
+    monkeypatch.setenv("SERASA_RETRY_BUDGET_MIN_PER_SEC", "0")
+    service = SerasaService()
+    service.retry_budget.balance = 10
+    with patch("services.serasa_service.SerasaService._SerasaService__get_token", return_value="t1"):
+        yield service
+    service.close()
+
+
+@patch("requests.Session.get")
+def test_transient_failures_are_retried(mock_get, retrying_service):
+    """
+    Test that a 503 and a connection error are retried and counted for the endpoint.
+    :param mock_get: a mock for the pooled session get
+    :param retrying_service: a SerasaService instance
+    :return: assertions on the response and counters
+    """
+    mock_get.side_effect = [make_response(503), requests.ConnectionError("reset"), make_response(200, {"ok": True})]
+    resp = retrying_service._SerasaService__request_with_retry("http://mock-serasa/x", "123", "pf")
+    assert resp.status_code == 200
+    assert retrying_service.retry_stats.snapshot()["pf"]["attempts"] == 3
+    assert retrying_service.retry_stats.snapshot()["pf"]["retries"] == 2
+
+
+@patch("requests.Session.get")
+def test_retries_stop_at_max_attempts(mock_get, retrying_service):
+    """
+    Test that the last response is returned once the attempts are used up.
+    :param mock_get: a mock for the pooled session get
+    :param retrying_service: a SerasaService instance
+    :return: assertions on the response and counters
+    """
+    mock_get.return_value = make_response(502)
+    resp = retrying_service._SerasaService__request_with_retry("http://mock-serasa/x", "123", "pj")
+    assert resp.status_code == 502
+    assert mock_get.call_count == 3
+    assert retrying_service.retry_stats.snapshot()["pj"]["gave_up"] == 1
+
+
+@patch("requests.Session.get")
+def test_non_retryable_status_is_not_retried(mock_get, retrying_service):
+    """
+    Test that statuses outside the policy are returned at once.
+    :param mock_get: a mock for the pooled session get
+    :param retrying_service: a SerasaService instance
+    :return: assertions on the call count
+    """
+    mock_get.return_value = make_response(500)
+    assert retrying_service._SerasaService__request_with_retry("http://mock-serasa/x", "123", "pf").status_code == 500
+    assert mock_get.call_count == 1
+
+
+@patch("requests.Session.get")
+def test_retry_budget_exhausted(mock_get, retrying_service):
+    """
+    Test that retries stop when the budget runs out.
+    :param mock_get: a mock for the pooled session get
+    :param retrying_service: a SerasaService instance
+    :return: assertions on the call count and counters
+    """
+    retrying_service.retry_budget.balance = 0
+    mock_get.return_value = make_response(503)
+    retrying_service._SerasaService__request_with_retry("http://mock-serasa/x", "123", "pf")
+    assert mock_get.call_count == 1
+    assert retrying_service.retry_stats.snapshot()["pf"]["budget_exhausted"] == 1
+
+
+@patch("requests.Session.get")
+def test_retries_never_cross_the_deadline(mock_get, retrying_service):
+    """
+    Test that no retry starts past the request deadline, and that call timeouts are shortened to it.
+    :param mock_get: a mock for the pooled session get
+    :param retrying_service: a SerasaService instance
+    :return: assertions on the exception, timeouts and counters
+    """
+    mock_get.side_effect = requests.Timeout("read timeout")
+    token = request_deadline_var.set(time.monotonic() + 0.5)
+    try:
+        with patch.object(retrying_service.retry_policy.__class__, "backoff", return_value=1.0):
+            with pytest.raises(requests.Timeout):
+                retrying_service._SerasaService__request_with_retry("http://mock-serasa/x", "123", "pf")
+    finally:
+        request_deadline_var.reset(token)
+
+    assert mock_get.call_count == 1
+    connect_timeout, read_timeout = mock_get.call_args.kwargs["timeout"]
+    assert read_timeout <= 0.5
+    assert retrying_service.retry_stats.snapshot()["pf"]["deadline_exceeded"] == 1
+
+
+@patch("requests.Session.get")
+def test_slow_report_call_is_hedged(mock_get, monkeypatch):
+    """
+    Test that a report call slower than the recent latency percentile is re-sent when hedging is enabled
+    for its report type, with its own copy of the headers, and that the other report type is left alone.
+    :param mock_get: a mock for the pooled session get
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the response and hedging counters
+    """
+    monkeypatch.setenv("SERASA_PF_HEDGE", "true")
+    service = SerasaService()
+    hedger = service.hedgers["pf"]
+    for _ in range(hedger.policy.min_samples):
+        hedger.window.record(0.001)
+    hedger.budget.balance = 1
+    sent = []
+
+    def get(url, headers, timeout):
+        sent.append(headers)
+        if mock_get.call_count == 1:
+            time.sleep(0.3)
+            return make_response(500)
+        return make_response(200, {"ok": True})
+
+    mock_get.side_effect = get
+    try:
+        with patch("services.serasa_service.SerasaService._SerasaService__get_token", return_value="t1"):
+            resp = service._SerasaService__request_with_retry("http://mock-serasa/x", "123", "pf")
+        assert resp.status_code == 200
+        assert service.stats()["hedging"]["pf"]["hedge_wins"] == 1
+        # the concurrent calls never share the headers each one adds its trace context to
+        assert len(sent) == 2 and sent[0] is not sent[1]
+        assert not service.stats()["hedging"]["pj"]["enabled"]
+    finally:
+        service.close()
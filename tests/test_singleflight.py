@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, callers):
+    """
+    Helper that calls `flight.do` from several threads at once.
+    :param flight: a SingleFlight instance
+    :param key: the key shared by all callers
+    :param fn: the function executed by the leader
+    :param callers: an integer with the number of concurrent callers
+    :return: a list with the result or exception seen by each caller
+    """
+    outcomes = []
+    lock = threading.Lock()
+
+    def call():
+        try:
+            result = flight.do(key, fn)
+        except Exception as e:
+            result = e
+        with lock:
+            outcomes.append(result)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_concurrent_calls_are_coalesced():
+    """
+    Test that concurrent callers for the same key share a single execution.
+    :return: assertions on results and counters
+    """
+    flight = SingleFlight()
+    release = threading.Event()
+    executions = []
+
+    def fn():
+        executions.append(1)
+        release.wait(timeout=5)
+        return "report"
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    outcomes = run_concurrently(flight, "cpf:12345678909", fn, 10)
+
+    assert outcomes == ["report"] * 10
+    assert len(executions) == 1
+    assert flight.stats() == {"leader": 1, "coalesced": 9, "in_flight": 0}
+
+
+def test_leader_error_is_shared():
+    """
+    Test that followers receive the exception raised by the leader.
+    :return: assertions on the propagated exceptions
+    """
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(timeout=5)
+        raise ValueError("upstream down")
+
+    timer = threading.Timer(0.2, release.set)
+    timer.start()
+    outcomes = run_concurrently(flight, "cpf:12345678909", fn, 5)
+
+    assert len(outcomes) == 5
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert flight.leader_count == 1
+
+
+def test_sequential_calls_are_not_coalesced():
+    """
+    Test that a new call after the previous one finished executes again.
+    :return: assertions on the counters
+    """
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == 1
+    with pytest.raises(KeyError):
+        flight.do("k", lambda: {}["missing"])
+    assert flight.do("k", lambda: 2) == 2
+    assert flight.stats() == {"leader": 3, "coalesced": 0, "in_flight": 0}
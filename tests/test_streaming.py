@@ -0,0 +1,38 @@
+import asyncio
+import json
+
+from utils.streaming import async_batch_chunks, batch_chunks, wants_ndjson
+
+
+def test_wants_ndjson():
+    """
+    Test the choice between JSON and NDJSON from the Accept header and an explicit format.
+    :return: assertions on the negotiated format
+    """
+    assert wants_ndjson("application/x-ndjson") is True
+    assert wants_ndjson("application/json, application/x-ndjson;q=0.5") is False
+    assert wants_ndjson("application/json;q=0.5, application/x-ndjson") is True
+    assert wants_ndjson("*/*") is False
+    assert wants_ndjson(None) is False
+    assert wants_ndjson("application/x-ndjson", "json") is False
+    assert wants_ndjson(None, "NDJSON") is True
+
+
+def test_batch_chunks():
+    """
+    Test that the streamed JSON body matches the non-streamed batch response and NDJSON has one item per line.
+    :return: assertions on the serialized bodies
+    """
+    items = [{"document": "1", "status": 400}, {"document": "2", "status": 200}]
+    assert json.loads("".join(batch_chunks(iter(items), ndjson=False))) == {"results": items, "total": 2}
+    assert json.loads("".join(batch_chunks(iter([]), ndjson=False))) == {"results": [], "total": 0}
+    assert [json.loads(line) for line in "".join(batch_chunks(iter(items), ndjson=True)).splitlines()] == items
+
+    async def collect():
+        async def source():
+            for item in items:
+                yield item
+
+        return "".join([chunk async for chunk in async_batch_chunks(source(), ndjson=False)])
+
+    assert json.loads(asyncio.run(collect())) == {"results": items, "total": 2}
@@ -0,0 +1,118 @@
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from services.token_manager import TokenManager
+
+
+def make_session(expires_in=60, delay=0.0, status_code=200):
+    """
+    Helper that builds a session mock whose post answers the login endpoint.
+    :param expires_in: an integer with the token lifetime in seconds
+    :param delay: a float with the simulated login latency in seconds
+    :param status_code: an integer representing the HTTP status code
+    :return: a MagicMock simulating a requests.Session
+    """
+    session = MagicMock()
+    counter = {"n": 0}
+    lock = threading.Lock()
+
+    def post(*args, **kwargs):
+        time.sleep(delay)
+        with lock:
+            counter["n"] += 1
+            n = counter["n"]
+        resp = MagicMock()
+        resp.status_code = status_code
+        resp.json.return_value = {"accessToken": f"token-{n}", "expiresIn": expires_in}
+        return resp
+
+    session.post.side_effect = post
+    return session
+
+
+@pytest.fixture
+def manager_factory():
+    """
+    Fixture that builds token managers and stops their refresh threads after the test.
+    :return: a callable creating TokenManager instances
+    """
+    managers = []
+
+    def factory(session, refresh_margin=15):
+        manager = TokenManager(session, "http://mock-serasa/login", {}, (1, 1), refresh_margin=refresh_margin)
+        managers.append(manager)
+        return manager
+
+    yield factory
+    for manager in managers:
+        manager.close()
+
+
+def test_single_login_in_flight(manager_factory):
+    """
+    Test that concurrent callers without a token trigger exactly one login.
+    :param manager_factory: a factory for TokenManager instances
+    :return: assertions on the login count and tokens handed out
+    """
+    session = make_session(delay=0.2)
+    manager = manager_factory(session)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert session.post.call_count == 1
+    assert set(tokens) == {"token-1"}
+    assert manager.stats()["logins"] == 1
+    assert manager.stats()["last_latency"] >= 0.2
+
+
+def test_forced_login_reuses_token_renewed_by_another_thread(manager_factory):
+    """
+    Test that a 401 retry does not log in again when the rejected token was already replaced.
+    :param manager_factory: a factory for TokenManager instances
+    :return: assertions on the login count
+    """
+    session = make_session()
+    manager = manager_factory(session)
+    first = manager.get_token()
+    second = manager.get_token(force=True, stale_token=first)
+    assert second == "token-2"
+    assert manager.get_token(force=True, stale_token=first) == "token-2"
+    assert session.post.call_count == 2
+
+
+def test_background_refresh_before_expiration(manager_factory):
+    """
+    Test that the token is renewed in the background before it expires.
+    :param manager_factory: a factory for TokenManager instances
+    :return: assertions on the refreshed token and counters
+    """
+    session = make_session(expires_in=7)
+    manager = manager_factory(session, refresh_margin=1)
+    assert manager.get_token() == "token-1"
+
+    deadline = time.time() + 3
+    while manager.refresh_count == 0 and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert manager.refresh_count >= 1
+    assert manager.get_token() != "token-1"
+    assert manager.stats()["refreshes"] >= 1
+
+
+def test_login_failure_is_counted(manager_factory):
+    """
+    Test that authentication failures raise and are counted.
+    :param manager_factory: a factory for TokenManager instances
+    :return: assertions on the raised exception and failure count
+    """
+    manager = manager_factory(make_session(status_code=500))
+    with pytest.raises(Exception, match="Error authenticating"):
+        manager.get_token()
+    assert manager.stats()["failures"] == 1
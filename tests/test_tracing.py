@@ -0,0 +1,221 @@
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app import create_app
+from services.serasa_service import SerasaService
+from utils.metrics import HTTP_REQUEST_DURATION
+from utils.tracing import (
+    NOOP_SPAN,
+    BatchSpanProcessor,
+    FileSpanExporter,
+    Tracer,
+    inject,
+    parse_traceparent,
+    span,
+    trace_id_from_correlation_id,
+)
+
+INCOMING_TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+class ListExporter:
+    """
+    Exporter keeping the exported spans in memory.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def make_response(status_code=200, json_data=None):
+    """
+    Helper function to create a mock response object.
+    :param status_code: an integer representing the HTTP status code
+    :param json_data: a dictionary representing the JSON response data
+    :return: a MagicMock object simulating a response
+    """
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = json_data or {}
+    return resp
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """
+    Fixture to create a SerasaService instance with environment variables mocked.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: a SerasaService instance
+    """
+    monkeypatch.setenv("MOCK_URL", "http://mock-serasa")
+    monkeypatch.setenv("SERASA_AUTH_TOKEN", "fake-token")
+    service = SerasaService()
+    yield service
+    service.close()
+
+
+def test_spans_are_noops_without_a_trace():
+    """
+    Test that instrumented code gets the shared no-op span and sends no trace header when tracing is off.
+    :return: assertions on the span and headers
+    """
+    headers = {}
+    with span("validation") as current:
+        inject(headers)
+    assert current is NOOP_SPAN
+    assert headers == {}
+    assert Tracer(enabled=False).start("GET /", "abc") is None
+
+
+def test_trace_ids():
+    """
+    Test that a valid traceparent is joined, an invalid one ignored, and that a UUID correlation ID becomes
+    the trace ID.
+    :return: assertions on the parsed identifiers
+    """
+    assert parse_traceparent(f"00-{INCOMING_TRACE_ID}-00f067aa0ba902b7-01") == (INCOMING_TRACE_ID, "00f067aa0ba902b7", True)
+    assert parse_traceparent(f"00-{INCOMING_TRACE_ID}-00f067aa0ba902b7-00")[2] is False
+    assert parse_traceparent("00-xyz-00f067aa0ba902b7-01") is None
+    assert parse_traceparent(f"00-{'0' * 32}-00f067aa0ba902b7-01") is None
+    assert parse_traceparent(None) is None
+    assert trace_id_from_correlation_id("2b8a7c1e-0f4e-4a53-9d0c-1e7f7a8b9c0d") == "2b8a7c1e0f4e4a539d0c1e7f7a8b9c0d"
+    assert len(trace_id_from_correlation_id("req-42")) == 32
+
+
+@patch("requests.Session.get")
+@patch("requests.Session.post")
+def test_consult_records_a_span_per_stage(mock_post, mock_get, service):
+    """
+    Test that a CPF consultation records validation, cache, auth and upstream spans under the root span,
+    sends the upstream span as the parent in the traceparent header and reports them in Server-Timing.
+    :param mock_post: a mock for the token request
+    :param mock_get: a mock for the report request
+    :param service: a SerasaService instance
+    :return: assertions on the spans, headers and exported trace
+    """
+    mock_post.return_value = make_response(200, {"accessToken": "abc123", "expiresIn": 60})
+    mock_get.return_value = make_response(200, {"score": 700})
+    exporter = ListExporter()
+    processor = BatchSpanProcessor(exporter, interval=3600)
+    tracer = Tracer(enabled=True, processor=processor)
+
+    handle = tracer.start("GET /api/v1/consulta/cpf/<cpf>", "req-1", f"00-{INCOMING_TRACE_ID}-00f067aa0ba902b7-01")
+    _, status = service.consult_cpf("12345678909")
+    timing = tracer.finish(handle, status)
+    processor.flush()
+
+    spans = {item.name: item for item in exporter.spans}
+    assert list(spans) == ["validation", "cache", "auth", "upstream", "request"]
+    assert {item.trace.trace_id for item in exporter.spans} == {INCOMING_TRACE_ID}
+    assert spans["request"].parent_id == "00f067aa0ba902b7"
+    assert all(spans[name].parent_id == spans["request"].span_id for name in ("validation", "cache", "auth", "upstream"))
+    assert spans["upstream"].attributes == {"report_type": "pf", "http.status_code": 200}
+
+    headers = mock_get.call_args.kwargs["headers"]
+    assert headers["traceparent"] == f"00-{INCOMING_TRACE_ID}-{spans['upstream'].span_id}-01"
+    assert [part.split(";")[0] for part in timing.split(", ")] == ["validation", "cache", "auth", "upstream", "total"]
+
+
+def test_unsampled_traces_are_timed_but_not_exported(tmp_path):
+    """
+    Test that traces left out by the sample rate still produce Server-Timing, and that sampled ones are
+    written to the file as OTLP/JSON.
+    :param tmp_path: a pytest fixture providing a temporary directory
+    :return: assertions on the header and file contents
+    """
+    path = tmp_path / "traces.jsonl"
+    processor = BatchSpanProcessor(FileSpanExporter(str(path), "credit-check"), interval=3600)
+
+    unsampled = Tracer(enabled=True, sample_rate=0.0, processor=processor)
+    handle = unsampled.start("GET /health", "req-1")
+    with span("validation"):
+        pass
+    assert unsampled.finish(handle, 200).startswith("validation;dur=")
+    processor.flush()
+    assert not path.exists()
+
+    sampled = Tracer(enabled=True, sample_rate=1.0, processor=processor)
+    handle = sampled.start("GET /health", "req-2")
+    with pytest.raises(ValueError), span("validation"):
+        raise ValueError("boom")
+    sampled.finish(handle, 500)
+    processor.flush()
+
+    [line] = path.read_text().splitlines()
+    exported = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [(item["name"], item["status"]["code"]) for item in exported] == [("validation", 2), ("request", 1)]
+    assert exported[0]["parentSpanId"] == exported[1]["spanId"]
+    assert "parentSpanId" not in exported[1]
+
+
+@patch("requests.Session.get")
+@patch("requests.Session.post")
+def test_flask_returns_server_timing(mock_post, mock_get, service):
+    """
+    Test that the Flask app returns the Server-Timing header when tracing is enabled, and not otherwise.
+    :param mock_post: a mock for the token request
+    :param mock_get: a mock for the report request
+    :param service: a SerasaService instance
+    :return: assertions on the response headers
+    """
+    mock_post.return_value = make_response(200, {"accessToken": "abc123", "expiresIn": 60})
+    mock_get.return_value = make_response(200, {"score": 700})
+    app = create_app(service=service)
+
+    with app.test_client() as client:
+        assert "Server-Timing" not in client.get("/api/v1/consulta/cpf/12345678909").headers
+
+        with patch("utils.tracing.tracer", Tracer(enabled=True)):
+            response = client.get("/api/v1/consulta/cpf/98765432100")
+    assert response.status_code == 200
+    assert "upstream;dur=" in response.headers["Server-Timing"]
+    assert "traceparent" in mock_get.call_args.kwargs["headers"]
+
+
+def test_flask_streamed_batch_is_traced_until_closed():
+    """
+    Test that a streamed batch is measured and traced until its last result is sent, not only while the
+    view sets it up.
+    :return: assertions on the exported spans and the recorded duration
+    """
+
+    class StreamingService:
+        """
+        Service streaming each batch result after a short upstream call.
+        """
+
+        batch_max_size = 10
+
+        @staticmethod
+        def stream_batch(documents, ordered=True):
+            def items():
+                for document in documents:
+                    with span("upstream"):
+                        time.sleep(0.05)
+                    yield {"document": document, "status": 200, "success": True}
+
+            return items(), 200
+
+    exporter = ListExporter()
+    processor = BatchSpanProcessor(exporter, interval=3600)
+    app = create_app(service=StreamingService())
+    route = ("/api/v1/consulta/batch", "POST", "200")
+    before = HTTP_REQUEST_DURATION.collect().get(route, [0.0])[-1]
+
+    with patch("utils.tracing.tracer", Tracer(enabled=True, processor=processor)), app.test_client() as client:
+        response = client.post("/api/v1/consulta/batch", json={"documents": ["12345678909", "12345678000195"]})
+        assert response.json["total"] == 2
+        assert response.headers["Server-Timing"].startswith("total;dur=")
+        # WSGI servers close the response once the last chunk is sent
+        response.close()
+    processor.flush()
+
+    assert [item.name for item in exporter.spans] == ["upstream", "upstream", "request"]
+    assert exporter.spans[-1].duration >= 0.1
+    assert HTTP_REQUEST_DURATION.collect()[route][-1] - before >= 0.1
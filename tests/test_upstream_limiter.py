@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pytest
+
+from services.upstream_limiter import UpstreamLimiter, UpstreamLimits, UpstreamOverloaded, parse_retry_after
+
+
+def test_limit_grows_on_healthy_calls():
+    """
+    Test the additive increase: about one extra slot per round of healthy calls, up to the maximum.
+    :return: assertions on the concurrency limit
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=4, max_concurrency=5))
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(200, 0.01)
+    assert limiter.limit == pytest.approx(4.9, abs=0.05)
+
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(200, 0.01)
+    assert limiter.limit == 5
+
+
+@pytest.mark.parametrize("status_code, latency", [(429, 0.01), (503, 0.01), (None, 0.01), (200, 5.0)])
+def test_limit_backs_off_on_failures(status_code, latency):
+    """
+    Test the multiplicative decrease on 429, 5xx, transport errors and latency spikes.
+    :param status_code: the status of the failed call, None for a transport error
+    :param latency: the duration of the call
+    :return: assertions on the concurrency limit
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=8, latency_threshold=2.0, cooldown=0))
+    limiter.acquire()
+    limiter.release(status_code, latency, retry_after=0)
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+
+
+def test_cooldown_limits_consecutive_decreases():
+    """
+    Test that a burst of failures cuts the limit once per cooldown and never below the minimum.
+    :return: assertions on the concurrency limit
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=8, min_concurrency=2, cooldown=60))
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(500, 0.01)
+    assert limiter.limit == 4
+
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=8, min_concurrency=2, cooldown=0))
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(500, 0.01)
+    assert limiter.limit == 2
+
+
+def test_waiting_caller_is_admitted_on_release():
+    """
+    Test that a caller over the concurrency limit waits and proceeds once a slot is freed.
+    :return: assertions on the queue depth and admission
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=1, queue_timeout=5))
+    limiter.acquire()
+    admitted = threading.Event()
+
+    def waiter():
+        limiter.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert limiter.stats()["queued"] == 1
+    assert not admitted.is_set()
+
+    limiter.release(200, 0.01)
+    assert admitted.wait(1)
+    thread.join()
+    assert limiter.stats()["in_flight"] == 1
+
+
+def test_caller_is_shed_after_queue_timeout():
+    """
+    Test that a caller is shed when no slot frees up within the queue timeout.
+    :return: assertions on the exception and the shed counter
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=1, queue_timeout=0.05))
+    limiter.acquire()
+    with pytest.raises(UpstreamOverloaded):
+        limiter.acquire()
+    assert limiter.stats()["shed"] == 1
+
+
+def test_caller_is_shed_when_queue_is_full():
+    """
+    Test that callers beyond the queue size are shed immediately.
+    :return: assertions on the exception and the shed counter
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(initial_concurrency=1, queue_size=0, queue_timeout=5))
+    limiter.acquire()
+    start = time.monotonic()
+    with pytest.raises(UpstreamOverloaded, match="full"):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.5
+
+
+def test_rate_paces_calls():
+    """
+    Test that the token bucket spaces calls to the configured rate after the burst.
+    :return: assertions on the elapsed time
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(rate=20, burst=1, queue_timeout=5))
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(200, 0.0)
+    assert time.monotonic() - start >= 0.14
+
+
+def test_throttled_call_pauses_new_calls():
+    """
+    Test that a 429 holds new calls for the Retry-After period.
+    :return: assertions on the pause
+    """
+    limiter = UpstreamLimiter(UpstreamLimits(queue_timeout=5))
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=0.1)
+    assert limiter.stats()["paused_for"] > 0
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_limits_from_env(monkeypatch):
+    """
+    Test that the limiter configuration is read from the environment and capped by the connection limit.
+    :param monkeypatch: a pytest fixture for modifying environment variables
+    :return: assertions on the configuration
+    """
+    monkeypatch.setenv("SERASA_UPSTREAM_RATE", "5")
+    monkeypatch.setenv("SERASA_UPSTREAM_CONCURRENCY", "50")
+    monkeypatch.setenv("SERASA_UPSTREAM_QUEUE_SIZE", "7")
+    limits = UpstreamLimits.from_env(max_concurrency=20)
+    assert (limits.rate, limits.burst, limits.initial_concurrency, limits.max_concurrency) == (5, 5, 20, 20)
+    assert limits.queue_size == 7
+
+
+class FakeResponse:
+    """
+    Minimal response with headers and a JSON body.
+    """
+
+    def __init__(self, headers, body):
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        """
+        Returns the body.
+        """
+        return self.body
+
+
+@pytest.mark.parametrize(
+    "headers, body, expected",
+    [({"Retry-After": "3"}, {}, 3.0), ({}, {"retryAfter": 900}, 900.0), ({}, {}, None), ({"Retry-After": "soon"}, {}, None)],
+)
+def test_parse_retry_after(headers, body, expected):
+    """
+    Test that the wait is read from the Retry-After header or the retryAfter body field.
+    :param headers: the response headers
+    :param body: the response body
+    :param expected: the expected wait
+    :return: assertion on the parsed value
+    """
+    assert parse_retry_after(FakeResponse(headers, body)) == expected
@@ -1,5 +1,18 @@
 import pytest
-from services.validation import validate_cpf, validate_cnpj
+from benchmarks.bench_validators import CASES, reference_document, run
+from services.validation import (
+    Document,
+    Validation,
+    check_cnpj,
+    check_cpf,
+    check_document,
+    document_type,
+    only_digits,
+    parse_cnpj,
+    parse_cpf,
+    validate_cpf,
+    validate_cnpj,
+)
 
 
 class TestCPFValidation:
@@ -53,3 +66,113 @@ class TestCNPJValidation:
         :return: assertion that the CNPJ is invalid
         """
         assert validate_cnpj(cnpj) is False
+
+
+class TestDocumentNormalization:
+    """
+    Tests for the canonical Document produced at the validation boundary.
+    """
+
+    def test_formatted_and_raw_cpf_are_equal(self):
+        """
+        Test that formatted and digits-only CPFs produce the same document.
+        :return: assertions on the normalized document
+        """
+        document = parse_cpf("123.456.789-09")
+        assert document == parse_cpf("12345678909")
+        assert document == Document("CPF", "12345678909")
+        assert document.key == "pf:12345678909"
+
+    def test_cnpj_key_is_namespaced(self):
+        """
+        Test that CNPJ keys live in a different namespace than CPF keys.
+        :return: assertions on the CNPJ key
+        """
+        document = parse_cnpj("12.345.678/0001-95")
+        assert document.key == "pj:12345678000195"
+        assert document.report_type == "pj"
+
+    def test_invalid_documents_are_rejected(self):
+        """
+        Test that invalid inputs do not produce a document.
+        :return: assertions on the rejected inputs
+        """
+        assert parse_cpf("111.111.111-11") is None
+        assert parse_cnpj("12.345.678/0001") is None
+
+    @pytest.mark.parametrize(
+        "value, expected",
+        [("123.456.789-09", "CPF"), ("12.345.678/0001-95", "CNPJ"), ("123", None)],
+    )
+    def test_document_type(self, value, expected):
+        """
+        Test document type inference from the number of digits.
+        :param value: a string representing the document
+        :param expected: the expected document type
+        :return: assertion on the inferred type
+        """
+        assert document_type(value) == expected
+
+
+class TestValidationResult:
+    """
+    Tests for the Validation result of the scalar fast path.
+    """
+
+    def test_result_carries_the_normalized_digits(self):
+        """
+        Test that a validation keeps the type and normalized digits, valid or not.
+        :return: assertions on the results
+        """
+        assert check_cpf("123.456.789-09") == Validation("CPF", "12345678909", True)
+        assert check_cpf("123.456.789-00") == Validation("CPF", "12345678900", False)
+        assert check_cnpj(" 11.222.333/0001-81 ") == Validation("CNPJ", "11222333000181", True)
+        assert check_cpf("123").valid is False
+        assert check_cpf("123.456.789-09").document() == Document("CPF", "12345678909")
+        assert check_cpf("111.111.111-11").document() is None
+
+    @pytest.mark.parametrize(
+        "value, expected",
+        [
+            ("52998224725", Validation("CPF", "52998224725", True)),
+            ("11.222.333/0001-81", Validation("CNPJ", "11222333000181", True)),
+            ("CPF: 529.982.247-25", Validation("CPF", "52998224725", True)),
+            ("1234", Validation(None, "1234", False)),
+        ],
+    )
+    def test_check_document_infers_the_type(self, value, expected):
+        """
+        Test that the type is inferred from the number of digits, whatever else surrounds them.
+        :param value: a string representing the document
+        :param expected: the expected validation
+        :return: assertion on the validation
+        """
+        assert check_document(value) == expected
+
+    def test_only_digits_fallback(self):
+        """
+        Test that characters other than the usual separators go through the regular expression, and that
+        digits of other scripts are normalized to ASCII.
+        :return: assertions on the normalized strings
+        """
+        assert only_digits("123.456.789-09") == "12345678909"
+        assert only_digits("abc1x2") == "12"
+        assert only_digits("\u0663\u0664-5") == "345"
+
+    def test_fast_path_matches_reference(self):
+        """
+        Test that the fast path agrees with the original implementation on every benchmark case.
+        :return: assertions on the validity of each case
+        """
+        for _, fast, reference, value in CASES:
+            assert fast(value).valid == reference(value)
+        assert check_document("123").valid == reference_document("123")
+
+    def test_fast_path_is_not_slower_than_reference(self):
+        """
+        Regression guard: each validator must stay clearly faster than the original implementation.
+        The threshold sits well below the measured speedup (2x or more) to tolerate noisy machines.
+        :return: assertions on the measured speedups
+        """
+        for name, fast, reference in run(number=2000):
+            assert reference / fast > 1.2, name
@@ -0,0 +1,36 @@
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Header carrying the caller's timeout, in seconds
+DEADLINE_HEADER = "X-Request-Timeout"
+
+# Absolute deadline (time.monotonic) of the request being handled
+request_deadline_var: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def deadline_from_header(value: Optional[str]) -> float:
+    """
+    Computes the deadline of a request from its X-Request-Timeout header, falling back to
+    SERASA_REQUEST_TIMEOUT when the header is missing or invalid.
+    :param value: the header value, in seconds
+    :return: the absolute deadline as a time.monotonic value
+    """
+    default = float(os.getenv("SERASA_REQUEST_TIMEOUT", 15))
+    try:
+        timeout = float(value) if value else default
+    except ValueError:
+        timeout = default
+    if timeout <= 0:
+        timeout = default
+    return time.monotonic() + min(timeout, default * 4)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Returns the time left before the deadline of the current request.
+    :return: the remaining seconds (possibly negative), or None when no deadline is set
+    """
+    deadline = request_deadline_var.get()
+    return None if deadline is None else deadline - time.monotonic()
@@ -0,0 +1,15 @@
+def cache_headers(response_data: dict) -> dict:
+    """
+    Builds the cache headers of a consultation response, shared by the Flask and ASGI apps.
+    X-Cache-Hit names the cache tier that served the response ("l1" or "l2"), or is "false" on a miss;
+    X-Cache-Stale is set when the report was served past its fresh TTL.
+    :param response_data: the dictionary returned by the Serasa service
+    :return: a dictionary of response headers
+    """
+    headers = {}
+    if "cached" in response_data:
+        cached = response_data["cached"]
+        headers["X-Cache-Hit"] = response_data.get("cache_tier", "true") if cached else "false"
+    if response_data.get("stale"):
+        headers["X-Cache-Stale"] = "true"
+    return headers
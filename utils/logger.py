@@ -1,9 +1,20 @@
 import logging
+import os
+import random
 import sys
 import json
+import threading
+import time
 import uuid
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
 from flask import g, request, has_request_context
 
+# Correlation ID of the current request outside Flask (e.g. the ASGI app)
+correlation_id_var: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
 
 class JsonFormatter(logging.Formatter):
     """
@@ -28,20 +39,277 @@ class JsonFormatter(logging.Formatter):
             "level": record.levelname,
             "time": self.formatTime(record, self.datefmt),
             "message": record.getMessage(),
-            "correlation_id": getattr(g, "correlation_id", None) if has_request_context() else None,
+            # captured by AsyncLogHandler in the logging thread, as the record is formatted on another one
+            "correlation_id": record.correlation_id if hasattr(record, "correlation_id") else current_correlation_id(),
         }
         return json.dumps(log_record)
 
 
+class AsyncLogHandler(logging.Handler):
+    """
+    Logging handler that keeps formatting and I/O off the logging thread.
+    `emit` only captures the correlation ID and appends the record to a bounded queue; a background
+    thread formats queued records and writes them to the stream in batches of up to `batch_size`,
+    every `flush_interval` seconds or as soon as a batch is full. When the queue is full the oldest
+    record is dropped and counted, so a slow stdout reader can never block a request.
+    Queued records are written by `flush`, which `logging.shutdown` calls at exit.
+
+    Records are formatted later, so the payload passed to the logger must not be mutated afterwards.
+
+    Attributes:
+        stream: The stream records are written to.
+        max_queue (int): Maximum number of records waiting to be written.
+        batch_size (int): Maximum number of records per write.
+        flush_interval (float): Seconds the writer waits for a full batch before writing what it has.
+        dropped (int): Records dropped because the queue was full.
+
+    Methods:
+        emit(record):
+            Queues a record.
+        flush():
+            Writes every queued record.
+        close():
+            Writes every queued record and stops the writer thread.
+    """
+
+    def __init__(self, stream, max_queue: int = 10000, batch_size: int = 256, flush_interval: float = 0.05):
+        super().__init__()
+        self.stream = stream
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = deque(maxlen=max_queue)
+        self.__start()
+        os.register_at_fork(after_in_child=self.__after_fork)
+
+    def __start(self):
+        self._wakeup = threading.Event()
+        self._write_lock = threading.Lock()
+        self._drop_lock = threading.Lock()
+        self._closed = False
+        self._writer = threading.Thread(target=self.__run, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def __after_fork(self):
+        # the writer thread does not survive a fork, and queued records belong to the parent
+        self._queue.clear()
+        self.__start()
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        """
+        Filters and queues a record, without the handler lock taken by logging.Handler.handle: the
+        queue is safe to append to from any thread.
+        """
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record: logging.LogRecord):
+        """
+        Queues a record, dropping the oldest one when the queue is full.
+        :param record: a logging.LogRecord instance
+        """
+        record.correlation_id = current_correlation_id()
+        queue = self._queue
+        if len(queue) >= self.max_queue:
+            with self._drop_lock:
+                self.dropped += 1
+        queue.append(record)
+        if len(queue) == self.batch_size:
+            self._wakeup.set()
+
+    def __run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Formats and writes every queued record, in batches.
+        """
+        queue = self._queue
+        with self._write_lock:
+            while queue:
+                lines = []
+                while len(lines) < self.batch_size:
+                    try:
+                        record = queue.popleft()
+                    except IndexError:
+                        break
+                    try:
+                        lines.append(self.format(record))
+                    except Exception:
+                        self.handleError(record)
+                if not lines:
+                    break
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except (OSError, ValueError):
+                    # stdout closed or broken: there is nowhere left to report the records
+                    pass
+
+    def close(self):
+        """
+        Writes every queued record and stops the writer thread.
+        """
+        self._closed = True
+        self._wakeup.set()
+        self.flush()
+        super().close()
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth and dropped records.
+        :return: a dictionary with the counters
+        """
+        return {"queued": len(self._queue), "dropped": self.dropped}
+
+
+def create_handler() -> logging.Handler:
+    """
+    Builds the stdout handler selected by LOG_ASYNC: the queue-based AsyncLogHandler by default, or a
+    synchronous StreamHandler.
+    :return: a logging.Handler with the JSON formatter
+    """
+    if os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes"):
+        handler = AsyncLogHandler(
+            sys.stdout,
+            max_queue=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+            batch_size=int(os.getenv("LOG_BATCH_SIZE", 256)),
+            flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", 0.05)),
+        )
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+class LogSampler:
+    """
+    Decides which informational records are worth building.
+    Each event type is kept with its own probability, so chatty events such as cache hits can be
+    sampled while rare ones are always logged. Warnings and errors are never sampled.
+
+    Attributes:
+        rates (dict): Probability of keeping each event type, between 0 and 1.
+        default_rate (float): Probability of keeping event types missing from `rates`.
+    """
+
+    def __init__(self, rates: Optional[dict] = None, default_rate: float = 1.0):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+
+    @classmethod
+    def from_env(cls) -> "LogSampler":
+        """
+        Builds the sampler from LOG_SAMPLE_RATES (e.g. "cache_hit=0.01,validate_document=0.01") and
+        LOG_SAMPLE_DEFAULT.
+        :return: a LogSampler instance
+        """
+        rates = {}
+        for item in os.getenv("LOG_SAMPLE_RATES", "").split(","):
+            event, _, rate = item.partition("=")
+            if event.strip() and rate.strip():
+                rates[event.strip()] = float(rate)
+        return cls(rates, float(os.getenv("LOG_SAMPLE_DEFAULT", 1.0)))
+
+    def sampled(self, event: str) -> bool:
+        """
+        Draws whether a record of an event type is kept.
+        :param event: a string with the event type
+        :return: True when the record should be logged
+        """
+        rate = self.rates.get(event, self.default_rate)
+        return rate >= 1 or random.random() < rate
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Caps repeated identical warnings and errors, such as one per request during an upstream outage.
+    Records with the same level and payload, ignoring per-request fields such as the document, are let
+    through at most `limit` times per `window` seconds; the first one let through after some were
+    suppressed carries their count in "suppressed".
+
+    Attributes:
+        limit (int): Identical records logged per window; 0 disables the filter.
+        window (float): Length of a window in seconds.
+        max_keys (int): Distinct records tracked at once.
+        suppressed (int): Records suppressed since start.
+    """
+
+    VARYING_FIELDS = frozenset({"document_id", "url", "attempt", "delay", "retry_after", "duration", "latency"})
+
+    def __init__(self, limit: int = 5, window: float = 10.0, max_keys: int = 1000):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+
+        payload = record.msg
+        if isinstance(payload, dict):
+            key = (record.levelno, *(f"{k}={v}" for k, v in payload.items() if k not in self.VARYING_FIELDS))
+        else:
+            key = (record.levelno, str(payload))
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                suppressed = entry[2] if entry else 0
+                self._windows[key] = [now, 1, 0]
+            elif entry[1] < self.limit:
+                entry[1] += 1
+                suppressed = entry[2]
+                entry[2] = 0
+            else:
+                entry[2] += 1
+                self.suppressed += 1
+                return False
+
+        if suppressed:
+            if isinstance(payload, dict):
+                record.msg = {**payload, "suppressed": suppressed}
+            else:
+                record.msg = f"{payload} (suppressed {suppressed})"
+        return True
+
+
 # Initialize the logger for the credit check service
 logger = logging.getLogger("credit_check")
-logger.setLevel(logging.INFO)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
-# Create a stream handler that outputs to stdout
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(JsonFormatter())
+# Output to stdout, formatted and written off the request threads unless LOG_ASYNC is disabled
+handler = create_handler()
 logger.addHandler(handler)
 
+sampler = LogSampler.from_env()
+repeat_filter = RepeatFilter(int(os.getenv("LOG_REPEAT_LIMIT", 5)), float(os.getenv("LOG_REPEAT_WINDOW", 10)))
+logger.addFilter(repeat_filter)
+
+
+def log_enabled(event: str, level: int = logging.INFO) -> bool:
+    """
+    Tells whether a record of an event would be logged, so callers skip building its payload otherwise.
+    Records below the logger level are skipped, and informational ones are sampled per event type.
+    :param event: a string with the event type
+    :param level: the level of the record
+    :return: True when the record should be built and logged
+    """
+    return logger.isEnabledFor(level) and (level >= logging.WARNING or sampler.sampled(event))
+
 
 def get_correlation_id() -> str:
     """
@@ -51,3 +319,13 @@ def get_correlation_id() -> str:
     if not hasattr(g, "correlation_id"):
         g.correlation_id = request.headers.get("X-Correlation-ID", str(uuid.uuid4()))
     return g.correlation_id
+
+
+def current_correlation_id() -> Optional[str]:
+    """
+    Returns the correlation ID of the request being handled, from the Flask context or the context variable.
+    :return: a string representing the correlation ID, or None outside a request
+    """
+    if has_request_context():
+        return getattr(g, "correlation_id", None)
+    return correlation_id_var.get()
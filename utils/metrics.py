@@ -1,21 +1,504 @@
+import fcntl
+import json
+import os
+import threading
 import time
-from functools import wraps
-from flask import g
+import weakref
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
 
+from utils.logger import handler as log_handler, logger, repeat_filter
 
-def track_metrics(func):
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _ShardOwner:
+    """
+    Holds the shard of one thread in its thread-local storage.
+    """
+
+    __slots__ = ("values", "__weakref__")
+
+
+class _Metric:
+    """
+    Base of the metric types. Values are kept in one shard per thread, so recording only touches
+    memory owned by the calling thread and needs no lock; shards are summed when the metric is read.
+    The shard of a finished thread is folded into a shared base, so its counts are never lost and
+    short-lived threads do not grow the list of shards.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        labelnames (tuple): Names of the labels, in the order values are passed when recording.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._base = {}
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        """
+        Returns the values recorded by the calling thread, creating its shard on first use.
+        """
+        try:
+            return self._local.owner.values
+        except AttributeError:
+            # the owner lives in the thread-local storage, released when the thread exits
+            owner = self._local.owner = _ShardOwner()
+            values = owner.values = {}
+            with self._lock:
+                self._shards.append(values)
+            weakref.finalize(owner, self._retire, values)
+            return values
+
+    def _retire(self, values: dict):
+        """
+        Folds the shard of a finished thread into the base shard.
+        :param values: the shard of the thread
+        """
+        with self._lock:
+            shards = [shard for shard in self._shards if shard is not values]
+            if len(shards) == len(self._shards):
+                # dropped by a reset
+                return
+            self._shards = shards
+            for labels, value in values.items():
+                self._merge(self._base, labels, value)
+
+    def _merge(self, into: dict, labels: tuple, value):
+        raise NotImplementedError
+
+    def collect(self) -> dict:
+        """
+        Sums the shards of every thread.
+        :return: a dictionary mapping label values to the metric value
+        """
+        with self._lock:
+            shards = [dict(self._base)] + self._shards
+        total = {}
+        for shard in shards:
+            for labels, value in shard.copy().items():
+                self._merge(total, labels, value)
+        return total
+
+    def reset(self):
+        """
+        Forgets every recorded value.
+        """
+        with self._lock:
+            self._shards = []
+            self._base = {}
+            local, self._local = self._local, threading.local()
+        # dropping the old storage runs the finalizers of its shards, which take the lock
+        del local
+
+
+class Counter(_Metric):
+    """
+    Monotonic counter.
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        """
+        Increments the counter.
+        :param labels: the label values, in the order of `labelnames`
+        :param amount: a float added to the counter
+        """
+        values = self._shard()
+        values[labels] = values.get(labels, 0.0) + amount
+
+    def _merge(self, into: dict, labels: tuple, value: float):
+        into[labels] = into.get(labels, 0.0) + value
+
+
+class Histogram(_Metric):
+    """
+    Histogram with fixed buckets. Each label set holds one count per bucket (not cumulative) plus
+    the +Inf bucket, followed by the sum of the observed values.
+
+    Attributes:
+        buckets (tuple): Upper bounds of the buckets, in increasing order.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        """
+        Records an observation.
+        :param value: a float with the observed value
+        :param labels: the label values, in the order of `labelnames`
+        """
+        values = self._shard()
+        counts = values.get(labels)
+        if counts is None:
+            counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, into: dict, labels: tuple, value: list):
+        current = into.get(labels)
+        if current is None:
+            into[labels] = list(value)
+        else:
+            into[labels] = [a + b for a, b in zip(current, value)]
+
+
+class Registry:
     """
-    A decorator to track the duration of a request and store it in the Flask global context.
-    :param func: a callable function that represents a Flask route
-    :return: a wrapped function that tracks the request duration
+    Collection of metrics rendered in the Prometheus text format.
+
+    Counters and histograms are recorded in-process. Gauges are produced at read time by collectors,
+    functions returning (name, labels, value) samples, e.g. from the service stats.
+
+    With several worker processes, each one writes a snapshot of its metrics to `<pid>.json` in a shared
+    directory every `flush_interval` seconds, and the process answering a scrape merges every snapshot
+    with its own live values: counters and histograms are summed, gauges are kept per process with a
+    `pid` label. Snapshots of exited workers are folded into `archive.json`, so their counts survive.
+
+    Attributes:
+        metrics (dict): Registered counters and histograms by name.
+        collectors (dict): Gauge collectors by name.
+        multiprocess_dir (Optional[str]): Directory shared by the worker processes, when enabled.
+        flush_interval (float): Seconds between two snapshots of this process.
+
+    Methods:
+        counter(name, documentation, labelnames) -> Counter:
+            Registers a counter.
+        histogram(name, documentation, labelnames, buckets) -> Histogram:
+            Registers a histogram.
+        register_collector(name, collector):
+            Registers (or replaces) a gauge collector.
+        render() -> str:
+            Returns every metric in the Prometheus text format.
+        enable_multiprocess(directory, flush_interval):
+            Shares the metrics of this process and its forked children through `directory`.
+        flush():
+            Writes the snapshot of this process.
+        mark_process_dead(pid):
+            Folds the snapshot of an exited worker into the archive.
     """
 
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        duration = time.time() - start
-        g.request_duration = duration
-        return result
+    ARCHIVE = "archive.json"
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = {}
+        self.multiprocess_dir = None
+        self.flush_interval = 5.0
+        self._fork_hook = False
+
+    def __register(self, metric: _Metric) -> _Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        """
+        Registers a counter, or returns the one already registered under the same name.
+        :param name: the metric name, ending in _total
+        :param documentation: the HELP text
+        :param labelnames: the label names
+        :return: a Counter instance
+        """
+        return self.__register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """
+        Registers a histogram, or returns the one already registered under the same name.
+        :param name: the metric name
+        :param documentation: the HELP text
+        :param labelnames: the label names
+        :param buckets: the bucket upper bounds
+        :return: a Histogram instance
+        """
+        return self.__register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, name: str, collector: Callable[[], Iterable[tuple[str, dict, float]]]):
+        """
+        Registers a function producing gauge samples at read time, replacing any collector of the same name.
+        :param name: a string identifying the collector
+        :param collector: a callable returning (metric name, labels, value) tuples
+        """
+        self.collectors[name] = collector
+
+    def snapshot(self) -> dict:
+        """
+        Returns the values of this process in a JSON-serializable form.
+        :return: a dictionary with the metric values by name and the gauge samples
+        """
+        metrics = {}
+        for name, metric in self.metrics.items():
+            values = metric.collect()
+            if values:
+                metrics[name] = [[list(labels), value] for labels, value in values.items()]
+
+        gauges = []
+        for name, collector in list(self.collectors.items()):
+            try:
+                gauges.extend([sample_name, labels, value] for sample_name, labels, value in collector())
+            except Exception as e:
+                logger.warning({"event": "metrics_collector_failed", "collector": name, "error": str(e)})
+        return {"metrics": metrics, "gauges": gauges}
+
+    def __merge(self, into: dict, snapshot: dict):
+        """
+        Adds the counters and histograms of a snapshot to merged values.
+        :param into: a dictionary mapping metric names to {labels: value}
+        :param snapshot: a dictionary produced by `snapshot`
+        """
+        for name, samples in snapshot.get("metrics", {}).items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            values = into.setdefault(name, {})
+            for labels, value in samples:
+                metric._merge(values, tuple(labels), value)
+
+    def __read(self, path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def render(self) -> str:
+        """
+        Renders every metric, merged across processes when multiprocess mode is enabled.
+        :return: a string in the Prometheus text exposition format
+        """
+        own = self.snapshot()
+        merged = {}
+        self.__merge(merged, own)
+        gauges = own["gauges"]
+
+        if self.multiprocess_dir:
+            pid = str(os.getpid())
+            gauges = [[name, {**labels, "pid": pid}, value] for name, labels, value in gauges]
+            for filename in sorted(os.listdir(self.multiprocess_dir)):
+                if not filename.endswith(".json") or filename == f"{pid}.json":
+                    continue
+                snapshot = self.__read(os.path.join(self.multiprocess_dir, filename))
+                self.__merge(merged, snapshot)
+                if filename != self.ARCHIVE:
+                    other = filename.removesuffix(".json")
+                    gauges += [[name, {**labels, "pid": other}, value] for name, labels, value in snapshot.get("gauges", [])]
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(merged.get(name, {}).items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), value):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(pairs + [('le', format_value(bound))])} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(pairs)} {format_value(value[-1])}")
+                    lines.append(f"{name}_count{format_labels(pairs)} {cumulative}")
+                else:
+                    lines.append(f"{name}{format_labels(pairs)} {format_value(value)}")
+
+        typed = set()
+        for name, labels, value in sorted(gauges, key=lambda sample: sample[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{format_labels(sorted(labels.items()))} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def enable_multiprocess(self, directory: str, flush_interval: Optional[float] = None):
+        """
+        Shares the metrics of this process through `directory`, and restarts sharing in forked children
+        with their own, empty values.
+        :param directory: a directory shared by the worker processes
+        :param flush_interval: seconds between two snapshots of this process
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.multiprocess_dir = directory
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if not self._fork_hook:
+            self._fork_hook = True
+            os.register_at_fork(after_in_child=self.__after_fork)
+        self.__start_flusher()
+
+    def __after_fork(self):
+        # values recorded before the fork belong to the parent, which flushes them itself
+        for metric in self.metrics.values():
+            metric.reset()
+        self.__start_flusher()
+
+    def __start_flusher(self):
+        def loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    logger.warning({"event": "metrics_flush_failed", "error": str(e)})
+
+        threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+    def flush(self):
+        """
+        Writes the snapshot of this process to the shared directory, atomically.
+        """
+        if not self.multiprocess_dir:
+            return
+        snapshot = self.snapshot()
+        if not snapshot["metrics"] and not snapshot["gauges"]:
+            return
+        path = os.path.join(self.multiprocess_dir, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+
+    def mark_process_dead(self, pid: int):
+        """
+        Folds the counters and histograms of an exited worker into the archive and drops its gauges.
+        Called by the process manager once the worker is gone.
+        :param pid: the process ID of the exited worker
+        """
+        if not self.multiprocess_dir:
+            return
+        path = os.path.join(self.multiprocess_dir, f"{pid}.json")
+        archive_path = os.path.join(self.multiprocess_dir, self.ARCHIVE)
+        with open(os.path.join(self.multiprocess_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = self.__read(path)
+            if not snapshot:
+                return
+            merged = {}
+            self.__merge(merged, self.__read(archive_path))
+            self.__merge(merged, snapshot)
+            archive = {"metrics": {name: [[list(k), v] for k, v in values.items()] for name, values in merged.items()}}
+            with open(f"{archive_path}.tmp", "w") as f:
+                json.dump(archive, f)
+            os.replace(f"{archive_path}.tmp", archive_path)
+            os.remove(path)
+
+
+def clear_multiprocess_dir(directory: str):
+    """
+    Removes the snapshots left by a previous run. Called once by the process manager at startup.
+    :param directory: the directory shared by the worker processes
+    """
+    if not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.endswith((".json", ".tmp")):
+            os.remove(os.path.join(directory, filename))
+
+
+def format_value(value: float) -> str:
+    """
+    Formats a sample value, or a bucket bound, as the exposition format expects.
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value) -> str:
+    """
+    Escapes a label value: backslashes, double quotes and line feeds.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(pairs: list) -> str:
+    """
+    Formats label pairs as {name="value",...}, escaping the values.
+    """
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{escape_label(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def stats_samples(prefix: str, stats: dict, label_keys: dict, labels: Optional[dict] = None) -> list:
+    """
+    Turns a nested stats dictionary, as returned by the services `stats()`, into gauge samples.
+    Nested keys are joined into the metric name, except keys listed in `label_keys`, which become a
+    label; numbers and booleans become values, and strings become a label of a sample set to 1.
+    :param prefix: the metric name prefix
+    :param stats: the nested stats dictionary
+    :param label_keys: a dictionary mapping dictionary keys (e.g. "pf") to the label they set (e.g. "report_type")
+    :param labels: the labels set by the enclosing dictionaries
+    :return: a list of (name, labels, value) tuples
+    """
+    labels = labels or {}
+    samples = []
+    for key, value in stats.items():
+        if key in label_keys:
+            name, child_labels = prefix, {**labels, label_keys[key]: key}
+        else:
+            name, child_labels = f"{prefix}_{key}", labels
+        if isinstance(value, dict):
+            samples.extend(stats_samples(name, value, label_keys, child_labels))
+        elif isinstance(value, (bool, int, float)):
+            samples.append((name, child_labels, float(value)))
+        elif isinstance(value, str):
+            samples.append((name, {**child_labels, key: value}, 1.0))
+    return samples
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests served.", ("route", "method", "status"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request duration in seconds.", ("route", "method", "status")
+)
+UPSTREAM_REQUEST_DURATION = REGISTRY.histogram(
+    "serasa_upstream_request_duration_seconds",
+    "Duration of the calls to the Serasa upstream in seconds.",
+    ("report_type", "status"),
+)
+CACHE_LOOKUPS = REGISTRY.counter("serasa_cache_lookups_total", "Report cache lookups by result.", ("report_type", "result"))
+TOKEN_REFRESHES = REGISTRY.counter(
+    "serasa_token_refreshes_total", "Access token logins, on demand or in the background.", ("mode", "result")
+)
+RATE_LIMIT_REJECTIONS = REGISTRY.counter("rate_limit_rejections_total", "Requests rejected by the rate limiter.")
+
+
+def logging_samples() -> list:
+    """
+    Builds the gauge samples of the log pipeline: repeated records suppressed and, when logging is
+    asynchronous, the queue depth and dropped records.
+    :return: a list of (name, labels, value) tuples
+    """
+    samples = [("log_records_suppressed", {}, float(repeat_filter.suppressed))]
+    stats = getattr(log_handler, "stats", None)
+    return samples + stats_samples("log_records", stats(), {}) if stats else samples
+
+
+REGISTRY.register_collector("logging", logging_samples)
 
-    return wrapper
+if os.getenv("METRICS_MULTIPROC_DIR"):
+    REGISTRY.enable_multiprocess(
+        os.environ["METRICS_MULTIPROC_DIR"], float(os.getenv("METRICS_FLUSH_INTERVAL", REGISTRY.flush_interval))
+    )
@@ -1,17 +1,34 @@
+import math
+import os
+import threading
 import time
-from collections import defaultdict
+from collections import OrderedDict
+from typing import Optional
+
 from flask import request, jsonify
 
+from utils.logger import logger
+from utils.metrics import RATE_LIMIT_REJECTIONS
+from utils.resp import RespClient, RespError
+
 
 class RateLimiter:
     """
-    A simple rate limiter class to limit the number of requests from a specific IP address.
-    This class uses a sliding window algorithm to track requests and enforce limits.
+    A rate limiter class to limit the number of requests from a specific IP address.
+    This class uses the generic cell rate algorithm (GCRA): each IP is tracked by a single float, its
+    theoretical arrival time (TAT), so every request costs O(1) regardless of the limit. Up to `limit`
+    requests can be made in a burst, after which one request is allowed every `period / limit` seconds.
+
+    Keys whose TAT is in the past carry no information (a new key would behave the same way), so they are
+    evicted as they are met at the cold end of the LRU order, and the number of tracked IPs is capped by
+    `max_keys`; past the cap the least recently seen IP is forgotten.
 
     Attributes:
         limit (int): Maximum number of requests allowed within the specified period.
         period (int): Time period in seconds during which the limit applies.
-        requests (defaultdict): A dictionary to track request timestamps for each IP address.
+        max_keys (int): Maximum number of IP addresses tracked at once.
+        keys (OrderedDict): The TAT of each tracked IP address, least recently seen first.
+        blocking (bool): Whether `check` may wait on I/O, so async callers must run it in a thread.
 
     Methods:
         is_allowed(ip: str) -> (bool, int):
@@ -19,15 +36,62 @@ class RateLimiter:
             Returns a tuple (allowed: bool, reset: int) where 'allowed' indicates if the request is allowed,
             and 'reset' indicates the time in seconds until the limit resets.
 
+        check(ip: str, cost: int = 1) -> (bool, dict):
+            Applies the rate limit, counting the request `cost` times, and returns the X-RateLimit-*
+            headers for the response.
+
+        clear():
+            Forgets every tracked IP address.
+
         decorator(func):
             A decorator to apply rate limiting to a Flask route.
             Returns a wrapped function that applies rate limiting.
     """
 
-    def __init__(self, limit: int = 10, period: int = 60):
+    blocking = False
+
+    def __init__(self, limit: int = 10, period: int = 60, max_keys: int = None):
         self.limit = limit
         self.period = period
-        self.requests = defaultdict(list)
+        self.max_keys = max_keys or int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+        self.keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _acquire(self, ip: str, cost: int = 1) -> tuple[bool, float, int]:
+        """
+        Applies the GCRA to one request. Subclasses override this hook to keep the state elsewhere.
+        :param ip: a string representing the IP address of the requester
+        :param cost: an integer with the number of requests the request counts for
+        :return: a tuple (allowed, reset, remaining requests), where reset is the number of seconds until
+            the limit fully resets, or until the next request is allowed when this one is rejected
+        """
+        now = time.monotonic()
+        interval = self.period / self.limit
+        increment = interval * cost
+
+        with self._lock:
+            keys = self.keys
+            tat = keys.get(ip, now)
+            if tat < now:
+                tat = now
+
+            allowed = tat + increment - now <= self.period
+            if allowed:
+                tat += increment
+            keys[ip] = tat
+            keys.move_to_end(ip)
+
+            # evict idle keys from the cold end, and the coldest key when over the cap
+            for _ in range(2):
+                oldest, oldest_tat = next(iter(keys.items()))
+                if oldest_tat > now and len(keys) <= self.max_keys:
+                    break
+                del keys[oldest]
+
+        if not allowed:
+            # a rejected client can retry as soon as enough emission intervals have drained
+            return False, tat + increment - now - self.period, 0
+        return True, tat - now, max(0, int((self.period - (tat - now)) // interval))
 
     def is_allowed(self, ip: str) -> (bool, int):
         """
@@ -35,19 +99,33 @@ class RateLimiter:
         :param ip: a string representing the IP address of the requester
         :return: a tuple (allowed: bool, reset: int)
         """
-        now = time.time()
-        timestamps = self.requests[ip]
-
-        # remove timestamps older than the period
-        self.requests[ip] = [t for t in timestamps if t > now - self.period]
+        allowed, reset, _ = self._acquire(ip)
+        return allowed, math.ceil(reset)
 
-        if len(self.requests[ip]) >= self.limit:
-            reset = self.period - (now - self.requests[ip][0])
-            return False, int(reset)
+    def check(self, ip: str, cost: int = 1) -> tuple[bool, dict]:
+        """
+        Applies the rate limit to a request and builds the X-RateLimit-* headers for its response.
+        Shared by the Flask decorator and the ASGI app.
+        :param ip: a string representing the IP address of the requester
+        :param cost: an integer with the number of requests the request counts for, e.g. its documents
+        :return: a tuple (allowed: bool, headers: dict)
+        """
+        allowed, reset, remaining = self._acquire(ip, cost)
+        if not allowed:
+            RATE_LIMIT_REJECTIONS.inc()
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(math.ceil(reset)),
+        }
+        return allowed, headers
 
-        # if allowed, add the current timestamp
-        self.requests[ip].append(now)
-        return True, self.period
+    def clear(self):
+        """
+        Forgets every tracked IP address.
+        """
+        with self._lock:
+            self.keys.clear()
 
     def decorator(self, func):
         """
@@ -59,27 +137,205 @@ class RateLimiter:
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            ip = request.remote_addr
-            allowed, reset = self.is_allowed(ip)
-
-            remaining = max(0, self.limit - len(self.requests[ip]))
+            allowed, headers = self.check(request.remote_addr)
 
             if not allowed:
                 response = jsonify({"error": "Too many requests"})
                 response.status_code = 429
-                response.headers["X-RateLimit-Limit"] = str(self.limit)
-                response.headers["X-RateLimit-Remaining"] = "0"
-                response.headers["X-RateLimit-Reset"] = str(reset)
+                response.headers.update(headers)
                 return response
 
             # call the original function
             response = func(*args, **kwargs)
 
             # add rate limit headers to the response
-            response.headers["X-RateLimit-Limit"] = str(self.limit)
-            response.headers["X-RateLimit-Remaining"] = str(remaining)
-            response.headers["X-RateLimit-Reset"] = str(reset)
+            response.headers.update(headers)
 
             return response
 
         return wrapper
+
+
+class DistributedRateLimiter(RateLimiter):
+    """
+    Rate limiter whose counters live in a Redis-protocol store, so the limit holds across workers and
+    replicas. Each IP gets a fixed window of `period` seconds counted by one shared key.
+
+    To avoid a round trip per request, a process reserves up to `batch` requests at a time with a single
+    INCRBY and serves them locally. Reserved but unused requests are lost when the window ends, so a larger
+    batch trades accuracy (a client may get fewer than `limit` requests) for fewer store calls. Once the
+    store reports the window as exhausted, further requests are rejected locally until it ends.
+
+    When the store is unavailable requests are allowed (`fail_open`) or rejected, and the store is not
+    retried for `retry_after` seconds so an outage does not add a connect timeout to every request.
+
+    Attributes:
+        client (RespClient): Client of the shared store.
+        prefix (str): Prefix of the counter keys.
+        batch (int): Maximum number of requests reserved per store call.
+        fail_open (bool): Whether requests are allowed while the store is unavailable.
+        retry_after (float): Seconds to wait before calling the store again after an error.
+        keys (OrderedDict): Per IP (window, reserved requests left, requests left in the store).
+        store_calls (int): Number of reservations sent to the store.
+        store_errors (int): Number of failed reservations.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        client: RespClient,
+        limit: int = 10,
+        period: int = 60,
+        batch: Optional[int] = None,
+        fail_open: bool = True,
+        retry_after: float = 1.0,
+        prefix: str = "ratelimit:",
+        max_keys: int = None,
+    ):
+        super().__init__(limit=limit, period=period, max_keys=max_keys)
+        self.client = client
+        self.prefix = prefix
+        self.batch = batch or max(1, limit // 10)
+        self.fail_open = fail_open
+        self.retry_after = retry_after
+        self.store_calls = 0
+        self.store_errors = 0
+        self._store_down_until = 0.0
+
+    def __reserve(self, ip: str, window: int, amount: int) -> Optional[tuple[int, int]]:
+        """
+        Reserves up to `amount` requests of the current window in the shared store.
+        :param ip: a string representing the IP address of the requester
+        :param window: an integer identifying the current window
+        :param amount: an integer with the number of requests to reserve
+        :return: a tuple (granted, left in the store), or None when the store is unavailable
+        """
+        key = f"{self.prefix}{ip}:{window}"
+        try:
+            replies = self.client.pipeline([("INCRBY", key, amount), ("PEXPIRE", key, self.period * 1000 + 1000)])
+            # the pipeline returns error replies in place rather than raising them
+            for reply in replies:
+                if isinstance(reply, RespError):
+                    raise reply
+            count = replies[0]
+        except (OSError, ValueError, RespError) as e:
+            self.store_errors += 1
+            self._store_down_until = time.monotonic() + self.retry_after
+            logger.warning({"event": "rate_limit_store_error", "error": str(e), "fail_open": self.fail_open})
+            return None
+        finally:
+            self.store_calls += 1
+
+        granted = max(0, min(amount, self.limit - (count - amount)))
+        return granted, max(0, self.limit - count)
+
+    def _acquire(self, ip: str, cost: int = 1) -> tuple[bool, float, int]:
+        now = time.time()
+        window = int(now // self.period)
+        reset = (window + 1) * self.period - now
+
+        with self._lock:
+            entry = self.__take(ip, window, cost)
+            tokens = self.__tokens(ip, window)
+        if entry is not None:
+            return entry[0], reset, entry[1]
+
+        amount = max(self.batch, cost - tokens)
+        reserved = self.__reserve(ip, window, amount) if time.monotonic() >= self._store_down_until else None
+        if reserved is None:
+            # store unavailable: allow, or reject asking the client to come back once it is retried
+            return self.fail_open, reset if self.fail_open else self.retry_after, 0
+
+        granted, store_left = reserved
+        with self._lock:
+            self.keys[ip] = (window, self.__tokens(ip, window) + granted, store_left)
+            self.keys.move_to_end(ip)
+            self.__evict(window)
+            entry = self.__take(ip, window, cost)
+        return entry[0], reset, entry[1]
+
+    def __tokens(self, ip: str, window: int) -> int:
+        """
+        Returns the requests reserved locally for the current window. Must be called with the lock held.
+        """
+        entry = self.keys.get(ip)
+        return entry[1] if entry is not None and entry[0] == window else 0
+
+    def __take(self, ip: str, window: int, cost: int = 1) -> Optional[tuple[bool, int]]:
+        """
+        Serves a request from the local reservation. Must be called with the lock held.
+        :return: a tuple (allowed, remaining), or None when a new reservation is needed
+        """
+        entry = self.keys.get(ip)
+        if entry is None or entry[0] != window:
+            return None
+
+        _, tokens, store_left = entry
+        if tokens >= cost:
+            self.keys[ip] = (window, tokens - cost, store_left)
+            self.keys.move_to_end(ip)
+            return True, tokens - cost + store_left
+        if store_left == 0:
+            return False, tokens
+        return None
+
+    def __evict(self, window: int):
+        """
+        Drops entries of past windows from the cold end, and the coldest entry when over the cap.
+        Must be called with the lock held.
+        """
+        for _ in range(2):
+            oldest, entry = next(iter(self.keys.items()))
+            if entry[0] == window and len(self.keys) <= self.max_keys:
+                break
+            del self.keys[oldest]
+
+    def clear(self):
+        """
+        Forgets every local reservation. Counters in the shared store expire with their window.
+        """
+        super().clear()
+        self._store_down_until = 0.0
+
+
+def create_rate_limiter(limit: int = 10, period: int = 60, prefix: str = "ratelimit:") -> RateLimiter:
+    """
+    Builds the rate limiter selected by the RATE_LIMIT_BACKEND environment variable: "local" keeps the
+    state in the process, "redis" shares it through a Redis-protocol store.
+    :param limit: maximum number of requests allowed within the period
+    :param period: time period in seconds during which the limit applies
+    :param prefix: prefix of the counter keys in the shared store, distinct for each limit
+    :return: a RateLimiter instance
+    """
+    backend = os.getenv("RATE_LIMIT_BACKEND", "local").lower()
+    if backend == "local":
+        return RateLimiter(limit=limit, period=period)
+    if backend != "redis":
+        raise ValueError(f"Unknown rate limit backend: {backend}")
+
+    url = os.getenv("RATE_LIMIT_REDIS_URL") or os.getenv("SERASA_REDIS_URL", "redis://localhost:6379/0")
+    batch = os.getenv("RATE_LIMIT_BATCH")
+    return DistributedRateLimiter(
+        RespClient.from_url(url, timeout=float(os.getenv("RATE_LIMIT_STORE_TIMEOUT", 0.2))),
+        limit=limit,
+        period=period,
+        batch=int(batch) if batch else None,
+        fail_open=os.getenv("RATE_LIMIT_FAIL_OPEN", "true").lower() in ("1", "true", "yes"),
+        retry_after=float(os.getenv("RATE_LIMIT_RETRY_AFTER", 1.0)),
+        prefix=prefix,
+    )
+
+
+def create_batch_limiter() -> RateLimiter:
+    """
+    Builds the per-IP quota of documents consulted through the batch endpoint, where each request counts
+    once per document: RATE_LIMIT_BATCH_DOCUMENTS documents every RATE_LIMIT_BATCH_PERIOD seconds, on
+    the backend selected by RATE_LIMIT_BACKEND.
+    :return: a RateLimiter instance
+    """
+    return create_rate_limiter(
+        limit=int(os.getenv("RATE_LIMIT_BATCH_DOCUMENTS", 5000)),
+        period=int(os.getenv("RATE_LIMIT_BATCH_PERIOD", 60)),
+        prefix="ratelimit:batch:",
+    )
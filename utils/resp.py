@@ -0,0 +1,176 @@
+import queue
+import socket
+from typing import Optional
+from urllib.parse import urlparse
+
+
+class RespError(Exception):
+    """
+    Error reply returned by a Redis-protocol server.
+    """
+
+
+class RespClient:
+    """
+    Minimal thread-safe client for Redis-protocol (RESP2) servers.
+    Connections are kept in a small pool and reused across calls, so each command costs one round trip.
+
+    Attributes:
+        host (str): The server host.
+        port (int): The server port.
+        db (int): The logical database selected on every new connection.
+        timeout (float): Socket connect/read timeout in seconds.
+
+    Methods:
+        execute(*args) -> Any:
+            Sends one command and returns its decoded reply.
+        pipeline(commands: list) -> list:
+            Sends several commands in a single round trip and returns their replies.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, timeout: float = 1.0, pool_size: int = 16):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RespClient":
+        """
+        Builds a client from a URL like redis://host:port/db.
+        :param url: a string representing the server URL
+        :return: a RespClient instance
+        """
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(host=parsed.hostname or "localhost", port=parsed.port or 6379, db=db, **kwargs)
+
+    def __connect(self) -> "_Connection":
+        conn = _Connection(socket.create_connection((self.host, self.port), timeout=self.timeout))
+        if self.db:
+            conn.send([("SELECT", self.db)])
+            conn.read_reply()
+        return conn
+
+    def __acquire(self) -> "_Connection":
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.__connect()
+
+    def __release(self, conn: "_Connection"):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def pipeline(self, commands: list) -> list:
+        """
+        Sends several commands in a single round trip.
+        Error replies are returned in place as RespError instances instead of being raised.
+        :param commands: a list of tuples, each holding a command name followed by its arguments
+        :return: a list with one decoded reply per command
+        """
+        conn = self.__acquire()
+        try:
+            conn.send(commands)
+            replies = [conn.read_reply() for _ in commands]
+        except (OSError, ValueError):
+            conn.close()
+            raise
+        self.__release(conn)
+        return replies
+
+    def execute(self, *args):
+        """
+        Sends one command and returns its decoded reply.
+        :param args: the command name followed by its arguments
+        :return: the decoded reply (bytes, int, str, list or None)
+        """
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self):
+        """
+        Closes every pooled connection.
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def encode_command(args) -> bytes:
+    """
+    Encodes a command as a RESP array of bulk strings.
+    :param args: the command name followed by its arguments
+    :return: the encoded command
+    """
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode()
+        else:
+            data = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def read_reply(stream):
+    """
+    Reads one RESP value from a buffered binary stream.
+    :param stream: a file-like object opened in binary mode
+    :return: the decoded value; error replies are returned as RespError instances
+    """
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b"+":
+        return payload.decode()
+    if prefix == b"-":
+        return RespError(payload.decode())
+    if prefix == b":":
+        return int(payload)
+    if prefix == b"$":
+        length = int(payload)
+        if length == -1:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        length = int(payload)
+        if length == -1:
+            return None
+        return [read_reply(stream) for _ in range(length)]
+    raise ValueError(f"Unexpected RESP prefix: {prefix!r}")
+
+
+class _Connection:
+    """
+    A socket wrapped with a buffered reader.
+    """
+
+    def __init__(self, sock: socket.socket):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    def send(self, commands: list):
+        self.sock.sendall(b"".join(encode_command(args) for args in commands))
+
+    def read_reply(self) -> Optional[object]:
+        return read_reply(self.reader)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
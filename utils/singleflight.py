@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+    """
+    Holds the outcome of an in-flight call shared between a leader and its followers.
+    """
+
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share the same key into a single execution.
+    The first caller for a key (the leader) runs the function; callers arriving while it is
+    in flight (followers) wait and receive the leader's result, or re-raise the leader's exception.
+
+    Attributes:
+        leader_count (int): Number of calls that actually executed the function.
+        coalesced_count (int): Number of calls that waited on a leader instead of executing.
+
+    Methods:
+        do(key, fn, *args, **kwargs) -> Any:
+            Runs `fn` once per key among concurrent callers and returns its result to all of them.
+        stats() -> dict:
+            Returns the leader/coalesced counters and the number of calls currently in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executes `fn(*args, **kwargs)` unless a call for `key` is already in flight.
+        :param key: a hashable value identifying the call
+        :param fn: a callable to execute when this caller is the leader
+        :return: the result produced by the leader
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced_count += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leader_count += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    def stats(self) -> dict:
+        """
+        Returns the single-flight counters.
+        :return: a dictionary with leader, coalesced and in-flight counts
+        """
+        with self._lock:
+            return {
+                "leader": self.leader_count,
+                "coalesced": self.coalesced_count,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight: concurrent coroutines awaiting the same key share one execution.
+
+    Attributes:
+        leader_count (int): Number of calls that actually executed the coroutine function.
+        coalesced_count (int): Number of calls that awaited a leader instead of executing.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Awaits `fn(*args, **kwargs)` unless a call for `key` is already in flight.
+        :param key: a hashable value identifying the call
+        :param fn: a coroutine function to execute when this caller is the leader
+        :return: the result produced by the leader
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced_count += 1
+            return await asyncio.shield(future)
+
+        self.leader_count += 1
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        """
+        Returns the single-flight counters.
+        :return: a dictionary with leader, coalesced and in-flight counts
+        """
+        return {"leader": self.leader_count, "coalesced": self.coalesced_count, "in_flight": len(self._calls)}
@@ -0,0 +1,69 @@
+import json
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+NDJSON_TYPES = (NDJSON_CONTENT_TYPE, "application/ndjson", "application/jsonl")
+# asks proxies such as nginx to pass each chunk on instead of buffering the whole body
+STREAMING_HEADERS = {"X-Accel-Buffering": "no"}
+
+
+def wants_ndjson(accept: Optional[str], requested: Optional[str] = None) -> bool:
+    """
+    Tells whether a batch response should be NDJSON rather than a single JSON document.
+    :param accept: the Accept header, e.g. "application/x-ndjson, application/json;q=0.5"
+    :param requested: "ndjson" or "json" when given explicitly, e.g. in a format query parameter
+    :return: True when NDJSON is requested or preferred over JSON
+    """
+    if requested:
+        return requested.lower() == "ndjson"
+    best, best_quality = False, 0.0
+    for entry in (accept or "").split(","):
+        media_type, *params = [part.strip().lower() for part in entry.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality and (media_type in NDJSON_TYPES or media_type == "application/json"):
+            best, best_quality = media_type in NDJSON_TYPES, quality
+    return best
+
+
+def batch_chunks(items: Iterator, ndjson: bool, dumps: Callable = json.dumps) -> Iterator[str]:
+    """
+    Serializes batch results one at a time, so the response holds a single report in memory.
+    As NDJSON each result is one line; otherwise the body is the {"results": [...], "total": n} document
+    of the non-streamed batch response.
+    :param items: an iterator of result item dictionaries
+    :param ndjson: a boolean selecting NDJSON output
+    :param dumps: the function serializing one item
+    :return: a generator of body chunks
+    """
+    if ndjson:
+        for item in items:
+            yield dumps(item) + "\n"
+        return
+    total = 0
+    yield '{"results": ['
+    for item in items:
+        yield ("," if total else "") + dumps(item)
+        total += 1
+    yield f'], "total": {total}}}'
+
+
+async def async_batch_chunks(items: AsyncIterator, ndjson: bool, dumps: Callable = json.dumps) -> AsyncIterator[str]:
+    """
+    Async variant of `batch_chunks`, for the ASGI app.
+    """
+    if ndjson:
+        async for item in items:
+            yield dumps(item) + "\n"
+        return
+    total = 0
+    yield '{"results": ['
+    async for item in items:
+        yield ("," if total else "") + dumps(item)
+        total += 1
+    yield f'], "total": {total}}}'
@@ -0,0 +1,443 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar, Token
+from typing import Any, Optional
+
+import requests
+
+from utils.logger import logger
+
+TRACEPARENT_HEADER = "traceparent"
+
+# Trace of the request being handled, and the span new spans are children of
+trace_var: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+span_var: ContextVar[Optional["Span"]] = ContextVar("span", default=None)
+
+
+class Trace:
+    """
+    Spans recorded while handling one request.
+
+    Attributes:
+        trace_id (str): 32 hex digits identifying the trace, shared with the upstream.
+        sampled (bool): Whether the spans are exported.
+        spans (list): Finished spans, in the order they finished.
+    """
+
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+
+
+class Span:
+    """
+    A timed stage of a request, used as a context manager. An exception leaving the block marks
+    the span as failed.
+
+    Attributes:
+        trace (Trace): The trace the span belongs to.
+        name (str): The stage name, also used in the Server-Timing header.
+        span_id (str): 16 hex digits identifying the span.
+        parent_id (Optional[str]): The span ID of the parent, if any.
+        attributes (dict): Details of the stage, e.g. the upstream status code.
+        start_ns (int): Start time, in nanoseconds since the epoch.
+        duration (float): Duration in seconds, set when the span ends.
+        error (bool): Whether the stage failed.
+    """
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "attributes", "start_ns", "duration", "error", "_start", "_token")
+
+    def __init__(self, trace: Trace, name: str, attributes: dict, parent_id: Optional[str] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.duration = 0.0
+        self.error = False
+
+    def __enter__(self) -> "Span":
+        parent = span_var.get()
+        if parent is not None:
+            self.parent_id = parent.span_id
+        self._token = span_var.set(self)
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.error = True
+            self.attributes["error"] = exc_type.__name__
+        span_var.reset(self._token)
+        self.trace.spans.append(self)
+        return False
+
+    def set(self, key: str, value: Any):
+        """
+        Adds an attribute to the span.
+        """
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        """
+        Returns the W3C traceparent header value naming this span as the parent.
+        """
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+
+class _NoopSpan:
+    """
+    Span returned while no trace is active, so instrumented code costs a context variable lookup.
+    """
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """
+    Opens a span for a stage of the current request.
+    :param name: the stage name
+    :param attributes: details of the stage
+    :return: a Span to use as a context manager, or a no-op span when the request is not traced
+    """
+    trace = trace_var.get()
+    if trace is None:
+        return NOOP_SPAN
+    return Span(trace, name, attributes)
+
+
+def inject(headers: dict):
+    """
+    Adds the traceparent header of the current span to outgoing request headers.
+    :param headers: a dictionary of request headers, updated in place
+    """
+    current = span_var.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple[str, str, bool]]:
+    """
+    Parses a W3C traceparent header.
+    :param value: the header value
+    :return: a tuple (trace ID, parent span ID, sampled), or None when the header is missing or invalid
+    """
+    parts = value.strip().split("-") if value else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def trace_id_from_correlation_id(correlation_id: str) -> str:
+    """
+    Derives the trace ID from the correlation ID, so logs and traces of a request share an identifier:
+    a UUID maps to its 32 hex digits, any other value to a hash.
+    :param correlation_id: a string representing the correlation ID
+    :return: a string with 32 hex digits
+    """
+    try:
+        return uuid.UUID(correlation_id).hex
+    except ValueError:
+        return hashlib.sha256(correlation_id.encode()).hexdigest()[:32]
+
+
+def server_timing(spans: list, total: float) -> str:
+    """
+    Builds the Server-Timing header, summing the spans of each stage (e.g. upstream retries).
+    :param spans: the finished spans of the request, without the root span
+    :param total: the request duration in seconds
+    :return: a header value such as "validation;dur=0.1, upstream;dur=52.3, total;dur=53.0"
+    """
+    durations = {}
+    for item in spans:
+        durations[item.name] = durations.get(item.name, 0.0) + item.duration
+    durations["total"] = total
+    return ", ".join(f"{name};dur={duration * 1000:.2f}" for name, duration in durations.items())
+
+
+def otlp_payload(spans: list, service_name: str) -> dict:
+    """
+    Converts spans to an OTLP/JSON trace export request.
+    :param spans: a list of finished spans
+    :param service_name: the service.name resource attribute
+    :return: a JSON-serializable dictionary
+    """
+
+    def attribute(key: str, value: Any) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [attribute("service.name", service_name)]},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "credit_check"},
+                        "spans": [
+                            {
+                                "traceId": item.trace.trace_id,
+                                "spanId": item.span_id,
+                                **({"parentSpanId": item.parent_id} if item.parent_id else {}),
+                                "name": item.name,
+                                "kind": 2 if item.parent_id is None or item.name == "request" else 1,
+                                "startTimeUnixNano": str(item.start_ns),
+                                "endTimeUnixNano": str(item.start_ns + int(item.duration * 1e9)),
+                                "attributes": [attribute(k, v) for k, v in item.attributes.items()],
+                                "status": {"code": 2 if item.error else 1},
+                            }
+                            for item in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class FileSpanExporter:
+    """
+    Appends each batch of spans to a file as one OTLP/JSON line, the format read by OpenTelemetry
+    collectors' file receivers.
+    """
+
+    def __init__(self, path: str, service_name: str):
+        self.path = path
+        self.service_name = service_name
+
+    def export(self, spans: list):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(otlp_payload(spans, self.service_name)) + "\n")
+
+
+class OtlpHttpSpanExporter:
+    """
+    Sends each batch of spans to an OTLP/HTTP endpoint (e.g. an OpenTelemetry collector) as JSON.
+    """
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def export(self, spans: list):
+        resp = self.session.post(self.url, json=otlp_payload(spans, self.service_name), timeout=self.timeout)
+        resp.raise_for_status()
+
+
+class BatchSpanProcessor:
+    """
+    Exports the spans of sampled traces from a background thread, in batches, so exporting never
+    delays a response. Past `max_queue` spans waiting, the oldest are dropped and counted.
+
+    Attributes:
+        exporter: An object with an `export(spans)` method.
+        max_queue (int): Maximum number of spans waiting to be exported.
+        batch_size (int): Maximum number of spans per export.
+        interval (float): Seconds between two exports.
+        dropped (int): Spans dropped because the queue was full.
+        failed (int): Spans lost to failed exports.
+    """
+
+    def __init__(self, exporter, max_queue: int = 2048, batch_size: int = 512, interval: float = 1.0):
+        self.exporter = exporter
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self.failed = 0
+        self._queue = deque(maxlen=max_queue)
+        self.__start()
+        os.register_at_fork(after_in_child=self.__after_fork)
+
+    def __start(self):
+        self._lock = threading.Lock()
+        threading.Thread(target=self.__run, name="span-exporter", daemon=True).start()
+
+    def __after_fork(self):
+        self._queue.clear()
+        self.__start()
+
+    def submit(self, spans: list):
+        """
+        Queues the spans of a finished trace.
+        :param spans: a list of finished spans
+        """
+        overflow = len(self._queue) + len(spans) - self.max_queue
+        if overflow > 0:
+            self.dropped += overflow
+        self._queue.extend(spans)
+
+    def __run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Exports every queued span.
+        """
+        with self._lock:
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    logger.warning({"event": "trace_export_failed", "error": str(e)})
+
+
+class Tracer:
+    """
+    Starts and finishes the trace of each request.
+    When disabled no trace is started, so spans opened by the instrumented code are no-ops.
+    Traces are always timed for the Server-Timing header once enabled; only sampled ones are exported.
+    A request carrying a traceparent header joins that trace and follows its sampling decision,
+    otherwise the trace ID is derived from the correlation ID and `sample_rate` of traces are sampled.
+
+    Attributes:
+        enabled (bool): Whether requests are traced.
+        sample_rate (float): Share of new traces that are exported.
+        processor (Optional[BatchSpanProcessor]): Exports sampled spans, when an exporter is configured.
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 1.0, processor: Optional[BatchSpanProcessor] = None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.processor = processor
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """
+        Builds the tracer from TRACING_ENABLED, TRACE_SAMPLE_RATE and TRACE_EXPORTER ("none", "file" with
+        TRACE_EXPORT_FILE, or "otlp" with TRACE_OTLP_ENDPOINT).
+        :return: a Tracer instance
+        """
+        enabled = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+        service_name = os.getenv("TRACE_SERVICE_NAME", "credit-check")
+        kind = os.getenv("TRACE_EXPORTER", "none").lower()
+        exporter = None
+        if enabled and kind == "file":
+            exporter = FileSpanExporter(os.getenv("TRACE_EXPORT_FILE", "traces.jsonl"), service_name)
+        elif enabled and kind == "otlp":
+            exporter = OtlpHttpSpanExporter(os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318"), service_name)
+        elif kind not in ("none", "file", "otlp"):
+            raise ValueError(f"Unknown trace exporter: {kind}")
+        processor = (
+            BatchSpanProcessor(exporter, interval=float(os.getenv("TRACE_EXPORT_INTERVAL", 1.0))) if exporter else None
+        )
+        return cls(enabled, float(os.getenv("TRACE_SAMPLE_RATE", 1.0)), processor)
+
+    def start(self, name: str, correlation_id: str, traceparent: Optional[str] = None) -> Optional[tuple[Token, Span]]:
+        """
+        Starts the trace of a request and opens its root span.
+        :param name: the root span name, e.g. "GET /api/v1/consulta/cpf/<cpf>"
+        :param correlation_id: the correlation ID of the request
+        :param traceparent: the incoming traceparent header, if any
+        :return: a handle to pass to `finish`, or None when tracing is disabled
+        """
+        if not self.enabled:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = trace_id_from_correlation_id(correlation_id), None
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        trace = Trace(trace_id, sampled)
+        token = trace_var.set(trace)
+        root = Span(trace, "request", {"http.route": name, "correlation_id": correlation_id}, parent_id)
+        root.__enter__()
+        return token, root
+
+    def timing(self, handle: Optional[tuple[Token, Span]]) -> Optional[str]:
+        """
+        Builds the Server-Timing header of a trace still in progress, for servers that send the response
+        headers before the request ends.
+        :param handle: the value returned by `start`
+        :return: the Server-Timing header value, or None when tracing is disabled
+        """
+        if handle is None:
+            return None
+        root = handle[1]
+        return server_timing(root.trace.spans, time.perf_counter() - root._start)
+
+    def finish(self, handle: Optional[tuple[Token, Span]], status_code: Optional[int] = None) -> Optional[str]:
+        """
+        Closes the root span, queues the trace for export when sampled and ends the trace.
+        :param handle: the value returned by `start`
+        :param status_code: the response status code
+        :return: the Server-Timing header value, or None when tracing is disabled
+        """
+        if handle is None:
+            return None
+        token, root = handle
+        if status_code is not None:
+            root.set("http.status_code", status_code)
+        root.__exit__(None, None, None)
+        trace = root.trace
+        trace_var.reset(token)
+        if trace.sampled and self.processor is not None:
+            self.processor.submit(trace.spans)
+        return server_timing([item for item in trace.spans if item is not root], root.duration)
+
+
+tracer = Tracer.from_env()
+
+
+def start_trace(name: str, correlation_id: str, traceparent: Optional[str] = None) -> Optional[tuple[Token, Span]]:
+    """
+    Starts the trace of a request with the process tracer. See Tracer.start.
+    """
+    return tracer.start(name, correlation_id, traceparent)
+
+
+def trace_timing(handle: Optional[tuple[Token, Span]]) -> Optional[str]:
+    """
+    Builds the Server-Timing header of a trace in progress with the process tracer. See Tracer.timing.
+    """
+    return tracer.timing(handle)
+
+
+def finish_trace(handle: Optional[tuple[Token, Span]], status_code: Optional[int] = None) -> Optional[str]:
+    """
+    Finishes the trace of a request with the process tracer. See Tracer.finish.
+    """
+    return tracer.finish(handle, status_code)
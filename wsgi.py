@@ -0,0 +1,9 @@
+"""
+Production WSGI entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The application is the one created when `app` is imported, so the master preloads a single instance.
+"""
+
+from app import app  # noqa: F401